@@ -1,4 +1,6 @@
-from fastapi import Depends, HTTPException, status
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from jose import jwt, JWTError
@@ -9,6 +11,7 @@ from db.base import SessionLocal
 from db import models
 from crud import usuario as usuario_crud
 from schemas import token as token_schema
+from security.jwt_handler import PROPOSITO_STREAM
 
 
 def get_db():
@@ -20,14 +23,14 @@ def get_db():
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
+# Igual, pero sin error si falta la cabecera (EventSource no puede enviar Authorization)
+oauth2_scheme_opcional = OAuth2PasswordBearer(tokenUrl="/login", auto_error=False)
 
 
-def get_current_user(
-        db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)
-) -> models.Usuario:
+def _usuario_desde_token(db: Session, token: str, proposito: Optional[str] = None) -> models.Usuario:
     """
-    Dependencia principal: valida el token, busca al usuario por ID y verifica si está activo.
-    No verifica roles, solo autentica al usuario.
+    Valida el token, busca al usuario por ID y verifica si está activo.
+    'proposito' es el claim que debe traer el token (None: token de acceso normal).
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -42,6 +45,10 @@ def get_current_user(
         token_data = token_schema.TokenPayload(**payload)
     except (JWTError, ValidationError):
         raise credentials_exception
+    # El token debe ser del tipo esperado: el del stream no sirve para el resto de la API
+    # y el de acceso no se acepta en la URL del stream
+    if payload.get("proposito") != proposito:
+        raise credentials_exception
 
     # --- CORRECCIÓN CLAVE: Buscamos al usuario por su ID, no por su email ---
     user = usuario_crud.get_user(db, user_id=token_data.sub)
@@ -54,6 +61,16 @@ def get_current_user(
     return user
 
 
+def get_current_user(
+        db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)
+) -> models.Usuario:
+    """
+    Dependencia principal: valida el token, busca al usuario por ID y verifica si está activo.
+    No verifica roles, solo autentica al usuario.
+    """
+    return _usuario_desde_token(db, token)
+
+
 def get_current_admin_user(
         current_user: models.Usuario = Depends(get_current_user),
 ) -> models.Usuario:
@@ -83,4 +100,24 @@ def get_current_active_user(
         current_user: models.Usuario = Depends(get_current_user),
 ) -> models.Usuario:
     """Dependencia de autenticación y verificación de estado activo (Alias para get_current_user)."""
-    return current_user
\ No newline at end of file
+    return current_user
+
+
+def get_current_user_stream(
+        db: Session = Depends(get_db),
+        token_header: Optional[str] = Depends(oauth2_scheme_opcional),
+        token: Optional[str] = Query(None, description="Token del stream de POST /eventos/token (para EventSource, que no envía cabeceras)")
+) -> models.Usuario:
+    """
+    Como get_current_user para los streams SSE: acepta el token de acceso en la cabecera
+    o, en ?token=, solo un token de stream (corto y de un solo propósito, POST /eventos/token).
+    """
+    if token_header:
+        return _usuario_desde_token(db, token_header)
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="No autenticado",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return _usuario_desde_token(db, token, proposito=PROPOSITO_STREAM)
@@ -1,7 +1,8 @@
 # C:\Users\marlo\Desktop\abastecimientos_backend\api\routers\abastecimientos.py
 # --- MODIFICADO: Importar StreamingResponse y BytesIO ---
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from fastapi.responses import StreamingResponse # <-- Importar StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header, Response
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse # <-- Importar StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from io import BytesIO # <-- Importar BytesIO
 # --- FIN MODIFICADO ---
 from sqlalchemy.orm import Session, joinedload
@@ -10,9 +11,11 @@ from schemas import abastecimiento as abastecimiento_schema
 from crud import abastecimiento as abastecimiento_crud
 from api import deps
 from db import models
-from services.report_service import generate_historial_pdf
 from core import email_service
 from services import report_service
+from services import outbox_service
+from services import job_service, comprobante_service, historial_export_service, report_cache
+from services import event_hub
 import traceback
 from datetime import datetime
 
@@ -41,65 +44,92 @@ def read_historial(
 # --- ENDPOINT PARA DESCARGAR HISTORIAL (CORREGIDO con StreamingResponse) ---
 @router.get("/historial/descargar")
 async def descargar_historial(
-    formato: str = Query(..., description="Formato deseado: 'pdf' o 'excel'"),
+    formato: str = Query(..., description="Formato deseado: 'pdf', 'excel', 'csv' o 'parquet'"),
     db: Session = Depends(deps.get_db),
     current_user: models.Usuario = Depends(deps.get_current_user),
     sitio_id: Optional[int] = Query(None),
-    q: Optional[str] = Query(None, min_length=2, description="Buscar por ID o nombre de sitio")
+    q: Optional[str] = Query(None, min_length=2, description="Buscar por ID o nombre de sitio"),
+    row_group_size: Optional[int] = Query(None, ge=1000, le=1000000, description="Filas por row group (solo parquet)"),
+    if_none_match: Optional[str] = Header(None)
 ):
-    historial_completo = abastecimiento_crud.get_historial_abastecimientos(
-        db, current_user=current_user, sitio_id=sitio_id, q=q, limit=None
-    )
+    formato = formato.lower()
+    if formato not in ("pdf", "excel", "csv", "parquet"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Formato no válido. Use 'pdf', 'excel', 'csv' o 'parquet'.")
+
+    filename: str = f"historial_abastecimientos_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+    # CSV y Parquet se generan mientras se envían, con su propia sesión
+    if formato in ("csv", "parquet"):
+        if formato == "parquet" and not report_service.parquet_disponible():
+            raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="El formato parquet requiere pyarrow, que no está instalado en el servidor.")
+        extension, media_type = historial_export_service.FORMATOS[formato]
+        return StreamingResponse(
+            historial_export_service.iter_historial_export(formato, current_user.id_usuario, sitio_id, q, row_group_size),
+            media_type=media_type,
+            headers={'Content-Disposition': f'attachment; filename="{filename}.{extension}"'}
+        )
 
-    if not historial_completo:
+    # PDF y Excel se guardan en la caché de reportes: la clave incluye el alcance del
+    # usuario, los filtros y la marca de agua del historial (cambia con altas/ediciones/cancelaciones)
+    watermark = abastecimiento_crud.get_historial_watermark(db, current_user=current_user, sitio_id=sitio_id, q=q)
+    if not watermark or not watermark["total"]:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No se encontraron registros para descargar con los filtros aplicados.")
 
-    file_content: Optional[bytes] = None
-    media_type: Optional[str] = None
-    filename: str = f"historial_abastecimientos_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    extension, media_type = historial_export_service.FORMATOS[formato]
+    cache = report_cache.get_cache()
+    clave = cache.clave(formato=formato, sitio_id=sitio_id, q=q, **watermark)
+    etag = f'"{clave}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'private, no-cache',
+        'Content-Disposition': f'attachment; filename="{filename}.{extension}"'
+    }
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+
+    ruta = cache.get(clave, extension)
+    if ruta is None:
+        # Filas livianas (solo las columnas del reporte) leídas con cursor del lado del servidor
+        filas_formateadas = report_service.format_rows(
+            abastecimiento_crud.stream_historial_rows(db, current_user=current_user, sitio_id=sitio_id, q=q)
+        )
 
-    if formato.lower() == "pdf":
-        try:
-            # report_service.generate_historial_pdf ya devuelve bytes
-            file_content = report_service.generate_historial_pdf(historial_completo)
-            media_type = "application/pdf"
-            filename += ".pdf"
-        except Exception as e:
-            print(f"Error generando PDF del historial: {e}")
-            raise HTTPException(status_code=500, detail="Error al generar el archivo PDF.")
+        def escribir(destino: str):
+            if formato == "pdf":
+                with open(destino, "wb") as f:
+                    f.write(report_service.render_historial_pdf(filas_formateadas))
+            else:
+                # Hoja write-only volcada directamente al archivo de la caché
+                report_service.write_historial_excel(filas_formateadas, destino)
 
-    elif formato.lower() == "excel":
+        # La generación es síncrona y pesada: se hace en el threadpool para no bloquear el event loop
         try:
-            # report_service.generate_historial_excel ya devuelve bytes
-            file_content = report_service.generate_historial_excel(historial_completo)
-            media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            filename += ".xlsx"
+            ruta = await run_in_threadpool(cache.put, clave, extension, escribir)
         except Exception as e:
-            print(f"Error generando Excel del historial: {e}")
-            raise HTTPException(status_code=500, detail="Error al generar el archivo Excel.")
-
+            print(f"Error generando {formato} del historial: {e}")
+            print(traceback.format_exc())
+            raise HTTPException(status_code=500, detail=f"Error al generar el archivo {'PDF' if formato == 'pdf' else 'Excel'}.")
     else:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Formato no válido. Use 'pdf' o 'excel'.")
+        print(f"-> Historial {formato}: servido desde caché ({clave[:12]})") # DEBUG
 
-    if file_content is None or media_type is None:
-         raise HTTPException(status_code=500, detail="No se pudo generar el contenido del archivo.")
+    return FileResponse(ruta, media_type=media_type, headers=headers)
 
-    # --- CORRECCIÓN: Usar StreamingResponse ---
-    # Envolver los bytes en un objeto BytesIO para que sea iterable (como un stream)
-    content_stream = BytesIO(file_content)
 
-    headers = {
-        'Content-Disposition': f'attachment; filename="{filename}"'
+# --- ENDPOINT CREAR ABASTECIMIENTO (sin cambios respecto a la versión anterior) ---
+def _datos_evento(ab: models.Abastecimiento) -> dict:
+    """Resumen del abastecimiento para los eventos en vivo (services/event_hub.py)."""
+    return {
+        "id_abastecimiento": ab.id_abastecimiento,
+        "nombre_sitio": ab.sitio.nombre if ab.sitio else None,
+        "fecha": ab.fecha.strftime('%d/%m/%Y %H:%M') if isinstance(ab.fecha, datetime) else str(ab.fecha),
+        "galones_abastecidos": ab.gls_abastecidos,
+        "status": ab.status,
     }
-    # Devolver StreamingResponse en lugar de Response
-    return StreamingResponse(content=content_stream, media_type=media_type, headers=headers)
-    # --- FIN CORRECCIÓN ---
 
 
-# --- ENDPOINT CREAR ABASTECIMIENTO (sin cambios respecto a la versión anterior) ---
 @router.post("/", response_model=abastecimiento_schema.Abastecimiento, status_code=status.HTTP_201_CREATED)
-# ... (código de create_new_abastecimiento sin cambios) ...
-async def create_new_abastecimiento(
+# Síncrono: FastAPI lo ejecuta en su pool de hilos, así la base de datos no bloquea el event loop
+def create_new_abastecimiento(
     abastecimiento: abastecimiento_schema.AbastecimientoCreate,
     db: Session = Depends(deps.get_db),
     current_user: models.Usuario = Depends(deps.get_current_user)
@@ -120,10 +150,10 @@ async def create_new_abastecimiento(
         )
 
     try:
+        # Sin commit: el abastecimiento y los correos de su comprobante se confirman juntos
         new_abastecimiento = abastecimiento_crud.create_abastecimiento(
-            db=db, abastecimiento=abastecimiento, tecnico_id=tecnico.id_tecnico
+            db=db, abastecimiento=abastecimiento, tecnico_id=tecnico.id_tecnico, commit=False
         )
-        db.refresh(new_abastecimiento)
 
         reloaded_abastecimiento = db.query(models.Abastecimiento).options(
             joinedload(models.Abastecimiento.sitio).joinedload(models.Sitio.supervisor),
@@ -132,50 +162,76 @@ async def create_new_abastecimiento(
 
         if not reloaded_abastecimiento:
              print(f"Error: No se pudo recargar Abastecimiento ID {new_abastecimiento.id_abastecimiento}")
+             db.commit()
              return new_abastecimiento
 
+        # El PDF se genera al enviar, desde el registro: si el proceso se reinicia, el correo sigue en el outbox
+        try:
+            with db.begin_nested():
+                comprobante_service.encolar_correos_comprobante(db, reloaded_abastecimiento)
+        except Exception as e:
+            print(f"!!!!!!!! ERROR al encolar comprobante para Abast ID {reloaded_abastecimiento.id_abastecimiento}: {e} !!!!!!!!")
+            print(traceback.format_exc())
+
+        # Sin expirar al confirmar: el evento, el trabajo y la respuesta usan lo ya cargado y la
+        # conexión vuelve al pool con el commit (get_db cierra la sesión después de responder)
+        db.expire_on_commit = False
+        db.commit()
     except Exception as e:
+        db.rollback()
         print(f"Error crítico al crear/recargar abastecimiento: {e}")
         print(traceback.format_exc())
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error al guardar el registro.")
 
-    try:
-        pdf_bytes = generate_historial_pdf(reloaded_abastecimiento) # Llamada directa a la función importada
-
-        fecha_filename = reloaded_abastecimiento.fecha.strftime('%Y%m%d_%H%M') if isinstance(reloaded_abastecimiento.fecha, datetime) else "fecha_invalida"
-        sitio_nombre_filename = reloaded_abastecimiento.sitio.nombre.replace(" ", "_").replace("/", "-") if reloaded_abastecimiento.sitio else "SitioID"+str(reloaded_abastecimiento.id_sitio)
-        filename = f"Reporte_Abastecimiento_{sitio_nombre_filename}_{fecha_filename}.pdf"
-
-        recipients_data: Dict[str, tuple[Optional[int], str]] = {}
-        site_technician = reloaded_abastecimiento.sitio.tecnico if reloaded_abastecimiento.sitio else None
-        if (site_technician and site_technician.usuario and site_technician.usuario.correo):
-            email_tec_sitio = site_technician.usuario.correo
-            if email_tec_sitio not in recipients_data:
-                recipients_data[email_tec_sitio] = (site_technician.usuario.id_usuario, site_technician.nombre_tecnico)
-        site_supervisor = reloaded_abastecimiento.sitio.supervisor if reloaded_abastecimiento.sitio else None
-        if (site_supervisor and site_supervisor.correo):
-             email_sup = site_supervisor.correo
-             if email_sup not in recipients_data:
-                 recipients_data[email_sup] = (None, site_supervisor.nombre_completo)
-
-        if recipients_data:
-            print(f"-> Enviando PDF para Abast ID {reloaded_abastecimiento.id_abastecimiento} a: {list(recipients_data.keys())}")
-            for email, (user_id, nombre) in recipients_data.items():
-                await email_service.send_abastecimiento_report_email(
-                    db=db, user_id_destino=user_id, email_to=email, nombre_receptor=nombre,
-                    abastecimiento=reloaded_abastecimiento, pdf_content=pdf_bytes, filename=filename
-                )
-            print(f"-> Llamadas a send_abastecimiento_report_email completadas.")
-        else:
-             print(f"-> Sin destinatarios para Abast ID {reloaded_abastecimiento.id_sitio}")
+    outbox_service.notify()
 
-    except Exception as mail_pdf_e:
-        print(f"!!!!!!!! ERROR no crítico PDF/Email Abast ID {reloaded_abastecimiento.id_abastecimiento}: {mail_pdf_e} !!!!!!!!")
+    event_hub.publicar("abastecimiento_creado", reloaded_abastecimiento.id_sitio, _datos_evento(reloaded_abastecimiento))
+
+    # La descarga del PDF se genera en segundo plano; el cliente recibe el id del trabajo
+    # y descarga el comprobante con GET /abastecimientos/comprobantes/{job_id}
+    try:
+        job_id = job_service.get_manager().submit(
+            comprobante_service.TIPO_JOB,
+            comprobante_service.generar_comprobante,
+            reloaded_abastecimiento.id_abastecimiento,
+            nombre_archivo=comprobante_service.nombre_archivo_comprobante(reloaded_abastecimiento),
+            media_type="application/pdf",
+            id_usuario=current_user.id_usuario,
+        )
+        reloaded_abastecimiento.id_comprobante_job = job_id
+    except Exception as job_e:
+        print(f"!!!!!!!! ERROR no crítico al encolar comprobante Abast ID {reloaded_abastecimiento.id_abastecimiento}: {job_e} !!!!!!!!")
         print(traceback.format_exc())
 
     return reloaded_abastecimiento
 
 
+@router.get("/comprobantes/{job_id}")
+def descargar_comprobante(
+    job_id: str,
+    current_user: models.Usuario = Depends(deps.get_current_user)
+):
+    """
+    Descarga el comprobante PDF generado en segundo plano al crear un abastecimiento.
+    Mientras el trabajo no termina responde 202 con su estado.
+    """
+    manager = job_service.get_manager()
+    job = manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comprobante no encontrado.")
+
+    es_supervisor = any(rol.nombre in [models.RolEnum.ADMIN, models.RolEnum.SUPERVISOR] for rol in current_user.roles)
+    if job["id_usuario"] != current_user.id_usuario and not es_supervisor:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No tienes acceso a este comprobante.")
+
+    if job["estado"] == job_service.ESTADO_FALLIDO:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="No se pudo generar el comprobante.")
+    if job["estado"] != job_service.ESTADO_COMPLETADO:
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={"id": job_id, "estado": job["estado"]})
+
+    return FileResponse(manager.result_path(job_id), media_type=job["media_type"], filename=job["nombre_archivo"])
+
+
 # --- ENDPOINT GET LISTA (sin cambios) ---
 @router.get("/", response_model=List[abastecimiento_schema.Abastecimiento])
 # ... (código de read_abastecimientos sin cambios) ...
@@ -202,7 +258,10 @@ async def update_abastecimiento_entry(
          raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Abastecimiento con id {abastecimiento_id} no encontrado.")
 
     original_data = {c.name: getattr(db_abastecimiento_base, c.name) for c in db_abastecimiento_base.__table__.columns if hasattr(db_abastecimiento_base, c.name)}
-    updated_abastecimiento = abastecimiento_crud.update_abastecimiento(db, db_abastecimiento=db_abastecimiento_base, abastecimiento_in=abastecimiento_in)
+    # Sin commit: la edición y los correos del outbox se confirman juntos (ver el final)
+    updated_abastecimiento = abastecimiento_crud.update_abastecimiento(
+        db, db_abastecimiento=db_abastecimiento_base, abastecimiento_in=abastecimiento_in, commit=False
+    )
 
     reloaded_updated = db.query(models.Abastecimiento).options(
         joinedload(models.Abastecimiento.sitio).joinedload(models.Sitio.supervisor),
@@ -211,6 +270,8 @@ async def update_abastecimiento_entry(
 
     if not reloaded_updated:
         print(f"Advertencia: No se pudo recargar Abast ID {abastecimiento_id} después de actualizar.")
+        db.commit()
+        db.refresh(updated_abastecimiento)
         return updated_abastecimiento
 
     changes_summary = []
@@ -242,17 +303,21 @@ async def update_abastecimiento_entry(
 
         if recipients_map:
             try:
-                await email_service.send_abastecimiento_update_notification(
-                    db=db, recipients_map=recipients_map, nombre_modificador=current_user.nombre_completo,
-                    modificador_email=current_user.correo, abastecimiento_id=reloaded_updated.id_abastecimiento,
-                    nombre_sitio=reloaded_updated.sitio.nombre, sitio_id=reloaded_updated.sitio.id_sitio,
-                    fecha_modificacion=datetime.now().strftime("%d/%m/%Y a las %H:%M:%S"),
-                    changes_html="".join(changes_summary)
-                )
+                with db.begin_nested():
+                    email_service.send_abastecimiento_update_notification(
+                        db=db, recipients_map=recipients_map, nombre_modificador=current_user.nombre_completo,
+                        modificador_email=current_user.correo, abastecimiento_id=reloaded_updated.id_abastecimiento,
+                        nombre_sitio=reloaded_updated.sitio.nombre, sitio_id=reloaded_updated.sitio.id_sitio,
+                        fecha_modificacion=datetime.now().strftime("%d/%m/%Y a las %H:%M:%S"),
+                        changes_html="".join(changes_summary)
+                    )
             except Exception as e:
-                 print(f"!!!!!!!! ERROR al enviar notificación de actualización para Abast ID {abastecimiento_id}: {e} !!!!!!!!")
+                 print(f"!!!!!!!! ERROR al encolar notificación de actualización para Abast ID {abastecimiento_id}: {e} !!!!!!!!")
                  print(traceback.format_exc())
 
+    event_hub.publicar_al_confirmar(db, "abastecimiento_actualizado", reloaded_updated.id_sitio, _datos_evento(reloaded_updated))
+    db.commit()
+    outbox_service.notify()
     return reloaded_updated
 
 
@@ -290,14 +355,16 @@ async def soft_delete_abastecimiento_entry(
                   recipients_map[technician_user_id] = technician_email
 
     try:
-        abastecimiento_crud.soft_delete_abastecimiento(db, db_abastecimiento=db_abastecimiento_loaded)
+        # Sin commit: la cancelación y los correos del outbox se confirman juntos (ver abajo)
+        abastecimiento_crud.soft_delete_abastecimiento(db, db_abastecimiento=db_abastecimiento_loaded, commit=False)
     except Exception as e:
          print(f"Error durante soft_delete_abastecimiento: {e}")
          print(traceback.format_exc())
+         db.rollback()
          try:
              abastecimiento_base = db.get(models.Abastecimiento, abastecimiento_id)
              if abastecimiento_base:
-                 abastecimiento_crud.soft_delete_abastecimiento(db, db_abastecimiento=abastecimiento_base)
+                 abastecimiento_crud.soft_delete_abastecimiento(db, db_abastecimiento=abastecimiento_base, commit=False)
              else:
                  raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Registro no encontrado para cancelar.")
          except Exception as e2:
@@ -307,13 +374,19 @@ async def soft_delete_abastecimiento_entry(
 
     if recipients_map:
         try:
-             await email_service.send_abastecimiento_cancellation_notification(
-                db=db, recipients_map=recipients_map, nombre_cancelador=current_user.nombre_completo,
-                abastecimiento_id=abastecimiento_id, nombre_sitio=nombre_del_sitio,
-                fecha_cancelacion=datetime.now().strftime("%d/%m/%Y a las %H:%M:%S")
-            )
+            with db.begin_nested():
+                email_service.send_abastecimiento_cancellation_notification(
+                    db=db, recipients_map=recipients_map, nombre_cancelador=current_user.nombre_completo,
+                    abastecimiento_id=abastecimiento_id, nombre_sitio=nombre_del_sitio,
+                    fecha_cancelacion=datetime.now().strftime("%d/%m/%Y a las %H:%M:%S")
+                )
         except Exception as e:
-            print(f"!!!!!!!! ERROR al enviar notificación de cancelación para Abast ID {abastecimiento_id}: {e} !!!!!!!!")
+            print(f"!!!!!!!! ERROR al encolar notificación de cancelación para Abast ID {abastecimiento_id}: {e} !!!!!!!!")
             print(traceback.format_exc())
 
+    event_hub.publicar_al_confirmar(db, "abastecimiento_cancelado", db_abastecimiento_loaded.id_sitio,
+                                    {"id_abastecimiento": abastecimiento_id, "nombre_sitio": nombre_del_sitio})
+    db.commit()
+    outbox_service.notify()
+
     return {"msg": f"El abastecimiento con ID {abastecimiento_id} ha sido cancelado." + (" Se ha notificado a los responsables." if recipients_map else "")}
\ No newline at end of file
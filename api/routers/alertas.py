@@ -5,7 +5,7 @@ from api import deps
 from db import models  # Importa los modelos base
 from schemas import alerta as alerta_schema # Importa schemas/alerta.py
 from crud import alerta as alerta_crud # Importa crud/alerta.py
-from services import alert_service
+from services import alert_service, event_hub
 
 # Importar los Enums específicos que necesitas usar en este archivo
 from db.models import EstadoAlertaEnum, TipoAlertaEnum
@@ -77,5 +77,6 @@ def close_alert(
         )
 
     closed_alert = alerta_crud.close_alert(db, db_alerta=db_alerta)
+    event_hub.publicar("alerta_cerrada", closed_alert.id_sitio, {"id_alerta": closed_alert.id_alerta})
 
     return closed_alert
\ No newline at end of file
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import datetime
@@ -13,6 +13,7 @@ from core.email_service import (
     send_password_reset_email,
     send_password_changed_notification_email
 )
+from services import outbox_service
 
 router = APIRouter(tags=["Autenticación"])
 
@@ -44,16 +45,19 @@ def login_for_access_token(
 
 
 @router.post("/forgot-password", status_code=status.HTTP_200_OK)
-async def request_password_reset(
+def request_password_reset(
         request_data: usuario_schema.RequestPasswordReset,
+        background_tasks: BackgroundTasks,
         db: Session = Depends(deps.get_db)
 ):
     user = usuario_crud.get_user_by_email(db, email=request_data.correo)
     if user:
-        token = usuario_crud.set_password_reset_token(db, user=user)
+        token = usuario_crud.set_password_reset_token(db, user=user, commit=False)
+        db.commit()
 
-        await send_password_reset_email(
-            db=db,
+        # Se envía después de responder (no en el outbox: el enlace lleva el token)
+        background_tasks.add_task(
+            send_password_reset_email,
             user_id=user.id_usuario,
             email_to=user.correo,
             nombre_usuario=user.nombre_completo,
@@ -85,15 +89,16 @@ async def reset_password(
     user.reset_token_expires = None
 
     db.add(user)
-    db.commit()
 
     # --- CORRECCIÓN AQUÍ ---
     # Añadimos los argumentos 'db' y 'user_id' que faltaban en la llamada
-    await send_password_changed_notification_email(
+    send_password_changed_notification_email(
         db=db,
         user_id=user_id,
         email_to=user_email,
         nombre_usuario=user_name
     )
+    db.commit()
+    outbox_service.notify()
 
     return {"msg": "Contraseña restablecida con éxito."}
\ No newline at end of file
@@ -0,0 +1,89 @@
+# api/routers/eventos.py
+import asyncio
+import json
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from api import deps
+from core.config import settings
+from crud import sitio as sitio_crud
+from db import models
+from schemas import token as token_schema
+from security.jwt_handler import create_stream_token
+from services import dashboard_service, event_hub
+
+router = APIRouter(
+    prefix="/eventos",
+    tags=["Eventos"]
+)
+
+
+def _formatear(evento: dict) -> str:
+    return f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {json.dumps(evento, default=str)}\n\n"
+
+
+async def _stream(hub: event_hub.EventHub, suscripcion: event_hub.Suscripcion):
+    """Envía los eventos de la suscripción y un comentario periódico mientras no haya."""
+    try:
+        yield "retry: 5000\n\n"  # Reintento del EventSource si se corta la conexión
+        while True:
+            try:
+                evento = await asyncio.wait_for(suscripcion.cola.get(), timeout=settings.SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if evento is None:  # El hub cerró la suscripción
+                break
+            yield _formatear(evento)
+    finally:
+        # También al desconectarse el cliente (Starlette cancela el generador)
+        hub.desuscribir(suscripcion)
+
+
+@router.post("/token", response_model=token_schema.StreamToken)
+def crear_token_stream(current_user: models.Usuario = Depends(deps.get_current_user)):
+    """
+    Token para abrir el stream con EventSource (GET /eventos/?token=...): solo sirve para
+    el stream y vence en SSE_TOKEN_EXPIRE_SECONDS (hasta entonces se puede reutilizar),
+    así el token de acceso no va en la URL.
+    Se valida al conectar; si el EventSource se corta, el cliente pide uno nuevo y vuelve a abrirlo.
+    """
+    return {"token": create_stream_token(current_user.id_usuario),
+            "expira_en_segundos": settings.SSE_TOKEN_EXPIRE_SECONDS}
+
+
+@router.get("/")
+async def stream_eventos(
+        db: Session = Depends(deps.get_db),
+        current_user: models.Usuario = Depends(deps.get_current_user_stream)
+):
+    """
+    Stream SSE (text/event-stream) con los cambios que afectan al dashboard y las
+    alertas: abastecimiento_creado, abastecimiento_actualizado, abastecimiento_cancelado,
+    alerta_abierta, alerta_cerrada y prediccion_actualizada. Cada evento trae el id del
+    sitio y un resumen del cambio; el alcance es el mismo que el de /dashboard/.
+    Un evento "resync" indica que se descartaron eventos (cola llena): recargar /dashboard/.
+    El token de acceso puede ir en la cabecera Authorization; con EventSource, un token de
+    stream (POST /eventos/token) en ?token=.
+    Al reconectarse conviene recargar /dashboard/: los eventos perdidos no se reenvían.
+    Requiere un servidor persistente (uvicorn): en Vercel cada request es una invocación
+    aparte con tiempo máximo y los eventos no llegan a otras (ver services/event_hub.py).
+    """
+    alcance, tecnico_id = dashboard_service.get_dashboard_scope(current_user)
+    if alcance is None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No tienes acceso a los eventos del dashboard.")
+    sitios = None
+    if tecnico_id is not None:
+        sitios = await run_in_threadpool(sitio_crud.get_ids_sitios_tecnico, db, tecnico_id)
+
+    hub = event_hub.get_hub()
+    suscripcion = hub.suscribir(alcance, sitios)
+    if suscripcion is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Demasiadas conexiones de eventos abiertas.")
+
+    return StreamingResponse(
+        _stream(hub, suscripcion),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # Sin buffer en nginx
+    )
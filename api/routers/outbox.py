@@ -0,0 +1,30 @@
+import secrets
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, status
+
+from core.config import settings
+from services import outbox_service
+
+router = APIRouter(
+    prefix="/outbox",
+    tags=["Outbox"]
+)
+
+
+@router.get(
+    "/procesar",
+    summary="Enviar los correos pendientes del outbox (cron)"
+)
+async def procesar_outbox(authorization: Optional[str] = Header(default=None)):
+    """
+    Envía los correos pendientes del outbox durante como mucho OUTBOX_CRON_MAX_SECONDS.
+    Lo llama el cron de vercel.json o un programador externo (plan Hobby: ver
+    services/outbox_service.py), con 'Authorization: Bearer <CRON_SECRET>': en Vercel
+    no corre el despachador en segundo plano de main.py.
+    """
+    esperado = f"Bearer {settings.CRON_SECRET}" if settings.CRON_SECRET else None
+    if not esperado or not secrets.compare_digest(authorization or "", esperado):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No autorizado.")
+
+    procesados = await outbox_service.drain_for(settings.OUTBOX_CRON_MAX_SECONDS)
+    return {"procesados": procesados}
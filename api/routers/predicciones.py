@@ -30,4 +30,13 @@ def get_prediction_for_sitio(
         )
 
     # Si no es un error, es el objeto de la DB, que coincide con el response_model
-    return resultado
\ No newline at end of file
+    return resultado
+
+@router.get("/cache/estadisticas")
+def get_prediction_cache_stats(
+        current_user: models.Usuario = Depends(deps.get_current_admin_user)
+):
+    """
+    Aciertos y fallos de la caché de predicciones en este proceso.
+    """
+    return prediction_service.get_cache_stats()
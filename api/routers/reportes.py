@@ -0,0 +1,93 @@
+import os
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import FileResponse, JSONResponse
+from sqlalchemy.orm import Session
+from api import deps
+from crud import abastecimiento as abastecimiento_crud
+from db import models
+from schemas import reporte as reporte_schema
+from services import job_service, historial_export_service, report_service, consumo_report_service
+
+router = APIRouter(
+    prefix="/reportes",
+    tags=["Reportes"]
+)
+
+
+def _job_response(job: dict) -> reporte_schema.ReporteJob:
+    return reporte_schema.ReporteJob(
+        id=job["id"],
+        estado=job["estado"],
+        formato=(job.get("datos") or {}).get("formato"),
+        nombre_archivo=job.get("nombre_archivo"),
+        creado_en=job["creado_en"],
+        terminado_en=job.get("terminado_en"),
+        error=job.get("error"),
+    )
+
+
+@router.post("/", response_model=reporte_schema.ReporteJob, status_code=status.HTTP_202_ACCEPTED)
+def create_reporte(
+        reporte_in: reporte_schema.ReporteCreate,
+        db: Session = Depends(deps.get_db),
+        current_user: models.Usuario = Depends(deps.get_current_user)
+):
+    """
+    Encola la exportación del historial (mismos filtros y permisos que
+    /abastecimientos/historial/descargar). El archivo se descarga con GET /reportes/{id}.
+    Usuarios con el mismo alcance que piden el mismo reporte a la vez comparten el trabajo.
+    """
+    if reporte_in.formato == "parquet" and not report_service.parquet_disponible():
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="El formato parquet requiere pyarrow, que no está instalado en el servidor.")
+    alcance = abastecimiento_crud.get_historial_scope(db, current_user)
+    if alcance is None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No tienes acceso al historial.")
+
+    job_id = historial_export_service.submit_reporte(
+        reporte_in.formato, current_user.id_usuario, alcance,
+        sitio_id=reporte_in.sitio_id, q=reporte_in.q, row_group_size=reporte_in.row_group_size
+    )
+    return _job_response(job_service.get_manager().get(job_id))
+
+
+@router.get("/{reporte_id}", response_model=reporte_schema.ReporteJob)
+def get_reporte(
+        reporte_id: str,
+        db: Session = Depends(deps.get_db),
+        current_user: models.Usuario = Depends(deps.get_current_user)
+):
+    """
+    Estado del reporte (202 mientras se genera) o el archivo cuando está listo.
+    Lo puede descargar quien lo pidió o cualquier usuario con el mismo alcance del historial.
+    Los archivos se eliminan pasada la TTL de los trabajos (404).
+    """
+    manager = job_service.get_manager()
+    job = manager.get(reporte_id)
+    if not job or job.get("tipo") != historial_export_service.TIPO_JOB:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reporte no encontrado o expirado.")
+    alcance_job = (job.get("datos") or {}).get("alcance")
+    if job["id_usuario"] != current_user.id_usuario and (
+            alcance_job is None or alcance_job != abastecimiento_crud.get_historial_scope(db, current_user)):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No tienes acceso a este reporte.")
+
+    if job["estado"] == job_service.ESTADO_COMPLETADO:
+        if not os.path.exists(manager.result_path(reporte_id)):  # Eliminado por TTL desde otro proceso
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reporte no encontrado o expirado.")
+        return FileResponse(manager.result_path(reporte_id), media_type=job["media_type"], filename=job["nombre_archivo"])
+    if job["estado"] == job_service.ESTADO_FALLIDO:
+        return _job_response(job)
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=_job_response(job).model_dump())
+
+
+@router.post("/consumo/{periodicidad}")
+def generar_reportes_consumo(
+        periodicidad: Literal["semanal", "mensual"],
+        db: Session = Depends(deps.get_db),
+        current_user: models.Usuario = Depends(deps.get_current_admin_user)  # Solo Admins
+):
+    """
+    Genera los reportes de consumo del último periodo completo y encola un correo
+    por destinatario (normalmente lo dispara cron con python -m services.consumo_report_service).
+    """
+    return consumo_report_service.generar_reportes_consumo(db, periodicidad)
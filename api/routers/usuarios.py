@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import List
 
@@ -8,6 +8,7 @@ from api import deps
 from db import models
 from core.email_service import send_password_changed_notification_email, send_welcome_email
 from security.password_handler import PasswordHandler
+from services import outbox_service
 
 router = APIRouter(
     prefix="/usuarios",
@@ -34,13 +35,16 @@ async def change_current_user_password(
 
     hashed_password = PasswordHandler.get_password_hash(password_data.nueva_contrasena)
     current_user.contrasena = hashed_password
-    db.commit()
 
-    # Notificar al usuario sobre el cambio
-    await send_password_changed_notification_email(
+    # Notificar al usuario sobre el cambio (se confirma junto con la contraseña)
+    send_password_changed_notification_email(
+        db=db,
+        user_id=current_user.id_usuario,
         email_to=current_user.correo,
         nombre_usuario=current_user.nombre_completo
     )
+    db.commit()
+    outbox_service.notify()
     return
 
 
@@ -58,16 +62,20 @@ def read_users(
 
 
 @router.post("/signup", response_model=usuario_schema.Usuario, status_code=status.HTTP_201_CREATED)
-async def signup_new_user(user_data: usuario_schema.UsuarioCreate, db: Session = Depends(deps.get_db)):
+def signup_new_user(user_data: usuario_schema.UsuarioCreate, background_tasks: BackgroundTasks,
+                    db: Session = Depends(deps.get_db)):
     db_user = usuario_crud.get_user_by_email(db, email=user_data.correo)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="El correo electrónico ya está registrado."
         )
-    new_user = usuario_crud.create_user(db=db, user=user_data)
-    await send_welcome_email(
-        db=db,
+    new_user = usuario_crud.create_user(db=db, user=user_data, commit=False)
+    db.commit()
+    db.refresh(new_user)
+    # Se envía después de responder (no en el outbox: lleva la contraseña)
+    background_tasks.add_task(
+        send_welcome_email,
         user_id=new_user.id_usuario,
         email_to=new_user.correo,
         nombre_usuario=new_user.nombre_completo,
@@ -77,8 +85,9 @@ async def signup_new_user(user_data: usuario_schema.UsuarioCreate, db: Session =
 
 
 @router.post("/admin-create", response_model=usuario_schema.Usuario, status_code=status.HTTP_201_CREATED)
-async def create_user_by_admin(
+def create_user_by_admin(
         user_data: usuario_schema.UsuarioCreate,
+        background_tasks: BackgroundTasks,
         db: Session = Depends(deps.get_db),
         admin_user: models.Usuario = Depends(deps.get_current_admin_user)
 ):
@@ -88,9 +97,12 @@ async def create_user_by_admin(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="El correo electrónico ya está registrado."
         )
-    new_user = usuario_crud.create_user(db=db, user=user_data)
-    await send_welcome_email(
-        db=db,
+    new_user = usuario_crud.create_user(db=db, user=user_data, commit=False)
+    db.commit()
+    db.refresh(new_user)
+    # Se envía después de responder (no en el outbox: lleva la contraseña)
+    background_tasks.add_task(
+        send_welcome_email,
         user_id=new_user.id_usuario,
         email_to=new_user.correo,
         nombre_usuario=new_user.nombre_completo,
@@ -143,11 +155,14 @@ async def verify_and_change_password(
     hashed_password = PasswordHandler.get_password_hash(password_data.nueva_contrasena)
     current_user.contrasena = hashed_password
     db.add(current_user)
-    db.commit()
-    await send_password_changed_notification_email(
+    send_password_changed_notification_email(
+        db=db,
+        user_id=current_user.id_usuario,
         email_to=current_user.correo,
         nombre_usuario=current_user.nombre_completo
     )
+    db.commit()
+    outbox_service.notify()
     return {"msg": "Contraseña cambiada con éxito."}
 
 
@@ -19,6 +19,54 @@ class Settings(BaseSettings):
     MAIL_STARTTLS: bool
     MAIL_SSL_TLS: bool
     PASSWORD_RESET_EXPIRE_MINUTES: int = 30
+    SMTP_POOL_SIZE: int = 3  # Conexiones SMTP persistentes por proceso
+
+    # --- OUTBOX DE CORREOS ---
+    OUTBOX_POLL_SECONDS: float = 10.0  # Revisión periódica del outbox si nadie avisa antes
+    OUTBOX_BATCH_SIZE: int = 50  # Correos tomados por lote
+    OUTBOX_MAX_ATTEMPTS: int = 6  # Intentos antes de marcar un correo como FALLIDO
+    OUTBOX_RETRY_BASE_SECONDS: float = 30.0  # Espera del primer reintento (se duplica en cada uno)
+    OUTBOX_SEND_TIMEOUT_SECONDS: float = 30.0  # Tiempo máximo por correo
+    OUTBOX_LEASE_SECONDS: float = 1800.0  # Tiempo que un lote reclamado es de su despachador (mayor que un lote completo)
+    OUTBOX_CRON_MAX_SECONDS: float = 50.0  # Tiempo máximo de /outbox/procesar (por debajo del límite de la función serverless)
+    CRON_SECRET: Optional[str] = None  # Secreto de los cron de Vercel (Authorization: Bearer ...); sin él /outbox/procesar responde 403
+
+    # --- PREDICCIONES ---
+    PREDICTION_REGRESSION_BACKEND: str = "numpy"  # "numpy" o "sklearn"
+    PREDICTION_NIVEL_MAX_AGE_MINUTES: int = 60  # Antigüedad máxima del nivel estimado guardado antes de refrescarlo
+    PREDICTION_NIVEL_REFRESH_BATCH: int = 1000  # Niveles refrescados como máximo por consulta del dashboard
+    PREDICTION_INTERVAL_WINDOW: int = 50  # Últimos intervalos de consumo usados por sitio (tras cambiarlo: rebuild estado-consumo)
+
+    # --- ALERTAS ---
+    ALERT_CHUNK_SIZE: int = 500  # Sitios por bloque en la generación de alertas
+    ALERT_EMAIL_CONCURRENCY: int = 10  # Correos de alerta enviados en paralelo
+    ALERT_EMAIL_TIMEOUT_SECONDS: float = 30.0  # Tiempo máximo por correo de alerta
+
+    # --- REPORTES ---
+    REPORT_LOGO_PATH: Optional[str] = None  # Logo de los PDFs (por defecto static/img/logo.png)
+    PARQUET_ROW_GROUP_SIZE: int = 50000  # Filas por row group en exportaciones parquet
+    REPORT_CACHE_DIR: Optional[str] = None  # Caché de reportes generados (por defecto, en el directorio temporal)
+    REPORT_CACHE_MAX_BYTES: int = 512 * 1024 * 1024  # Tamaño máximo de la caché (LRU)
+    PDF_PARALLEL_THRESHOLD_ROWS: int = 20000  # Desde cuántas filas el PDF se genera en varios procesos (0 = nunca)
+    PDF_PARALLEL_WORKERS: int = 0  # Procesos para el PDF en paralelo (0 = uno por núcleo)
+
+    # --- TRABAJOS EN SEGUNDO PLANO ---
+    JOB_WORKERS: int = 2  # Hilos para generar PDFs/reportes fuera del event loop
+    JOBS_DIR: Optional[str] = None  # Carpeta de resultados (por defecto, en el directorio temporal)
+    JOB_RESULT_TTL_SECONDS: int = 3600  # Tiempo que se conservan los archivos generados
+
+    # --- CACHÉ DEL DASHBOARD ---
+    DASHBOARD_CACHE_BACKEND: str = "memoria"  # "memoria" (por proceso), "redis" o "fakeredis" (pruebas)
+    REDIS_URL: str = "redis://localhost:6379/0"
+    DASHBOARD_CACHE_TTL_SECONDS: float = 30.0  # Vida máxima de una entrada aunque no haya cambios
+    DASHBOARD_CACHE_MAX_ENTRIES: int = 1000  # Entradas del LRU en memoria (alcances distintos)
+    DASHBOARD_CACHE_LOCK_SECONDS: float = 10.0  # Espera máxima por el cálculo de otro request
+
+    # --- EVENTOS EN VIVO (SSE) ---
+    SSE_HEARTBEAT_SECONDS: float = 15.0  # Comentario periódico para mantener abiertas las conexiones
+    SSE_QUEUE_SIZE: int = 100  # Eventos pendientes por conexión antes de cerrarla por lenta
+    SSE_MAX_CONNECTIONS: int = 5000  # Conexiones simultáneas por proceso
+    SSE_TOKEN_EXPIRE_SECONDS: int = 60  # Vigencia del token del stream (POST /eventos/token); reutilizable mientras no vence
 
     class Config:
         env_file = ".env"
@@ -1,13 +1,18 @@
 from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
 from sqlalchemy.orm import Session
 from core.config import settings
+from core import smtp_pool
+import asyncio
 import datetime
+from typing import List, Optional
 from sqlalchemy.orm import Session
 
 from db.models import CanalEnvioEnum
 # --- CAMBIOS: Importar módulos para el logging ---
 from db import models
 from crud import notificacion as notificacion_crud
+from crud import outbox as outbox_crud
+from db.base import SessionLocal
 from schemas import notificacion as notificacion_schema
 
 # --- CORRECCIÓN: Importar los Enums con el nombre correcto ---
@@ -26,29 +31,84 @@ conf = ConnectionConfig(
 )
 
 
-async def _send_and_log_message(db: Session, message: MessageSchema, log_data_dict: dict):
+async def _deliver(message: MessageSchema, smtp=None, timeout: Optional[float] = None):
     """
-    Función interna que intenta enviar un correo, añade el estado del envío al
-    diccionario del log, y luego crea y guarda el registro.
+    Entrega el mensaje por el pool SMTP persistente (reutilizando 'smtp' si se pasa).
+    Si el pool no está iniciado o el mensaje lleva adjuntos, usa FastMail directamente.
+    'timeout' cuenta solo el envío: la espera por una conexión libre del pool no vence.
+    """
+    pool = smtp_pool.get_pool()
+    if pool is None or message.attachments:
+        await asyncio.wait_for(FastMail(conf).send_message(message), timeout=timeout)
+    else:
+        await pool.send(smtp_pool.build_mime_message(message), smtp=smtp, timeout=timeout)
+
+
+async def _send_message(message: MessageSchema, log_data_dict: dict, timeout: Optional[float] = None,
+                        smtp=None) -> dict:
+    """
+    Intenta enviar un correo y añade el estado del envío al diccionario del log
+    (sin guardarlo). Si se indica timeout (segundos), un envío más lento se da por fallido
+    (sin contar la espera por una conexión del pool).
     """
-    from schemas.notificacion import MessageSchema, MessageType
-    fm = FastMail(conf)
     try:
-        await fm.send_message(message)
+        await _deliver(message, smtp=smtp, timeout=timeout)
         # --- CORREGIDO ---
         log_data_dict['estado_envio'] = EstadoEnvioEnum.EXITOSO
+    except asyncio.TimeoutError:
+        log_data_dict['estado_envio'] = EstadoEnvioEnum.FALLIDO
+        log_data_dict['respuesta_proveedor'] = f"Tiempo de espera agotado ({timeout}s)"
     except Exception as e:
         # --- CORREGIDO ---
         log_data_dict['estado_envio'] = EstadoEnvioEnum.FALLIDO
         log_data_dict['respuesta_proveedor'] = str(e)[:255]
+    return log_data_dict
+
+
+async def _send_and_log_message(message: MessageSchema, log_data_dict: dict):
+    """
+    Envía el correo sin pasar por el outbox y guarda su registro en el log, con una
+    sesión propia: se usa para los correos con credenciales o enlaces de restablecimiento
+    (que no deben quedar guardados en la base de datos) y corre como BackgroundTask,
+    después de responder, cuando la sesión de la request ya se cerró.
+    """
+    log_data_dict = await _send_message(message, log_data_dict, timeout=settings.OUTBOX_SEND_TIMEOUT_SECONDS)
+    final_log = notificacion_schema.NotificacionLogCreate(**log_data_dict)
+    db = SessionLocal()
+    try:
+        await asyncio.to_thread(notificacion_crud.create_log, db, final_log)
     finally:
-        final_log = notificacion_schema.NotificacionLogCreate(**log_data_dict)
-        notificacion_crud.create_log(db, log=final_log)
+        db.close()
+
+
+def _queue_message(db: Session, message: MessageSchema, log_data_dict: dict, adjuntos: Optional[list] = None,
+                   adjuntar_comprobante: bool = False):
+    """
+    Deja el correo en el outbox (sin commit): se confirma en la misma transacción
+    que el cambio de negocio y lo envía el despachador en segundo plano
+    (services/outbox_service.py), que también escribe el NotificacionLog.
+    """
+    outbox_crud.enqueue(
+        db,
+        direccion_destino=log_data_dict["direccion_destino"],
+        asunto=message.subject,
+        cuerpo_html=message.body,
+        id_usuario_destino=log_data_dict.get("id_usuario_destino"),
+        id_alerta=log_data_dict.get("id_alerta"),
+        id_abastecimiento=log_data_dict.get("id_abastecimiento"),
+        adjuntos=adjuntos,
+        adjuntar_comprobante=adjuntar_comprobante,
+    )
 
 
 # --- CAMBIOS: Todas las funciones públicas ahora aceptan 'db' y contexto para el log ---
+# Las funciones send_* síncronas dejan el correo en el outbox: el llamador debe hacer
+# commit para que se envíe. Las asíncronas (correo de bienvenida, restablecimiento
+# de contraseña y alertas del proceso nocturno) no pasan por el outbox: los dos
+# primeros llevan la contraseña o el token y no se guardan en la base de datos; los
+# routers los programan con BackgroundTasks para enviarlos después de responder.
 
-async def send_welcome_email(db: Session, user_id: int, email_to: str, nombre_usuario: str, contrasena: str):
+async def send_welcome_email(user_id: int, email_to: str, nombre_usuario: str, contrasena: str):
     """
     Envía un correo de bienvenida a un nuevo usuario con sus credenciales.
     """
@@ -105,10 +165,10 @@ async def send_welcome_email(db: Session, user_id: int, email_to: str, nombre_us
         "canal_envio": CanalEnvioEnum.EMAIL,
         "direccion_destino": email_to
     }
-    await _send_and_log_message(db, message, log_data_dict)
+    await _send_and_log_message(message, log_data_dict)
 
 
-async def send_password_changed_notification_email(db: Session, user_id: int, email_to: str, nombre_usuario: str):
+def send_password_changed_notification_email(db: Session, user_id: int, email_to: str, nombre_usuario: str):
     """
     Envía una notificación al usuario informando que su contraseña ha sido cambiada.
     """
@@ -168,10 +228,10 @@ async def send_password_changed_notification_email(db: Session, user_id: int, em
         "canal_envio": CanalEnvioEnum.EMAIL,
         "direccion_destino": email_to
     }
-    await _send_and_log_message(db, message, log_data_dict)
+    _queue_message(db, message, log_data_dict)
 
 
-async def send_password_reset_email(db: Session, user_id: int, email_to: str, nombre_usuario: str, token: str):
+async def send_password_reset_email(user_id: int, email_to: str, nombre_usuario: str, token: str):
     """
     Envía un correo con el enlace para restablecer la contraseña.
     """
@@ -231,10 +291,10 @@ async def send_password_reset_email(db: Session, user_id: int, email_to: str, no
         "canal_envio": CanalEnvioEnum.EMAIL,
         "direccion_destino": email_to
     }
-    await _send_and_log_message(db, message, log_data_dict)
+    await _send_and_log_message(message, log_data_dict)
 
 
-async def send_abastecimiento_update_notification(
+def send_abastecimiento_update_notification(
     db: Session,
     abastecimiento_id: int,
     recipients_map: dict, # Ej: {15: "correo1@example.com", 20: "correo2@example.com"}
@@ -309,10 +369,10 @@ async def send_abastecimiento_update_notification(
             "canal_envio": CanalEnvioEnum.EMAIL,
             "direccion_destino": email_to
         }
-        await _send_and_log_message(db, message, log_data_dict)
+        _queue_message(db, message, log_data_dict)
 
 
-async def send_abastecimiento_cancellation_notification(
+def send_abastecimiento_cancellation_notification(
     db: Session,
     abastecimiento_id: int,
     recipients_map: dict,
@@ -377,11 +437,150 @@ async def send_abastecimiento_cancellation_notification(
             "canal_envio": CanalEnvioEnum.EMAIL,
             "direccion_destino": email_to
         }
-        await _send_and_log_message(db, message, log_data_dict)
+        _queue_message(db, message, log_data_dict)
 
 
-async def send_new_alert_notification(
+def send_abastecimiento_report_email(
     db: Session,
+    user_id_destino: Optional[int],
+    email_to: str,
+    nombre_receptor: str,
+    abastecimiento: models.Abastecimiento
+):
+    """
+    Encola el correo con el comprobante PDF de un abastecimiento recién registrado.
+    El PDF no se guarda en el outbox: lo genera el despachador al enviar, a partir del
+    registro (ver services/comprobante_service.py).
+    """
+    nombre_sitio = abastecimiento.sitio.nombre if abastecimiento.sitio else f"ID {abastecimiento.id_sitio}"
+    fecha = abastecimiento.fecha.strftime("%d/%m/%Y %H:%M") if isinstance(abastecimiento.fecha, datetime.datetime) else str(abastecimiento.fecha)
+    html = f"""
+    <!DOCTYPE html>
+    <html lang="es">
+    <head>
+        <meta charset="UTF-8">
+        <title>Reporte de Abastecimiento</title>
+        <style>
+            body {{ font-family: Arial, sans-serif; background-color: #f4f4f4; }}
+            .container {{ max-width: 600px; margin: 20px auto; background-color: #ffffff; padding: 20px; border-radius: 8px; box-shadow: 0 4px 8px rgba(0,0,0,0.1); }}
+            .header {{ text-align: center; padding-bottom: 20px; border-bottom: 1px solid #dddddd; }}
+            .header img {{ max-width: 150px; }}
+            .info-box {{ background-color: #f9f9f9; border-left: 5px solid #0056b3; padding: 1px 20px; margin: 20px 0; }}
+            .footer {{ text-align: center; font-size: 12px; color: #888888; padding-top: 20px; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <img src="https://storage.googleapis.com/umg2025/logo.png" alt="Logo Tigo">
+            </div>
+            <div class="content">
+                <h1>Nuevo Abastecimiento Registrado</h1>
+                <p>Hola {nombre_receptor},</p>
+                <p>Se ha registrado un nuevo abastecimiento. Encontrarás el reporte completo adjunto en PDF.</p>
+                <div class="info-box">
+                    <p><strong>Sitio:</strong> {nombre_sitio}</p>
+                    <p><strong>OT:</strong> {abastecimiento.ot}</p>
+                    <p><strong>Fecha:</strong> {fecha}</p>
+                    <p><strong>Galones abastecidos:</strong> {abastecimiento.gls_abastecidos}</p>
+                </div>
+            </div>
+            <div class="footer">
+                <p>Este es un correo generado automáticamente.</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+    message = MessageSchema(
+        subject=f"Reporte de Abastecimiento - Sitio {nombre_sitio}",
+        recipients=[email_to],
+        body=html,
+        subtype=MessageType.html
+    )
+    log_data_dict = {
+        "id_usuario_destino": user_id_destino,
+        "id_abastecimiento": abastecimiento.id_abastecimiento,
+        "canal_envio": CanalEnvioEnum.EMAIL,
+        "direccion_destino": email_to
+    }
+    _queue_message(db, message, log_data_dict, adjuntar_comprobante=True)
+
+
+def send_consumo_digest_email(
+    db: Session,
+    user_id_destino: Optional[int],
+    email_to: str,
+    nombre_receptor: str,
+    periodo: str,
+    resumenes: List[dict],
+    adjuntos: List[tuple]
+):
+    """
+    Envía en un solo correo los reportes de consumo del periodo que le corresponden al
+    destinatario (services/consumo_report_service.py). 'resumenes' tiene titulo, sitios,
+    abastecimientos y gls_abastecidos de cada reporte; 'adjuntos' los PDFs
+    (nombre, contenido, tipo MIME). Síncrona: se llama desde el proceso en lote.
+    """
+    filas_html = "".join(
+        f"<tr><td>{r['titulo']}</td><td style=\"text-align:right\">{r['sitios']}</td>"
+        f"<td style=\"text-align:right\">{r['abastecimientos']}</td>"
+        f"<td style=\"text-align:right\">{r['gls_abastecidos']:.2f}</td></tr>"
+        for r in resumenes
+    )
+    html = f"""
+    <!DOCTYPE html>
+    <html lang="es">
+    <head>
+        <meta charset="UTF-8">
+        <title>Reportes de Consumo</title>
+        <style>
+            body {{ font-family: Arial, sans-serif; background-color: #f4f4f4; }}
+            .container {{ max-width: 600px; margin: 20px auto; background-color: #ffffff; padding: 20px; border-radius: 8px; box-shadow: 0 4px 8px rgba(0,0,0,0.1); }}
+            .header {{ text-align: center; padding-bottom: 20px; border-bottom: 1px solid #dddddd; }}
+            .header img {{ max-width: 150px; }}
+            table {{ width: 100%; border-collapse: collapse; margin: 20px 0; }}
+            th, td {{ border-bottom: 1px solid #dddddd; padding: 6px; font-size: 14px; }}
+            th {{ background-color: #f9f9f9; text-align: left; }}
+            .footer {{ text-align: center; font-size: 12px; color: #888888; padding-top: 20px; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <img src="https://storage.googleapis.com/umg2025/logo.png" alt="Logo Tigo">
+            </div>
+            <div class="content">
+                <h1>Reportes de Consumo</h1>
+                <p>Hola {nombre_receptor},</p>
+                <p>Estos son los reportes de consumo del periodo {periodo}. El detalle por sitio está en los PDF adjuntos.</p>
+                <table>
+                    <tr><th>Reporte</th><th>Sitios</th><th>Abast.</th><th>Galones</th></tr>
+                    {filas_html}
+                </table>
+            </div>
+            <div class="footer">
+                <p>Este es un correo generado automáticamente.</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+    message = MessageSchema(
+        subject=f"Reportes de Consumo - {periodo}",
+        recipients=[email_to],
+        body=html,
+        subtype=MessageType.html
+    )
+    log_data_dict = {
+        "id_usuario_destino": user_id_destino,
+        "canal_envio": CanalEnvioEnum.EMAIL,
+        "direccion_destino": email_to
+    }
+    _queue_message(db, message, log_data_dict, adjuntos=adjuntos)
+
+
+def _build_new_alert_message(
     user_id: int,
     alerta_id: int,
     email_to: str,
@@ -390,6 +589,7 @@ async def send_new_alert_notification(
     tipo_alerta: str,
     mensaje_alerta: str
 ):
+    """Arma el mensaje de nueva alerta y el diccionario base de su log."""
     html = f"""
     <!DOCTYPE html>
     <html lang="es">
@@ -443,10 +643,53 @@ async def send_new_alert_notification(
         "canal_envio": CanalEnvioEnum.EMAIL,
         "direccion_destino": email_to
     }
-    await _send_and_log_message(db, message, log_data_dict)
+    return message, log_data_dict
+
+
+def send_new_alert_notification(
+    db: Session,
+    user_id: int,
+    alerta_id: int,
+    email_to: str,
+    nombre_tecnico: str,
+    nombre_sitio: str,
+    tipo_alerta: str,
+    mensaje_alerta: str
+):
+    message, log_data_dict = _build_new_alert_message(
+        user_id, alerta_id, email_to, nombre_tecnico, nombre_sitio, tipo_alerta, mensaje_alerta
+    )
+    _queue_message(db, message, log_data_dict)
+
+
+async def send_new_alert_notifications(
+    db: Session,
+    notificaciones: List[dict],
+    concurrency: int = 10,
+    timeout: Optional[float] = 30.0
+) -> dict:
+    """
+    Envía varias notificaciones de nueva alerta en paralelo, con como máximo
+    'concurrency' envíos simultáneos y un tiempo máximo por mensaje (solo el envío:
+    con más envíos que conexiones en el pool, el resto espera su turno sin que venza). Cada elemento
+    de 'notificaciones' tiene los argumentos de send_new_alert_notification (sin db).
+    Los logs se insertan todos juntos al final.
+    """
+    semaforo = asyncio.Semaphore(max(1, concurrency))
+
+    async def _enviar(datos: dict) -> dict:
+        message, log_data_dict = _build_new_alert_message(**datos)
+        async with semaforo:
+            return await _send_message(message, log_data_dict, timeout=timeout)
+
+    logs = await asyncio.gather(*(_enviar(datos) for datos in notificaciones))
+    notificacion_crud.create_logs_bulk(db, [notificacion_schema.NotificacionLogCreate(**log) for log in logs])
+
+    exitosos = sum(1 for log in logs if log['estado_envio'] == EstadoEnvioEnum.EXITOSO)
+    return {"enviados": exitosos, "fallidos": len(logs) - exitosos}
 
 
-async def send_alert_resolved_notification(
+def send_alert_resolved_notification(
     db: Session,
     alerta_id: int,
     recipients_map: dict,
@@ -508,4 +751,4 @@ async def send_alert_resolved_notification(
             "canal_envio": CanalEnvioEnum.EMAIL,
             "direccion_destino": email_to
         }
-        await _send_and_log_message(db, message, log_data_dict)
\ No newline at end of file
+        _queue_message(db, message, log_data_dict)
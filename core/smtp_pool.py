@@ -0,0 +1,158 @@
+# core/smtp_pool.py
+"""
+Pool de conexiones SMTP persistentes (aiosmtplib).
+Mantiene unas pocas conexiones ya autenticadas y las reutiliza entre mensajes,
+en lugar de abrir TCP + TLS + AUTH por cada correo. Se inicia y cierra con el
+ciclo de vida de la aplicación (ver main.py).
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from email.message import EmailMessage
+from typing import Optional, Sequence
+
+import aiosmtplib
+from fastapi_mail import MessageSchema, MessageType
+
+from core.config import settings
+
+
+class SMTPConnectionPool:
+    def __init__(self, hostname: str, port: int, username: Optional[str], password: Optional[str],
+                 use_tls: bool, start_tls: bool, validate_certs: bool = True,
+                 size: int = 3, timeout: float = 30.0):
+        self._params = dict(
+            hostname=hostname, port=port, username=username, password=password,
+            use_tls=use_tls, start_tls=start_tls, validate_certs=validate_certs, timeout=timeout,
+        )
+        self.size = max(1, size)
+        self._libres: asyncio.Queue = asyncio.Queue()
+        # Un cupo por conexión prestada o en apertura: como mucho 'size' a la vez. Se
+        # devuelve siempre (también si el envío se cancela o vence su tiempo), así un
+        # envío colgado no deja el cupo tomado para siempre
+        self._cupos = asyncio.Semaphore(self.size)
+
+    async def _acquire(self) -> aiosmtplib.SMTP:
+        await self._cupos.acquire()
+        smtp = None
+        try:
+            if self._libres.empty():
+                smtp = aiosmtplib.SMTP(**self._params)
+            else:
+                smtp = self._libres.get_nowait()
+            if not smtp.is_connected:
+                # connect() negocia TLS/STARTTLS y hace login con las credenciales del constructor
+                await smtp.connect()
+            return smtp
+        except BaseException:
+            # BaseException: incluye la cancelación (asyncio.wait_for al vencer el tiempo)
+            if smtp is not None:
+                smtp.close()
+            self._cupos.release()
+            raise
+
+    def _release(self, smtp: aiosmtplib.SMTP):
+        self._libres.put_nowait(smtp)
+        self._cupos.release()
+
+    def _discard(self, smtp: aiosmtplib.SMTP):
+        smtp.close()
+        self._cupos.release()
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Presta una conexión del pool; si falla o se cancela durante el uso se descarta
+        en lugar de devolverla (su estado es incierto) y el cupo queda libre.
+        """
+        smtp = await self._acquire()
+        try:
+            yield smtp
+        except BaseException:
+            self._discard(smtp)
+            raise
+        else:
+            self._release(smtp)
+
+    async def send(self, mensaje: EmailMessage, smtp: Optional[aiosmtplib.SMTP] = None,
+                   timeout: Optional[float] = None):
+        """
+        Envía un mensaje. Si se pasa 'smtp' se usa esa conexión (varios envíos sobre
+        la misma); si no, se toma una del pool. Reconecta una vez si el servidor cerró la conexión.
+        'timeout' (segundos) limita solo el envío, no la espera por una conexión libre:
+        al vencer se lanza asyncio.TimeoutError.
+        """
+        if smtp is None:
+            async with self.connection() as conexion:
+                return await self.send(mensaje, smtp=conexion, timeout=timeout)
+        return await asyncio.wait_for(self._send_on(smtp, mensaje), timeout=timeout)
+
+    @staticmethod
+    async def _send_on(smtp: aiosmtplib.SMTP, mensaje: EmailMessage):
+        try:
+            return await smtp.send_message(mensaje)
+        except aiosmtplib.SMTPServerDisconnected:
+            await smtp.connect()
+            return await smtp.send_message(mensaje)
+
+    async def close(self):
+        while not self._libres.empty():
+            smtp = self._libres.get_nowait()
+            try:
+                await smtp.quit()
+            except Exception:
+                smtp.close()
+
+
+_pool: Optional[SMTPConnectionPool] = None
+
+
+def build_email(destinatario: str, asunto: str, cuerpo: str, subtype: str = "html",
+                adjuntos: Optional[Sequence[tuple]] = None) -> EmailMessage:
+    """Arma un EmailMessage; 'adjuntos' es una lista de (nombre, contenido, tipo_mime)."""
+    mime = EmailMessage()
+    mime["From"] = settings.MAIL_FROM
+    mime["To"] = destinatario
+    mime["Subject"] = asunto
+    mime.set_content(cuerpo or "", subtype=subtype, charset="utf-8")
+    for nombre, contenido, tipo_mime in adjuntos or []:
+        maintype, _, subtipo = (tipo_mime or "application/octet-stream").partition("/")
+        mime.add_attachment(contenido, maintype=maintype, subtype=subtipo or "octet-stream", filename=nombre)
+    return mime
+
+
+def build_mime_message(message: MessageSchema) -> EmailMessage:
+    """Convierte un MessageSchema de fastapi-mail (sin adjuntos) en un EmailMessage para aiosmtplib."""
+    subtype = "html" if message.subtype == MessageType.html else "plain"
+    destinatario = ", ".join(getattr(r, "email", str(r)) for r in message.recipients)
+    return build_email(destinatario, message.subject, message.body, subtype=subtype)
+
+
+def create_pool() -> SMTPConnectionPool:
+    """Pool con la configuración de correo de la aplicación (las conexiones se abren bajo demanda)."""
+    return SMTPConnectionPool(
+        hostname=settings.MAIL_SERVER,
+        port=settings.MAIL_PORT,
+        username=settings.MAIL_USERNAME,
+        password=settings.MAIL_PASSWORD,
+        use_tls=settings.MAIL_SSL_TLS,
+        start_tls=settings.MAIL_STARTTLS,
+        size=settings.SMTP_POOL_SIZE,
+    )
+
+
+async def start_pool():
+    """Crea el pool global (las conexiones se abren bajo demanda, no en el arranque)."""
+    global _pool
+    if _pool is None:
+        _pool = create_pool()
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def get_pool() -> Optional[SMTPConnectionPool]:
+    return _pool
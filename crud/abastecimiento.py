@@ -1,22 +1,35 @@
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import desc, asc, or_  # Importar asc y or_
+from sqlalchemy import desc, or_, func
 from db import models
 from schemas import abastecimiento as abastecimiento_schema
-from typing import Optional, List
+from crud import estado_consumo as estado_consumo_crud
+from crud import consumo_diario as consumo_diario_crud
+from crud import prediccion as prediccion_crud
+from typing import Iterator, Optional, List
+from datetime import datetime
 
 
-# --- FUNCIÓN PARA EL HISTORIAL (CORREGIDA) ---
-def get_historial_abastecimientos(
-    db: Session,
-    current_user: models.Usuario,
-    sitio_id: Optional[int] = None,
-    q: Optional[str] = None,
-    skip: int = 0,
-    limit: Optional[int] = 100 # <-- Cambiado a Optional[int]
-) -> List[models.Abastecimiento]: # <-- Especificar tipo de retorno
+# Columnas del historial usadas por los reportes (report_service.HEADERS), sin objetos ORM
+HISTORIAL_COLUMNAS = (
+    models.Abastecimiento.ot,
+    models.Sitio.nombre.label("sitio_nombre"),
+    models.Abastecimiento.fecha,
+    models.Abastecimiento.gls_existentes,
+    models.Abastecimiento.gls_abastecidos,
+    models.Abastecimiento.horometraje,
+    models.Abastecimiento.status,
+    models.Abastecimiento.alarma_transferencia,
+    models.Abastecimiento.alarma_falla_energia,
+)
+
+
+ALCANCE_TODOS = "todos"
+
+
+def get_historial_scope(db: Session, current_user: models.Usuario) -> Optional[str]:
     """
-    Obtiene el historial de abastecimientos filtrado por rol y parámetros.
-    Si limit es None, devuelve todos los resultados que coincidan (sin paginación).
+    Alcance del historial visible para el usuario: ALCANCE_TODOS (ADMIN/SUPERVISOR),
+    "tecnico:<id_tecnico>" (TECNICO, solo sus sitios) o None si no puede ver nada.
     """
     user_with_roles = db.query(models.Usuario).options(
         joinedload(models.Usuario.roles),
@@ -24,56 +37,104 @@ def get_historial_abastecimientos(
     ).filter(models.Usuario.id_usuario == current_user.id_usuario).first()
 
     if not user_with_roles:
-        return []
+        return None
 
     user_roles = {rol.nombre for rol in user_with_roles.roles}
     print(f"-> Historial: Usuario {current_user.correo}, Roles cargados: {user_roles}") # DEBUG
 
-    query = db.query(models.Abastecimiento).options(
-        joinedload(models.Abastecimiento.sitio) # Cargar sitio para filtros y posible uso
-    )
-
-    # Aplicar filtros de rol y búsqueda (lógica sin cambios)
     if 'ADMIN' in user_roles or 'SUPERVISOR' in user_roles:
         print("-> Acceso como ADMIN/SUPERVISOR.") # DEBUG
-        if q:
-            query = query.join(models.Sitio, models.Abastecimiento.id_sitio == models.Sitio.id_sitio).filter(
-                or_(
-                    models.Sitio.id.ilike(f"%{q}%"),
-                    models.Sitio.nombre.ilike(f"%{q}%"),
-                    models.Abastecimiento.ot.ilike(f"%{q}%")
-                )
-            )
-        if sitio_id:
-            query = query.filter(models.Abastecimiento.id_sitio == sitio_id)
-
-    elif 'TECNICO' in user_roles:
+        return ALCANCE_TODOS
+    if 'TECNICO' in user_roles:
         print("-> Acceso como TECNICO.") # DEBUG
         tecnico_profile = user_with_roles.tecnico
         if not tecnico_profile:
             print(f"-> Advertencia: Usuario {current_user.correo} rol TECNICO sin perfil.")
-            return []
-
-        # Siempre unimos con Sitio para filtrar por tecnico_id
-        query = query.join(models.Sitio, models.Abastecimiento.id_sitio == models.Sitio.id_sitio) \
-            .filter(models.Sitio.id_tecnico == tecnico_profile.id_tecnico)
-
-        if sitio_id: # Filtro adicional sobre los sitios del técnico
-            query = query.filter(models.Abastecimiento.id_sitio == sitio_id)
-        if q: # Filtro adicional sobre los sitios del técnico
-            query = query.filter(
-                or_(
-                    models.Sitio.id.ilike(f"%{q}%"),
-                    models.Sitio.nombre.ilike(f"%{q}%"),
-                    models.Abastecimiento.ot.ilike(f"%{q}%")
-                )
+            return None
+        return f"tecnico:{tecnico_profile.id_tecnico}"
+    print(f"-> Usuario {current_user.correo} sin roles válidos.") # DEBUG
+    return None
+
+
+def _aplicar_filtros_historial(query, alcance: str, sitio_id: Optional[int] = None, q: Optional[str] = None):
+    # Un técnico solo ve los sitios que tiene asignados
+    if alcance != ALCANCE_TODOS:
+        id_tecnico = int(alcance.split(":", 1)[1])
+        query = query.filter(models.Sitio.id_tecnico == id_tecnico)
+
+    if sitio_id:
+        query = query.filter(models.Abastecimiento.id_sitio == sitio_id)
+    if q:
+        query = query.filter(
+            or_(
+                models.Sitio.id.ilike(f"%{q}%"),
+                models.Sitio.nombre.ilike(f"%{q}%"),
+                models.Abastecimiento.ot.ilike(f"%{q}%")
             )
-    else:
-        print(f"-> Usuario {current_user.correo} sin roles válidos.") # DEBUG
-        return []
+        )
+    return query
 
+
+def _build_historial_query(db: Session, current_user: models.Usuario, query,
+                           sitio_id: Optional[int] = None, q: Optional[str] = None):
+    """
+    Aplica los filtros de rol y búsqueda del historial a 'query' (que debe incluir
+    el join con Sitio). Devuelve None si el usuario no puede ver ningún registro.
+    """
+    alcance = get_historial_scope(db, current_user)
+    if alcance is None:
+        return None
+    query = _aplicar_filtros_historial(query, alcance, sitio_id=sitio_id, q=q)
     # Aplicar ordenamiento
-    query = query.order_by(desc(models.Abastecimiento.fecha))
+    return query.order_by(desc(models.Abastecimiento.fecha))
+
+
+def get_historial_watermark(db: Session, current_user: models.Usuario,
+                            sitio_id: Optional[int] = None, q: Optional[str] = None) -> Optional[dict]:
+    """
+    Marca de agua del historial filtrado: alcance del usuario, número de registros,
+    último id y suma de las revisiones. Cambia con cualquier alta, edición o cancelación
+    dentro del alcance, aunque ocurran en el mismo segundo (cada UPDATE incrementa la
+    revisión de la fila). Se usa como clave de la caché de reportes. None si no hay acceso.
+    """
+    alcance = get_historial_scope(db, current_user)
+    if alcance is None:
+        return None
+    query = db.query(
+        func.count(models.Abastecimiento.id_abastecimiento),
+        func.max(models.Abastecimiento.id_abastecimiento),
+        func.coalesce(func.sum(models.Abastecimiento.revision), 0),
+    ).outerjoin(models.Sitio, models.Abastecimiento.id_sitio == models.Sitio.id_sitio)
+    total, max_id, revisiones = _aplicar_filtros_historial(query, alcance, sitio_id=sitio_id, q=q).one()
+    return {
+        "alcance": alcance,
+        "total": total,
+        "max_id": max_id,
+        "revisiones": int(revisiones),
+    }
+
+
+# --- FUNCIÓN PARA EL HISTORIAL (CORREGIDA) ---
+def get_historial_abastecimientos(
+    db: Session,
+    current_user: models.Usuario,
+    sitio_id: Optional[int] = None,
+    q: Optional[str] = None,
+    skip: int = 0,
+    limit: Optional[int] = 100 # <-- Cambiado a Optional[int]
+) -> List[models.Abastecimiento]: # <-- Especificar tipo de retorno
+    """
+    Obtiene el historial de abastecimientos filtrado por rol y parámetros.
+    Si limit es None, devuelve todos los resultados que coincidan (sin paginación).
+    """
+    query = db.query(models.Abastecimiento).outerjoin(
+        models.Sitio, models.Abastecimiento.id_sitio == models.Sitio.id_sitio
+    ).options(
+        joinedload(models.Abastecimiento.sitio) # Cargar sitio para filtros y posible uso
+    )
+    query = _build_historial_query(db, current_user, query, sitio_id=sitio_id, q=q)
+    if query is None:
+        return []
 
     # --- MODIFICACIÓN: Aplicar paginación solo si limit no es None ---
     if limit is not None:
@@ -84,13 +145,79 @@ def get_historial_abastecimientos(
     print(f"-> get_historial (limit={limit}): Devolviendo {len(registros)} registros.") # DEBUG
     return registros
 
-# --- FUNCIONES EXISTENTES (CON CORRECCIÓN EN get_abastecimientos_by_sitio) ---
-def create_abastecimiento(db: Session, abastecimiento: abastecimiento_schema.AbastecimientoCreate, tecnico_id: int):
+
+def stream_historial_rows(
+    db: Session,
+    current_user: models.Usuario,
+    sitio_id: Optional[int] = None,
+    q: Optional[str] = None,
+    batch_size: int = 1000
+) -> Iterator:
+    """
+    Igual que get_historial_abastecimientos sin paginación, pero para descargas:
+    devuelve tuplas livianas (HISTORIAL_COLUMNAS) leídas con un cursor del lado del
+    servidor, 'batch_size' filas a la vez, en lugar de materializar todos los objetos ORM.
+    """
+    query = db.query(*HISTORIAL_COLUMNAS).outerjoin(
+        models.Sitio, models.Abastecimiento.id_sitio == models.Sitio.id_sitio
+    )
+    query = _build_historial_query(db, current_user, query, sitio_id=sitio_id, q=q)
+    if query is None:
+        return iter(())
+    # yield_per activa stream_results (SSCursor en PyMySQL): las filas llegan por lotes
+    return iter(query.yield_per(batch_size))
+
+def get_consumo_por_sitio(db: Session, desde: datetime, hasta: datetime) -> List:
+    """
+    Consumo del periodo [desde, hasta) agregado por contratista, supervisor y sitio en
+    una sola consulta (reportes periódicos de services/consumo_report_service.py).
+    Solo abastecimientos activos; ordenado para agrupar por contratista y supervisor.
+    """
+    return db.query(
+        models.Contratista.id_contratista,
+        models.Contratista.nombre_contrata,
+        models.Supervisor.id_supervisor,
+        models.Supervisor.nombre_completo.label("supervisor_nombre"),
+        models.Supervisor.correo.label("supervisor_correo"),
+        models.Sitio.id_sitio,
+        models.Sitio.id.label("sitio_codigo"),
+        models.Sitio.nombre.label("sitio_nombre"),
+        func.count(models.Abastecimiento.id_abastecimiento).label("abastecimientos"),
+        func.sum(models.Abastecimiento.gls_abastecidos).label("gls_abastecidos"),
+        (func.max(models.Abastecimiento.horometraje) - func.min(models.Abastecimiento.horometraje)).label("horas"),
+        func.avg(models.Abastecimiento.rendimiento_mg).label("rendimiento_promedio"),
+    ).join(
+        models.Sitio, models.Abastecimiento.id_sitio == models.Sitio.id_sitio
+    ).outerjoin(
+        models.Supervisor, models.Sitio.id_supervisor == models.Supervisor.id_supervisor
+    ).outerjoin(
+        models.Contratista, models.Sitio.id_contratista == models.Contratista.id_contratista
+    ).filter(
+        models.Abastecimiento.status == 'ACTIVO',
+        models.Abastecimiento.fecha >= desde,
+        models.Abastecimiento.fecha < hasta,
+    ).group_by(
+        models.Contratista.id_contratista, models.Contratista.nombre_contrata,
+        models.Supervisor.id_supervisor, models.Supervisor.nombre_completo, models.Supervisor.correo,
+        models.Sitio.id_sitio, models.Sitio.id, models.Sitio.nombre,
+    ).order_by(
+        models.Contratista.nombre_contrata, models.Supervisor.nombre_completo, models.Sitio.nombre
+    ).all()
+
+# --- FUNCIONES EXISTENTES ---
+def create_abastecimiento(db: Session, abastecimiento: abastecimiento_schema.AbastecimientoCreate, tecnico_id: int,
+                          commit: bool = True):
     # El argumento tecnico_id no se usa
+    # commit=False deja la transacción abierta (p. ej. para encolar correos en el outbox)
     db_abastecimiento = models.Abastecimiento(**abastecimiento.model_dump())
     db.add(db_abastecimiento)
-    db.commit()
-    db.refresh(db_abastecimiento)
+    db.flush()
+    estado_consumo_crud.registrar_abastecimiento(db, db_abastecimiento)
+    consumo_diario_crud.aplicar_cambio(db, None, consumo_diario_crud.huella(db_abastecimiento))
+    prediccion_crud.invalidate_prediccion(db, db_abastecimiento.id_sitio)
+    if commit:
+        db.commit()
+        db.refresh(db_abastecimiento)
     return db_abastecimiento
 
 
@@ -105,21 +232,6 @@ def get_abastecimientos(db: Session, skip: int = 0, limit: int = 100):
     ).offset(skip).limit(limit).all()
 
 
-def get_abastecimientos_by_sitio(db: Session, sitio_id: int):
-    """
-    Obtiene abastecimientos ACTIVOS de un sitio, ordenados por fecha ASCENDENTE.
-    El servicio de predicción NECESITA este orden (asc) para calcular
-    diferencias entre registros.
-    """
-    # --- CORRECCIÓN CRÍTICA PARA PREDICCIONES ---
-    return db.query(models.Abastecimiento).filter(
-        models.Abastecimiento.id_sitio == sitio_id,
-        models.Abastecimiento.status == 'ACTIVO'  # Filtrar solo activos para predicción
-    ).order_by(
-        asc(models.Abastecimiento.fecha)  # CAMBIADO A asc()
-    ).all()
-
-
 def get_abastecimiento_by_id(db: Session, abastecimiento_id: int):
     return db.query(models.Abastecimiento).options(
         joinedload(models.Abastecimiento.sitio).joinedload(models.Sitio.supervisor),
@@ -130,20 +242,33 @@ def get_abastecimiento_by_id(db: Session, abastecimiento_id: int):
 
 
 def update_abastecimiento(db: Session, db_abastecimiento: models.Abastecimiento,
-                          abastecimiento_in: abastecimiento_schema.AbastecimientoUpdate):
+                          abastecimiento_in: abastecimiento_schema.AbastecimientoUpdate, commit: bool = True):
+    aporte_anterior = consumo_diario_crud.huella(db_abastecimiento)
     update_data = abastecimiento_in.model_dump(exclude_unset=True)
     for field, value in update_data.items():
         setattr(db_abastecimiento, field, value)
     db.add(db_abastecimiento)
-    db.commit()
-    db.refresh(db_abastecimiento)
+    db.flush()
+    consumo_diario_crud.aplicar_cambio(db, aporte_anterior, consumo_diario_crud.huella(db_abastecimiento))
+    # Una edición puede cambiar cualquier intervalo: se recalcula el estado del sitio
+    estado_consumo_crud.rebuild_estado_sitio(db, db_abastecimiento.id_sitio)
+    prediccion_crud.invalidate_prediccion(db, db_abastecimiento.id_sitio)
+    if commit:
+        db.commit()
+        db.refresh(db_abastecimiento)
     return db_abastecimiento
 
 
-def soft_delete_abastecimiento(db: Session, db_abastecimiento: models.Abastecimiento):
+def soft_delete_abastecimiento(db: Session, db_abastecimiento: models.Abastecimiento, commit: bool = True):
+    aporte_anterior = consumo_diario_crud.huella(db_abastecimiento)
     # Asume que 'status' es un string y 'CANCELADO' es un valor válido
     db_abastecimiento.status = 'CANCELADO'
     db.add(db_abastecimiento)
-    db.commit()
-    db.refresh(db_abastecimiento)
+    db.flush()
+    consumo_diario_crud.aplicar_cambio(db, aporte_anterior, None)
+    estado_consumo_crud.rebuild_estado_sitio(db, db_abastecimiento.id_sitio)
+    prediccion_crud.invalidate_prediccion(db, db_abastecimiento.id_sitio)
+    if commit:
+        db.commit()
+        db.refresh(db_abastecimiento)
     return db_abastecimiento
\ No newline at end of file
@@ -1,3 +1,4 @@
+from sqlalchemy import insert, update
 from sqlalchemy.orm import Session, joinedload
 from db import models
 from schemas import alerta as alerta_schema
@@ -67,4 +68,48 @@ def close_alert(db: Session, db_alerta: models.Alerta):
     db.add(db_alerta)
     db.commit()
     db.refresh(db_alerta)
-    return db_alerta
\ No newline at end of file
+    return db_alerta
+
+
+def get_open_alerts_by_sitio(db: Session, sitio_ids: list) -> dict:
+    """
+    Alertas ABIERTAS de varios sitios en una sola consulta: {id_sitio: alerta}.
+    """
+    if not sitio_ids:
+        return {}
+    alertas = db.query(models.Alerta).filter(
+        models.Alerta.id_sitio.in_(sitio_ids),
+        models.Alerta.estado_alerta == EstadoAlertaEnum.ABIERTA
+    ).order_by(models.Alerta.id_alerta).all()
+    abiertas = {}
+    for alerta in alertas:
+        abiertas.setdefault(alerta.id_sitio, alerta)
+    return abiertas
+
+
+def bulk_apply_alert_changes(db: Session, actualizar: list, cerrar: list, crear: list):
+    """
+    Aplica en bloque los cambios de alertas calculados en memoria:
+      - actualizar: dicts con id_alerta y los campos a cambiar (UPDATE por clave primaria)
+      - cerrar: ids de alertas a pasar a CERRADA (un solo UPDATE ... WHERE id IN)
+      - crear: dicts de alertas nuevas (un solo INSERT de varias filas)
+    Devuelve las alertas creadas. No hace commit.
+    """
+    if actualizar:
+        db.execute(update(models.Alerta), actualizar)
+    if cerrar:
+        db.query(models.Alerta).filter(models.Alerta.id_alerta.in_(cerrar)).update(
+            {models.Alerta.estado_alerta: EstadoAlertaEnum.CERRADA}, synchronize_session=False)
+    if not crear:
+        return []
+
+    filas = [{**c, "estado_alerta": EstadoAlertaEnum.ABIERTA} for c in crear]
+    if db.get_bind().dialect.insert_returning:
+        # MariaDB/SQLite: INSERT de varias filas con RETURNING (devuelve exactamente las insertadas)
+        return list(db.scalars(insert(models.Alerta).returning(models.Alerta), filas))
+    # MySQL no admite RETURNING: el ORM inserta y toma el id de cada fila (lastrowid), de modo
+    # que una alerta creada a la vez por otro proceso nunca se confunde con las de este bloque
+    nuevas = [models.Alerta(**fila) for fila in filas]
+    db.add_all(nuevas)
+    db.flush()
+    return nuevas
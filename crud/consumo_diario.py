@@ -0,0 +1,81 @@
+# crud/consumo_diario.py
+from collections import defaultdict
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+from db import models
+from db.upsert import upsert
+
+
+def huella(db_abastecimiento: models.Abastecimiento) -> Optional[Tuple[date, int, float]]:
+    """
+    Aporte del abastecimiento al rollup: (día, sitio, galones), o None si no suma
+    (no está ACTIVO). Se toma antes y después de una edición para aplicar la diferencia.
+    """
+    if db_abastecimiento.status != 'ACTIVO' or db_abastecimiento.fecha is None:
+        return None
+    fecha = db_abastecimiento.fecha
+    dia = fecha.date() if isinstance(fecha, datetime) else fecha
+    return dia, db_abastecimiento.id_sitio, db_abastecimiento.gls_abastecidos or 0.0
+
+
+def aplicar_cambio(db: Session, antes: Optional[tuple], despues: Optional[tuple]):
+    """
+    Resta el aporte 'antes' y suma el aporte 'despues' (huella()) con un solo upsert
+    incremental. No hace commit: se confirma junto con el cambio del abastecimiento.
+    """
+    if antes == despues:
+        return
+    deltas = defaultdict(lambda: [0, 0.0])
+    for aporte, signo in ((antes, -1), (despues, 1)):
+        if aporte is None:
+            continue
+        dia, id_sitio, galones = aporte
+        deltas[(dia, id_sitio)][0] += signo
+        deltas[(dia, id_sitio)][1] += signo * galones
+    filas = [
+        {"fecha": dia, "id_sitio": id_sitio, "n_abastecimientos": n, "gls_abastecidos": galones}
+        for (dia, id_sitio), (n, galones) in deltas.items()
+        if n != 0 or galones != 0
+    ]
+    upsert(db, models.ConsumoDiario, filas, key_columns=["fecha", "id_sitio"],
+           increment_columns=["n_abastecimientos", "gls_abastecidos"])
+
+
+def get_galones_por_dia(db: Session, desde: date, tecnico_id: Optional[int] = None) -> List:
+    """Galones por día desde 'desde' (inclusive), opcionalmente solo de los sitios del técnico."""
+    query = db.query(
+        models.ConsumoDiario.fecha,
+        func.sum(models.ConsumoDiario.gls_abastecidos)
+    ).filter(models.ConsumoDiario.fecha >= desde)
+    if tecnico_id is not None:
+        query = query.join(
+            models.Sitio, models.ConsumoDiario.id_sitio == models.Sitio.id_sitio
+        ).filter(models.Sitio.id_tecnico == tecnico_id)
+    return query.group_by(models.ConsumoDiario.fecha).order_by(models.ConsumoDiario.fecha).all()
+
+
+def rebuild_all(db: Session) -> int:
+    """
+    Reconstruye consumo_diario desde el historial ACTIVO con un INSERT ... SELECT
+    (backfill inicial o tras ediciones hechas fuera de la API). Devuelve las filas creadas.
+    """
+    # DATE(fecha) en MySQL y en SQLite (CAST(... AS DATE) en SQLite da solo el año)
+    dia = func.date(models.Abastecimiento.fecha).label("dia")
+    origen = select(
+        dia,
+        models.Abastecimiento.id_sitio,
+        func.count(models.Abastecimiento.id_abastecimiento),
+        func.coalesce(func.sum(models.Abastecimiento.gls_abastecidos), 0),
+    ).where(
+        models.Abastecimiento.status == 'ACTIVO',
+        models.Abastecimiento.id_sitio.isnot(None)
+    ).group_by(dia, models.Abastecimiento.id_sitio)
+
+    db.query(models.ConsumoDiario).delete(synchronize_session=False)
+    resultado = db.execute(insert(models.ConsumoDiario).from_select(
+        ["fecha", "id_sitio", "n_abastecimientos", "gls_abastecidos"], origen
+    ))
+    db.commit()
+    return resultado.rowcount
@@ -0,0 +1,179 @@
+# crud/estado_consumo.py
+from collections import deque
+from itertools import groupby
+from sqlalchemy.orm import Session
+from core.config import settings
+from db import models
+from typing import Iterable, List, Optional
+
+# Columnas del historial necesarias para reconstruir el estado
+_COLUMNAS = (
+    models.Abastecimiento.id_sitio,
+    models.Abastecimiento.id_abastecimiento,
+    models.Abastecimiento.fecha,
+    models.Abastecimiento.horometraje,
+    models.Abastecimiento.gls_existentes,
+    models.Abastecimiento.gls_abastecidos,
+)
+
+
+def _intervalo(horometraje_anterior: float, nivel_post_anterior: float,
+               horometraje: float, gls_existentes: float) -> Optional[list]:
+    """Intervalo [horometraje_diff, gls_consumidos] si es válido (ambos positivos), si no None."""
+    horometraje_diff = horometraje - horometraje_anterior
+    gls_consumidos = nivel_post_anterior - gls_existentes
+    if horometraje_diff > 0 and gls_consumidos > 0:
+        return [horometraje_diff, gls_consumidos]
+    return None
+
+
+def _estado_desde_filas(id_sitio: int, filas: Iterable) -> dict:
+    """Calcula los valores del estado a partir de filas ordenadas por fecha ascendente."""
+    estado = {"id_sitio": id_sitio, "n_registros": 0}
+    # Solo los últimos PREDICTION_INTERVAL_WINDOW intervalos válidos
+    intervalos = deque(maxlen=settings.PREDICTION_INTERVAL_WINDOW)
+    anterior = None
+    for fila in filas:
+        if anterior is None:
+            estado["primera_fecha"] = fila.fecha
+            estado["primer_horometraje"] = fila.horometraje
+        else:
+            intervalo = _intervalo(anterior.horometraje, anterior.gls_existentes + anterior.gls_abastecidos,
+                                   fila.horometraje, fila.gls_existentes)
+            if intervalo:
+                intervalos.append(intervalo)
+        estado["n_registros"] += 1
+        anterior = fila
+
+    estado["intervalos"] = list(intervalos)
+    if anterior is not None:
+        estado.update({
+            "id_ultimo_abastecimiento": anterior.id_abastecimiento,
+            "ultima_fecha": anterior.fecha,
+            "ultimo_horometraje": anterior.horometraje,
+            "ultimo_gls_existentes": anterior.gls_existentes,
+            "ultimo_gls_abastecidos": anterior.gls_abastecidos,
+        })
+    return estado
+
+
+def rebuild_estado_sitio(db: Session, id_sitio: int) -> models.EstadoConsumoSitio:
+    """
+    Recalcula el estado de un sitio leyendo su historial ACTIVO.
+    No hace commit: se confirma junto con el cambio que lo provocó.
+    """
+    filas = db.query(*_COLUMNAS).filter(
+        models.Abastecimiento.id_sitio == id_sitio,
+        models.Abastecimiento.status == 'ACTIVO'
+    ).order_by(models.Abastecimiento.fecha.asc(), models.Abastecimiento.id_abastecimiento.asc()).all()
+
+    valores = _estado_desde_filas(id_sitio, filas)
+    db_estado = db.get(models.EstadoConsumoSitio, id_sitio)
+    if db_estado is None:
+        db_estado = models.EstadoConsumoSitio(id_sitio=id_sitio)
+    for campo in ("primera_fecha", "primer_horometraje", "id_ultimo_abastecimiento", "ultima_fecha",
+                  "ultimo_horometraje", "ultimo_gls_existentes", "ultimo_gls_abastecidos"):
+        setattr(db_estado, campo, valores.get(campo))
+    db_estado.n_registros = valores["n_registros"]
+    db_estado.intervalos = valores["intervalos"]
+    db.add(db_estado)
+    db.flush()
+    return db_estado
+
+
+def registrar_abastecimiento(db: Session, db_abastecimiento: models.Abastecimiento) -> models.EstadoConsumoSitio:
+    """
+    Actualiza el estado del sitio con un abastecimiento recién creado.
+    Si es el más reciente del sitio (caso normal) la actualización no lee el historial
+    y su costo está acotado por el tamaño de la ventana (no crece con el historial);
+    si llega fuera de orden se reconstruye el estado del sitio. No hace commit.
+    """
+    id_sitio = db_abastecimiento.id_sitio
+    db_estado = db.get(models.EstadoConsumoSitio, id_sitio)
+    es_siguiente = (
+        db_estado is not None
+        and db_abastecimiento.status == 'ACTIVO'
+        and (db_estado.n_registros == 0 or db_abastecimiento.fecha >= db_estado.ultima_fecha)
+    )
+    if not es_siguiente:
+        return rebuild_estado_sitio(db, id_sitio)
+
+    if db_estado.n_registros == 0:
+        db_estado.primera_fecha = db_abastecimiento.fecha
+        db_estado.primer_horometraje = db_abastecimiento.horometraje
+    else:
+        intervalo = _intervalo(db_estado.ultimo_horometraje,
+                               db_estado.ultimo_gls_existentes + db_estado.ultimo_gls_abastecidos,
+                               db_abastecimiento.horometraje, db_abastecimiento.gls_existentes)
+        if intervalo:
+            # Ventana acotada: se descarta el intervalo más antiguo al superar el tamaño.
+            # Se reasigna la lista para que SQLAlchemy detecte el cambio en la columna JSON
+            ventana = list(db_estado.intervalos or []) + [intervalo]
+            db_estado.intervalos = ventana[-settings.PREDICTION_INTERVAL_WINDOW:]
+
+    db_estado.n_registros += 1
+    db_estado.id_ultimo_abastecimiento = db_abastecimiento.id_abastecimiento
+    db_estado.ultima_fecha = db_abastecimiento.fecha
+    db_estado.ultimo_horometraje = db_abastecimiento.horometraje
+    db_estado.ultimo_gls_existentes = db_abastecimiento.gls_existentes
+    db_estado.ultimo_gls_abastecidos = db_abastecimiento.gls_abastecidos
+    db.add(db_estado)
+    return db_estado
+
+
+def get_estado(db: Session, id_sitio: int) -> models.EstadoConsumoSitio:
+    """Devuelve el estado del sitio; si aún no existe, lo construye y lo guarda."""
+    db_estado = db.get(models.EstadoConsumoSitio, id_sitio)
+    if db_estado is None:
+        db_estado = rebuild_estado_sitio(db, id_sitio)
+        db.commit()
+        db.refresh(db_estado)
+    return db_estado
+
+
+def create_faltantes(db: Session, sitio_ids: List[int]) -> int:
+    """
+    Crea el estado de los sitios de 'sitio_ids' que aún no lo tienen (sitios sin
+    altas por la API desde que existe la tabla), con una sola lectura del historial
+    de esos sitios. Devuelve cuántos se crearon. No hace commit.
+    """
+    if not sitio_ids:
+        return 0
+    existentes = {id_sitio for (id_sitio,) in db.query(models.EstadoConsumoSitio.id_sitio).filter(
+        models.EstadoConsumoSitio.id_sitio.in_(sitio_ids))}
+    faltantes = [id_sitio for id_sitio in sitio_ids if id_sitio not in existentes]
+    if not faltantes:
+        return 0
+
+    filas = db.query(*_COLUMNAS).filter(
+        models.Abastecimiento.id_sitio.in_(faltantes),
+        models.Abastecimiento.status == 'ACTIVO'
+    ).order_by(
+        models.Abastecimiento.id_sitio, models.Abastecimiento.fecha, models.Abastecimiento.id_abastecimiento
+    ).all()
+    por_sitio = {id_sitio: list(grupo) for id_sitio, grupo in groupby(filas, key=lambda f: f.id_sitio)}
+    db.bulk_insert_mappings(models.EstadoConsumoSitio, [
+        _estado_desde_filas(id_sitio, por_sitio.get(id_sitio, [])) for id_sitio in faltantes
+    ])
+    return len(faltantes)
+
+
+def rebuild_all(db: Session, batch_size: int = 5000) -> int:
+    """
+    Reconstruye el estado de todos los sitios en una sola lectura del historial
+    ACTIVO (para backfills, tras ediciones inconsistentes o al cambiar
+    PREDICTION_INTERVAL_WINDOW). Devuelve los sitios procesados.
+    """
+    filas = db.query(*_COLUMNAS).filter(
+        models.Abastecimiento.status == 'ACTIVO'
+    ).order_by(
+        models.Abastecimiento.id_sitio, models.Abastecimiento.fecha, models.Abastecimiento.id_abastecimiento
+    ).yield_per(batch_size)
+
+    estados = [_estado_desde_filas(id_sitio, grupo) for id_sitio, grupo in groupby(filas, key=lambda f: f.id_sitio)]
+
+    db.query(models.EstadoConsumoSitio).delete(synchronize_session=False)
+    if estados:
+        db.bulk_insert_mappings(models.EstadoConsumoSitio, estados)
+    db.commit()
+    return len(estados)
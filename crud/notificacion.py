@@ -1,4 +1,5 @@
 # crud/notificacion.py
+from sqlalchemy import insert
 from sqlalchemy.orm import Session, joinedload
 from db import models
 from schemas import notificacion as notificacion_schema
@@ -13,6 +14,15 @@ def create_log(db: Session, log: notificacion_schema.NotificacionLogCreate):
     db.refresh(db_log)
     return db_log
 
+def create_logs_bulk(db: Session, logs: list):
+    """
+    Inserta varios registros del log de notificaciones en una sola sentencia.
+    """
+    if not logs:
+        return
+    db.execute(insert(models.NotificacionLog), [log.model_dump() for log in logs])
+    db.commit()
+
 # --- NUEVAS FUNCIONES PARA LA CONFIGURACIÓN ---
 
 def get_config_by_id(db: Session, config_id: int):
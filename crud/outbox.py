@@ -0,0 +1,154 @@
+# crud/outbox.py
+from datetime import datetime, timedelta
+from sqlalchemy import and_, insert, or_
+from sqlalchemy.orm import Session, selectinload
+from db import models
+from typing import List, Optional, Sequence
+
+
+def enqueue(
+    db: Session,
+    direccion_destino: str,
+    asunto: str,
+    cuerpo_html: str,
+    id_usuario_destino: Optional[int] = None,
+    id_alerta: Optional[int] = None,
+    id_abastecimiento: Optional[int] = None,
+    adjuntos: Optional[Sequence[tuple]] = None,
+    adjuntar_comprobante: bool = False,
+) -> models.NotificacionOutbox:
+    """
+    Agrega un correo al outbox. 'adjuntos' es una lista de (nombre, contenido, tipo_mime);
+    con adjuntar_comprobante el despachador adjunta al enviar el PDF del comprobante
+    de 'id_abastecimiento'. No hace commit: el correo se confirma junto con el cambio
+    de negocio que lo origina.
+    """
+    db_outbox = models.NotificacionOutbox(
+        direccion_destino=direccion_destino,
+        asunto=asunto,
+        cuerpo_html=cuerpo_html,
+        id_usuario_destino=id_usuario_destino,
+        id_alerta=id_alerta,
+        id_abastecimiento=id_abastecimiento,
+        adjuntar_comprobante=adjuntar_comprobante,
+        estado=models.EstadoOutboxEnum.PENDIENTE,
+        intentos=0,
+        proximo_intento=datetime.utcnow(),
+    )
+    for nombre, contenido, tipo_mime in adjuntos or []:
+        db_outbox.adjuntos.append(models.NotificacionOutboxAdjunto(
+            nombre=nombre, contenido=contenido, tipo_mime=tipo_mime
+        ))
+    db.add(db_outbox)
+    return db_outbox
+
+
+def claim_pending(db: Session, propietario: str, limit: int = 50,
+                  concesion_segundos: float = 1800.0) -> List[dict]:
+    """
+    Reclama los correos pendientes cuyo próximo intento ya venció (y los EN_PROCESO
+    cuya concesión venció sin resultado): los marca EN_PROCESO a nombre de
+    'propietario' hasta ahora + 'concesion_segundos' y hace commit. Así los bloqueos
+    (FOR UPDATE SKIP LOCKED) solo duran esta transacción corta y el envío SMTP se
+    hace sin transacción abierta. Devuelve los datos necesarios para enviar cada correo.
+    """
+    ahora = datetime.utcnow()
+    reclamados = db.query(models.NotificacionOutbox).options(
+        selectinload(models.NotificacionOutbox.adjuntos)
+    ).filter(or_(
+        and_(models.NotificacionOutbox.estado == models.EstadoOutboxEnum.PENDIENTE,
+             models.NotificacionOutbox.proximo_intento <= ahora),
+        and_(models.NotificacionOutbox.estado == models.EstadoOutboxEnum.EN_PROCESO,
+             models.NotificacionOutbox.reclamado_hasta < ahora),
+    )).order_by(
+        models.NotificacionOutbox.proximo_intento, models.NotificacionOutbox.id_outbox
+    ).limit(limit).with_for_update(skip_locked=True).all()
+
+    pendientes = []
+    for db_outbox in reclamados:
+        db_outbox.estado = models.EstadoOutboxEnum.EN_PROCESO
+        db_outbox.reclamado_por = propietario
+        db_outbox.reclamado_hasta = ahora + timedelta(seconds=concesion_segundos)
+        pendientes.append({
+            "id_outbox": db_outbox.id_outbox,
+            "direccion_destino": db_outbox.direccion_destino,
+            "asunto": db_outbox.asunto,
+            "cuerpo_html": db_outbox.cuerpo_html,
+            "adjuntos": [(a.nombre, a.contenido, a.tipo_mime) for a in db_outbox.adjuntos],
+            "comprobante": db_outbox.id_abastecimiento if db_outbox.adjuntar_comprobante else None,
+        })
+    db.commit()
+    return pendientes
+
+
+def _log(db_outbox: models.NotificacionOutbox, estado: models.EstadoEnvioEnum,
+         respuesta: Optional[str] = None) -> dict:
+    return {
+        "id_usuario_destino": db_outbox.id_usuario_destino,
+        "id_alerta": db_outbox.id_alerta,
+        "id_abastecimiento": db_outbox.id_abastecimiento,
+        "canal_envio": models.CanalEnvioEnum.EMAIL,
+        "direccion_destino": db_outbox.direccion_destino,
+        "estado_envio": estado,
+        "respuesta_proveedor": respuesta,
+    }
+
+
+def _terminar(db_outbox: models.NotificacionOutbox, estado: models.EstadoOutboxEnum):
+    """Estado final: el cuerpo y los adjuntos ya no hacen falta y no se conservan."""
+    db_outbox.estado = estado
+    db_outbox.cuerpo_html = None
+    db_outbox.adjuntos = []
+
+
+def record_results(db: Session, propietario: str, enviados: List[int], fallidos: List[tuple],
+                   max_intentos: int, backoff_base_segundos: float):
+    """
+    Registra el resultado de un lote reclamado por 'propietario'. 'enviados' son ids
+    de outbox y 'fallidos' una lista de (id_outbox, mensaje_error). Solo se actualizan
+    los correos que siguen EN_PROCESO a su nombre (si la concesión venció y otro
+    despachador los tomó, el resultado es de ese otro). Los fallidos se reprograman con
+    espera exponencial (base * 2^(intentos-1)) hasta agotar 'max_intentos'. Se escribe
+    un NotificacionLog por cada envío exitoso o fallido definitivo. Hace commit.
+    """
+    ids = list(enviados) + [id_outbox for id_outbox, _ in fallidos]
+    if not ids:
+        return
+    propios = {o.id_outbox: o for o in db.query(models.NotificacionOutbox).filter(
+        models.NotificacionOutbox.id_outbox.in_(ids),
+        models.NotificacionOutbox.estado == models.EstadoOutboxEnum.EN_PROCESO,
+        models.NotificacionOutbox.reclamado_por == propietario,
+    )}
+
+    ahora = datetime.utcnow()
+    logs = []
+    for id_outbox in enviados:
+        db_outbox = propios.get(id_outbox)
+        if db_outbox is None:
+            continue
+        db_outbox.intentos += 1
+        db_outbox.ultimo_error = None
+        _terminar(db_outbox, models.EstadoOutboxEnum.ENVIADO)
+        logs.append(_log(db_outbox, models.EstadoEnvioEnum.EXITOSO))
+
+    for id_outbox, error in fallidos:
+        db_outbox = propios.get(id_outbox)
+        if db_outbox is None:
+            continue
+        db_outbox.intentos += 1
+        db_outbox.ultimo_error = (error or "")[:255]
+        if db_outbox.intentos >= max_intentos:
+            _terminar(db_outbox, models.EstadoOutboxEnum.FALLIDO)
+            logs.append(_log(db_outbox, models.EstadoEnvioEnum.FALLIDO, db_outbox.ultimo_error))
+        else:
+            espera = backoff_base_segundos * (2 ** (db_outbox.intentos - 1))
+            db_outbox.estado = models.EstadoOutboxEnum.PENDIENTE
+            db_outbox.proximo_intento = ahora + timedelta(seconds=espera)
+
+    for db_outbox in propios.values():
+        db_outbox.reclamado_por = None
+        db_outbox.reclamado_hasta = None
+
+    if logs:
+        db.execute(insert(models.NotificacionLog), logs)
+    db.commit()
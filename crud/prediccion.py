@@ -1,6 +1,8 @@
 # crud/prediccion.py
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session, contains_eager
 from db import models
+from db.upsert import upsert
 # No necesitas importar el schema aquí si recibes un dict
 # from schemas import prediccion as prediccion_schema
 from datetime import datetime
@@ -25,6 +27,10 @@ def create_or_update_prediccion(db: Session, prediccion_data: dict):
         # Usar .get() por si no viene en el dict, aunque debería
         db_prediccion.horometro_estimado_fin = prediccion_data.get("horometro_estimado_fin")
         db_prediccion.id_ultimo_abastecimiento_usado = prediccion_data["id_ultimo_abastecimiento_usado"]
+        db_prediccion.huella_modelo = prediccion_data.get("huella_modelo")
+        db_prediccion.consumo_diario_gls = prediccion_data.get("consumo_diario_gls")
+        db_prediccion.nivel_estimado_gls = prediccion_data.get("nivel_estimado_gls")
+        db_prediccion.nivel_estimado_en = prediccion_data.get("nivel_estimado_en")
         # Nota: creado_en no se actualiza aquí, se mantiene el original.
         # Si quisieras actualizar una marca de tiempo, necesitarías un campo 'actualizado_en' en el modelo.
     else:
@@ -35,7 +41,11 @@ def create_or_update_prediccion(db: Session, prediccion_data: dict):
             # fecha_prediccion=datetime.now(), # Eliminado
             fecha_proximo_abastecimiento=prediccion_data["fecha_proximo_abastecimiento"],
             horometro_estimado_fin=prediccion_data.get("horometro_estimado_fin"),
-            id_ultimo_abastecimiento_usado=prediccion_data["id_ultimo_abastecimiento_usado"]
+            id_ultimo_abastecimiento_usado=prediccion_data["id_ultimo_abastecimiento_usado"],
+            huella_modelo=prediccion_data.get("huella_modelo"),
+            consumo_diario_gls=prediccion_data.get("consumo_diario_gls"),
+            nivel_estimado_gls=prediccion_data.get("nivel_estimado_gls"),
+            nivel_estimado_en=prediccion_data.get("nivel_estimado_en")
             # creado_en se llenará automáticamente por la BD
         )
         # --- FIN CORRECCIÓN ---
@@ -50,4 +60,94 @@ def create_or_update_prediccion(db: Session, prediccion_data: dict):
         db.rollback() # Deshacer cambios si hay error
         print(f"Error en CRUD al guardar predicción: {e}")
         # Podrías relanzar la excepción o devolver None/manejar el error
-        raise e # Relanzar para que el servicio lo maneje
\ No newline at end of file
+        raise e # Relanzar para que el servicio lo maneje
+
+
+def get_predicciones_vigentes(db: Session, sitio_ids: list, huella_modelo: str):
+    """
+    Predicciones que siguen siendo válidas: calculadas con la misma huella de modelo
+    y con el último abastecimiento ACTIVO que tiene hoy el sitio (según estado_consumo_sitio).
+    """
+    if not sitio_ids:
+        return []
+    return db.query(models.PrediccionAbastecimiento).join(
+        models.EstadoConsumoSitio,
+        models.EstadoConsumoSitio.id_sitio == models.PrediccionAbastecimiento.id_sitio
+    ).filter(
+        models.PrediccionAbastecimiento.id_sitio.in_(sitio_ids),
+        models.PrediccionAbastecimiento.huella_modelo == huella_modelo,
+        models.PrediccionAbastecimiento.id_ultimo_abastecimiento_usado == models.EstadoConsumoSitio.id_ultimo_abastecimiento
+    ).all()
+
+
+def invalidate_prediccion(db: Session, id_sitio: int):
+    """
+    Marca la predicción del sitio como no vigente (se recalculará en la próxima consulta).
+    No hace commit: se confirma junto con el cambio del abastecimiento.
+    """
+    db.query(models.PrediccionAbastecimiento).filter(
+        models.PrediccionAbastecimiento.id_sitio == id_sitio
+    ).update({models.PrediccionAbastecimiento.huella_modelo: None}, synchronize_session=False)
+
+
+
+def bulk_upsert_predicciones(db: Session, predicciones_data: list):
+    """
+    Guarda varias predicciones (dicts como en create_or_update_prediccion) con un
+    único INSERT ... ON DUPLICATE KEY UPDATE sobre id_sitio y devuelve los objetos.
+    No hace commit: el llamador confirma una vez por bloque.
+    """
+    if not predicciones_data:
+        return []
+    columnas = ["fecha_proximo_abastecimiento", "id_ultimo_abastecimiento_usado",
+                "horometro_estimado_fin", "consumo_diario_gls", "nivel_estimado_gls",
+                "nivel_estimado_en", "huella_modelo"]
+    filas = [{"id_sitio": data["id_sitio"], **{c: data.get(c) for c in columnas}} for data in predicciones_data]
+    upsert(db, models.PrediccionAbastecimiento, filas, key_columns=["id_sitio"], update_columns=columnas)
+
+    return db.query(models.PrediccionAbastecimiento).populate_existing().filter(
+        models.PrediccionAbastecimiento.id_sitio.in_([f["id_sitio"] for f in filas])
+    ).all()
+
+
+def get_sitios_menor_nivel(db: Session, limit: int = 5, tecnico_id: int | None = None):
+    """
+    Predicciones con menor nivel de combustible estimado (usa el índice de
+    nivel_estimado_gls: ORDER BY ... LIMIT sin recorrer todos los sitios). El nivel
+    guardado puede ser negativo (sitio ya agotado): los agotados hace más tiempo salen
+    primero. Está al día según prediction_service.refrescar_niveles.
+    """
+    query = db.query(models.PrediccionAbastecimiento).join(
+        models.Sitio, models.PrediccionAbastecimiento.id_sitio == models.Sitio.id_sitio
+    ).options(contains_eager(models.PrediccionAbastecimiento.sitio)).filter(
+        models.PrediccionAbastecimiento.nivel_estimado_gls.isnot(None)
+    )
+    if tecnico_id is not None:
+        query = query.filter(models.Sitio.id_tecnico == tecnico_id)
+    return query.order_by(models.PrediccionAbastecimiento.nivel_estimado_gls.asc()).limit(limit).all()
+
+
+def get_niveles_desactualizados(db: Session, antes_de: datetime, limite: int):
+    """
+    Hasta 'limite' predicciones cuyo nivel estimado se calculó antes de 'antes_de' (las
+    más antiguas primero, por el índice de nivel_estimado_en): (id_prediccion,
+    consumo_diario_gls, fecha_proximo_abastecimiento).
+    """
+    return db.query(
+        models.PrediccionAbastecimiento.id_prediccion,
+        models.PrediccionAbastecimiento.consumo_diario_gls,
+        models.PrediccionAbastecimiento.fecha_proximo_abastecimiento,
+    ).filter(
+        models.PrediccionAbastecimiento.consumo_diario_gls.isnot(None),
+        or_(models.PrediccionAbastecimiento.nivel_estimado_en.is_(None),
+            models.PrediccionAbastecimiento.nivel_estimado_en < antes_de)
+    ).order_by(models.PrediccionAbastecimiento.nivel_estimado_en.asc()).limit(limite).all()
+
+
+def bulk_update_niveles(db: Session, niveles: list):
+    """
+    Actualiza el nivel estimado de varias predicciones (dicts con id_prediccion,
+    nivel_estimado_gls y nivel_estimado_en) por clave primaria. No hace commit.
+    """
+    if niveles:
+        db.execute(update(models.PrediccionAbastecimiento), niveles)
@@ -4,6 +4,11 @@ from schemas import sitio as sitio_schema
 from fastapi import HTTPException
 
 
+def get_ids_sitios_tecnico(db: Session, tecnico_id: int) -> set:
+    """Ids de los sitios asignados al técnico."""
+    return {id_sitio for (id_sitio,) in db.query(models.Sitio.id_sitio).filter(models.Sitio.id_tecnico == tecnico_id)}
+
+
 def get_sitios(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Sitio).options(
         joinedload(models.Sitio.tipo_sitio),
@@ -12,6 +17,27 @@ def get_sitios(db: Session, skip: int = 0, limit: int = 100):
     ).order_by(models.Sitio.nombre).offset(skip).limit(limit).all()
 
 
+def iter_sitios_para_alertas(db: Session, chunk_size: int = 500):
+    """
+    Recorre TODOS los sitios en bloques de chunk_size usando paginación por clave
+    (id_sitio > último visto), sin OFFSET. Cada bloque es una sola consulta que
+    carga solo lo que necesita la notificación de alertas (técnico y su usuario).
+    """
+    ultimo_id = 0
+    while True:
+        bloque = db.query(models.Sitio).options(
+            joinedload(models.Sitio.tecnico).joinedload(models.Tecnico.usuario)
+        ).filter(
+            models.Sitio.id_sitio > ultimo_id
+        ).order_by(models.Sitio.id_sitio).limit(chunk_size).all()
+
+        if not bloque:
+            return
+        # Guardar la clave antes de ceder el bloque (el llamador puede expulsar los objetos de la sesión)
+        ultimo_id = bloque[-1].id_sitio
+        yield bloque
+
+
 def create_sitio(db: Session, sitio: sitio_schema.SitioCreate):
     db_sitio_check = db.query(models.Sitio).filter(models.Sitio.id == sitio.id).first()
     if db_sitio_check:
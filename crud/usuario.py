@@ -29,7 +29,15 @@ def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Usuario).offset(skip).limit(limit).all()
 
 
-def set_password_reset_token(db: Session, user: models.Usuario) -> str:
+def get_active_users_by_role(db: Session, rol: models.RolEnum) -> List[models.Usuario]:
+    """Usuarios activos con el rol indicado (p. ej. destinatarios de reportes para ADMIN)."""
+    return db.query(models.Usuario).join(models.Usuario.roles).filter(
+        models.Rol.nombre == rol.value,
+        models.Usuario.activo == True
+    ).all()
+
+
+def set_password_reset_token(db: Session, user: models.Usuario, commit: bool = True) -> str:
     """Genera, guarda y devuelve un token de reseteo de contraseña."""
     token = secrets.token_urlsafe(32)
     expire_delta = timedelta(minutes=settings.PASSWORD_RESET_EXPIRE_MINUTES)
@@ -38,7 +46,8 @@ def set_password_reset_token(db: Session, user: models.Usuario) -> str:
     user.reset_token_expires = datetime.utcnow() + expire_delta
 
     db.add(user)
-    db.commit()
+    if commit:
+        db.commit()
 
     return token
 
@@ -48,8 +57,8 @@ def get_user_by_reset_token(db: Session, token: str) -> models.Usuario | None:
     return db.query(models.Usuario).filter(models.Usuario.reset_token == token).first()
 
 
-def create_user(db: Session, user: usuario_schema.UsuarioCreate):
-    """Crea un nuevo usuario en la base de datos."""
+def create_user(db: Session, user: usuario_schema.UsuarioCreate, commit: bool = True):
+    """Crea un nuevo usuario en la base de datos. Con commit=False solo hace flush."""
     hashed_password = PasswordHandler.get_password_hash(user.contrasena)
 
     rol = db.query(models.Rol).filter(models.Rol.id_rol == user.id_rol).first()
@@ -63,8 +72,11 @@ def create_user(db: Session, user: usuario_schema.UsuarioCreate):
         roles=[rol]
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    if commit:
+        db.commit()
+        db.refresh(db_user)
+    else:
+        db.flush()
     return db_user
 
 
@@ -2,7 +2,8 @@
 
 import enum
 from sqlalchemy import (Column, Integer, String, Boolean, TIMESTAMP, text,
-                        ForeignKey, Float, DateTime, Table, Enum as SQLAlchemyEnum, Date)
+                        ForeignKey, Float, DateTime, Table, Enum as SQLAlchemyEnum, Date, JSON,
+                        Text, LargeBinary)
 from sqlalchemy.orm import relationship
 from .base import Base
 from sqlalchemy.sql import func # Necesario para server_default y onupdate
@@ -48,6 +49,12 @@ class EstadoEnvioEnum(str, enum.Enum):
     EXITOSO = "EXITOSO"
     FALLIDO = "FALLIDO"
 
+class EstadoOutboxEnum(str, enum.Enum):
+    PENDIENTE = "PENDIENTE"
+    EN_PROCESO = "EN_PROCESO"
+    ENVIADO = "ENVIADO"
+    FALLIDO = "FALLIDO"
+
 # --- MODELOS DE LA BASE DE DATOS ---
 
 class Rol(Base):
@@ -197,6 +204,11 @@ class Abastecimiento(Base):
     rendimiento_mg = Column(Float, nullable=False)
     alarma_transferencia = Column(Boolean, default=False)
     alarma_falla_energia = Column(Boolean, default=False)
+    # Última modificación (altas, ediciones y cancelaciones)
+    actualizado_en = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now(), index=True)
+    # Contador de modificaciones de la fila (cualquier UPDATE lo incrementa en la base de datos);
+    # su suma es parte de la marca de agua de la caché de reportes, sin depender del reloj
+    revision = Column(Integer, nullable=False, default=0, server_default="0", onupdate=text("revision + 1"))
 
     # Relaciones
     sitio = relationship("Sitio", back_populates="abastecimientos")
@@ -212,6 +224,14 @@ class PrediccionAbastecimiento(Base):
     fecha_proximo_abastecimiento = Column(DateTime, nullable=False)
     id_ultimo_abastecimiento_usado = Column(Integer, ForeignKey('abastecimiento.id_abastecimiento'), nullable=False)
     horometro_estimado_fin = Column(Float, nullable=False)
+    # Consumo estimado (tasa Gls/Hr x uso diario) y nivel de combustible estimado en
+    # nivel_estimado_en (negativo si ya se agotó); indexados para listar los sitios con
+    # menos combustible y para refrescar primero los niveles más antiguos
+    consumo_diario_gls = Column(Float, nullable=True)
+    nivel_estimado_gls = Column(Float, nullable=True, index=True)
+    nivel_estimado_en = Column(DateTime, nullable=True, index=True)
+    # Versión/parámetros del modelo con que se calculó; NULL = invalidada (ver prediction_service)
+    huella_modelo = Column(String(64), nullable=True)
     creado_en = Column(TIMESTAMP, server_default=func.now())
 
     # Relaciones
@@ -220,6 +240,41 @@ class PrediccionAbastecimiento(Base):
     alertas = relationship("Alerta", back_populates="prediccion")
 
 
+class ConsumoDiario(Base):
+    """
+    Totales diarios por sitio de los abastecimientos ACTIVOS (rollup del historial).
+    Se actualiza con incrementos al crear/editar/cancelar abastecimientos; el dashboard
+    y los reportes lo leen en lugar de agrupar Abastecimiento por día.
+    """
+    __tablename__ = 'consumo_diario'
+    fecha = Column(Date, primary_key=True)
+    id_sitio = Column(Integer, ForeignKey('sitio.id_sitio', ondelete="CASCADE"), primary_key=True, index=True)
+    n_abastecimientos = Column(Integer, nullable=False, default=0)
+    gls_abastecidos = Column(Float, nullable=False, default=0)
+
+
+class EstadoConsumoSitio(Base):
+    """
+    Estado acumulado del consumo de un sitio (solo abastecimientos ACTIVOS).
+    Se actualiza al crear/editar/cancelar abastecimientos para que la predicción
+    no tenga que releer todo el historial.
+    """
+    __tablename__ = 'estado_consumo_sitio'
+    id_sitio = Column(Integer, ForeignKey('sitio.id_sitio', ondelete="CASCADE"), primary_key=True)
+    n_registros = Column(Integer, nullable=False, default=0)
+    primera_fecha = Column(DateTime, nullable=True)
+    primer_horometraje = Column(Float, nullable=True)
+    id_ultimo_abastecimiento = Column(Integer, ForeignKey('abastecimiento.id_abastecimiento'), nullable=True)
+    ultima_fecha = Column(DateTime, nullable=True)
+    ultimo_horometraje = Column(Float, nullable=True)
+    ultimo_gls_existentes = Column(Float, nullable=True)
+    ultimo_gls_abastecidos = Column(Float, nullable=True)
+    # Últimos intervalos de consumo válidos [[horometraje_diff, gls_consumidos], ...] (como mucho
+    # PREDICTION_INTERVAL_WINDOW) para el filtro IQR y la regresión
+    intervalos = Column(JSON, nullable=False, default=list)
+    actualizado_en = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+
 class Alerta(Base):
     __tablename__ = 'alerta'
     id_alerta = Column(Integer, primary_key=True)
@@ -263,4 +318,44 @@ class NotificacionLog(Base):
     # Relaciones
     alerta = relationship("Alerta", back_populates="notificaciones_log")
     abastecimiento = relationship("Abastecimiento", back_populates="notificaciones_log")
-    usuario_destino = relationship("Usuario", back_populates="notificaciones_recibidas")
\ No newline at end of file
+    usuario_destino = relationship("Usuario", back_populates="notificaciones_recibidas")
+
+
+class NotificacionOutbox(Base):
+    """
+    Correos pendientes de envío. Se escriben en la misma transacción que el cambio
+    de negocio y los envía en segundo plano services/outbox_service.py.
+    Un correo EN_PROCESO pertenece a 'reclamado_por' hasta 'reclamado_hasta'; si esa
+    concesión vence sin resultado, otro despachador puede volver a tomarlo.
+    """
+    __tablename__ = 'notificacion_outbox'
+    id_outbox = Column(Integer, primary_key=True)
+    id_usuario_destino = Column(Integer, ForeignKey('usuario.id_usuario', ondelete="SET NULL"), nullable=True)
+    id_alerta = Column(Integer, ForeignKey('alerta.id_alerta'), nullable=True)
+    id_abastecimiento = Column(Integer, ForeignKey('abastecimiento.id_abastecimiento'), nullable=True)
+    direccion_destino = Column(String(160), nullable=False)
+    asunto = Column(String(255), nullable=False)
+    cuerpo_html = Column(Text, nullable=True)  # Se borra al terminar (enviado o fallido definitivo)
+    estado = Column(SQLAlchemyEnum(EstadoOutboxEnum), default=EstadoOutboxEnum.PENDIENTE, nullable=False, index=True)
+    intentos = Column(Integer, default=0, nullable=False)
+    proximo_intento = Column(DateTime, nullable=False, server_default=func.now(), index=True)
+    # El PDF del comprobante de 'id_abastecimiento' se genera al enviar (no se guarda aquí)
+    adjuntar_comprobante = Column(Boolean, default=False, nullable=False, server_default="0")
+    reclamado_por = Column(String(64), nullable=True)
+    reclamado_hasta = Column(DateTime, nullable=True)
+    ultimo_error = Column(String(255), nullable=True)
+    creado_en = Column(TIMESTAMP, server_default=func.now())
+    actualizado_en = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+    adjuntos = relationship("NotificacionOutboxAdjunto", back_populates="outbox", cascade="all, delete-orphan")
+
+
+class NotificacionOutboxAdjunto(Base):
+    __tablename__ = 'notificacion_outbox_adjunto'
+    id_adjunto = Column(Integer, primary_key=True)
+    id_outbox = Column(Integer, ForeignKey('notificacion_outbox.id_outbox', ondelete="CASCADE"), nullable=False)
+    nombre = Column(String(255), nullable=False)
+    tipo_mime = Column(String(100), nullable=False, default="application/octet-stream")
+    contenido = Column(LargeBinary(length=16 * 1024 * 1024), nullable=False)  # MEDIUMBLOB en MySQL
+
+    outbox = relationship("NotificacionOutbox", back_populates="adjuntos")
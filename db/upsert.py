@@ -0,0 +1,47 @@
+#db/upsert.py
+from typing import Iterable, List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+
+def upsert(
+    db: Session,
+    model,
+    rows: List[dict],
+    key_columns: List[str],
+    update_columns: Optional[Iterable[str]] = None,
+    increment_columns: Optional[Iterable[str]] = None,
+):
+    """
+    Inserta varias filas en una sola sentencia y, si la clave única ya existe,
+    actualiza la fila existente:
+      - MySQL/MariaDB (PyMySQL): INSERT ... ON DUPLICATE KEY UPDATE
+      - SQLite (pruebas locales): INSERT ... ON CONFLICT (...) DO UPDATE
+    update_columns se sobrescriben con el valor nuevo; increment_columns se suman
+    al valor existente. No hace commit.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    update_columns = list(update_columns or [])
+    increment_columns = list(increment_columns or [])
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("mysql", "mariadb"):
+        stmt = mysql_insert(table).values(rows)
+        nuevos = stmt.inserted
+    elif dialect == "sqlite":
+        stmt = sqlite_insert(table).values(rows)
+        nuevos = stmt.excluded
+    else:
+        raise NotImplementedError(f"upsert no soportado para el dialecto '{dialect}'.")
+
+    set_ = {c: nuevos[c] for c in update_columns}
+    set_.update({c: table.c[c] + nuevos[c] for c in increment_columns})
+
+    if dialect == "sqlite":
+        stmt = stmt.on_conflict_do_update(index_elements=key_columns, set_=set_)
+    else:
+        stmt = stmt.on_duplicate_key_update(**set_)
+    db.execute(stmt)
@@ -1,4 +1,6 @@
 # C:\Users\marlo\Desktop\abastecimientos_backend\main.py
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
@@ -17,10 +19,39 @@ from api.routers import (
     dashboard,
     grupo_tecnico,
     contratistas,
-    tipos_sitio
+    tipos_sitio,
+    reportes,
+    eventos,
+    outbox
 )
 
-app = FastAPI(title="Abastecimientos API")
+from core import smtp_pool
+from db.base import SessionLocal
+from services import outbox_service, job_service, report_service, dashboard_cache, event_hub
+
+# Los commits que cambian datos del dashboard invalidan su caché y publican sus eventos
+dashboard_cache.registrar_invalidacion(SessionLocal)
+event_hub.registrar_eventos(SessionLocal)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pool de conexiones SMTP reutilizables durante la vida del proceso
+    await smtp_pool.start_pool()
+    # Despachador en segundo plano del outbox de correos (en Vercel no corre: ver el cron de vercel.json)
+    await outbox_service.start_dispatcher()
+    # Eventos en vivo (SSE): se entregan en este event loop (solo con servidor persistente, no en Vercel)
+    event_hub.get_hub().iniciar(asyncio.get_running_loop())
+    yield
+    event_hub.get_hub().detener()
+    await outbox_service.stop_dispatcher()
+    await smtp_pool.close_pool()
+    # Trabajos en segundo plano (PDFs): no se aceptan más
+    job_service.shutdown()
+    report_service.shutdown_pdf_pool()
+
+
+app = FastAPI(title="Abastecimientos API", lifespan=lifespan)
 
 # --- CORRECCIÓN ---
 # Añade la URL de tu frontend en Vercel a la lista de orígenes
@@ -56,6 +87,9 @@ app.include_router(dashboard.router)
 app.include_router(grupo_tecnico.router)
 app.include_router(contratistas.router)
 app.include_router(tipos_sitio.router)
+app.include_router(reportes.router)
+app.include_router(eventos.router)
+app.include_router(outbox.router)
 
 @app.get("/")
 def read_root():
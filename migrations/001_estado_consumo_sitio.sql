@@ -0,0 +1,24 @@
+-- migrations/001_estado_consumo_sitio.sql
+-- Estado acumulado del consumo por sitio (models.EstadoConsumoSitio).
+-- MySQL/MariaDB. Aplicar antes de desplegar el código que lo usa:
+--     mysql -h <host> -u <usuario> -p <base> < migrations/001_estado_consumo_sitio.sql
+-- y luego llenarlo:
+--     python -m services.rebuild_service estado-consumo
+
+CREATE TABLE IF NOT EXISTS estado_consumo_sitio (
+    id_sitio INTEGER NOT NULL,
+    n_registros INTEGER NOT NULL DEFAULT 0,
+    primera_fecha DATETIME NULL,
+    primer_horometraje FLOAT NULL,
+    id_ultimo_abastecimiento INTEGER NULL,
+    ultima_fecha DATETIME NULL,
+    ultimo_horometraje FLOAT NULL,
+    ultimo_gls_existentes FLOAT NULL,
+    ultimo_gls_abastecidos FLOAT NULL,
+    -- Últimos PREDICTION_INTERVAL_WINDOW intervalos válidos [[horometraje_diff, gls_consumidos], ...]
+    intervalos JSON NOT NULL,
+    actualizado_en TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id_sitio),
+    FOREIGN KEY (id_sitio) REFERENCES sitio (id_sitio) ON DELETE CASCADE,
+    FOREIGN KEY (id_ultimo_abastecimiento) REFERENCES abastecimiento (id_abastecimiento)
+);
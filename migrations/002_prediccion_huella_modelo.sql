@@ -0,0 +1,8 @@
+-- migrations/002_prediccion_huella_modelo.sql
+-- Huella del modelo con que se calculó cada predicción (caché de predicciones).
+-- NULL = invalidada: las filas existentes se recalculan en la próxima consulta.
+-- MySQL/MariaDB. Aplicar antes de desplegar el código que la usa:
+--     mysql -h <host> -u <usuario> -p <base> < migrations/002_prediccion_huella_modelo.sql
+
+ALTER TABLE prediccion_abastecimiento
+    ADD COLUMN huella_modelo VARCHAR(64) NULL;
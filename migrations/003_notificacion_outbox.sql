@@ -0,0 +1,44 @@
+-- migrations/003_notificacion_outbox.sql
+-- Outbox de correos (models.NotificacionOutbox y models.NotificacionOutboxAdjunto).
+-- MySQL/MariaDB. Aplicar antes de desplegar el código que lo usa:
+--     mysql -h <host> -u <usuario> -p <base> < migrations/003_notificacion_outbox.sql
+-- En Vercel, además, definir CRON_SECRET: el cron de vercel.json vacía el outbox.
+
+CREATE TABLE IF NOT EXISTS notificacion_outbox (
+    id_outbox INTEGER NOT NULL AUTO_INCREMENT,
+    id_usuario_destino INTEGER NULL,
+    id_alerta INTEGER NULL,
+    id_abastecimiento INTEGER NULL,
+    direccion_destino VARCHAR(160) NOT NULL,
+    asunto VARCHAR(255) NOT NULL,
+    -- Se borra al terminar (enviado o fallido definitivo)
+    cuerpo_html TEXT NULL,
+    estado ENUM('PENDIENTE', 'EN_PROCESO', 'ENVIADO', 'FALLIDO') NOT NULL DEFAULT 'PENDIENTE',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo_intento DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    -- Despachador que tiene el correo EN_PROCESO y hasta cuándo
+    reclamado_por VARCHAR(64) NULL,
+    reclamado_hasta DATETIME NULL,
+    ultimo_error VARCHAR(255) NULL,
+    creado_en TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+    actualizado_en TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (id_outbox),
+    INDEX ix_notificacion_outbox_estado (estado),
+    INDEX ix_notificacion_outbox_proximo_intento (proximo_intento),
+    FOREIGN KEY (id_usuario_destino) REFERENCES usuario (id_usuario) ON DELETE SET NULL,
+    FOREIGN KEY (id_alerta) REFERENCES alerta (id_alerta),
+    FOREIGN KEY (id_abastecimiento) REFERENCES abastecimiento (id_abastecimiento)
+);
+
+CREATE TABLE IF NOT EXISTS notificacion_outbox_adjunto (
+    id_adjunto INTEGER NOT NULL AUTO_INCREMENT,
+    id_outbox INTEGER NOT NULL,
+    nombre VARCHAR(255) NOT NULL,
+    tipo_mime VARCHAR(100) NOT NULL DEFAULT 'application/octet-stream',
+    contenido MEDIUMBLOB NOT NULL,
+    PRIMARY KEY (id_adjunto),
+    FOREIGN KEY (id_outbox) REFERENCES notificacion_outbox (id_outbox) ON DELETE CASCADE
+);
+
+-- Los correos a supervisores (sin cuenta de usuario) se registran sin id_usuario_destino
+ALTER TABLE notificacion_log MODIFY id_usuario_destino INTEGER NULL;
@@ -0,0 +1,7 @@
+-- migrations/004_outbox_adjuntar_comprobante.sql
+-- Correos de comprobante cuyo PDF genera el despachador al enviar (models.NotificacionOutbox.adjuntar_comprobante).
+-- MySQL/MariaDB. Aplicar después de 003 y antes de desplegar el código que lo usa:
+--     mysql -h <host> -u <usuario> -p <base> < migrations/004_outbox_adjuntar_comprobante.sql
+
+ALTER TABLE notificacion_outbox
+    ADD COLUMN adjuntar_comprobante BOOLEAN NOT NULL DEFAULT 0 AFTER cuerpo_html;
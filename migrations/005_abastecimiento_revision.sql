@@ -0,0 +1,11 @@
+-- migrations/005_abastecimiento_revision.sql
+-- Última modificación y contador de revisiones de cada abastecimiento
+-- (models.Abastecimiento.actualizado_en y .revision; marca de agua de la caché de reportes).
+-- MySQL/MariaDB. Aplicar antes de desplegar el código que lo usa:
+--     mysql -h <host> -u <usuario> -p <base> < migrations/005_abastecimiento_revision.sql
+-- Los reportes ya guardados en REPORT_CACHE_DIR dejan de usarse solos (la clave cambia).
+
+ALTER TABLE abastecimiento
+    ADD COLUMN actualizado_en TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    ADD COLUMN revision INTEGER NOT NULL DEFAULT 0,
+    ADD INDEX ix_abastecimiento_actualizado_en (actualizado_en);
@@ -0,0 +1,16 @@
+-- migrations/006_consumo_diario.sql
+-- Totales diarios por sitio de los abastecimientos ACTIVOS (models.ConsumoDiario).
+-- MySQL/MariaDB. Aplicar antes de desplegar el código que lo usa:
+--     mysql -h <host> -u <usuario> -p <base> < migrations/006_consumo_diario.sql
+-- y luego llenarlo:
+--     python -m services.rebuild_service consumo-diario
+
+CREATE TABLE IF NOT EXISTS consumo_diario (
+    fecha DATE NOT NULL,
+    id_sitio INTEGER NOT NULL,
+    n_abastecimientos INTEGER NOT NULL DEFAULT 0,
+    gls_abastecidos FLOAT NOT NULL DEFAULT 0,
+    PRIMARY KEY (fecha, id_sitio),
+    INDEX ix_consumo_diario_id_sitio (id_sitio),
+    FOREIGN KEY (id_sitio) REFERENCES sitio (id_sitio) ON DELETE CASCADE
+);
@@ -0,0 +1,16 @@
+-- migrations/007_prediccion_nivel_estimado.sql
+-- Consumo diario y nivel de combustible estimado de cada predicción
+-- (models.PrediccionAbastecimiento.consumo_diario_gls, .nivel_estimado_gls y .nivel_estimado_en).
+-- MySQL/MariaDB. Aplicar antes de desplegar el código que los usa:
+--     mysql -h <host> -u <usuario> -p <base> < migrations/007_prediccion_nivel_estimado.sql
+-- Las filas existentes quedan en NULL y se recalculan solas en la próxima consulta
+-- (MODEL_VERSION cambió, así que su huella_modelo ya no es vigente).
+
+ALTER TABLE prediccion_abastecimiento
+    ADD COLUMN consumo_diario_gls FLOAT NULL,
+    ADD COLUMN nivel_estimado_gls FLOAT NULL,
+    ADD COLUMN nivel_estimado_en DATETIME NULL,
+    -- ORDER BY ... LIMIT de los sitios con menos combustible
+    ADD INDEX ix_prediccion_abastecimiento_nivel_estimado_gls (nivel_estimado_gls),
+    -- Refresco de los niveles más antiguos primero (prediction_service.refrescar_niveles)
+    ADD INDEX ix_prediccion_abastecimiento_nivel_estimado_en (nivel_estimado_en);
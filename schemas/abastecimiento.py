@@ -48,6 +48,8 @@ class Abastecimiento(AbastecimientoBase):
     status: AbastecimientoStatus
     # Usamos SitioParaHistorial para ser consistentes
     sitio: Optional[SitioParaHistorial] = None
+    # Solo al crear: id del trabajo que genera el comprobante PDF (GET /abastecimientos/comprobantes/{id})
+    id_comprobante_job: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -27,6 +27,13 @@ class AbastecimientoRecienteInfo(BaseModel):
     fecha: str # O datetime
     galones_abastecidos: float
 
+# Sitio con poco combustible (nivel estimado a partir de la predicción)
+class SitioMenorNivelInfo(BaseModel):
+    id_sitio: int
+    nombre_sitio: str
+    nivel_estimado_gls: Optional[float] = None
+    consumo_diario_gls: Optional[float] = None
+
 # Esquema principal del Dashboard (sin cambios)
 class DashboardData(BaseModel):
     total_sitios: int
@@ -40,4 +47,4 @@ class DashboardData(BaseModel):
     sitios_criticos: List[SitioCriticoInfo]
     galones_por_dia_chart: List[ChartDataPoint]
     ultimos_abastecimientos: List[AbastecimientoRecienteInfo]
-    sitios_menor_nivel: List[Any]
\ No newline at end of file
+    sitios_menor_nivel: List[SitioMenorNivelInfo]
\ No newline at end of file
@@ -20,7 +20,7 @@ class NotificacionLog(BaseModel):
     id_notificacion: int
     id_alerta: int | None = None
     id_abastecimiento: int | None = None
-    id_usuario_destino: int
+    id_usuario_destino: int | None = None  # None para destinatarios sin usuario (p. ej. supervisores)
     canal_envio: CanalEnvioEnum
     estado_envio: EstadoEnvioEnum
     creado_en: datetime
@@ -29,7 +29,7 @@ class NotificacionLog(BaseModel):
         from_attributes = True
 
 class NotificacionLogCreate(BaseModel):
-    id_usuario_destino: int
+    id_usuario_destino: int | None = None
     canal_envio: CanalEnvioEnum
     direccion_destino: str
     estado_envio: EstadoEnvioEnum
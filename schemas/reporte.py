@@ -0,0 +1,19 @@
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
+
+
+class ReporteCreate(BaseModel):
+    formato: Literal["pdf", "excel", "csv", "parquet"]
+    sitio_id: Optional[int] = None
+    q: Optional[str] = Field(None, min_length=2)
+    row_group_size: Optional[int] = Field(None, ge=1000, le=1000000)  # Solo parquet
+
+
+class ReporteJob(BaseModel):
+    id: str
+    estado: str
+    formato: Optional[str] = None
+    nombre_archivo: Optional[str] = None
+    creado_en: str
+    terminado_en: Optional[str] = None
+    error: Optional[str] = None
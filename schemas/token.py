@@ -12,6 +12,11 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
+# Respuesta de POST /eventos/token: token corto para abrir el stream SSE con ?token=
+class StreamToken(BaseModel):
+    token: str
+    expira_en_segundos: int
+
 # Esta clase es de una versión anterior de tu código. La mantenemos por si la usas en otro lugar,
 # pero la nueva lógica de 'deps.py' ya no la necesita.
 class TokenData(BaseModel):
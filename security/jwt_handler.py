@@ -9,6 +9,7 @@ from schemas import token as token_schema
 SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60  # El token será válido por 60 minutos
+PROPOSITO_STREAM = "sse"  # Claim "proposito" de los tokens del stream de eventos
 
 
 def create_access_token(data: dict):
@@ -23,6 +24,15 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_stream_token(user_id: int) -> str:
+    """
+    Token corto solo para abrir el stream SSE (?token= en /eventos/): EventSource no
+    envía cabeceras y la URL queda en logs e historial, así que no se usa el de acceso.
+    """
+    expire = datetime.now(timezone.utc) + timedelta(seconds=settings.SSE_TOKEN_EXPIRE_SECONDS)
+    to_encode = {"sub": str(user_id), "proposito": PROPOSITO_STREAM, "exp": expire}
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
 def verify_token(token: str, credentials_exception):
     """Verifica y decodifica un token de acceso JWT."""
     try:
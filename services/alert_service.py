@@ -1,11 +1,12 @@
 import traceback
 from sqlalchemy.orm import Session, joinedload
 from datetime import datetime, timedelta
+from typing import Optional
 from db import models
 from crud import sitio as sitio_crud, alerta as alerta_crud
-from schemas import alerta as alerta_schema
-from services import prediction_service
+from services import prediction_service, event_hub
 from core import email_service
+from core.config import settings
 from db.models import TipoAlertaEnum, EstadoAlertaEnum, CanalEnvioEnum, EstadoEnvioEnum
 from crud import notificacion as notificacion_crud
 from schemas import notificacion as notificacion_schema
@@ -18,160 +19,173 @@ async def generar_alertas_de_predicciones(db: Session):
     """
     Calcula predicciones y genera/actualiza alertas, notificando si es necesario.
     """
-    sitios = sitio_crud.get_sitios(db)
     nuevas_alertas_generadas = 0
     alertas_actualizadas = 0
+    sitios_procesados = 0
+    notificaciones = []  # Correos de nuevas alertas, enviados al final del proceso
     fecha_actual = datetime.now()
 
-    print(f"--- Iniciando generación de alertas para {len(sitios)} sitios ---")
-
-    for sitio in sitios:
-        sitio_con_relaciones = db.query(models.Sitio).options(
-            joinedload(models.Sitio.tecnico).joinedload(models.Tecnico.usuario)
-        ).filter(models.Sitio.id_sitio == sitio.id_sitio).first()
-
-        if not sitio_con_relaciones:
-            print(f"\nError: No se pudo recargar el sitio ID: {sitio.id_sitio}")
-            continue
-
-        print(f"\nProcesando sitio ID: {sitio_con_relaciones.id_sitio}, Nombre: {sitio_con_relaciones.nombre}")
-
-        # --- PASO A: Calcular Predicción ---
-        resultado_prediccion = prediction_service.calculate_prediction(db, id_sitio=sitio_con_relaciones.id_sitio)
-        print(f"Resultado predicción: {resultado_prediccion}")
-
-        if isinstance(resultado_prediccion, dict) and "error" in resultado_prediccion:
-            print(f"-> Error en predicción: {resultado_prediccion['error']}")
-            continue
-        if not isinstance(resultado_prediccion, models.PrediccionAbastecimiento):
-            print(f"-> Predicción inválida.")
-            continue
-
-        prediccion_actualizada = resultado_prediccion
-
-        # --- PASO B: Determinar Tipo de Alerta ---
-        if not isinstance(prediccion_actualizada.fecha_proximo_abastecimiento, datetime):
-            print(f"-> Fecha de predicción inválida.")
-            continue
-
-        dias_restantes = (prediccion_actualizada.fecha_proximo_abastecimiento - fecha_actual).days
-        print(f"-> Días restantes calculados: {dias_restantes}")
-
-        tipo_alerta = None
-        mensaje = ""
-        if dias_restantes < 0:
-            tipo_alerta = TipoAlertaEnum.CRITICA
-            mensaje = f"Nivel CRITICO. Fecha estimada de agotamiento ya pasó ({prediccion_actualizada.fecha_proximo_abastecimiento.strftime('%Y-%m-%d')}). Revisar urgentemente."
-        elif dias_restantes <= UMBRAL_DIAS_CRITICO:
-            tipo_alerta = TipoAlertaEnum.CRITICA
-            mensaje = f"Nivel CRITICO. Se estiman {dias_restantes} días de combustible restantes (hasta {prediccion_actualizada.fecha_proximo_abastecimiento.strftime('%Y-%m-%d')})."
-        elif dias_restantes <= UMBRAL_DIAS_ADVERTENCIA:
-            tipo_alerta = TipoAlertaEnum.ADVERTENCIA
-            mensaje = f"Nivel ADVERTENCIA. Se estiman {dias_restantes} días de combustible restantes (hasta {prediccion_actualizada.fecha_proximo_abastecimiento.strftime('%Y-%m-%d')})."
-
-        # --- PASO C: Lógica de Creación/Actualización/Cierre ---
-
-        # Buscar si ya hay CUALQUIER alerta abierta para este sitio
-        alerta_existente = db.query(models.Alerta).filter(
-            models.Alerta.id_sitio == sitio_con_relaciones.id_sitio,
-            models.Alerta.estado_alerta == EstadoAlertaEnum.ABIERTA
-        ).first()
-
-        if tipo_alerta:
-            # (Se necesita una alerta de tipo CRITICA o ADVERTENCIA)
-            print(f"-> Tipo de alerta determinado: {tipo_alerta.value}")
-
-            if alerta_existente:
-                if alerta_existente.tipo_alerta == tipo_alerta:
-                    # CASO 1: Alerta existente es del MISMO tipo -> ACTUALIZAR
-                    print(f"-> Actualizando alerta existente ID {alerta_existente.id_alerta} con nuevo mensaje.")
-                    alerta_existente.mensaje = mensaje
-                    alerta_existente.id_prediccion = prediccion_actualizada.id_prediccion
-                    alerta_existente.actualizado_en = datetime.now()
-                    db.add(alerta_existente)
-                    db.commit()
-                    alertas_actualizadas += 1
-                    # (Opcional: enviar correo de actualización si el mensaje cambió mucho)
+    print(f"--- Iniciando generación de alertas (bloques de {settings.ALERT_CHUNK_SIZE} sitios) ---")
+
+    # Todos los sitios, por bloques con paginación por clave: la memoria no crece con el número de sitios
+    for bloque in sitio_crud.iter_sitios_para_alertas(db, chunk_size=settings.ALERT_CHUNK_SIZE):
+        # Predicciones del bloque en una sola pasada (una consulta + cálculo vectorizado)
+        ids_bloque = [s.id_sitio for s in bloque]
+        predicciones = prediction_service.calculate_predictions_batch(db, sitio_ids=ids_bloque)
+        abiertas = alerta_crud.get_open_alerts_by_sitio(db, ids_bloque)
+        actualizar, cerrar, crear = [], [], []
+        sitios_cerradas = {}  # id_alerta cerrada -> id_sitio (eventos en vivo)
+
+        for sitio in bloque:
+            print(f"\nProcesando sitio ID: {sitio.id_sitio}, Nombre: {sitio.nombre}")
+
+            # --- PASO A: Calcular Predicción ---
+            resultado_prediccion = predicciones.get(sitio.id_sitio)
+            print(f"Resultado predicción: {resultado_prediccion}")
+
+            if isinstance(resultado_prediccion, dict) and "error" in resultado_prediccion:
+                print(f"-> Error en predicción: {resultado_prediccion['error']}")
+                continue
+            if not isinstance(resultado_prediccion, models.PrediccionAbastecimiento):
+                print(f"-> Predicción inválida.")
+                continue
+
+            prediccion_actualizada = resultado_prediccion
+
+            # --- PASO B: Determinar Tipo de Alerta ---
+            if not isinstance(prediccion_actualizada.fecha_proximo_abastecimiento, datetime):
+                print(f"-> Fecha de predicción inválida.")
+                continue
+
+            dias_restantes = (prediccion_actualizada.fecha_proximo_abastecimiento - fecha_actual).days
+            print(f"-> Días restantes calculados: {dias_restantes}")
+
+            tipo_alerta = None
+            mensaje = ""
+            if dias_restantes < 0:
+                tipo_alerta = TipoAlertaEnum.CRITICA
+                mensaje = f"Nivel CRITICO. Fecha estimada de agotamiento ya pasó ({prediccion_actualizada.fecha_proximo_abastecimiento.strftime('%Y-%m-%d')}). Revisar urgentemente."
+            elif dias_restantes <= UMBRAL_DIAS_CRITICO:
+                tipo_alerta = TipoAlertaEnum.CRITICA
+                mensaje = f"Nivel CRITICO. Se estiman {dias_restantes} días de combustible restantes (hasta {prediccion_actualizada.fecha_proximo_abastecimiento.strftime('%Y-%m-%d')})."
+            elif dias_restantes <= UMBRAL_DIAS_ADVERTENCIA:
+                tipo_alerta = TipoAlertaEnum.ADVERTENCIA
+                mensaje = f"Nivel ADVERTENCIA. Se estiman {dias_restantes} días de combustible restantes (hasta {prediccion_actualizada.fecha_proximo_abastecimiento.strftime('%Y-%m-%d')})."
+
+            # --- PASO C: Lógica de Creación/Actualización/Cierre (en memoria, se aplica por bloque) ---
+
+            # Alerta abierta del sitio (cargadas para todo el bloque en una consulta)
+            alerta_existente = abiertas.get(sitio.id_sitio)
+            nueva_alerta_data = {
+                "id_sitio": sitio.id_sitio,
+                "id_prediccion": prediccion_actualizada.id_prediccion,
+                "tipo_alerta": tipo_alerta,
+                "mensaje": mensaje
+            }
+
+            if tipo_alerta:
+                # (Se necesita una alerta de tipo CRITICA o ADVERTENCIA)
+                print(f"-> Tipo de alerta determinado: {tipo_alerta.value}")
+
+                if alerta_existente:
+                    if alerta_existente.tipo_alerta == tipo_alerta:
+                        # CASO 1: Alerta existente es del MISMO tipo -> ACTUALIZAR
+                        print(f"-> Actualizando alerta existente ID {alerta_existente.id_alerta} con nuevo mensaje.")
+                        actualizar.append({
+                            "id_alerta": alerta_existente.id_alerta,
+                            "mensaje": mensaje,
+                            "id_prediccion": prediccion_actualizada.id_prediccion,
+                            "actualizado_en": datetime.now()
+                        })
+                        alertas_actualizadas += 1
+                        # (Opcional: enviar correo de actualización si el mensaje cambió mucho)
+
+                    else:
+                        # CASO 2: Alerta existente es de DIFERENTE tipo -> CERRAR LA VIEJA y CREAR NUEVA
+                        print(
+                            f"-> Cerrando alerta vieja ID {alerta_existente.id_alerta} (tipo {alerta_existente.tipo_alerta.value}) y creando nueva...")
+                        cerrar.append(alerta_existente.id_alerta)
+                        sitios_cerradas[alerta_existente.id_alerta] = sitio.id_sitio
+                        crear.append(nueva_alerta_data)
 
                 else:
-                    # CASO 2: Alerta existente es de DIFERENTE tipo -> CERRAR LA VIEJA y CREAR NUEVA
-                    print(
-                        f"-> Cerrando alerta vieja ID {alerta_existente.id_alerta} (tipo {alerta_existente.tipo_alerta.value})...")
-                    alerta_crud.close_alert(db, db_alerta=alerta_existente)
-
-                    # (Lógica de crear nueva)
+                    # CASO 3: No hay alerta existente -> CREAR NUEVA
                     print("-> Creando nueva alerta...")
-                    alerta_data = alerta_schema.AlertaCreate(
-                        id_sitio=sitio_con_relaciones.id_sitio,
-                        id_prediccion=prediccion_actualizada.id_prediccion,
-                        tipo_alerta=tipo_alerta,
-                        mensaje=mensaje
-                    )
-                    nueva_alerta = alerta_crud.create_alerta(db, alerta=alerta_data)
-                    nuevas_alertas_generadas += 1
-                    await notificar_alerta(db, nueva_alerta, sitio_con_relaciones)  # Enviar correo
+                    crear.append(nueva_alerta_data)
 
             else:
-                # CASO 3: No hay alerta existente -> CREAR NUEVA
-                print("-> Creando nueva alerta...")
-                alerta_data = alerta_schema.AlertaCreate(
-                    id_sitio=sitio_con_relaciones.id_sitio,
-                    id_prediccion=prediccion_actualizada.id_prediccion,
-                    tipo_alerta=tipo_alerta,
-                    mensaje=mensaje
-                )
-                nueva_alerta = alerta_crud.create_alerta(db, alerta=alerta_data)
-                nuevas_alertas_generadas += 1
-                await notificar_alerta(db, nueva_alerta, sitio_con_relaciones)  # Enviar correo
-
-        else:
-            # (No se necesita alerta nueva, días restantes > 14)
-            print("-> Días restantes suficientes. No se requiere alerta nueva.")
-            if alerta_existente:
-                # CASO 4: Ya no se necesita alerta, pero hay una abierta -> CERRARLA
-                print(
-                    f"-> Cerrando alerta obsoleta ID {alerta_existente.id_alerta} (tipo {alerta_existente.tipo_alerta.value}).")
-                alerta_crud.close_alert(db, db_alerta=alerta_existente)
+                # (No se necesita alerta nueva, días restantes > 14)
+                print("-> Días restantes suficientes. No se requiere alerta nueva.")
+                if alerta_existente:
+                    # CASO 4: Ya no se necesita alerta, pero hay una abierta -> CERRARLA
+                    print(
+                        f"-> Cerrando alerta obsoleta ID {alerta_existente.id_alerta} (tipo {alerta_existente.tipo_alerta.value}).")
+                    cerrar.append(alerta_existente.id_alerta)
+                    sitios_cerradas[alerta_existente.id_alerta] = sitio.id_sitio
+
+        # Aplicar predicciones y alertas del bloque en una sola transacción
+        nuevas_alertas = alerta_crud.bulk_apply_alert_changes(db, actualizar=actualizar, cerrar=cerrar, crear=crear)
+
+        # Preparar los correos antes del commit (los objetos aún están cargados); se envían al final
+        sitios_por_id = {s.id_sitio: s for s in bloque}
+        for nueva_alerta in nuevas_alertas:
+            datos = _datos_notificacion(nueva_alerta, sitios_por_id[nueva_alerta.id_sitio])
+            if datos:
+                notificaciones.append(datos)
+
+        # Eventos en vivo del bloque (se publican al confirmar)
+        for id_alerta in cerrar:
+            event_hub.publicar_al_confirmar(db, "alerta_cerrada", sitios_cerradas.get(id_alerta), {"id_alerta": id_alerta})
+        for nueva_alerta in nuevas_alertas:
+            event_hub.publicar_al_confirmar(db, "alerta_abierta", nueva_alerta.id_sitio, {
+                "id_alerta": nueva_alerta.id_alerta,
+                "nombre_sitio": sitios_por_id[nueva_alerta.id_sitio].nombre,
+                "tipo_alerta": nueva_alerta.tipo_alerta.value,
+                "mensaje": nueva_alerta.mensaje,
+            })
+
+        db.commit()
+        nuevas_alertas_generadas += len(nuevas_alertas)
+
+        sitios_procesados += len(bloque)
+        # Liberar los objetos del bloque del mapa de identidad antes del siguiente
+        db.expunge_all()
+
+    # --- Envío de correos en paralelo (acotado), fuera del recorrido de sitios ---
+    if notificaciones:
+        print(f"-> Enviando {len(notificaciones)} correos de alerta (máx. {settings.ALERT_EMAIL_CONCURRENCY} en paralelo)...")
+        try:
+            resultado_envio = await email_service.send_new_alert_notifications(
+                db, notificaciones,
+                concurrency=settings.ALERT_EMAIL_CONCURRENCY,
+                timeout=settings.ALERT_EMAIL_TIMEOUT_SECONDS
+            )
+            print(f"-> Correos de alerta: {resultado_envio}")
+        except Exception as e:
+            print(f"!!!!!!!! ERROR durante el envío de correos de alerta: {e} !!!!!!!!")
+            print(traceback.format_exc())
 
     print(
-        f"--- Fin generación. Nuevas alertas creadas: {nuevas_alertas_generadas}. Alertas actualizadas: {alertas_actualizadas} ---")
+        f"--- Fin generación. Sitios procesados: {sitios_procesados}. Nuevas alertas creadas: {nuevas_alertas_generadas}. Alertas actualizadas: {alertas_actualizadas} ---")
     return {
         "mensaje": f"Proceso completado. {nuevas_alertas_generadas} nuevas alertas creadas, {alertas_actualizadas} actualizadas."}
 
 
-# --- Función Auxiliar para Enviar Correo ---
-# (La movimos aquí para no repetir código)
-async def notificar_alerta(db: Session, nueva_alerta: models.Alerta, sitio_con_relaciones: models.Sitio):
-    """Función interna para manejar el envío de correo y el logging."""
-    if (sitio_con_relaciones.tecnico and
-            sitio_con_relaciones.tecnico.usuario and
-            sitio_con_relaciones.tecnico.usuario.correo):
-
-        id_usuario_destino = sitio_con_relaciones.tecnico.id_usuario
-        email_destino = sitio_con_relaciones.tecnico.usuario.correo
-        nombre_tecnico = sitio_con_relaciones.tecnico.nombre_tecnico
-        nombre_sitio = sitio_con_relaciones.nombre
-
-        try:
-            print(f"-> Intentando enviar correo de alerta a: {email_destino}")
-            await email_service.send_new_alert_notification(
-                db=db,
-                user_id=id_usuario_destino,
-                alerta_id=nueva_alerta.id_alerta,
-                email_to=email_destino,
-                nombre_tecnico=nombre_tecnico,
-                nombre_sitio=nombre_sitio,
-                tipo_alerta=nueva_alerta.tipo_alerta.value,
-                mensaje_alerta=nueva_alerta.mensaje
-            )
-            print(f"-> Llamada a send_new_alert_notification completada.")
-
-        except Exception as e:
-            print(
-                f"!!!!!!!! ERROR durante la llamada a send_new_alert_notification para alerta ID {nueva_alerta.id_alerta} !!!!!!!!")
-            print(f"Error: {e}")
-            print(traceback.format_exc())
-            # El log de fallo ya lo maneja email_service, así que solo imprimimos.
-
-    else:
-        print("-> No se encontró información completa del técnico/usuario asignado al sitio para enviar correo.")
\ No newline at end of file
+# --- Función Auxiliar para preparar el Correo ---
+def _datos_notificacion(nueva_alerta: models.Alerta, sitio: models.Sitio) -> Optional[dict]:
+    """Argumentos de email_service.send_new_alert_notification para la alerta, o None si no hay destinatario."""
+    if (sitio.tecnico and
+            sitio.tecnico.usuario and
+            sitio.tecnico.usuario.correo):
+        return {
+            "user_id": sitio.tecnico.id_usuario,
+            "alerta_id": nueva_alerta.id_alerta,
+            "email_to": sitio.tecnico.usuario.correo,
+            "nombre_tecnico": sitio.tecnico.nombre_tecnico,
+            "nombre_sitio": sitio.nombre,
+            "tipo_alerta": nueva_alerta.tipo_alerta.value,
+            "mensaje_alerta": nueva_alerta.mensaje
+        }
+
+    print(f"-> Sitio {sitio.id_sitio}: no se encontró información completa del técnico/usuario asignado para enviar correo.")
+    return None
@@ -0,0 +1,72 @@
+# services/comprobante_service.py
+"""
+Comprobante PDF de un abastecimiento nuevo. El correo del comprobante se encola en el
+outbox en la misma transacción que el abastecimiento (encolar_correos_comprobante), y
+el PDF se genera a partir del registro cuando el despachador lo envía
+(renderizar_comprobante): si el proceso se reinicia, el correo sigue pendiente.
+La descarga para el cliente se genera en un trabajo en segundo plano (services/job_service.py).
+"""
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session, joinedload
+
+from core import email_service
+from db import models
+from db.base import SessionLocal
+from services.report_service import generate_comprobante_pdf
+
+TIPO_JOB = "comprobante_abastecimiento"
+
+
+def nombre_archivo_comprobante(abastecimiento: models.Abastecimiento) -> str:
+    fecha_filename = abastecimiento.fecha.strftime('%Y%m%d_%H%M') if isinstance(abastecimiento.fecha, datetime) else "fecha_invalida"
+    sitio_nombre_filename = abastecimiento.sitio.nombre.replace(" ", "_").replace("/", "-") if abastecimiento.sitio else "SitioID"+str(abastecimiento.id_sitio)
+    return f"Reporte_Abastecimiento_{sitio_nombre_filename}_{fecha_filename}.pdf"
+
+
+def encolar_correos_comprobante(db: Session, abastecimiento: models.Abastecimiento) -> int:
+    """
+    Encola el correo del comprobante para el técnico y el supervisor del sitio.
+    No hace commit: se confirma con el abastecimiento. Devuelve los correos encolados.
+    """
+    recipients_data: Dict[str, tuple[Optional[int], str]] = {}
+    site_technician = abastecimiento.sitio.tecnico if abastecimiento.sitio else None
+    if site_technician and site_technician.usuario and site_technician.usuario.correo:
+        recipients_data.setdefault(site_technician.usuario.correo,
+                                   (site_technician.usuario.id_usuario, site_technician.nombre_tecnico))
+    site_supervisor = abastecimiento.sitio.supervisor if abastecimiento.sitio else None
+    if site_supervisor and site_supervisor.correo:
+        recipients_data.setdefault(site_supervisor.correo, (None, site_supervisor.nombre_completo))
+
+    if not recipients_data:
+        print(f"-> Sin destinatarios para el comprobante de Abast ID {abastecimiento.id_abastecimiento}")
+        return 0
+    print(f"-> Encolando comprobante de Abast ID {abastecimiento.id_abastecimiento} a: {list(recipients_data.keys())}")
+    for email, (user_id, nombre) in recipients_data.items():
+        email_service.send_abastecimiento_report_email(
+            db=db, user_id_destino=user_id, email_to=email, nombre_receptor=nombre, abastecimiento=abastecimiento
+        )
+    return len(recipients_data)
+
+
+def renderizar_comprobante(id_abastecimiento: int) -> Tuple[str, bytes]:
+    """
+    Genera el PDF del abastecimiento desde la base de datos: devuelve (nombre_archivo, bytes).
+    Usa su propia sesión porque corre en otro hilo.
+    """
+    db = SessionLocal()
+    try:
+        abastecimiento = db.query(models.Abastecimiento).options(
+            joinedload(models.Abastecimiento.sitio)
+        ).filter(models.Abastecimiento.id_abastecimiento == id_abastecimiento).first()
+        if abastecimiento is None:
+            raise ValueError(f"Abastecimiento ID {id_abastecimiento} no encontrado.")
+        return nombre_archivo_comprobante(abastecimiento), generate_comprobante_pdf(abastecimiento)
+    finally:
+        db.close()
+
+
+def generar_comprobante(id_abastecimiento: int) -> bytes:
+    """Trabajo de descarga: devuelve los bytes del PDF (el JobManager los guarda para descargarlos)."""
+    return renderizar_comprobante(id_abastecimiento)[1]
@@ -0,0 +1,165 @@
+# services/consumo_report_service.py
+"""
+Reportes periódicos (semanales o mensuales) de consumo por contratista y por supervisor.
+
+Todo el periodo se lee con una sola consulta agregada por contratista, supervisor y
+sitio (crud.abastecimiento.get_consumo_por_sitio). Los PDFs se generan en el pool de
+procesos de report_service y cada destinatario recibe un único correo (digest) con
+todos sus reportes adjuntos, encolado en el outbox:
+    - cada supervisor, el reporte de sus sitios;
+    - los administradores, el reporte de cada contratista.
+
+Uso (p. ej. desde cron):
+    python -m services.consumo_report_service semanal
+    python -m services.consumo_report_service mensual --fecha 2025-06-01
+"""
+import argparse
+import traceback
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from core import email_service
+from crud import abastecimiento as abastecimiento_crud
+from crud import usuario as usuario_crud
+from db import models
+from db.base import SessionLocal
+from services import outbox_service, report_service
+
+PERIODICIDADES = ("semanal", "mensual")
+
+
+def periodo_anterior(periodicidad: str, referencia: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """
+    Último periodo completo antes de 'referencia' (por defecto, ahora) como [desde, hasta):
+    la semana anterior de lunes a lunes o el mes calendario anterior.
+    """
+    referencia = referencia or datetime.now()
+    inicio_dia = referencia.replace(hour=0, minute=0, second=0, microsecond=0)
+    if periodicidad == "semanal":
+        hasta = inicio_dia - timedelta(days=inicio_dia.weekday())
+        return hasta - timedelta(days=7), hasta
+    if periodicidad == "mensual":
+        hasta = inicio_dia.replace(day=1)
+        return (hasta - timedelta(days=1)).replace(day=1), hasta
+    raise ValueError(f"Periodicidad no soportada: {periodicidad}")
+
+
+def _agrupar(filas: List) -> Tuple[Dict[int, dict], Dict[int, dict]]:
+    """Reparte las filas agregadas en reportes por supervisor y por contratista."""
+    por_supervisor: Dict[int, dict] = {}
+    por_contratista: Dict[int, dict] = {}
+    for fila in filas:
+        datos = {
+            "sitio_codigo": fila.sitio_codigo,
+            "sitio_nombre": fila.sitio_nombre,
+            "abastecimientos": int(fila.abastecimientos),
+            "gls_abastecidos": float(fila.gls_abastecidos or 0),
+            "horas": float(fila.horas or 0),
+            "rendimiento_promedio": float(fila.rendimiento_promedio) if fila.rendimiento_promedio is not None else None,
+        }
+        if fila.id_supervisor is not None:
+            por_supervisor.setdefault(fila.id_supervisor, {
+                "titulo": f"Consumo - Supervisor {fila.supervisor_nombre}",
+                "nombre": fila.supervisor_nombre,
+                "correo": fila.supervisor_correo,
+                "filas": [],
+            })["filas"].append(datos)
+        if fila.id_contratista is not None:
+            por_contratista.setdefault(fila.id_contratista, {
+                "titulo": f"Consumo - Contratista {fila.nombre_contrata}",
+                "nombre": fila.nombre_contrata,
+                "filas": [],
+            })["filas"].append(datos)
+    return por_supervisor, por_contratista
+
+
+def _nombre_archivo(titulo: str, desde: datetime) -> str:
+    return f"{titulo.replace(' ', '_').replace('/', '-')}_{desde.strftime('%Y%m%d')}.pdf"
+
+
+def _resumen(reporte: dict) -> dict:
+    return {
+        "titulo": reporte["titulo"],
+        "sitios": len(reporte["filas"]),
+        "abastecimientos": sum(f["abastecimientos"] for f in reporte["filas"]),
+        "gls_abastecidos": sum(f["gls_abastecidos"] for f in reporte["filas"]),
+    }
+
+
+def generar_reportes_consumo(db: Session, periodicidad: str, referencia: Optional[datetime] = None) -> dict:
+    """
+    Genera y encola los reportes del último periodo completo. Devuelve un resumen
+    con el periodo, cuántos reportes se generaron y cuántos correos se encolaron.
+    """
+    desde, hasta = periodo_anterior(periodicidad, referencia)
+    periodo = f"{desde.strftime('%d/%m/%Y')} - {(hasta - timedelta(days=1)).strftime('%d/%m/%Y')}"
+    print(f"--- Reportes de consumo {periodicidad}: {periodo} ---")
+
+    filas = abastecimiento_crud.get_consumo_por_sitio(db, desde, hasta)
+    por_supervisor, por_contratista = _agrupar(filas)
+    reportes = list(por_supervisor.values()) + list(por_contratista.values())
+    print(f"-> {len(filas)} filas agregadas; {len(reportes)} reportes a generar")
+    if not reportes:
+        return {"periodo": periodo, "reportes": 0, "correos": 0}
+
+    # Todos los PDFs en paralelo (pool de procesos de report_service)
+    pool = report_service.get_pdf_pool()
+    futuros = [
+        pool.submit(report_service.generate_consumo_pdf, r["titulo"], f"Periodo: {periodo}", r["filas"])
+        for r in reportes
+    ]
+    for reporte, futuro in zip(reportes, futuros):
+        reporte["pdf"] = futuro.result()
+
+    def adjunto(reporte: dict) -> tuple:
+        return _nombre_archivo(reporte["titulo"], desde), reporte["pdf"], "application/pdf"
+
+    correos = 0
+    for reporte in por_supervisor.values():
+        if not reporte["correo"]:
+            print(f"-> Supervisor '{reporte['nombre']}' sin correo, se omite.")
+            continue
+        email_service.send_consumo_digest_email(
+            db, user_id_destino=None, email_to=reporte["correo"], nombre_receptor=reporte["nombre"],
+            periodo=periodo, resumenes=[_resumen(reporte)], adjuntos=[adjunto(reporte)]
+        )
+        correos += 1
+
+    if por_contratista:
+        resumenes = [_resumen(r) for r in por_contratista.values()]
+        adjuntos = [adjunto(r) for r in por_contratista.values()]
+        for admin in usuario_crud.get_active_users_by_role(db, models.RolEnum.ADMIN):
+            email_service.send_consumo_digest_email(
+                db, user_id_destino=admin.id_usuario, email_to=admin.correo, nombre_receptor=admin.nombre_completo,
+                periodo=periodo, resumenes=resumenes, adjuntos=adjuntos
+            )
+            correos += 1
+
+    db.commit()
+    outbox_service.notify()
+    print(f"--- Fin reportes de consumo: {len(reportes)} reportes, {correos} correos encolados ---")
+    return {"periodo": periodo, "reportes": len(reportes), "correos": correos}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera y envía los reportes periódicos de consumo.")
+    parser.add_argument("periodicidad", choices=PERIODICIDADES)
+    parser.add_argument("--fecha", type=datetime.fromisoformat, default=None,
+                        help="Fecha de referencia (se reporta el periodo completo anterior).")
+    args = parser.parse_args()
+    db = SessionLocal()
+    try:
+        generar_reportes_consumo(db, args.periodicidad, args.fecha)
+    except Exception:
+        db.rollback()
+        print(traceback.format_exc())
+        raise
+    finally:
+        db.close()
+        report_service.shutdown_pdf_pool()
+
+
+if __name__ == "__main__":
+    main()
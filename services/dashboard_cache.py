@@ -0,0 +1,218 @@
+# services/dashboard_cache.py
+"""
+Caché de las estadísticas del dashboard por alcance.
+
+Para ADMIN y SUPERVISOR el resultado es el mismo para todos ("global"); para un
+TECNICO solo depende de su id ("tecnico:<id>"). Las entradas viven como mucho
+settings.DASHBOARD_CACHE_TTL_SECONDS y se invalidan todas juntas (se incrementa una
+versión que forma parte de la clave) al confirmarse un cambio en abastecimientos,
+consumo diario, predicciones, alertas o sitios: ver registrar_invalidacion().
+
+Backends (settings.DASHBOARD_CACHE_BACKEND):
+    - "memoria": LRU en el proceso (por defecto). Cada worker tiene la suya; un
+      cambio hecho en otro worker se ve al vencer la TTL.
+    - "redis": compartida entre workers (settings.REDIS_URL).
+    - "fakeredis": la misma lógica que redis en memoria, para pruebas (requiere fakeredis).
+
+Solo un request por clave calcula a la vez: el resto espera su resultado
+(hasta settings.DASHBOARD_CACHE_LOCK_SECONDS) en lugar de repetir las consultas.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import chain
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import event
+
+from core.config import settings
+
+PREFIJO = "dashboard"
+CLAVE_VERSION = f"{PREFIJO}:version"
+ALCANCE_GLOBAL = "global"
+
+# Tablas cuyo cambio afecta al dashboard
+TABLAS_DASHBOARD = {"abastecimiento", "consumo_diario", "prediccion_abastecimiento", "alerta", "sitio"}
+
+
+class MemoriaBackend:
+    """LRU con vencimiento en el proceso."""
+    N_BLOQUEOS = 64  # Bloqueos repartidos por hash de la clave (no crece con las claves)
+
+    def __init__(self, max_entradas: int):
+        self.max_entradas = max_entradas
+        self._datos: OrderedDict = OrderedDict()  # clave -> (vence, valor)
+        self._version = 0
+        self._lock = threading.Lock()
+        self._bloqueos = [threading.Lock() for _ in range(self.N_BLOQUEOS)]
+
+    def get(self, clave: str) -> Optional[str]:
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            vence, valor = entrada
+            if vence < time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def set(self, clave: str, valor: str, ttl: float):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def version(self) -> int:
+        return self._version
+
+    def incrementar_version(self) -> int:
+        with self._lock:
+            self._version += 1
+            # Las entradas de versiones anteriores ya no se leen: se liberan
+            self._datos.clear()
+            return self._version
+
+    @contextmanager
+    def bloqueo(self, clave: str, timeout: float):
+        lock = self._bloqueos[hash(clave) % self.N_BLOQUEOS]
+        adquirido = lock.acquire(timeout=timeout)
+        try:
+            yield adquirido
+        finally:
+            if adquirido:
+                lock.release()
+
+
+class RedisBackend:
+    """Backend compartido entre procesos (redis-py o un cliente fakeredis compatible)."""
+
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def get(self, clave: str) -> Optional[str]:
+        return self.cliente.get(clave)
+
+    def set(self, clave: str, valor: str, ttl: float):
+        self.cliente.set(clave, valor, px=max(1, int(ttl * 1000)))
+
+    def version(self) -> int:
+        return int(self.cliente.get(CLAVE_VERSION) or 0)
+
+    def incrementar_version(self) -> int:
+        return int(self.cliente.incr(CLAVE_VERSION))
+
+    @contextmanager
+    def bloqueo(self, clave: str, timeout: float):
+        # El bloqueo expira solo (timeout) si el proceso que calcula muere
+        lock = self.cliente.lock(clave, timeout=timeout, blocking_timeout=timeout)
+        adquirido = lock.acquire()
+        try:
+            yield adquirido
+        finally:
+            if adquirido:
+                try:
+                    lock.release()
+                except Exception:
+                    pass  # Ya había expirado
+
+
+class DashboardCache:
+    def __init__(self, backend, ttl: float, espera_bloqueo: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.espera_bloqueo = espera_bloqueo
+
+    def _clave(self, alcance: str) -> str:
+        return f"{PREFIJO}:v{self.backend.version()}:{alcance}"
+
+    def get_or_compute(self, alcance: str, calcular: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Devuelve las estadísticas del alcance desde la caché o las calcula (una vez por clave)."""
+        clave = self._clave(alcance)
+        valor = self.backend.get(clave)
+        if valor is not None:
+            return json.loads(valor)
+
+        with self.backend.bloqueo(f"{clave}:calculando", self.espera_bloqueo):
+            # Otro request pudo calcularlo mientras se esperaba el bloqueo
+            valor = self.backend.get(clave)
+            if valor is not None:
+                return json.loads(valor)
+            resultado = calcular()
+            # Si hubo una invalidación durante el cálculo, la entrada queda en la versión
+            # anterior y no se vuelve a leer
+            self.backend.set(clave, json.dumps(resultado, default=str), self.ttl)
+            return resultado
+
+    def invalidar(self):
+        try:
+            self.backend.incrementar_version()
+        except Exception as e:
+            # No debe romper el commit que la provocó; la TTL acota la información vieja
+            print(f"Advertencia: no se pudo invalidar la caché del dashboard. {e}")
+
+
+def _crear_backend():
+    tipo = settings.DASHBOARD_CACHE_BACKEND
+    if tipo == "redis":
+        import redis
+        return RedisBackend(redis.Redis.from_url(settings.REDIS_URL, decode_responses=True))
+    if tipo == "fakeredis":
+        import fakeredis
+        return RedisBackend(fakeredis.FakeRedis(decode_responses=True))
+    if tipo == "memoria":
+        return MemoriaBackend(settings.DASHBOARD_CACHE_MAX_ENTRIES)
+    raise ValueError(f"Backend de caché del dashboard no soportado: {tipo}")
+
+
+_cache: Optional[DashboardCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> DashboardCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DashboardCache(_crear_backend(), ttl=settings.DASHBOARD_CACHE_TTL_SECONDS,
+                                    espera_bloqueo=settings.DASHBOARD_CACHE_LOCK_SECONDS)
+        return _cache
+
+
+# --- Invalidación por eventos de la sesión ---
+_MARCA = "dashboard_modificado"
+
+
+def registrar_invalidacion(session_factory):
+    """
+    Invalida la caché después de cada commit que tocó alguna tabla de TABLAS_DASHBOARD,
+    ya sea con objetos del ORM (flush) o con sentencias INSERT/UPDATE/DELETE ejecutadas
+    en la sesión (upserts, updates masivos). Después del commit, no antes: así un
+    cálculo concurrente no vuelve a guardar datos anteriores al cambio.
+    """
+    @event.listens_for(session_factory, "after_flush")
+    def _marcar_flush(session, flush_context):
+        for obj in chain(session.new, session.dirty, session.deleted):
+            if getattr(obj, "__tablename__", None) in TABLAS_DASHBOARD:
+                session.info[_MARCA] = True
+                return
+
+    @event.listens_for(session_factory, "do_orm_execute")
+    def _marcar_sentencia(orm_execute_state):
+        if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+            return
+        tabla = getattr(orm_execute_state.statement, "table", None)
+        if tabla is not None and tabla.name in TABLAS_DASHBOARD:
+            orm_execute_state.session.info[_MARCA] = True
+
+    @event.listens_for(session_factory, "after_commit")
+    def _invalidar(session):
+        if session.info.pop(_MARCA, False):
+            get_cache().invalidar()
+
+    @event.listens_for(session_factory, "after_rollback")
+    def _descartar(session):
+        session.info.pop(_MARCA, None)
@@ -1,29 +1,126 @@
 # services/dashboard_service.py
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, desc, cast, Date as SQLDate
-from datetime import datetime, timedelta
+from sqlalchemy import func, desc, case, select
+from datetime import date, datetime, timedelta
 import pytz # Importar pytz para manejar zonas horarias
 from db import models
-from typing import Optional, List, Dict, Any
+from crud import consumo_diario as consumo_diario_crud
+from crud import prediccion as prediccion_crud
+from services import dashboard_cache, prediction_service
+from typing import Optional, List, Dict, Any, Tuple
 
-def get_dashboard_stats(db: Session, current_user: models.Usuario) -> Dict[str, Any]:
+def _get_kpis(db: Session, tecnico_id: Optional[int], inicio_mes: date,
+              desde_30_dias: date, now_naive: datetime) -> Dict[str, Any]:
+    """
+    Todos los indicadores escalares del dashboard en un solo viaje a la BD: los conteos
+    y sumas del mes y de los últimos 30 días salen de una única pasada sobre el rollup
+    diario (consumo_diario) con agregación condicional (SUM(CASE ...)); sitios,
+    predicciones próximas y alertas abiertas van como subconsultas escalares del mismo
+    SELECT. Con tecnico_id se limita todo a los sitios del técnico.
+    """
+    cd = models.ConsumoDiario
+    pred = models.PrediccionAbastecimiento
+    en_mes = cd.fecha >= inicio_mes
+    en_30d = cd.fecha >= desde_30_dias
+
+    abast = select(
+        func.sum(case((en_mes, cd.n_abastecimientos), else_=0)).label("total_abastecimientos_mes"),
+        func.sum(case((en_mes, cd.gls_abastecidos), else_=0)).label("total_galones_mes"),
+        func.sum(case((en_30d, cd.n_abastecimientos), else_=0)).label("abastecimientos_ultimos_30_dias"),
+        func.sum(case((en_30d, cd.gls_abastecidos), else_=0)).label("total_galones_ultimos_30_dias"),
+    ).where(
+        cd.fecha >= min(inicio_mes, desde_30_dias)  # Rango que cubre ambos periodos (clave primaria por fecha)
+    )
+    sitios = select(func.count(models.Sitio.id_sitio))
+    proximos = select(func.count(pred.id_prediccion)).where(
+        pred.fecha_proximo_abastecimiento >= now_naive,
+        pred.fecha_proximo_abastecimiento < now_naive + timedelta(days=7)
+    )
+    alertas = select(func.count(models.Alerta.id_alerta)).where(
+        models.Alerta.estado_alerta.in_([models.EstadoAlertaEnum.ABIERTA, models.EstadoAlertaEnum.ENVIADA])
+    )
+
+    if tecnico_id is not None:
+        abast = abast.join_from(cd, models.Sitio, cd.id_sitio == models.Sitio.id_sitio)
+        proximos = proximos.join_from(pred, models.Sitio, pred.id_sitio == models.Sitio.id_sitio)
+        alertas = alertas.join_from(models.Alerta, models.Sitio, models.Alerta.id_sitio == models.Sitio.id_sitio)
+        abast, sitios, proximos, alertas = (
+            q.where(models.Sitio.id_tecnico == tecnico_id) for q in (abast, sitios, proximos, alertas)
+        )
+
+    abast = abast.subquery()
+    fila = db.execute(select(
+        sitios.scalar_subquery().label("total_sitios"),
+        abast.c.total_abastecimientos_mes,
+        abast.c.total_galones_mes,
+        proximos.scalar_subquery().label("sitios_proximo_abastecimiento"),
+        alertas.scalar_subquery().label("alertas_abiertas"),
+        abast.c.total_galones_ultimos_30_dias,
+        abast.c.abastecimientos_ultimos_30_dias,
+    ).select_from(abast)).one()
+
+    return {
+        "total_sitios": int(fila.total_sitios or 0),
+        "total_abastecimientos_mes": int(fila.total_abastecimientos_mes or 0),
+        "total_galones_mes": float(fila.total_galones_mes or 0.0),
+        "sitios_proximo_abastecimiento": int(fila.sitios_proximo_abastecimiento or 0),
+        "alertas_abiertas": int(fila.alertas_abiertas or 0),
+        "total_galones_ultimos_30_dias": float(fila.total_galones_ultimos_30_dias or 0.0),
+        "abastecimientos_ultimos_30_dias": int(fila.abastecimientos_ultimos_30_dias or 0),
+    }
+
+
+def _sin_datos() -> Dict[str, Any]:
+    """Dashboard vacío (usuario sin rol válido)."""
+    return {
+        "total_sitios": 0, "total_abastecimientos_mes": 0, "total_galones_mes": 0.0,
+        "sitios_proximo_abastecimiento": 0, "alertas_abiertas": 0,
+        "total_galones_ultimos_30_dias": 0.0, "abastecimientos_ultimos_30_dias": 0,
+        "sitios_criticos": [], "ultimos_abastecimientos": [],
+        "sitios_menor_nivel": [], "galones_por_dia_chart": []
+    }
+
+
+def get_dashboard_scope(current_user: models.Usuario) -> Tuple[Optional[str], Optional[int]]:
     """
-    Calcula estadísticas clave para el dashboard basadas en el rol del usuario,
-    usando la hora de Guatemala.
+    Alcance de las estadísticas del usuario: ("global", None) para ADMIN/SUPERVISOR,
+    ("tecnico:<id>", id_tecnico) para un técnico y (None, None) sin rol válido.
+    get_current_user ya cargó roles y técnico: no se vuelve a consultar el usuario.
     """
-    # --- Obtener usuario y roles (sin cambios) ---
-    user_with_roles = db.query(models.Usuario).options(
-        joinedload(models.Usuario.roles),
-        joinedload(models.Usuario.tecnico)
-    ).filter(models.Usuario.id_usuario == current_user.id_usuario).first()
-
-    if not user_with_roles: return {"error": "Usuario no encontrado"}
-    user_roles = {rol.nombre for rol in user_with_roles.roles}
+    user_roles = {rol.nombre for rol in current_user.roles}
     is_admin = 'ADMIN' in user_roles
     is_supervisor = 'SUPERVISOR' in user_roles
     is_tecnico = 'TECNICO' in user_roles
-    tecnico_id = user_with_roles.tecnico.id_tecnico if is_tecnico and user_with_roles.tecnico else None
+    tecnico_id = current_user.tecnico.id_tecnico if is_tecnico and current_user.tecnico else None
+
+    if is_tecnico and tecnico_id:
+        return f"tecnico:{tecnico_id}", tecnico_id
+    if is_admin or is_supervisor:
+        return dashboard_cache.ALCANCE_GLOBAL, None
+    return None, None
+
 
+def get_dashboard_stats(db: Session, current_user: models.Usuario) -> Dict[str, Any]:
+    """
+    Estadísticas del dashboard para el alcance del usuario, desde la caché
+    (services/dashboard_cache.py) o calculadas si no están.
+    """
+    alcance, tecnico_id = get_dashboard_scope(current_user)
+    if alcance is None:
+        return _sin_datos()
+    # Niveles estimados con más de PREDICTION_NIVEL_MAX_AGE_MINUTES: se refrescan (un bloque
+    # acotado) antes de leer la caché; el commit la invalida solo si hubo cambios.
+    # Misma hora que usa prediction_service al guardar el nivel (datetime.now())
+    if prediction_service.refrescar_niveles(db, datetime.now()):
+        db.commit()
+    return dashboard_cache.get_cache().get_or_compute(alcance, lambda: _calcular_stats(db, tecnico_id))
+
+
+def _calcular_stats(db: Session, tecnico_id: Optional[int]) -> Dict[str, Any]:
+    """
+    Calcula estadísticas clave para el dashboard (todas o solo las de los sitios del
+    técnico), usando la hora de Guatemala.
+    """
     # --- CORRECCIÓN: Usar zona horaria de Guatemala ---
     guatemala_tz = pytz.timezone('America/Guatemala')
     now = datetime.now(guatemala_tz) # Obtener hora actual en Guatemala
@@ -36,29 +133,19 @@ def get_dashboard_stats(db: Session, current_user: models.Usuario) -> Dict[str,
     stats: Dict[str, Any] = {}
     inicio_mes = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     hace_30_dias = now - timedelta(days=30)
+    # Los totales de 30 días y el gráfico salen del rollup diario: cuentan días completos
+    desde_30_dias = hace_30_dias.date()
     # Define tu umbral crítico (ej: necesita abastecimiento en menos de 3 días desde AHORA)
     limite_critico = now + timedelta(days=3)
 
     # --- Definir queries base (sin cambios) ---
-    base_query_sitios = db.query(models.Sitio)
     query_abast_mes = db.query(models.Abastecimiento).filter(
         models.Abastecimiento.fecha >= inicio_mes.replace(tzinfo=None), # Comparar naive si fecha en BD es naive
         models.Abastecimiento.status == 'ACTIVO'
     )
-    query_abast_30d = db.query(models.Abastecimiento).filter(
-        models.Abastecimiento.fecha >= hace_30_dias.replace(tzinfo=None), # Comparar naive
-        models.Abastecimiento.status == 'ACTIVO'
-    )
     # Comparar now_naive con fecha_proximo_abastecimiento (asumiendo naive en BD)
     now_naive = now.replace(tzinfo=None)
     limite_critico_naive = limite_critico.replace(tzinfo=None)
-    query_proximos_7d = db.query(models.PrediccionAbastecimiento).filter(
-        models.PrediccionAbastecimiento.fecha_proximo_abastecimiento >= now_naive,
-        models.PrediccionAbastecimiento.fecha_proximo_abastecimiento < now_naive + timedelta(days=7)
-    )
-    query_alertas_abiertas = db.query(models.Alerta).filter(
-        models.Alerta.estado_alerta.in_([models.EstadoAlertaEnum.ABIERTA, models.EstadoAlertaEnum.ENVIADA])
-    )
     query_sitios_criticos = db.query(models.PrediccionAbastecimiento).options(
         joinedload(models.PrediccionAbastecimiento.sitio)
     ).filter(
@@ -66,33 +153,17 @@ def get_dashboard_stats(db: Session, current_user: models.Usuario) -> Dict[str,
         models.PrediccionAbastecimiento.fecha_proximo_abastecimiento >= now_naive
     )
 
-    # --- Aplicar filtros por rol (sin cambios) ---
-    if is_tecnico and tecnico_id:
-        base_query_sitios = base_query_sitios.filter(models.Sitio.id_tecnico == tecnico_id)
+    # --- Aplicar filtro del técnico ---
+    if tecnico_id is not None:
         query_abast_mes = query_abast_mes.join(models.Sitio).filter(models.Sitio.id_tecnico == tecnico_id)
-        query_abast_30d = query_abast_30d.join(models.Sitio).filter(models.Sitio.id_tecnico == tecnico_id)
-        query_proximos_7d = query_proximos_7d.join(models.Sitio).filter(models.Sitio.id_tecnico == tecnico_id)
-        query_alertas_abiertas = query_alertas_abiertas.join(models.Sitio).filter(models.Sitio.id_tecnico == tecnico_id)
         query_sitios_criticos = query_sitios_criticos.join(models.Sitio).filter(models.Sitio.id_tecnico == tecnico_id)
-    elif is_admin or is_supervisor:
-        pass
-    else: # Sin rol válido
-        return {
-            "total_sitios": 0, "total_abastecimientos_mes": 0, "total_galones_mes": 0.0,
-            "sitios_proximo_abastecimiento": 0, "alertas_abiertas": 0,
-            "total_galones_ultimos_30_dias": 0.0, "abastecimientos_ultimos_30_dias": 0,
-            "sitios_criticos": [], "ultimos_abastecimientos": [],
-            "sitios_menor_nivel": [], "galones_por_dia_chart": []
-        }
-
-    # --- Ejecutar queries (sin cambios) ---
-    stats["total_sitios"] = base_query_sitios.count()
-    stats["total_abastecimientos_mes"] = query_abast_mes.count()
-    stats["total_galones_mes"] = query_abast_mes.with_entities(func.sum(models.Abastecimiento.gls_abastecidos)).scalar() or 0.0
-    stats["sitios_proximo_abastecimiento"] = query_proximos_7d.count()
-    stats["alertas_abiertas"] = query_alertas_abiertas.count()
-    stats["total_galones_ultimos_30_dias"] = query_abast_30d.with_entities(func.sum(models.Abastecimiento.gls_abastecidos)).scalar() or 0.0
-    stats["abastecimientos_ultimos_30_dias"] = query_abast_30d.count()
+
+    # --- Indicadores escalares: una sola consulta ---
+    stats.update(_get_kpis(
+        db, tecnico_id=tecnico_id,
+        inicio_mes=inicio_mes.date(), desde_30_dias=desde_30_dias,
+        now_naive=now_naive
+    ))
 
     # --- Procesar lista de sitios críticos con Debugging y cálculo de días ---
     predicciones_criticas = query_sitios_criticos.order_by(
@@ -161,16 +232,25 @@ def get_dashboard_stats(db: Session, current_user: models.Usuario) -> Dict[str,
         } for ab in ultimos_abastecimientos
     ]
 
-    # --- Datos para Gráfico (sin cambios) ---
-    galones_por_dia = query_abast_30d.with_entities(
-        cast(models.Abastecimiento.fecha, SQLDate).label('dia_label'),
-        func.sum(models.Abastecimiento.gls_abastecidos).label('galones_value')
-    ).group_by(cast(models.Abastecimiento.fecha, SQLDate)).order_by(cast(models.Abastecimiento.fecha, SQLDate)).all()
+    # --- Datos para Gráfico (rollup diario: una fila por día, no por abastecimiento) ---
+    galones_por_dia = consumo_diario_crud.get_galones_por_dia(
+        db, desde=desde_30_dias, tecnico_id=tecnico_id
+    )
     stats["galones_por_dia_chart"] = [
-        {"label": dia.strftime('%Y-%m-%d'), "value": total_galones or 0.0}
+        {"label": dia.strftime('%Y-%m-%d'), "value": float(total_galones or 0.0)}
         for dia, total_galones in galones_por_dia
     ]
 
-    stats["sitios_menor_nivel"] = [] # Placeholder
+    # --- Sitios con menor nivel estimado (índice de prediccion_abastecimiento.nivel_estimado_gls; agotados primero) ---
+    stats["sitios_menor_nivel"] = [
+        {
+            "id_sitio": pred.id_sitio,
+            "nombre_sitio": pred.sitio.nombre if pred.sitio else "N/A",
+            # El guardado es de cuando se calculó; se lleva a la hora actual con el consumo diario
+            "nivel_estimado_gls": prediction_service.estimar_nivel(
+                pred.consumo_diario_gls, pred.fecha_proximo_abastecimiento, now_naive),
+            "consumo_diario_gls": round(pred.consumo_diario_gls, 2) if pred.consumo_diario_gls is not None else None,
+        } for pred in prediccion_crud.get_sitios_menor_nivel(db, limit=5, tecnico_id=tecnico_id)
+    ]
 
     return stats
\ No newline at end of file
@@ -0,0 +1,168 @@
+# services/event_hub.py
+"""
+Pub/sub en el proceso para los eventos en vivo del dashboard y las alertas (SSE,
+ver api/routers/eventos.py).
+
+Los productores publican deltas pequeños (abastecimiento creado/editado/cancelado,
+alerta abierta/cerrada, predicción actualizada) con el id del sitio afectado:
+    - publicar(): entrega inmediata (el cambio ya está confirmado);
+    - publicar_al_confirmar(db, ...): se entrega después del commit de la sesión y
+      se descarta si hay rollback (ver registrar_eventos()).
+
+Cada conexión es una Suscripcion con su cola acotada. Si la cola se llena (cliente
+lento o una ráfaga, p. ej. la generación de alertas, que publica al confirmar cada
+bloque y se entrega de una vez al liberarse el event loop), se descartan los eventos
+pendientes y se deja un evento "resync": la conexión sigue abierta y el cliente
+recarga /dashboard/ en lugar de aplicar los deltas perdidos. El alcance es el mismo que en
+dashboard_service.get_dashboard_scope: "global" recibe todo y un técnico solo los
+eventos de sus sitios (cargados al conectarse). Se puede publicar desde cualquier
+hilo: la entrega se hace en el event loop con call_soon_threadsafe.
+Los eventos no salen del proceso: con varios workers cada uno entrega los suyos.
+
+Despliegue: necesita un servidor persistente (uvicorn con un solo worker: con varios,
+cada stream solo recibe lo publicado en su proceso). En Vercel (serverless) no sirve:
+cada request corre en una invocación aparte, con duración máxima, y lo publicado en
+una no llega a los streams abiertos en otra.
+Para varios procesos o serverless habría que publicar por un broker externo
+(p. ej. Redis pub/sub) en lugar de este hub en memoria.
+"""
+import asyncio
+import itertools
+import threading
+from datetime import datetime
+from typing import Optional, Set
+
+from sqlalchemy import event
+
+from core.config import settings
+
+ALCANCE_GLOBAL = "global"
+TIPO_RESYNC = "resync"
+_PENDIENTES = "eventos_pendientes"
+
+
+class Suscripcion:
+    def __init__(self, alcance: str, sitios: Optional[Set[int]] = None, tamano_cola: int = 100):
+        self.alcance = alcance
+        self.sitios = sitios  # None: todos los sitios
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=tamano_cola)
+
+    def acepta(self, evento: dict) -> bool:
+        return self.sitios is None or evento.get("id_sitio") in self.sitios
+
+
+class EventHub:
+    def __init__(self, tamano_cola: int = 100, max_conexiones: int = 5000):
+        self.tamano_cola = tamano_cola
+        self.max_conexiones = max_conexiones
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._suscripciones: Set[Suscripcion] = set()
+        self._ids = itertools.count(1)
+
+    def iniciar(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def detener(self):
+        """Cierra todas las conexiones (al apagar la app)."""
+        for suscripcion in list(self._suscripciones):
+            self._cerrar(suscripcion)
+        self._suscripciones.clear()
+        self._loop = None
+
+    def suscribir(self, alcance: str, sitios: Optional[Set[int]] = None) -> Optional[Suscripcion]:
+        """Nueva suscripción (desde el event loop), o None si se alcanzó el máximo de conexiones."""
+        if len(self._suscripciones) >= self.max_conexiones:
+            return None
+        suscripcion = Suscripcion(alcance, sitios, self.tamano_cola)
+        self._suscripciones.add(suscripcion)
+        return suscripcion
+
+    def desuscribir(self, suscripcion: Suscripcion):
+        self._suscripciones.discard(suscripcion)
+
+    @property
+    def conexiones(self) -> int:
+        return len(self._suscripciones)
+
+    def publicar(self, tipo: str, id_sitio: Optional[int], datos: Optional[dict] = None):
+        """Publica un evento; se puede llamar desde cualquier hilo. Sin event loop no hace nada."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        evento = {
+            "id": next(self._ids),
+            "tipo": tipo,
+            "id_sitio": id_sitio,
+            "datos": datos or {},
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+        }
+        try:
+            loop.call_soon_threadsafe(self._entregar, evento)
+        except RuntimeError:
+            pass  # El loop se cerró entre la comprobación y la llamada
+
+    def _entregar(self, evento: dict):
+        for suscripcion in list(self._suscripciones):
+            if not suscripcion.acepta(evento):
+                continue
+            try:
+                suscripcion.cola.put_nowait(evento)
+            except asyncio.QueueFull:
+                self._resincronizar(suscripcion, evento)
+
+    def _resincronizar(self, suscripcion: Suscripcion, evento: dict):
+        """Cola llena: descarta lo pendiente y deja un "resync" seguido del evento nuevo."""
+        print(f"Advertencia: suscripción SSE ({suscripcion.alcance}) con la cola llena, se pide resync.")
+        while not suscripcion.cola.empty():
+            suscripcion.cola.get_nowait()
+        suscripcion.cola.put_nowait({
+            "id": next(self._ids),
+            "tipo": TIPO_RESYNC,
+            "id_sitio": None,
+            "datos": {"motivo": "Eventos descartados: recargar /dashboard/."},
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+        })
+        suscripcion.cola.put_nowait(evento)
+
+    def _cerrar(self, suscripcion: Suscripcion):
+        self._suscripciones.discard(suscripcion)
+        # None indica fin del stream; se vacía la cola si hace falta lugar
+        while True:
+            try:
+                suscripcion.cola.put_nowait(None)
+                return
+            except asyncio.QueueFull:
+                suscripcion.cola.get_nowait()
+
+
+_hub: Optional[EventHub] = None
+_hub_lock = threading.Lock()
+
+
+def get_hub() -> EventHub:
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = EventHub(tamano_cola=settings.SSE_QUEUE_SIZE, max_conexiones=settings.SSE_MAX_CONNECTIONS)
+        return _hub
+
+
+def publicar(tipo: str, id_sitio: Optional[int], datos: Optional[dict] = None):
+    get_hub().publicar(tipo, id_sitio, datos)
+
+
+def publicar_al_confirmar(db, tipo: str, id_sitio: Optional[int], datos: Optional[dict] = None):
+    """Deja el evento pendiente en la sesión: se publica tras el commit (registrar_eventos)."""
+    db.info.setdefault(_PENDIENTES, []).append((tipo, id_sitio, datos))
+
+
+def registrar_eventos(session_factory):
+    """Publica los eventos pendientes de la sesión al confirmar y los descarta con rollback."""
+    @event.listens_for(session_factory, "after_commit")
+    def _publicar_pendientes(session):
+        for tipo, id_sitio, datos in session.info.pop(_PENDIENTES, []):
+            publicar(tipo, id_sitio, datos)
+
+    @event.listens_for(session_factory, "after_rollback")
+    def _descartar_pendientes(session):
+        session.info.pop(_PENDIENTES, None)
@@ -0,0 +1,76 @@
+# services/historial_export_service.py
+"""
+Exportación del historial de abastecimientos en cualquiera de los formatos de
+report_service, leyendo las filas con cursor (crud.abastecimiento.stream_historial_rows).
+La usan la descarga directa (/abastecimientos/historial/descargar) y los
+trabajos en segundo plano de /reportes.
+"""
+from datetime import datetime
+from typing import Iterator, Optional
+
+from core.config import settings
+from crud import abastecimiento as abastecimiento_crud
+from db import models
+from db.base import SessionLocal
+from services import job_service, report_service
+
+TIPO_JOB = "reporte_historial"
+
+# formato -> (extensión, media type)
+FORMATOS = {
+    "pdf": ("pdf", "application/pdf"),
+    "excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("csv", "text/csv; charset=utf-8"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+
+def nombre_archivo(formato: str) -> str:
+    extension, _ = FORMATOS[formato]
+    return f"historial_abastecimientos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+
+def iter_historial_export(formato: str, user_id: int, sitio_id: Optional[int] = None, q: Optional[str] = None,
+                          row_group_size: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Genera el archivo por bloques. Usa su propia sesión (se consume fuera del request:
+    en un StreamingResponse o en un hilo del JobManager) y la cierra al terminar.
+    """
+    db = SessionLocal()
+    try:
+        current_user = db.get(models.Usuario, user_id)
+        filas = abastecimiento_crud.stream_historial_rows(db, current_user=current_user, sitio_id=sitio_id, q=q)
+        if formato == "csv":
+            yield from report_service.iter_historial_csv(filas)
+        elif formato == "parquet":
+            yield from report_service.iter_historial_parquet(filas, row_group_size or settings.PARQUET_ROW_GROUP_SIZE)
+        elif formato == "excel":
+            yield from report_service.iter_file(
+                report_service.generate_historial_excel_file(report_service.format_rows(filas))
+            )
+        elif formato == "pdf":
+            yield report_service.render_historial_pdf(report_service.format_rows(filas))
+        else:
+            raise ValueError(f"Formato no soportado: {formato}")
+    finally:
+        db.close()
+
+
+def submit_reporte(formato: str, user_id: int, alcance: str, sitio_id: Optional[int] = None,
+                   q: Optional[str] = None, row_group_size: Optional[int] = None) -> str:
+    """
+    Encola la exportación como trabajo en segundo plano. 'alcance' es el de
+    crud.abastecimiento.get_historial_scope para el usuario: peticiones con el mismo
+    alcance, filtros y formato (de cualquier usuario) mientras la primera sigue en
+    curso comparten el mismo trabajo, porque el archivo resultante es el mismo.
+    """
+    clave = f"{TIPO_JOB}:{alcance}:{formato}:{sitio_id}:{q}:{row_group_size}"
+    _, media_type = FORMATOS[formato]
+    return job_service.get_manager().submit(
+        TIPO_JOB, iter_historial_export, formato, user_id, sitio_id, q, row_group_size,
+        nombre_archivo=nombre_archivo(formato),
+        media_type=media_type,
+        id_usuario=user_id,
+        clave=clave,
+        datos={"formato": formato, "sitio_id": sitio_id, "q": q, "alcance": alcance},
+    )
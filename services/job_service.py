@@ -0,0 +1,188 @@
+# services/job_service.py
+"""
+Trabajos en segundo plano (generación de PDFs y otros archivos) fuera del event loop.
+
+Cada trabajo corre en un pool de hilos y deja su resultado en disco
+(settings.JOBS_DIR), junto a un archivo .json con su estado; así cualquier
+worker del mismo host puede servir el resultado aunque no lo haya generado.
+Los resultados se eliminan pasados settings.JOB_RESULT_TTL_SECONDS.
+"""
+import glob
+import json
+import os
+import re
+import tempfile
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional, Union
+
+from core.config import settings
+
+ESTADO_PENDIENTE = "PENDIENTE"
+ESTADO_EN_PROCESO = "EN_PROCESO"
+ESTADO_COMPLETADO = "COMPLETADO"
+ESTADO_FALLIDO = "FALLIDO"
+
+_JOB_ID_RE = re.compile(r"[0-9a-f]{32}")
+_ESTADOS_ACTIVOS = (ESTADO_PENDIENTE, ESTADO_EN_PROCESO)
+LIMPIEZA_CADA_SEGUNDOS = 60
+
+
+class JobManager:
+    def __init__(self, directorio: str, max_workers: int = 2, ttl_segundos: float = 3600):
+        self.directorio = directorio
+        os.makedirs(self.directorio, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="job")
+        self.ttl = timedelta(seconds=ttl_segundos)
+        self._jobs = {}
+        self._activos_por_clave = {}  # clave de deduplicación -> id del trabajo en curso
+        self._lock = threading.Lock()
+        self._ultima_limpieza = datetime.min
+
+    def _ruta(self, job_id: str, extension: str) -> str:
+        return os.path.join(self.directorio, f"{job_id}.{extension}")
+
+    def _guardar(self, job: dict):
+        with self._lock:
+            self._jobs[job["id"]] = job
+        # Escritura atómica del estado para que otros procesos no lean un JSON a medias
+        tmp = self._ruta(job["id"], "json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        os.replace(tmp, self._ruta(job["id"], "json"))
+
+    def submit(self, tipo: str, funcion: Callable[..., Union[bytes, Iterable[bytes]]], *args,
+               nombre_archivo: str, media_type: str, id_usuario: Optional[int] = None,
+               clave: Optional[str] = None, datos: Optional[dict] = None) -> str:
+        """
+        Encola 'funcion(*args)', que devuelve los bytes del archivo resultante o un
+        iterable de bloques de bytes (se escriben a disco a medida que llegan).
+        Si 'clave' coincide con la de un trabajo aún en curso, no se encola otro:
+        se devuelve el id del existente. 'datos' se guarda tal cual en el estado.
+        Devuelve el id del trabajo.
+        """
+        self.limpiar_expirados()
+        job = {
+            "id": uuid.uuid4().hex,
+            "tipo": tipo,
+            "estado": ESTADO_PENDIENTE,
+            "id_usuario": id_usuario,
+            "nombre_archivo": nombre_archivo,
+            "media_type": media_type,
+            "datos": datos,
+            "error": None,
+            "creado_en": datetime.utcnow().isoformat(),
+            "terminado_en": None,
+        }
+        with self._lock:
+            if clave is not None:
+                existente = self._activos_por_clave.get(clave)
+                if existente and self._jobs.get(existente, {}).get("estado") in _ESTADOS_ACTIVOS:
+                    return existente
+                self._activos_por_clave[clave] = job["id"]
+        self._guardar(job)
+        self._executor.submit(self._ejecutar, dict(job), funcion, args, clave)
+        return job["id"]
+
+    def _ejecutar(self, job: dict, funcion: Callable, args: tuple, clave: Optional[str] = None):
+        job["estado"] = ESTADO_EN_PROCESO
+        self._guardar(dict(job))
+        ruta = self._ruta(job["id"], "bin")
+        try:
+            resultado = funcion(*args)
+            with open(ruta + ".tmp", "wb") as f:
+                if isinstance(resultado, (bytes, bytearray)):
+                    f.write(resultado)
+                else:
+                    for bloque in resultado:
+                        f.write(bloque)
+            os.replace(ruta + ".tmp", ruta)
+            job["estado"] = ESTADO_COMPLETADO
+        except Exception as e:
+            print(f"!!!!!!!! ERROR en trabajo {job['tipo']} {job['id']}: {e} !!!!!!!!")
+            print(traceback.format_exc())
+            if os.path.exists(ruta + ".tmp"):
+                os.remove(ruta + ".tmp")
+            job["estado"] = ESTADO_FALLIDO
+            job["error"] = str(e)[:255]
+        job["terminado_en"] = datetime.utcnow().isoformat()
+        self._guardar(dict(job))
+        if clave is not None:
+            with self._lock:
+                if self._activos_por_clave.get(clave) == job["id"]:
+                    del self._activos_por_clave[clave]
+
+    def limpiar_expirados(self, forzar: bool = False) -> int:
+        """
+        Elimina los resultados terminados hace más de la TTL (como mucho una vez
+        por minuto salvo 'forzar'). Devuelve cuántos trabajos se eliminaron.
+        """
+        ahora = datetime.utcnow()
+        with self._lock:
+            if not forzar and ahora - self._ultima_limpieza < timedelta(seconds=LIMPIEZA_CADA_SEGUNDOS):
+                return 0
+            self._ultima_limpieza = ahora
+
+        eliminados = 0
+        for ruta_json in glob.glob(os.path.join(self.directorio, "*.json")):
+            try:
+                with open(ruta_json, encoding="utf-8") as f:
+                    job = json.load(f)
+                terminado = job.get("terminado_en")
+                if not terminado or ahora - datetime.fromisoformat(terminado) < self.ttl:
+                    continue
+                with self._lock:
+                    self._jobs.pop(job["id"], None)
+                for ruta in (self._ruta(job["id"], "bin"), ruta_json):
+                    if os.path.exists(ruta):
+                        os.remove(ruta)
+                eliminados += 1
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Advertencia: no se pudo limpiar el trabajo '{ruta_json}'. {e}")
+        return eliminados
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Estado del trabajo (de memoria o, si lo generó otro proceso, del disco)."""
+        if not _JOB_ID_RE.fullmatch(job_id or ""):
+            return None  # Evita rutas arbitrarias: el id se usa como nombre de archivo
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return dict(job)
+        try:
+            with open(self._ruta(job_id, "json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def result_path(self, job_id: str) -> str:
+        return self._ruta(job_id, "bin")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_manager() -> JobManager:
+    """JobManager del proceso (se crea en el primer uso)."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            directorio = settings.JOBS_DIR or os.path.join(tempfile.gettempdir(), "abastecimientos_jobs")
+            _manager = JobManager(directorio, max_workers=settings.JOB_WORKERS,
+                                  ttl_segundos=settings.JOB_RESULT_TTL_SECONDS)
+        return _manager
+
+
+def shutdown():
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager.shutdown()
+            _manager = None
@@ -0,0 +1,54 @@
+# services/least_squares.py
+"""
+Ajuste lineal de una variable por mínimos cuadrados en forma cerrada (NumPy).
+Sustituye a sklearn.linear_model.LinearRegression en el servicio de predicción:
+mismo resultado que LinearRegression() con fit_intercept=True, sin el costo de
+importar sklearn ni de crear un estimador por cada sitio.
+"""
+from typing import NamedTuple
+import numpy as np
+
+
+class LinearFit(NamedTuple):
+    slope: float
+    intercept: float
+    residuals: np.ndarray
+    r2: float
+
+
+def fit_line(x, y) -> LinearFit:
+    """
+    Ajusta y = slope * x + intercept. Los datos se centran antes de calcular la
+    pendiente (más estable numéricamente que las sumas crudas). Si x no tiene
+    varianza, la pendiente es 0 (mismo criterio que sklearn).
+    """
+    x = np.asarray(x, dtype=float).ravel()
+    y = np.asarray(y, dtype=float).ravel()
+    if x.size == 0 or x.size != y.size:
+        raise ValueError("x e y deben tener el mismo número de elementos (al menos uno).")
+
+    x_mean = x.mean()
+    y_mean = y.mean()
+    x_c = x - x_mean
+    y_c = y - y_mean
+    sxx = float(np.dot(x_c, x_c))
+    slope = float(np.dot(x_c, y_c)) / sxx if sxx > 0 else 0.0
+    intercept = float(y_mean - slope * x_mean)
+
+    residuals = y - (slope * x + intercept)
+    ss_res = float(np.dot(residuals, residuals))
+    ss_tot = float(np.dot(y_c, y_c))
+    if ss_tot > 0:
+        r2 = 1.0 - ss_res / ss_tot
+    else:
+        r2 = 1.0 if ss_res == 0 else 0.0
+
+    return LinearFit(slope=slope, intercept=intercept, residuals=residuals, r2=r2)
+
+
+def fit_slope_sklearn(x, y) -> float:
+    """Backend alternativo: pendiente con sklearn (importado solo si se usa)."""
+    from sklearn.linear_model import LinearRegression
+    model = LinearRegression()
+    model.fit(np.asarray(x, dtype=float).reshape(-1, 1), np.asarray(y, dtype=float))
+    return float(model.coef_[0])
@@ -0,0 +1,190 @@
+# services/outbox_service.py
+"""
+Despachador del outbox de correos.
+
+Los routers dejan los correos en la tabla notificacion_outbox dentro de la misma
+transacción que el cambio de negocio (ver core/email_service.py) y responden sin
+esperar al servidor SMTP. Cada lote se reclama en una transacción corta (EN_PROCESO
+con propietario y concesión), se envía por el pool SMTP sin transacción abierta y su
+resultado se registra en otra sesión; los fallidos se reprograman con espera exponencial.
+
+Dos formas de ejecutarlo:
+  - Servidor persistente (uvicorn): la tarea en segundo plano iniciada con el ciclo de
+    vida de la aplicación (main.py), que se despierta con notify() tras cada commit.
+  - Vercel (serverless): no hay proceso que viva entre requests, así que la tarea no
+    corre; un cron llama a GET /outbox/procesar (ver drain_for), que vacía el outbox
+    durante el request. El retraso de los correos es el del cron. El plan Hobby de
+    Vercel solo admite crons diarios (rechaza "* * * * *" al desplegar), por eso
+    vercel.json trae uno diario como respaldo: en Pro se puede bajar a cada minuto; en
+    Hobby, un programador externo (p. ej. cron-job.org) llama al endpoint cada minuto
+    con la cabecera 'Authorization: Bearer <CRON_SECRET>'.
+"""
+import asyncio
+import os
+import socket
+import time
+import traceback
+import uuid
+from typing import Optional
+
+from core import smtp_pool
+from core.config import settings
+from crud import outbox as outbox_crud
+from db.base import SessionLocal
+from services import comprobante_service
+
+_tarea: Optional[asyncio.Task] = None
+_despertar: Optional[asyncio.Event] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def notify():
+    """Avisa al despachador de que hay correos nuevos (seguro desde cualquier hilo)."""
+    if _loop is not None and _despertar is not None:
+        _loop.call_soon_threadsafe(_despertar.set)
+
+
+async def _adjuntos(correo: dict, comprobantes: dict) -> list:
+    """Adjuntos del correo; el comprobante PDF se genera aquí (una vez por abastecimiento y lote)."""
+    id_abastecimiento = correo["comprobante"]
+    if id_abastecimiento is None:
+        return correo["adjuntos"]
+    if id_abastecimiento not in comprobantes:
+        comprobantes[id_abastecimiento] = await asyncio.to_thread(
+            comprobante_service.renderizar_comprobante, id_abastecimiento)
+    nombre, contenido = comprobantes[id_abastecimiento]
+    return correo["adjuntos"] + [(nombre, contenido, "application/pdf")]
+
+
+async def _enviar_lote(pool: smtp_pool.SMTPConnectionPool, pendientes: list):
+    """Envía los correos del lote sobre una misma conexión. Devuelve (ids enviados, [(id, error)])."""
+    enviados, fallidos = [], []
+    comprobantes = {}
+    try:
+        async with pool.connection() as smtp:
+            for correo in pendientes:
+                try:
+                    adjuntos = await _adjuntos(correo, comprobantes)
+                except Exception as e:
+                    fallidos.append((correo["id_outbox"], f"Error al generar el comprobante: {e}"))
+                    continue
+                mime = smtp_pool.build_email(
+                    correo["direccion_destino"], correo["asunto"], correo["cuerpo_html"], adjuntos=adjuntos
+                )
+                try:
+                    await pool.send(mime, smtp=smtp, timeout=settings.OUTBOX_SEND_TIMEOUT_SECONDS)
+                    enviados.append(correo["id_outbox"])
+                except asyncio.TimeoutError:
+                    smtp.close()  # Estado de la conexión incierto: pool.send reconectará
+                    fallidos.append((correo["id_outbox"], f"Tiempo de espera agotado ({settings.OUTBOX_SEND_TIMEOUT_SECONDS}s)"))
+                except Exception as e:
+                    fallidos.append((correo["id_outbox"], str(e)))
+    except Exception as e:
+        # No se pudo obtener conexión: todo lo que quedó sin intentar se reprograma
+        procesados = set(enviados) | {id_outbox for id_outbox, _ in fallidos}
+        fallidos.extend((c["id_outbox"], f"Sin conexión SMTP: {e}") for c in pendientes if c["id_outbox"] not in procesados)
+    return enviados, fallidos
+
+
+def _en_sesion(funcion, *args):
+    """Ejecuta una función del crud en una sesión propia (cada llamada, en su hilo)."""
+    db = SessionLocal()
+    try:
+        return funcion(db, *args)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def drain_once(limit: Optional[int] = None, pool: Optional[smtp_pool.SMTPConnectionPool] = None) -> int:
+    """Procesa un lote del outbox. Devuelve cuántos correos se intentaron enviar."""
+    pool = pool or smtp_pool.get_pool()
+    if pool is None:
+        print("--- Outbox: pool SMTP no iniciado, no se envía nada ---")
+        return 0
+
+    # Propietario único por lote: si su concesión vence y otro despachador lo toma,
+    # el resultado tardío de este no pisa el del otro
+    propietario = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}"[-64:]
+    # Las consultas son síncronas: se ejecutan fuera del event loop
+    pendientes = await asyncio.to_thread(
+        _en_sesion, outbox_crud.claim_pending, propietario,
+        limit or settings.OUTBOX_BATCH_SIZE, settings.OUTBOX_LEASE_SECONDS
+    )
+    if not pendientes:
+        return 0
+    enviados, fallidos = await _enviar_lote(pool, pendientes)
+    await asyncio.to_thread(
+        _en_sesion, outbox_crud.record_results, propietario, enviados, fallidos,
+        settings.OUTBOX_MAX_ATTEMPTS, settings.OUTBOX_RETRY_BASE_SECONDS
+    )
+    print(f"--- Outbox: {len(enviados)} enviados, {len(fallidos)} fallidos ---")
+    return len(pendientes)
+
+
+async def drain_for(max_segundos: float) -> int:
+    """
+    Vacía el outbox durante como mucho 'max_segundos' (lote a lote) y devuelve los
+    correos procesados. Es el camino de los cron en despliegues sin proceso persistente;
+    si el pool global no está iniciado usa uno temporal para esta llamada.
+    """
+    pool = smtp_pool.get_pool()
+    temporal = pool is None
+    if temporal:
+        pool = smtp_pool.create_pool()
+    limite = time.monotonic() + max_segundos
+    total = 0
+    try:
+        while time.monotonic() < limite:
+            procesados = await drain_once(pool=pool)
+            total += procesados
+            if procesados < settings.OUTBOX_BATCH_SIZE:
+                break
+    finally:
+        if temporal:
+            await pool.close()
+    return total
+
+
+async def _run():
+    while True:
+        try:
+            procesados = await drain_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"!!!!!!!! ERROR en el despachador del outbox: {e} !!!!!!!!")
+            print(traceback.format_exc())
+            procesados = 0
+
+        if procesados >= settings.OUTBOX_BATCH_SIZE:
+            continue  # Lote lleno: probablemente quedan más pendientes
+        try:
+            await asyncio.wait_for(_despertar.wait(), timeout=settings.OUTBOX_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _despertar.clear()
+
+
+async def start_dispatcher():
+    """Inicia la tarea del despachador (requiere el pool SMTP ya iniciado)."""
+    global _tarea, _despertar, _loop
+    if _tarea is None:
+        _loop = asyncio.get_running_loop()
+        _despertar = asyncio.Event()
+        _tarea = asyncio.create_task(_run())
+
+
+async def stop_dispatcher():
+    global _tarea, _despertar, _loop
+    if _tarea is not None:
+        _tarea.cancel()
+        try:
+            await _tarea
+        except asyncio.CancelledError:
+            pass
+    _tarea = None
+    _despertar = None
+    _loop = None
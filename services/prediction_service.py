@@ -1,11 +1,14 @@
 import pandas as pd
-from sklearn.linear_model import LinearRegression
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
-import numpy as np  # Necesario para cálculos IQR si pandas < 1.0
+from typing import Dict, List, NamedTuple, Optional
+import numpy as np
+import threading
 
-from crud import abastecimiento as abastecimiento_crud
+from crud import estado_consumo as estado_consumo_crud
 from crud import prediccion as prediccion_crud
+from core.config import settings
+from services import least_squares, event_hub
 # Asegúrate de importar el modelo correcto
 from db import models
 
@@ -13,92 +16,159 @@ from db import models
 MIN_RECORDS_PREDICTION = 3
 MIN_RECORDS_USAGE = 2
 
+# Backend de la regresión: "numpy" (por defecto, forma cerrada) o "sklearn"
+REGRESSION_BACKENDS = ("numpy", "sklearn")
 
-def calculate_prediction(db: Session, id_sitio: int):
+# Subir cuando cambie la lógica del cálculo para invalidar las predicciones guardadas
+MODEL_VERSION = 4  # v2: guarda consumo diario y nivel estimado; v3: ventana de intervalos; v4: nivel sin tope en cero
+
+# Contadores de la caché de predicciones (por proceso)
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0}
+
+# Columnas mínimas que necesita el cálculo (evita hidratar objetos ORM completos)
+COLUMNAS_HISTORIAL = [
+    "id_sitio", "id_abastecimiento", "fecha",
+    "gls_existentes", "gls_abastecidos", "horometraje"
+]
+
+
+class _Registro(NamedTuple):
+    """Datos de un abastecimiento usados para el cálculo final de la predicción."""
+    id_abastecimiento: int
+    fecha: datetime
+    horometraje: float
+    gls_existentes: float
+    gls_abastecidos: float
+
+
+def get_model_fingerprint() -> str:
+    """Identifica la versión y parámetros del modelo; forma parte de la clave de la caché."""
+    return (f"v{MODEL_VERSION}:{settings.PREDICTION_REGRESSION_BACKEND}:"
+            f"{MIN_RECORDS_PREDICTION}:{MIN_RECORDS_USAGE}:{settings.PREDICTION_INTERVAL_WINDOW}")
+
+
+def _count_cache(hits: int = 0, misses: int = 0):
+    with _cache_lock:
+        _cache_stats["hits"] += hits
+        _cache_stats["misses"] += misses
+
+
+def get_cache_stats() -> dict:
+    """Aciertos/fallos de la caché de predicciones desde que arrancó el proceso."""
+    with _cache_lock:
+        hits, misses = _cache_stats["hits"], _cache_stats["misses"]
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_ratio": round(hits / total, 4) if total else 0.0}
+
+
+def _get_backend() -> str:
+    backend = settings.PREDICTION_REGRESSION_BACKEND
+    if backend not in REGRESSION_BACKENDS:
+        raise ValueError(f"Backend de regresión no soportado: {backend}. Use uno de {REGRESSION_BACKENDS}.")
+    return backend
+
+
+def _fit_slope(x, y) -> float:
+    """Pendiente Gls/Hr según el backend configurado en PREDICTION_REGRESSION_BACKEND."""
+    if _get_backend() == "sklearn":
+        return least_squares.fit_slope_sklearn(x, y)
+    return least_squares.fit_line(x, y).slope
+
+
+def _fit_slopes_por_sitio(datos: pd.DataFrame) -> pd.Series:
     """
-    Calcula la fecha del próximo abastecimiento con lógica mejorada y
-    guarda o actualiza el resultado en la base de datos.
+    Pendiente Gls/Hr de cada sitio de 'datos' (columnas id_sitio, horometraje_diff,
+    gls_consumidos) con el mismo backend que _fit_slope. Con "numpy" se calcula para
+    todos los sitios a la vez (misma fórmula que least_squares.fit_line); con "sklearn"
+    se ajusta un LinearRegression por sitio.
     """
-    # 1. Obtener Historial (ordenado por fecha ASCENDENTE para cálculos diff)
-    history = db.query(models.Abastecimiento) \
-        .filter(models.Abastecimiento.id_sitio == id_sitio) \
-        .order_by(models.Abastecimiento.fecha.asc()) \
-        .all()
+    grupos = datos.groupby('id_sitio', sort=False)
+    if _get_backend() == "sklearn":
+        return pd.Series({
+            id_sitio: least_squares.fit_slope_sklearn(grupo['horometraje_diff'], grupo['gls_consumidos'])
+            for id_sitio, grupo in grupos
+        }, dtype=float)
 
-    if len(history) < MIN_RECORDS_PREDICTION:
-        return {
-            "error": f"Se necesitan al menos {MIN_RECORDS_PREDICTION} registros históricos para una predicción fiable."}
+    # Mínimos cuadrados sobre datos centrados, por sitio
+    x_c = datos['horometraje_diff'] - grupos['horometraje_diff'].transform('mean')
+    y_c = datos['gls_consumidos'] - grupos['gls_consumidos'].transform('mean')
+    sumas = pd.DataFrame({'id_sitio': datos['id_sitio'], 'sxy': x_c * y_c, 'sxx': x_c * x_c}) \
+        .groupby('id_sitio', sort=False).sum()
+    return sumas['sxy'] / sumas['sxx'].where(sumas['sxx'] > 0)
 
-    # 2. Preparar DataFrame
-    df = pd.DataFrame([h.__dict__ for h in history])
-    # Convertir 'fecha' a datetime si no lo está
-    df['fecha'] = pd.to_datetime(df['fecha'])
-    df = df.sort_values(by='fecha').reset_index(drop=True)
 
-    # --- 3. CORRECCIÓN: Calcular Consumo por Intervalo ---
-    df['horometraje_diff'] = df['horometraje'].diff()
-    # Nivel de combustible *después* de cada abastecimiento
-    df['nivel_combustible_post'] = df['gls_existentes'] + df['gls_abastecidos']
-    # Consumo = Nivel post abastecimiento anterior - Nivel pre abastecimiento actual
-    df['gls_consumidos'] = df['nivel_combustible_post'].shift(1) - df['gls_existentes']
+def proyectar_nivel(consumo_diario_gls: Optional[float], fecha_proximo_abastecimiento: datetime,
+                    ahora: datetime) -> Optional[float]:
+    """
+    Galones estimados en el tanque en 'ahora': lo que falta consumir hasta la fecha
+    estimada de agotamiento al ritmo diario del sitio. Negativo si ya se agotó (lo que
+    se habría consumido desde entonces): así los sitios agotados no empatan en cero.
+    """
+    if consumo_diario_gls is None:
+        return None
+    dias_hasta_agotar = (fecha_proximo_abastecimiento - ahora).total_seconds() / (60 * 60 * 24)
+    return round(consumo_diario_gls * dias_hasta_agotar, 2)
 
-    # 4. Limpiar Datos
-    df_cleaned = df.dropna(subset=['horometraje_diff', 'gls_consumidos'])
-    # Solo intervalos con aumento de horometraje y consumo positivo
-    df_cleaned = df_cleaned[(df_cleaned['horometraje_diff'] > 0) & (df_cleaned['gls_consumidos'] > 0)]
 
-    if df_cleaned.empty or len(df_cleaned) < 2:  # Necesitamos al menos 2 intervalos para regresión/media
-        return {"error": "No se pudieron calcular suficientes intervalos de consumo válidos."}
+def estimar_nivel(consumo_diario_gls: Optional[float], fecha_proximo_abastecimiento: datetime,
+                  ahora: datetime) -> Optional[float]:
+    """Nivel para mostrar: como proyectar_nivel, pero nunca negativo."""
+    nivel = proyectar_nivel(consumo_diario_gls, fecha_proximo_abastecimiento, ahora)
+    return None if nivel is None else max(0.0, nivel)
 
-    # 5. Calcular Tasa de Consumo por Intervalo
-    df_cleaned['tasa_periodo'] = df_cleaned['gls_consumidos'] / df_cleaned['horometraje_diff']
 
-    # 6. Filtrar Outliers (IQR)
-    Q1 = df_cleaned['tasa_periodo'].quantile(0.25)
-    Q3 = df_cleaned['tasa_periodo'].quantile(0.75)
-    IQR = Q3 - Q1
-    limite_inferior = Q1 - 1.5 * IQR
-    limite_superior = Q3 + 1.5 * IQR
-    df_sin_outliers = df_cleaned[
-        (df_cleaned['tasa_periodo'] >= limite_inferior) & (df_cleaned['tasa_periodo'] <= limite_superior)]
+def refrescar_niveles(db: Session, ahora: datetime, limite: Optional[int] = None) -> int:
+    """
+    Vuelve a proyectar a 'ahora' el nivel guardado de las predicciones cuyo nivel tiene
+    más de PREDICTION_NIVEL_MAX_AGE_MINUTES, como mucho 'limite' por llamada (las más
+    antiguas primero), para que el ORDER BY indexado de get_sitios_menor_nivel siga al
+    día sin reescribir todas las filas. Devuelve cuántas actualizó. No hace commit.
+    """
+    limite = limite or settings.PREDICTION_NIVEL_REFRESH_BATCH
+    antes_de = ahora - timedelta(minutes=settings.PREDICTION_NIVEL_MAX_AGE_MINUTES)
+    niveles = [
+        {"id_prediccion": id_prediccion, "nivel_estimado_en": ahora,
+         "nivel_estimado_gls": proyectar_nivel(consumo_diario_gls, fecha_proximo_abastecimiento, ahora)}
+        for id_prediccion, consumo_diario_gls, fecha_proximo_abastecimiento
+        in prediccion_crud.get_niveles_desactualizados(db, antes_de, limite)
+    ]
+    prediccion_crud.bulk_update_niveles(db, niveles)
+    return len(niveles)
 
-    if len(df_sin_outliers) < 1:  # Necesitamos al menos 1 tasa válida
-        return {"error": "Después de filtrar datos atípicos, no quedan tasas de consumo válidas."}
-    elif len(df_sin_outliers) < 2:  # Si solo queda 1, usamos su tasa directamente
-        tasa_consumo_gls_por_hora = df_sin_outliers['tasa_periodo'].iloc[0]
-    else:
-        # 7. Regresión Lineal (si hay suficientes datos)
-        if df_sin_outliers['horometraje_diff'].nunique() < 2:
-            # Si todas las diferencias de horometraje son iguales, usar la media
-            tasa_consumo_gls_por_hora = df_sin_outliers['tasa_periodo'].mean()
-        else:
-            X = df_sin_outliers[['horometraje_diff']]
-            y = df_sin_outliers['gls_consumidos']
-            model = LinearRegression()
-            model.fit(X, y)
-            tasa_consumo_gls_por_hora = model.coef_[0]
 
+def _build_prediction_data(
+    id_sitio: int,
+    tasa_consumo_gls_por_hora: float,
+    n_registros: int,
+    primer_registro,
+    ultimo_registro,
+    debug: bool = True
+) -> dict:
+    """
+    A partir de la tasa de consumo ya estimada calcula la fecha del próximo
+    abastecimiento. Devuelve el dict listo para guardar o un dict de error.
+    Compartido por el cálculo individual y el cálculo por lotes.
+    """
     if tasa_consumo_gls_por_hora <= 0:
         return {"error": f"Tasa de consumo no válida calculada: {tasa_consumo_gls_por_hora:.2f} Gls/Hr"}
 
-    print(f"-> Tasa de consumo estimada para sitio {id_sitio}: {tasa_consumo_gls_por_hora:.2f} Gls/Hr")  # DEBUG
+    if debug:
+        print(f"-> Tasa de consumo estimada para sitio {id_sitio}: {tasa_consumo_gls_por_hora:.2f} Gls/Hr")  # DEBUG
 
     # --- 8. CORRECCIÓN: Combustible Actual ---
     # Es el nivel *después* del último abastecimiento registrado
-    ultimo_abastecimiento = history[-1]  # El último en la lista ordenada por fecha
-    galones_actuales = ultimo_abastecimiento.gls_existentes + ultimo_abastecimiento.gls_abastecidos
+    galones_actuales = ultimo_registro.gls_existentes + ultimo_registro.gls_abastecidos
 
     if galones_actuales <= 0:
         return {"error": "El último registro indica 0 galones después del abastecimiento."}
 
     horas_restantes = galones_actuales / tasa_consumo_gls_por_hora
-    print(f"-> Galones actuales: {galones_actuales:.2f}, Horas restantes estimadas: {horas_restantes:.2f}")  # DEBUG
+    if debug:
+        print(f"-> Galones actuales: {galones_actuales:.2f}, Horas restantes estimadas: {horas_restantes:.2f}")  # DEBUG
 
     # --- 9. REEMPLAZO: Calcular Uso Diario Dinámico ---
-    if len(history) >= MIN_RECORDS_USAGE:
-        primer_registro = history[0]
-        ultimo_registro = history[-1]
-
+    if n_registros >= MIN_RECORDS_USAGE:
         # Asegurarse que las fechas son objetos datetime
         fecha_primera = primer_registro.fecha
         fecha_ultima = ultimo_registro.fecha
@@ -111,17 +181,20 @@ def calculate_prediction(db: Session, id_sitio: int):
         if dias_totales < 1 or horometraje_diff_total <= 0:  # Evitar división por cero o uso no positivo
             # Si no hay suficientes días o uso, usar un valor por defecto o devolver error
             # Podríamos intentar con un periodo más corto si hay suficientes datos
-            print(
-                f"-> No se pudo calcular uso diario fiable (Días: {dias_totales:.1f}, Horas usadas: {horometraje_diff_total:.1f}). Usando valor por defecto.")  # DEBUG
+            if debug:
+                print(
+                    f"-> No se pudo calcular uso diario fiable (Días: {dias_totales:.1f}, Horas usadas: {horometraje_diff_total:.1f}). Usando valor por defecto.")  # DEBUG
             uso_diario_horas = 8  # Valor por defecto si falla el cálculo
         else:
             uso_diario_horas = horometraje_diff_total / dias_totales
             # Limitar a un máximo razonable para evitar valores extremos si hay pocos días
             uso_diario_horas = min(uso_diario_horas, 24)
-            print(f"-> Uso diario calculado: {uso_diario_horas:.2f} Hrs/Día")  # DEBUG
+            if debug:
+                print(f"-> Uso diario calculado: {uso_diario_horas:.2f} Hrs/Día")  # DEBUG
     else:
-        print(
-            f"-> No hay suficientes registros ({len(history)}) para calcular uso diario. Usando valor por defecto.")  # DEBUG
+        if debug:
+            print(
+                f"-> No hay suficientes registros ({n_registros}) para calcular uso diario. Usando valor por defecto.")  # DEBUG
         uso_diario_horas = 8  # Valor por defecto si no hay suficientes datos
 
     # Asegurar que uso_diario_horas no sea cero para evitar división infinita
@@ -129,22 +202,250 @@ def calculate_prediction(db: Session, id_sitio: int):
         uso_diario_horas = 0.1  # Un valor muy pequeño para evitar error, implica bajo uso
 
     dias_restantes = horas_restantes / uso_diario_horas
-    print(f"-> Días restantes estimados: {dias_restantes:.2f}")  # DEBUG
+    if debug:
+        print(f"-> Días restantes estimados: {dias_restantes:.2f}")  # DEBUG
 
     # 10. Cálculo de Fechas y Horometraje Final (sin cambios)
-    horometro_actual = ultimo_abastecimiento.horometraje
+    horometro_actual = ultimo_registro.horometraje
     horometro_estimado_fin = horometro_actual + horas_restantes
-    fecha_ultimo_abastecimiento = ultimo_abastecimiento.fecha
-    fecha_proximo_abastecimiento = fecha_ultimo_abastecimiento + timedelta(days=dias_restantes)
+    fecha_proximo_abastecimiento = ultimo_registro.fecha + timedelta(days=float(dias_restantes))
+
+    # 11. Nivel estimado hoy (se guarda indexado para el dashboard)
+    consumo_diario_gls = float(tasa_consumo_gls_por_hora * uso_diario_horas)
+    ahora = datetime.now()
 
-    # 11. Guardar/Actualizar Predicción
-    data_para_guardar = {
+    return {
         "id_sitio": id_sitio,
         "fecha_proximo_abastecimiento": fecha_proximo_abastecimiento,
-        "id_ultimo_abastecimiento_usado": ultimo_abastecimiento.id_abastecimiento,
-        "horometro_estimado_fin": round(horometro_estimado_fin, 2)
+        "id_ultimo_abastecimiento_usado": int(ultimo_registro.id_abastecimiento),
+        "horometro_estimado_fin": round(float(horometro_estimado_fin), 2),
+        "consumo_diario_gls": round(consumo_diario_gls, 4),
+        "nivel_estimado_gls": proyectar_nivel(consumo_diario_gls, fecha_proximo_abastecimiento, ahora),
+        "nivel_estimado_en": ahora,
+        "huella_modelo": get_model_fingerprint()
     }
+
+
+def _tasa_desde_intervalos(intervalos) -> float | dict:
+    """
+    Estima la tasa de consumo (Gls/Hr) a partir de los últimos intervalos válidos
+    [horometraje_diff, gls_consumidos] del sitio (la ventana de estado_consumo_sitio):
+    filtro IQR y regresión.
+    Devuelve la tasa o un dict de error.
+    """
+    if not intervalos or len(intervalos) < 2:  # Necesitamos al menos 2 intervalos para regresión/media
+        return {"error": "No se pudieron calcular suficientes intervalos de consumo válidos."}
+
+    datos = np.asarray(intervalos, dtype=float)
+    horometraje_diff = datos[:, 0]
+    gls_consumidos = datos[:, 1]
+    tasa_periodo = gls_consumidos / horometraje_diff
+
+    # Filtrar Outliers (IQR), misma interpolación lineal que pandas.quantile
+    Q1, Q3 = np.quantile(tasa_periodo, [0.25, 0.75])
+    IQR = Q3 - Q1
+    dentro = (tasa_periodo >= Q1 - 1.5 * IQR) & (tasa_periodo <= Q3 + 1.5 * IQR)
+
+    if dentro.sum() < 1:  # Necesitamos al menos 1 tasa válida
+        return {"error": "Después de filtrar datos atípicos, no quedan tasas de consumo válidas."}
+    if dentro.sum() < 2:  # Si solo queda 1, usamos su tasa directamente
+        return float(tasa_periodo[dentro][0])
+    if np.unique(horometraje_diff[dentro]).size < 2:
+        # Si todas las diferencias de horometraje son iguales, usar la media
+        return float(tasa_periodo[dentro].mean())
+    # Regresión Lineal
+    return _fit_slope(horometraje_diff[dentro], gls_consumidos[dentro])
+
+
+def _datos_evento(prediccion) -> dict:
+    """Resumen de la predicción (objeto o dict) para los eventos en vivo."""
+    leer = prediccion.get if isinstance(prediccion, dict) else lambda campo: getattr(prediccion, campo)
+    fecha = leer("fecha_proximo_abastecimiento")
+    return {
+        "fecha_proximo_abastecimiento": fecha.strftime('%d/%m/%Y') if isinstance(fecha, datetime) else None,
+        "nivel_estimado_gls": leer("nivel_estimado_gls"),
+    }
+
+
+def calculate_prediction(db: Session, id_sitio: int):
+    """
+    Calcula la fecha del próximo abastecimiento con lógica mejorada y
+    guarda o actualiza el resultado en la base de datos.
+    Usa el estado acumulado del sitio (estado_consumo_sitio) en lugar de releer el historial.
+    """
+    # 1. Estado acumulado del sitio (solo abastecimientos ACTIVOS)
+    estado = estado_consumo_crud.get_estado(db, id_sitio)
+
+    # Caché: si el último abastecimiento y el modelo no cambiaron, la predicción guardada sigue vigente
+    vigentes = prediccion_crud.get_predicciones_vigentes(db, [id_sitio], get_model_fingerprint())
+    if vigentes:
+        _count_cache(hits=1)
+        return vigentes[0]
+    _count_cache(misses=1)
+
+    if estado.n_registros < MIN_RECORDS_PREDICTION:
+        return {
+            "error": f"Se necesitan al menos {MIN_RECORDS_PREDICTION} registros históricos para una predicción fiable."}
+
+    # 2-7. Tasa de consumo a partir de los intervalos válidos
+    tasa_consumo_gls_por_hora = _tasa_desde_intervalos(estado.intervalos)
+    if isinstance(tasa_consumo_gls_por_hora, dict):
+        return tasa_consumo_gls_por_hora
+
+    # 8-10. Combustible actual, uso diario y fechas
+    primer_registro = _Registro(None, estado.primera_fecha, estado.primer_horometraje, 0.0, 0.0)
+    ultimo_registro = _Registro(estado.id_ultimo_abastecimiento, estado.ultima_fecha, estado.ultimo_horometraje,
+                                estado.ultimo_gls_existentes, estado.ultimo_gls_abastecidos)
+    data_para_guardar = _build_prediction_data(
+        id_sitio, tasa_consumo_gls_por_hora, estado.n_registros,
+        primer_registro=primer_registro, ultimo_registro=ultimo_registro
+    )
+    if "error" in data_para_guardar:
+        return data_para_guardar
+
+    # 11. Guardar/Actualizar Predicción (create_or_update_prediccion confirma y publica el evento)
+    event_hub.publicar_al_confirmar(db, "prediccion_actualizada", id_sitio, _datos_evento(data_para_guardar))
     db_prediction_object = prediccion_crud.create_or_update_prediccion(db, prediccion_data=data_para_guardar)
 
     # 12. Devolver Resultado
-    return db_prediction_object
\ No newline at end of file
+    return db_prediction_object
+
+
+# --- CÁLCULO POR LOTES (toda la flota en una sola pasada) ---
+
+def _registros_por_sitio(frame: pd.DataFrame) -> Dict[int, _Registro]:
+    """Convierte una fila por sitio del DataFrame en _Registro con tipos nativos de Python."""
+    fechas = pd.to_datetime(frame['fecha']).dt.to_pydatetime()
+    return {
+        int(id_sitio): _Registro(int(id_ab), fecha, float(horo), float(gls_ex), float(gls_ab))
+        for id_sitio, id_ab, fecha, horo, gls_ex, gls_ab in zip(
+            frame['id_sitio'], frame['id_abastecimiento'], fechas,
+            frame['horometraje'], frame['gls_existentes'], frame['gls_abastecidos']
+        )
+    }
+
+
+def _compute_predictions_frame(df: pd.DataFrame) -> Dict[int, dict]:
+    """
+    Versión vectorizada de calculate_prediction: recibe el historial ACTIVO de
+    varios sitios (columnas COLUMNAS_HISTORIAL) y aplica diff, filtro IQR y
+    ajuste de la pendiente para todos los sitios a la vez con groupby, sobre los
+    mismos últimos PREDICTION_INTERVAL_WINDOW intervalos válidos que el cálculo individual.
+    Devuelve {id_sitio: dict_para_guardar | {"error": ...}}.
+    """
+    df = df.sort_values(by=['id_sitio', 'fecha'], kind='mergesort').reset_index(drop=True)
+    df['fecha'] = pd.to_datetime(df['fecha'])
+    por_sitio = df.groupby('id_sitio', sort=False)
+
+    # Consumo por intervalo (mismo cálculo que el individual, pero por grupo)
+    df['horometraje_diff'] = por_sitio['horometraje'].diff()
+    df['nivel_combustible_post'] = df['gls_existentes'] + df['gls_abastecidos']
+    df['gls_consumidos'] = df.groupby('id_sitio', sort=False)['nivel_combustible_post'].shift(1) - df['gls_existentes']
+
+    n_registros = por_sitio.size()
+    primeros = _registros_por_sitio(df.drop_duplicates(subset='id_sitio', keep='first'))
+    ultimos = _registros_por_sitio(df.drop_duplicates(subset='id_sitio', keep='last'))
+
+    # Intervalos válidos (las comparaciones con NaN son False, equivale al dropna)
+    validos = df[(df['horometraje_diff'] > 0) & (df['gls_consumidos'] > 0)]
+    validos = validos.groupby('id_sitio', sort=False).tail(settings.PREDICTION_INTERVAL_WINDOW).copy()
+    n_validos = validos.groupby('id_sitio', sort=False).size()
+    validos = validos[validos['id_sitio'].map(n_validos) >= 2]
+    validos['tasa_periodo'] = validos['gls_consumidos'] / validos['horometraje_diff']
+
+    # Filtro IQR por sitio
+    por_sitio_validos = validos.groupby('id_sitio', sort=False)['tasa_periodo']
+    q1 = por_sitio_validos.quantile(0.25)
+    q3 = por_sitio_validos.quantile(0.75)
+    iqr = q3 - q1
+    limite_inferior = validos['id_sitio'].map(q1 - 1.5 * iqr)
+    limite_superior = validos['id_sitio'].map(q3 + 1.5 * iqr)
+    sin_outliers = validos[
+        (validos['tasa_periodo'] >= limite_inferior) & (validos['tasa_periodo'] <= limite_superior)].copy()
+
+    # Regresión solo para los sitios con al menos 2 intervalos y 2 valores de x distintos
+    grupos = sin_outliers.groupby('id_sitio', sort=False)
+    n_sin_outliers = grupos.size()
+    valores_x_distintos = grupos['horometraje_diff'].nunique()
+    con_regresion = valores_x_distintos[(valores_x_distintos >= 2) & (n_sin_outliers >= 2)].index
+    pendiente = _fit_slopes_por_sitio(sin_outliers[sin_outliers['id_sitio'].isin(con_regresion)])
+
+    # Igual que _tasa_desde_intervalos: un solo intervalo -> su tasa; x sin variación -> la media
+    tasas = grupos['tasa_periodo'].mean()
+    tasas = tasas.where(n_sin_outliers >= 2, grupos['tasa_periodo'].first())
+    tasas.loc[pendiente.index] = pendiente
+
+    resultados: Dict[int, dict] = {}
+    for id_sitio, n in n_registros.items():
+        id_sitio = int(id_sitio)
+        if n < MIN_RECORDS_PREDICTION:
+            resultados[id_sitio] = {
+                "error": f"Se necesitan al menos {MIN_RECORDS_PREDICTION} registros históricos para una predicción fiable."}
+        elif n_validos.get(id_sitio, 0) < 2:
+            resultados[id_sitio] = {"error": "No se pudieron calcular suficientes intervalos de consumo válidos."}
+        elif id_sitio not in tasas.index:
+            resultados[id_sitio] = {"error": "Después de filtrar datos atípicos, no quedan tasas de consumo válidas."}
+        else:
+            resultados[id_sitio] = _build_prediction_data(
+                id_sitio, float(tasas[id_sitio]), int(n),
+                primer_registro=primeros[id_sitio], ultimo_registro=ultimos[id_sitio], debug=False
+            )
+    return resultados
+
+
+def compute_predictions_batch(db: Session, sitio_ids: Optional[List[int]] = None) -> Dict[int, dict]:
+    """
+    Calcula (sin guardar) las predicciones de varios sitios con una sola consulta
+    columnar del historial ACTIVO. Si sitio_ids es None, procesa todos los sitios.
+    """
+    query = db.query(*[getattr(models.Abastecimiento, c) for c in COLUMNAS_HISTORIAL]).filter(
+        models.Abastecimiento.status == 'ACTIVO'
+    )
+    if sitio_ids is not None:
+        if not sitio_ids:
+            return {}
+        query = query.filter(models.Abastecimiento.id_sitio.in_(sitio_ids))
+
+    filas = query.order_by(
+        models.Abastecimiento.id_sitio, models.Abastecimiento.fecha, models.Abastecimiento.id_abastecimiento
+    ).all()
+    df = pd.DataFrame.from_records(filas, columns=COLUMNAS_HISTORIAL)
+    resultados = _compute_predictions_frame(df) if not df.empty else {}
+
+    # Sitios solicitados sin ningún registro activo
+    for id_sitio in (sitio_ids or []):
+        resultados.setdefault(id_sitio, {
+            "error": f"Se necesitan al menos {MIN_RECORDS_PREDICTION} registros históricos para una predicción fiable."})
+    return resultados
+
+
+def calculate_predictions_batch(db: Session, sitio_ids: Optional[List[int]] = None) -> dict:
+    """
+    Igual que calculate_prediction pero para varios sitios: devuelve
+    {id_sitio: PrediccionAbastecimiento | {"error": ...}}. Las predicciones aún vigentes
+    se devuelven sin recalcular; las nuevas se guardan con un solo upsert.
+    No hace commit: el llamador confirma una vez por bloque.
+    """
+    resultados = {}
+    if sitio_ids is not None:
+        # La vigencia se compara con estado_consumo_sitio: se crea para los sitios que no lo tienen
+        estado_consumo_crud.create_faltantes(db, sitio_ids)
+        # Reutilizar las predicciones vigentes y calcular solo las demás (su nivel
+        # estimado lo mantiene refrescar_niveles, no se reescribe en cada consulta)
+        for pred in prediccion_crud.get_predicciones_vigentes(db, sitio_ids, get_model_fingerprint()):
+            resultados[pred.id_sitio] = pred
+        _count_cache(hits=len(resultados), misses=len(sitio_ids) - len(resultados))
+        sitio_ids = [id_sitio for id_sitio in sitio_ids if id_sitio not in resultados]
+        if not sitio_ids:
+            return resultados
+
+    a_guardar = []
+    for id_sitio, data in compute_predictions_batch(db, sitio_ids=sitio_ids).items():
+        if "error" in data:
+            resultados[id_sitio] = data
+        else:
+            a_guardar.append(data)
+    for pred in prediccion_crud.bulk_upsert_predicciones(db, a_guardar):
+        resultados[pred.id_sitio] = pred
+        event_hub.publicar_al_confirmar(db, "prediccion_actualizada", pred.id_sitio, _datos_evento(pred))
+    return resultados
@@ -0,0 +1,52 @@
+# services/rebuild_service.py
+"""
+Reconstrucción de tablas derivadas (backfills y recuperación tras ediciones inconsistentes).
+
+Uso:
+    python -m services.rebuild_service estado-consumo
+    python -m services.rebuild_service consumo-diario
+"""
+import argparse
+
+from db.base import SessionLocal
+from services import dashboard_cache
+from crud import estado_consumo as estado_consumo_crud
+from crud import consumo_diario as consumo_diario_crud
+
+
+def rebuild_estado_consumo() -> int:
+    """Recalcula estado_consumo_sitio para todos los sitios."""
+    db = SessionLocal()
+    try:
+        return estado_consumo_crud.rebuild_all(db)
+    finally:
+        db.close()
+
+
+def rebuild_consumo_diario() -> int:
+    """Recalcula consumo_diario (totales por día y sitio) desde el historial."""
+    db = SessionLocal()
+    try:
+        return consumo_diario_crud.rebuild_all(db)
+    finally:
+        db.close()
+
+
+COMANDOS = {
+    "estado-consumo": rebuild_estado_consumo,
+    "consumo-diario": rebuild_consumo_diario,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruye tablas derivadas a partir del historial.")
+    parser.add_argument("tabla", choices=sorted(COMANDOS.keys()))
+    args = parser.parse_args()
+    # Con la caché del dashboard en Redis, la reconstrucción la invalida para todos los workers
+    dashboard_cache.registrar_invalidacion(SessionLocal)
+    procesados = COMANDOS[args.tabla]()
+    print(f"--- Reconstrucción '{args.tabla}' completada: {procesados} registros ---")
+
+
+if __name__ == "__main__":
+    main()
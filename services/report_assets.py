@@ -0,0 +1,55 @@
+# services/report_assets.py
+"""
+Recursos de los reportes (logo e imágenes) cargados una sola vez por proceso.
+
+Antes cada página del PDF descargaba el logo desde storage.googleapis.com; ahora se
+lee de static/ (o de settings.REPORT_LOGO_PATH), se reduce al tamaño con el que se
+dibuja y se guarda en memoria ya codificado para fpdf.
+"""
+import os
+from functools import lru_cache
+from io import BytesIO
+from typing import Optional
+
+from core.config import settings
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+LOGO_PATH = os.path.join(STATIC_DIR, "img", "logo.png")
+
+# El logo se dibuja a 33 mm de ancho: 400 px equivalen a ~300 dpi, suficiente para imprimir
+LOGO_MAX_WIDTH_PX = 400
+
+
+@lru_cache(maxsize=32)
+def get_image(path: str, max_width_px: Optional[int] = None) -> Optional[bytes]:
+    """
+    Devuelve la imagen como PNG en memoria (reducida a max_width_px si es más ancha),
+    o None si no existe o no se puede leer. El resultado se guarda para todo el proceso.
+    """
+    try:
+        with open(path, "rb") as f:
+            contenido = f.read()
+    except OSError as e:
+        print(f"Advertencia: No se pudo leer la imagen '{path}'. {e}")
+        return None
+
+    if max_width_px is None:
+        return contenido
+    try:
+        from PIL import Image
+        with Image.open(BytesIO(contenido)) as img:
+            if img.width <= max_width_px:
+                return contenido
+            alto = max(1, round(img.height * max_width_px / img.width))
+            reducida = img.resize((max_width_px, alto), Image.LANCZOS)
+            buffer = BytesIO()
+            reducida.save(buffer, format="PNG", optimize=True)
+            return buffer.getvalue()
+    except Exception as e:
+        print(f"Advertencia: No se pudo reducir la imagen '{path}', se usa la original. {e}")
+        return contenido
+
+
+def get_logo() -> Optional[bytes]:
+    """Logo de los reportes (settings.REPORT_LOGO_PATH o static/img/logo.png)."""
+    return get_image(settings.REPORT_LOGO_PATH or LOGO_PATH, LOGO_MAX_WIDTH_PX)
@@ -0,0 +1,101 @@
+# services/report_cache.py
+"""
+Caché en disco de reportes del historial ya generados.
+
+La clave se deriva del contenido que determina el reporte: formato, alcance del
+usuario, filtros y la marca de agua del historial (crud.abastecimiento.get_historial_watermark).
+Un alta, edición o cancelación dentro del alcance cambia la marca de agua y por lo
+tanto la clave: la entrada anterior deja de usarse y la expulsa el LRU.
+"""
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Callable, Optional
+
+from core.config import settings
+
+
+class ReportCache:
+    def __init__(self, directorio: str, max_bytes: int):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        os.makedirs(self.directorio, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def clave(**partes) -> str:
+        """Hash estable (sha256) de las partes de la clave; también sirve como ETag."""
+        return hashlib.sha256(json.dumps(partes, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _ruta(self, clave: str, extension: str) -> str:
+        return os.path.join(self.directorio, f"{clave}.{extension}")
+
+    def get(self, clave: str, extension: str) -> Optional[str]:
+        """Ruta del reporte si está en caché (y lo marca como usado recientemente)."""
+        ruta = self._ruta(clave, extension)
+        try:
+            os.utime(ruta)  # La fecha de modificación hace de "último uso" para el LRU
+        except OSError:
+            return None
+        return ruta
+
+    def put(self, clave: str, extension: str, escribir: Callable[[str], None]) -> str:
+        """
+        Genera la entrada llamando a escribir(ruta_temporal) y la publica con un
+        renombrado atómico. Devuelve la ruta final.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.directorio, suffix=".tmp")
+        os.close(fd)
+        try:
+            escribir(tmp)
+            ruta = self._ruta(clave, extension)
+            os.replace(tmp, ruta)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._evict(conservar=ruta)
+        return ruta
+
+    def _evict(self, conservar: Optional[str] = None):
+        """Elimina las entradas usadas hace más tiempo hasta quedar bajo max_bytes."""
+        with self._lock:
+            entradas = []
+            total = 0
+            for ruta in glob.glob(os.path.join(self.directorio, "*.*")):
+                if ruta.endswith(".tmp"):
+                    continue
+                try:
+                    info = os.stat(ruta)
+                except OSError:
+                    continue
+                entradas.append((info.st_mtime, info.st_size, ruta))
+                total += info.st_size
+            if total <= self.max_bytes:
+                return
+            for _, tamano, ruta in sorted(entradas):
+                if total <= self.max_bytes:
+                    break
+                if ruta == conservar:
+                    continue
+                try:
+                    os.remove(ruta)
+                    total -= tamano
+                except OSError:
+                    pass
+
+
+_cache: Optional[ReportCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ReportCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            directorio = settings.REPORT_CACHE_DIR or os.path.join(tempfile.gettempdir(), "abastecimientos_reportes")
+            _cache = ReportCache(directorio, settings.REPORT_CACHE_MAX_BYTES)
+        return _cache
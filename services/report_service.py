@@ -1,11 +1,26 @@
 # services/report_service.py
 from fpdf import FPDF
+from fpdf.image_datastructures import ImageCache
+from fpdf.image_parsing import preload_image
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+import copy
+import csv
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
+from itertools import chain, islice
+from tempfile import SpooledTemporaryFile
 from db import models
-from typing import List
+from typing import Iterable, Iterator, List, Optional
 from datetime import datetime
+from core.config import settings
+from services import report_assets
 
 # --- Constantes y _format_row (sin cambios) ---
 HEADERS = [
@@ -13,9 +28,13 @@ HEADERS = [
     "Gls. Abast.", "Horometraje", "Estado", "Alarmas"
 ]
 
-def _format_row(ab: models.Abastecimiento) -> list:
+def _format_row(ab) -> list:
+    """Acepta un Abastecimiento o una fila liviana de crud.abastecimiento.stream_historial_rows."""
     fecha_str = ab.fecha.strftime('%d/%m/%y %H:%M') if isinstance(ab.fecha, datetime) else str(ab.fecha)
-    sitio_nombre = ab.sitio.nombre if ab.sitio else "N/A"
+    if hasattr(ab, "sitio_nombre"):
+        sitio_nombre = ab.sitio_nombre or "N/A"
+    else:
+        sitio_nombre = ab.sitio.nombre if ab.sitio else "N/A"
     estado = str(ab.status.value) if hasattr(ab.status, 'value') else str(ab.status)
     alarmas_list = []
     if ab.alarma_transferencia: alarmas_list.append("Transferencia")
@@ -26,159 +45,730 @@ def _format_row(ab: models.Abastecimiento) -> list:
         f"{ab.gls_abastecidos:.2f}", f"{ab.horometraje:.2f}", estado, alarmas_str
     ]
 
+def format_rows(registros: Iterable) -> Iterator[list]:
+    """Formatea los registros uno a uno, a medida que se consumen."""
+    return (_format_row(ab) for ab in registros)
+
 # --- Generador de PDF (CORREGIDO - Anchos Variables + Centrado) ---
 class PDFWithHeader(FPDF):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pagina_inicial = 1
+        self.total_paginas = None  # None: total con el alias {nb} de fpdf
+        self.generado_en = datetime.now().strftime('%d/%m/%Y %H:%M')
+        self.titulo = "Historial de Abastecimientos"
+
     def header(self):
-        # Logo
+        # Logo (en memoria, ver services/report_assets.py: sin descargas por página)
+        logo = report_assets.get_logo()
         try:
-             self.image("https://storage.googleapis.com/umg2025/logo.png", x=10, y=8, w=33)
+            if logo is None:
+                raise FileNotFoundError("logo no disponible")
+            self.image(BytesIO(logo), x=10, y=8, w=33)
         except Exception as e:
-            print(f"Advertencia: No se pudo cargar el logo. {e}")
+            if self.page_no() == 1:
+                print(f"Advertencia: No se pudo cargar el logo. {e}")
             self.set_xy(10, 8)
             self.set_font('Arial', 'B', 10)
             self.cell(33, 10, 'Tigo', 0, 0, 'L')
         # Título
         self.set_xy(0, 15)
         self.set_font('Arial', 'B', 16)
-        self.cell(0, 10, "Historial de Abastecimientos", 0, 1, 'C')
+        self.cell(0, 10, self.titulo, 0, 1, 'C')
         self.ln(10)
 
     def footer(self):
         # Pie de página
         self.set_y(-15)
         self.set_font('Arial', 'I', 8)
-        self.cell(0, 10, f'Página {self.page_no()}/{{nb}}', 0, 0, 'C')
+        if self.total_paginas is None:
+            self.cell(0, 10, f'Página {self.page_no()}/{{nb}}', 0, 0, 'C')
+        else:
+            # Tramo de un PDF generado en paralelo: numeración del documento completo
+            self.cell(0, 10, f'Página {self.pagina_inicial - 1 + self.page_no()}/{self.total_paginas}', 0, 0, 'C')
         self.set_x(-50)
-        self.cell(0, 10, f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", 0, 0, 'R')
+        self.cell(0, 10, f"Generado: {self.generado_en}", 0, 0, 'R')
 
 
-def generate_historial_pdf(historial_data: List[models.Abastecimiento]) -> bytes:
-    pdf = PDFWithHeader()
-    pdf.alias_nb_pages()
-    pdf.add_page(orientation='L') # Paisaje
-    pdf.set_font("Arial", size=9)
-
-    page_width = pdf.w - 2 * pdf.l_margin
-    margin = pdf.l_margin
-
-    # --- CORRECCIÓN: Volver a anchos variables ---
-    # Ajusta estos valores según veas necesario para tu contenido
-    col_widths = [30, 75, 35, 20, 20, 25, 20, 45] # Dar más espacio a Sitio y Alarmas
-    if len(col_widths) != len(HEADERS): # Fallback (poco probable ahora)
-        width_per_col = page_width / len(HEADERS)
-        col_widths = [width_per_col] * len(HEADERS)
-    # --- FIN CORRECCIÓN ---
-
-    # --- Calcular X inicial para centrar la tabla (con los anchos variables) ---
-    table_total_width = sum(col_widths)
-    # Asegurarse que la tabla no sea más ancha que la página
-    if table_total_width > page_width:
-        # Reducir proporcionalmente si excede (o ajustar manualmente los anchos)
-        scale_factor = page_width / table_total_width
-        col_widths = [w * scale_factor for w in col_widths]
-        table_total_width = sum(col_widths) # Recalcular
-        print("Advertencia: Anchos de columna reducidos para caber en la página.")
-
-    start_x = (pdf.w - table_total_width) / 2 # Calcular X para centrar
-    # --- FIN CÁLCULO ---
-
-
-    # Encabezados de tabla (sin cambios en la lógica de dibujo)
-    pdf.set_font("Arial", 'B', 9)
-    pdf.set_fill_color(220, 220, 220)
-    line_height_header = pdf.font_size * 1.5
-    current_y_header = pdf.get_y()
-    for i, header in enumerate(HEADERS):
-        current_x_header = start_x + sum(col_widths[:i])
-        pdf.set_xy(current_x_header, current_y_header)
-        pdf.multi_cell(col_widths[i], line_height_header, header, border=1, align='C', fill=True)
-    pdf.set_y(current_y_header + line_height_header)
-
-    # Filas de datos (sin cambios en la lógica de dibujo con MultiCell y altura dinámica)
-    pdf.set_font("Arial", size=8)
-    pdf.set_fill_color(245, 245, 245)
-    fill = False
-    line_height_data = pdf.font_size * 1.8 # Espaciado vertical
-
-    for ab in historial_data:
-        # Control de salto de página
-        if pdf.get_y() + line_height_data > pdf.page_break_trigger - pdf.b_margin:
+class _TablaLayout:
+    """
+    Medición de filas de la tabla del historial sin crear un FPDF auxiliar por fila.
+    Calcula las x de cada columna una sola vez y cuenta las líneas de cada celda con
+    las métricas de la fuente actual (anchos de palabra cacheados), memorizando el
+    resultado para valores repetidos (nombres de sitio, estados, alarmas...).
+    """
+    MAX_CACHE = 50000  # Entradas por caché antes de vaciarla (acota la memoria en exports grandes)
+
+    def __init__(self, pdf: FPDF, col_widths: List[float], start_x: float):
+        self.pdf = pdf
+        self.col_widths = col_widths
+        self.col_x = []
+        x = start_x
+        for w in col_widths:
+            self.col_x.append(x)
+            x += w
+        # multi_cell deja c_margin a cada lado del texto
+        self.anchos_utiles = [w - 2 * pdf.c_margin if w > 2 * pdf.c_margin else w for w in col_widths]
+        self._anchos = {}
+        self._lineas = {}
+
+    def _ancho(self, texto: str) -> float:
+        ancho = self._anchos.get(texto)
+        if ancho is None:
+            if len(self._anchos) > self.MAX_CACHE:
+                self._anchos.clear()
+            ancho = self.pdf.get_string_width(texto)
+            self._anchos[texto] = ancho
+        return ancho
+
+    def _contar_lineas(self, texto: str, ancho_max: float) -> int:
+        """Mismo criterio que multi_cell: corta por espacios y, si una palabra no cabe, por caracteres."""
+        espacio = self._ancho(" ")
+        lineas = 0
+        for parrafo in texto.split("\n"):
+            lineas += 1
+            actual = 0.0
+            for palabra in parrafo.split(" "):
+                ancho = self._ancho(palabra)
+                if actual > 0 and actual + espacio + ancho <= ancho_max:
+                    actual += espacio + ancho
+                    continue
+                if actual > 0:
+                    lineas += 1
+                    actual = 0.0
+                if ancho <= ancho_max:
+                    actual = ancho
+                    continue
+                for caracter in palabra:
+                    ancho_c = self._ancho(caracter)
+                    if actual > 0 and actual + ancho_c > ancho_max:
+                        lineas += 1
+                        actual = 0.0
+                    actual += ancho_c
+        return lineas
+
+    def lineas(self, columna: int, texto: str) -> int:
+        clave = (columna, texto)
+        n = self._lineas.get(clave)
+        if n is None:
+            if len(self._lineas) > self.MAX_CACHE:
+                self._lineas.clear()
+            n = self._contar_lineas(texto, self.anchos_utiles[columna])
+            self._lineas[clave] = n
+        return n
+
+
+class _TablaHistorial:
+    """Página apaisada con la tabla del historial: geometría, encabezados y filas."""
+
+    def __init__(self, pdf: FPDF):
+        self.pdf = pdf
+        pdf.add_page(orientation='L') # Paisaje
+        pdf.set_font("Arial", size=9)
+
+        page_width = pdf.w - 2 * pdf.l_margin
+
+        # --- CORRECCIÓN: Volver a anchos variables ---
+        # Ajusta estos valores según veas necesario para tu contenido
+        col_widths = [30, 75, 35, 20, 20, 25, 20, 45] # Dar más espacio a Sitio y Alarmas
+        if len(col_widths) != len(HEADERS): # Fallback (poco probable ahora)
+            width_per_col = page_width / len(HEADERS)
+            col_widths = [width_per_col] * len(HEADERS)
+        # --- FIN CORRECCIÓN ---
+
+        # --- Calcular X inicial para centrar la tabla (con los anchos variables) ---
+        table_total_width = sum(col_widths)
+        # Asegurarse que la tabla no sea más ancha que la página
+        if table_total_width > page_width:
+            # Reducir proporcionalmente si excede (o ajustar manualmente los anchos)
+            scale_factor = page_width / table_total_width
+            col_widths = [w * scale_factor for w in col_widths]
+            table_total_width = sum(col_widths) # Recalcular
+            print("Advertencia: Anchos de columna reducidos para caber en la página.")
+
+        start_x = (pdf.w - table_total_width) / 2 # Calcular X para centrar
+        # --- FIN CÁLCULO ---
+
+        self.col_widths = col_widths
+        self.layout = _TablaLayout(pdf, col_widths, start_x)
+
+        # Encabezados de tabla
+        pdf.set_font("Arial", 'B', 9)
+        self.line_height_header = pdf.font_size * 1.5
+        self.dibujar_encabezados()
+
+        # Filas de datos (MultiCell con altura dinámica)
+        self._fuente_datos()
+        self.line_height_data = pdf.font_size * 1.8 # Espaciado vertical
+        # Y donde empieza la primera fila de cada página (todas tienen el mismo encabezado)
+        self.y_inicio = pdf.get_y()
+
+    def _fuente_datos(self):
+        self.pdf.set_font("Arial", size=8)
+        self.pdf.set_fill_color(245, 245, 245)
+
+    def dibujar_encabezados(self):
+        pdf = self.pdf
+        pdf.set_font("Arial", 'B', 9)
+        pdf.set_fill_color(220, 220, 220)
+        current_y_header = pdf.get_y()
+        for i, header in enumerate(HEADERS):
+            pdf.set_xy(self.layout.col_x[i], current_y_header)
+            pdf.multi_cell(self.col_widths[i], self.line_height_header, header, border=1, align='C', fill=True)
+        pdf.set_y(current_y_header + self.line_height_header)
+
+    def medir(self, row_data: List[str]) -> tuple:
+        """Líneas de cada celda y altura de la fila (la celda con más líneas)."""
+        lineas = [self.layout.lineas(i, item) for i, item in enumerate(row_data)]
+        return lineas, max(lineas) * self.line_height_data
+
+    def agregar_fila(self, row_data: List[str], fill: bool):
+        pdf = self.pdf
+        lineas, row_height = self.medir(row_data)
+
+        # Control de salto de página (con la altura real de la fila)
+        if pdf.get_y() + row_height > pdf.page_break_trigger:
             pdf.add_page(orientation='L')
-            # Redibujar encabezados
-            pdf.set_font("Arial", 'B', 9)
-            pdf.set_fill_color(220, 220, 220)
-            current_y_header = pdf.get_y()
-            for i, header in enumerate(HEADERS):
-                current_x_header = start_x + sum(col_widths[:i])
-                pdf.set_xy(current_x_header, current_y_header)
-                pdf.multi_cell(col_widths[i], line_height_header, header, border=1, align='C', fill=True)
-            pdf.set_y(current_y_header + line_height_header)
-            pdf.set_font("Arial", size=8) # Volver a fuente de datos
-
-        row_data = _format_row(ab)
-        start_y_row = pdf.get_y()
-        max_h = line_height_data
+            self.dibujar_encabezados()
+            self._fuente_datos() # Volver a fuente de datos
 
-        # Calcular altura máxima
-        temp_pdf = FPDF()
-        temp_pdf.add_page(orientation='L')
-        temp_pdf.set_font("Arial", size=8)
-        calculated_heights = []
-        for i, item in enumerate(row_data):
-            # Usar un margen interno pequeño (c_margin) para el cálculo
-            effective_width = col_widths[i] - (2 * pdf.c_margin) if col_widths[i] > (2 * pdf.c_margin) else col_widths[i]
-            lines = temp_pdf.multi_cell(effective_width, line_height_data / 1.5, str(item), split_only=True)
-            calculated_heights.append(len(lines) * line_height_data)
-        row_height = max(max_h, max(calculated_heights) if calculated_heights else max_h)
-
-        # Dibujar celdas
-        current_x_row = start_x
+        # Dibujar celdas: el borde/fondo ocupa toda la fila y el texto reparte
+        # esa altura entre sus líneas (queda centrado verticalmente)
+        start_y_row = pdf.get_y()
         for i, item in enumerate(row_data):
             align = 'L' if i in [0, 1, 7] else 'C' # Alinear OT, Sitio y Alarmas a la izquierda
-            pdf.set_xy(current_x_row, start_y_row)
-            pdf.multi_cell(col_widths[i], row_height, str(item), border=1, ln=3,
-                           align=align, fill=fill)
-            current_x_row += col_widths[i]
+            pdf.rect(self.layout.col_x[i], start_y_row, self.col_widths[i], row_height, style='DF' if fill else 'D')
+            pdf.set_xy(self.layout.col_x[i], start_y_row)
+            pdf.multi_cell(self.col_widths[i], row_height / lineas[i], item, border=0, ln=3, align=align)
 
         pdf.set_y(start_y_row + row_height)
+
+
+def generate_historial_pdf_rows(filas: Iterable[list], pagina_inicial: int = 1,
+                                total_paginas: Optional[int] = None, fila_inicial: int = 0,
+                                generado_en: Optional[str] = None) -> bytes:
+    """
+    Genera el PDF consumiendo filas ya formateadas (ver _format_row) a medida que llegan.
+    Los parámetros opcionales los usa el modo en paralelo para generar un tramo del
+    documento: numeración de páginas, alternancia de fondo y fecha del documento completo.
+    """
+    pdf = PDFWithHeader()
+    pdf.pagina_inicial = pagina_inicial
+    pdf.total_paginas = total_paginas
+    if generado_en:
+        pdf.generado_en = generado_en
+    if total_paginas is None:
+        pdf.alias_nb_pages()
+    tabla = _TablaHistorial(pdf)
+
+    fill = fila_inicial % 2 == 1
+    for fila in filas:
+        tabla.agregar_fila([str(item) for item in fila], fill)
         fill = not fill
 
     pdf_output: bytes = pdf.output(dest='S')
     return pdf_output
 
 
-# --- Generador de Excel (sin cambios) ---
-def generate_historial_excel(historial_data: List[models.Abastecimiento]) -> bytes:
-    # ... (código sin cambios) ...
-    workbook = Workbook()
-    sheet = workbook.active
-    sheet.title = "Historial Abastecimientos"
-    sheet.append(HEADERS)
-    for cell in sheet[1]: cell.font = Font(bold=True)
-    for ab in historial_data:
-        row_data = _format_row(ab)
-        formatted_row = []
-        for i, item in enumerate(row_data):
-            try:
-                if i in [3, 4, 5]: formatted_row.append(float(item))
-                else: formatted_row.append(item)
-            except ValueError: formatted_row.append(item)
-        sheet.append(formatted_row)
-    column_letters = [chr(ord('A') + i) for i in range(len(HEADERS))]
-    for col_idx, column_letter in enumerate(column_letters, 1):
-        max_length = 0
+# --- PDF en paralelo (historiales muy grandes) ---
+def pdf_paralelo_disponible() -> bool:
+    """pypdf es opcional: solo se necesita para unir los tramos generados en paralelo."""
+    try:
+        import pypdf  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _paginar(filas: List[List[str]]) -> tuple:
+    """
+    Reproduce los saltos de página de generate_historial_pdf_rows sin dibujar nada.
+    Devuelve (total de páginas, [(índice de fila, número de página), ...]) con las
+    filas que abren página y en las que se puede cortar un tramo: las que entran en
+    una página nueva (una fila más alta que la página provoca un salto extra).
+    """
+    tabla = _TablaHistorial(PDFWithHeader())
+    limite = tabla.pdf.page_break_trigger
+    paginas = 1
+    cortes = [(0, 1)]
+    y = tabla.y_inicio
+    for indice, fila in enumerate(filas):
+        _, alto = tabla.medir(fila)
+        if y + alto > limite:
+            paginas += 1
+            if tabla.y_inicio + alto <= limite:
+                cortes.append((indice, paginas))
+            y = tabla.y_inicio
+        if tabla.y_inicio + alto > limite:
+            # El salto automático de FPDF la reparte en varias páginas: se cuentan dibujándola
+            paginas_extra, y = _medir_fila_alta(fila)
+            paginas += paginas_extra
+        else:
+            y += alto
+    return paginas, cortes
+
+
+def _medir_fila_alta(fila: List[str]) -> tuple:
+    """
+    Dibuja en un PDF aparte una fila más alta que una página, como lo hace
+    generate_historial_pdf_rows (siempre empieza en una página nueva), y devuelve
+    (páginas extra que ocupa, Y en que queda el cursor).
+    """
+    tabla = _TablaHistorial(PDFWithHeader())
+    tabla.agregar_fila(fila, fill=False)  # Salta a la página 2 antes de dibujarla
+    return tabla.pdf.page - 2, tabla.pdf.get_y()
+
+
+def _render_tramo(filas: List[List[str]], pagina_inicial: int, total_paginas: int,
+                  fila_inicial: int, generado_en: str) -> bytes:
+    """Se ejecuta en un proceso del pool (debe ser una función de módulo para poder serializarse)."""
+    return generate_historial_pdf_rows(filas, pagina_inicial=pagina_inicial, total_paginas=total_paginas,
+                                       fila_inicial=fila_inicial, generado_en=generado_en)
+
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _pdf_workers() -> int:
+    return settings.PDF_PARALLEL_WORKERS or os.cpu_count() or 1
+
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    """Pool de procesos para generar PDFs (PDF en paralelo y reportes de consumo en lote)."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # spawn: el proceso del servidor tiene hilos (uvicorn, JobManager) y fork no es seguro
+            _pdf_pool = ProcessPoolExecutor(max_workers=_pdf_workers(),
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
+
+
+def shutdown_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=False, cancel_futures=True)
+            _pdf_pool = None
+
+
+def generate_historial_pdf_parallel(filas: List[List[str]], tramos: Optional[int] = None) -> bytes:
+    """
+    Genera el PDF repartiendo las filas en tramos alineados a página que se dibujan en
+    procesos separados y se unen con pypdf. Cada tramo recibe su número de página inicial
+    y el total ya calculado (_paginar), así el pie "Página X/N" y los encabezados repetidos
+    quedan igual que en el PDF generado en un solo proceso.
+    """
+    from pypdf import PdfWriter
+
+    total_paginas, cortes = _paginar(filas)
+    tramos = max(1, min(tramos or _pdf_workers(), len(cortes)))
+    # Cortes repartidos de forma pareja por número de página
+    elegidos = []
+    for n in range(tramos):
+        objetivo = 1 + n * total_paginas / tramos
+        corte = next((c for c in cortes if c[1] >= objetivo), None)
+        if corte is not None and (not elegidos or corte[0] > elegidos[-1][0]):
+            elegidos.append(corte)
+
+    if len(elegidos) < 2:
+        return generate_historial_pdf_rows(filas)
+
+    generado_en = datetime.now().strftime('%d/%m/%Y %H:%M')
+    pool = get_pdf_pool()
+    futuros = []
+    for n, (inicio, pagina) in enumerate(elegidos):
+        fin = elegidos[n + 1][0] if n + 1 < len(elegidos) else len(filas)
+        futuros.append(pool.submit(_render_tramo, filas[inicio:fin], pagina, total_paginas, inicio, generado_en))
+
+    writer = PdfWriter()
+    for futuro in futuros:
+        writer.append(BytesIO(futuro.result()))
+    salida = BytesIO()
+    writer.write(salida)
+    return salida.getvalue()
+
+
+def render_historial_pdf(filas: Iterable[list]) -> bytes:
+    """
+    Punto de entrada de los reportes PDF del historial. Por encima de
+    settings.PDF_PARALLEL_THRESHOLD_ROWS filas (y con pypdf instalado y más de un
+    núcleo) usa generate_historial_pdf_parallel; si no, el generador en un solo proceso.
+    El modo en paralelo necesita todas las filas formateadas en memoria para repartirlas.
+    """
+    umbral = settings.PDF_PARALLEL_THRESHOLD_ROWS
+    if umbral <= 0 or _pdf_workers() < 2 or not pdf_paralelo_disponible():
+        return generate_historial_pdf_rows(filas)
+
+    filas = iter(filas)
+    primeras = list(islice(filas, umbral))
+    if len(primeras) < umbral:
+        return generate_historial_pdf_rows(primeras)
+    todas = [[str(item) for item in fila] for fila in chain(primeras, filas)]
+    print(f"-> PDF del historial en paralelo: {len(todas)} filas, {_pdf_workers()} procesos")
+    return generate_historial_pdf_parallel(todas)
+
+
+# --- Comprobante de un abastecimiento (plantilla de posiciones fijas) ---
+# Página A5 vertical con los campos en posiciones fijas: no hay tabla ni medición de
+# celdas (solo el nombre del sitio puede ocupar dos líneas). Fuentes base de PDF
+# (sin carga de archivos) y logo en memoria (report_assets).
+COMPROBANTE_X_ETIQUETA = 12
+COMPROBANTE_X_VALOR = 62
+COMPROBANTE_ANCHO_VALOR = 74
+COMPROBANTE_ALTO_CAMPO = 7
+COMPROBANTE_Y_CAMPOS = 62
+# (etiqueta, función que obtiene el valor ya formateado)
+COMPROBANTE_CAMPOS = [
+    ("OT", lambda ab: ab.ot),
+    ("Fecha y hora", lambda ab: ab.fecha.strftime('%d/%m/%Y %H:%M') if isinstance(ab.fecha, datetime) else str(ab.fecha)),
+    ("Estado", lambda ab: str(ab.status.value) if hasattr(ab.status, 'value') else str(ab.status)),
+    ("Galones existentes", lambda ab: f"{ab.gls_existentes:.2f}"),
+    ("Galones abastecidos", lambda ab: f"{ab.gls_abastecidos:.2f}"),
+    ("Horometraje", lambda ab: f"{ab.horometraje:.2f}"),
+    ("Rendimiento", lambda ab: f"{ab.rendimiento_mg:.2f}"),
+    ("Alarma transferencia", lambda ab: "Sí" if ab.alarma_transferencia else "No"),
+    ("Alarma falla energía", lambda ab: "Sí" if ab.alarma_falla_energia else "No"),
+    ("Técnico", lambda ab: ab.sitio.tecnico.nombre_tecnico if ab.sitio and ab.sitio.tecnico else "N/A"),
+]
+
+
+# Imágenes ya decodificadas por fpdf, compartidas entre documentos: pdf.image() con los bytes
+# PNG vuelve a descomprimir y comprimir la imagen en cada FPDF nuevo (~10 ms por comprobante).
+_IMAGENES_PDF = ImageCache()
+
+
+def _imagen_en_cache(pdf: FPDF, imagen: bytes, **kwargs):
+    """pdf.image() reutilizando la imagen decodificada una sola vez por proceso."""
+    nombre, _, info = preload_image(_IMAGENES_PDF, imagen)
+    # Con perfil ICC el índice del perfil es del documento: se deja que fpdf lo decodifique
+    if nombre not in pdf.image_cache.images and info.get("iccp_i") is None:
+        copia = copy.copy(info)
+        copia["i"] = len(pdf.image_cache.images) + 1
+        copia["usages"] = 0
+        pdf.image_cache.images[nombre] = copia
+    return pdf.image(imagen, **kwargs)
+
+
+def generate_comprobante_pdf(abastecimiento: models.Abastecimiento) -> bytes:
+    """Comprobante PDF de un solo abastecimiento (se adjunta al correo del alta)."""
+    pdf = FPDF(orientation='P', format='A5')
+    pdf.set_auto_page_break(False)
+    pdf.add_page()
+
+    logo = report_assets.get_logo()
+    if logo is not None:
+        try:
+            _imagen_en_cache(pdf, logo, x=COMPROBANTE_X_ETIQUETA, y=10, w=28)
+        except Exception as e:
+            print(f"Advertencia: No se pudo cargar el logo. {e}")
+            logo = None
+    if logo is None:
+        pdf.set_font('Arial', 'B', 10)
+        pdf.set_xy(COMPROBANTE_X_ETIQUETA, 10)
+        pdf.cell(28, 10, 'Tigo', align='L')
+
+    pdf.set_font('Arial', 'B', 14)
+    pdf.set_xy(0, 26)
+    pdf.cell(pdf.w, 8, "Comprobante de Abastecimiento", align='C')
+
+    # Sitio (único campo de largo variable: hasta dos líneas)
+    sitio = abastecimiento.sitio
+    if sitio:
+        sitio_texto = f"{sitio.id} - {sitio.nombre}"
+        ubicacion = f"{sitio.municipio}, {sitio.departamento}"
+    else:
+        sitio_texto = f"Sitio ID {abastecimiento.id_sitio}"
+        ubicacion = ""
+    pdf.set_font('Arial', 'B', 10)
+    pdf.set_xy(COMPROBANTE_X_ETIQUETA, 40)
+    pdf.multi_cell(pdf.w - 2 * COMPROBANTE_X_ETIQUETA, 5, sitio_texto, border=0, align='L')
+    pdf.set_font('Arial', '', 9)
+    pdf.set_xy(COMPROBANTE_X_ETIQUETA, 51)
+    pdf.cell(pdf.w - 2 * COMPROBANTE_X_ETIQUETA, 5, ubicacion, align='L')
+
+    pdf.set_draw_color(200, 200, 200)
+    pdf.line(COMPROBANTE_X_ETIQUETA, COMPROBANTE_Y_CAMPOS - 3, pdf.w - COMPROBANTE_X_ETIQUETA, COMPROBANTE_Y_CAMPOS - 3)
+    y = COMPROBANTE_Y_CAMPOS
+    for etiqueta, valor in COMPROBANTE_CAMPOS:
+        pdf.set_font('Arial', 'B', 10)
+        pdf.set_xy(COMPROBANTE_X_ETIQUETA, y)
+        pdf.cell(COMPROBANTE_X_VALOR - COMPROBANTE_X_ETIQUETA, COMPROBANTE_ALTO_CAMPO, f"{etiqueta}:", align='L')
+        pdf.set_font('Arial', '', 10)
+        pdf.cell(COMPROBANTE_ANCHO_VALOR, COMPROBANTE_ALTO_CAMPO, str(valor(abastecimiento)), align='L')
+        y += COMPROBANTE_ALTO_CAMPO
+    pdf.line(COMPROBANTE_X_ETIQUETA, y + 3, pdf.w - COMPROBANTE_X_ETIQUETA, y + 3)
+
+    pdf.set_font('Arial', 'I', 8)
+    pdf.set_xy(COMPROBANTE_X_ETIQUETA, pdf.h - 15)
+    pdf.cell(pdf.w - 2 * COMPROBANTE_X_ETIQUETA, 6, f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", align='R')
+
+    return bytes(pdf.output())
+
+
+# --- Reporte de consumo por sitio (reportes periódicos en lote) ---
+CONSUMO_HEADERS = ["Código", "Sitio", "Abast.", "Gls. Abast.", "Horas", "Rend. prom."]
+CONSUMO_COL_WIDTHS = [30, 120, 25, 35, 30, 30]
+
+
+def _recortar(pdf: FPDF, texto: str, ancho: float) -> str:
+    """Recorta el texto con '...' para que entre en una sola línea de la celda."""
+    ancho_util = ancho - 2 * pdf.c_margin
+    if pdf.get_string_width(texto) <= ancho_util:
+        return texto
+    while texto and pdf.get_string_width(texto + "...") > ancho_util:
+        texto = texto[:-1]
+    return texto + "..."
+
+
+def generate_consumo_pdf(titulo: str, subtitulo: str, filas: List[dict]) -> bytes:
+    """
+    Tabla de consumo por sitio del periodo. 'filas' son diccionarios con sitio_codigo,
+    sitio_nombre, abastecimientos, gls_abastecidos, horas y rendimiento_promedio
+    (ver crud.abastecimiento.get_consumo_por_sitio). Se ejecuta en el pool de procesos,
+    así que recibe solo datos serializables.
+    """
+    pdf = PDFWithHeader()
+    pdf.titulo = titulo
+    pdf.alias_nb_pages()
+    pdf.add_page(orientation='L')
+
+    pdf.set_font("Arial", 'I', 10)
+    pdf.cell(0, 6, subtitulo, 0, 1, 'C')
+    pdf.ln(2)
+
+    start_x = (pdf.w - sum(CONSUMO_COL_WIDTHS)) / 2
+    line_height = 7
+
+    def dibujar_encabezados():
+        pdf.set_font("Arial", 'B', 9)
+        pdf.set_fill_color(220, 220, 220)
+        pdf.set_x(start_x)
+        for ancho, header in zip(CONSUMO_COL_WIDTHS, CONSUMO_HEADERS):
+            pdf.cell(ancho, line_height, header, 1, 0, 'C', fill=True)
+        pdf.ln(line_height)
+        pdf.set_font("Arial", size=8)
+        pdf.set_fill_color(245, 245, 245)
+
+    def dibujar_fila(valores: List[str], fill: bool):
+        if pdf.get_y() + line_height > pdf.page_break_trigger:
+            pdf.add_page(orientation='L')
+            dibujar_encabezados()
+        pdf.set_x(start_x)
+        for i, (ancho, valor) in enumerate(zip(CONSUMO_COL_WIDTHS, valores)):
+            pdf.cell(ancho, line_height, _recortar(pdf, valor, ancho), 1, 0, 'L' if i < 2 else 'R', fill=fill)
+        pdf.ln(line_height)
+
+    dibujar_encabezados()
+    total_abastecimientos = 0
+    total_gls = 0.0
+    for n, fila in enumerate(filas):
+        total_abastecimientos += fila["abastecimientos"]
+        total_gls += fila["gls_abastecidos"] or 0
+        rendimiento = fila["rendimiento_promedio"]
+        dibujar_fila([
+            str(fila["sitio_codigo"]), fila["sitio_nombre"], str(fila["abastecimientos"]),
+            f"{fila['gls_abastecidos'] or 0:.2f}", f"{fila['horas'] or 0:.2f}",
+            f"{rendimiento:.2f}" if rendimiento is not None else "N/A",
+        ], fill=n % 2 == 1)
+
+    pdf.set_font("Arial", 'B', 8)
+    dibujar_fila(["", f"Total ({len(filas)} sitios)", str(total_abastecimientos), f"{total_gls:.2f}", "", ""], fill=False)
+
+    pdf_output: bytes = pdf.output(dest='S')
+    return pdf_output
+
+
+# --- Generador de Excel (modo write-only, en streaming) ---
+EXCEL_FILAS_MUESTRA = 1000  # Filas iniciales usadas para calcular el ancho de las columnas
+EXCEL_ANCHO_MAXIMO = 60
+EXCEL_SPOOL_MAX_BYTES = 8 * 1024 * 1024  # Por encima de esto el archivo pasa de memoria a disco
+CHUNK_BYTES = 64 * 1024
+EXCEL_COLUMNAS_NUMERICAS = (3, 4, 5)
+
+
+def _excel_row(row_data: list) -> list:
+    formatted_row = []
+    for i, item in enumerate(row_data):
         try:
-            column = sheet[column_letter]
-            for cell in column:
-                try:
-                    if cell.value:
-                        cell_len = len(str(cell.value))
-                        if cell_len > max_length: max_length = cell_len
-                except: pass
-            adjusted_width = (max_length + 2)
-            sheet.column_dimensions[column_letter].width = adjusted_width
-        except KeyError: print(f"Advertencia: Columna {column_letter} no encontrada.")
-    buffer = BytesIO()
-    workbook.save(buffer)
-    buffer.seek(0)
-    return buffer.getvalue()
\ No newline at end of file
+            if i in EXCEL_COLUMNAS_NUMERICAS: formatted_row.append(float(item))
+            else: formatted_row.append(item)
+        except ValueError: formatted_row.append(item)
+    return formatted_row
+
+
+def write_historial_excel(filas: Iterable[list], destino) -> None:
+    """
+    Escribe el historial en 'destino' (ruta o archivo) con una hoja write-only de
+    openpyxl: las filas se vuelcan a disco a medida que llegan, sin mantener el libro
+    en memoria. 'filas' son filas ya formateadas (ver _format_row).
+
+    En modo write-only los anchos deben fijarse antes de la primera fila, así que se
+    calculan con las primeras EXCEL_FILAS_MUESTRA filas (acotados a EXCEL_ANCHO_MAXIMO).
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Historial Abastecimientos")
+
+    filas = iter(filas)
+    muestra = list(islice(filas, EXCEL_FILAS_MUESTRA))
+    anchos = [len(header) for header in HEADERS]
+    for row_data in muestra:
+        for i, item in enumerate(row_data):
+            if item is not None and len(str(item)) > anchos[i]:
+                anchos[i] = len(str(item))
+    for i, ancho in enumerate(anchos, 1):
+        sheet.column_dimensions[get_column_letter(i)].width = min(ancho + 2, EXCEL_ANCHO_MAXIMO)
+
+    encabezados = []
+    for header in HEADERS:
+        cell = WriteOnlyCell(sheet, value=header)
+        cell.font = Font(bold=True)
+        encabezados.append(cell)
+    sheet.append(encabezados)
+
+    for row_data in chain(muestra, filas):
+        sheet.append(_excel_row(row_data))
+    workbook.save(destino)
+
+
+def generate_historial_excel_file(filas: Iterable[list]) -> SpooledTemporaryFile:
+    """
+    Genera el Excel en un archivo temporal (en memoria si es pequeño, en disco si no)
+    posicionado al inicio, listo para enviarse por partes con iter_file.
+    """
+    archivo = SpooledTemporaryFile(max_size=EXCEL_SPOOL_MAX_BYTES)
+    try:
+        write_historial_excel(filas, archivo)
+    except Exception:
+        archivo.close()
+        raise
+    archivo.seek(0)
+    return archivo
+
+
+def iter_file(archivo, chunk_size: int = CHUNK_BYTES) -> Iterator[bytes]:
+    """Lee el archivo por bloques (para StreamingResponse) y lo cierra al terminar."""
+    try:
+        while True:
+            bloque = archivo.read(chunk_size)
+            if not bloque:
+                break
+            yield bloque
+    finally:
+        archivo.close()
+
+
+# --- Exportaciones para BI (CSV / Parquet) en streaming ---
+# Valores crudos (sin formatear) en el orden de crud.abastecimiento.HISTORIAL_COLUMNAS
+EXPORT_COLUMNAS = [
+    "ot", "sitio_nombre", "fecha", "gls_existentes", "gls_abastecidos",
+    "horometraje", "status", "alarma_transferencia", "alarma_falla_energia"
+]
+CSV_FILAS_POR_BLOQUE = 500
+
+
+def _valores_export(fila) -> list:
+    valores = list(fila)
+    status = valores[6]
+    valores[6] = str(status.value) if hasattr(status, 'value') else status
+    return valores
+
+
+def iter_historial_csv(filas: Iterable) -> Iterator[bytes]:
+    """
+    CSV (UTF-8) generado a medida que llegan las filas del cursor: cada
+    CSV_FILAS_POR_BLOQUE filas se envía un bloque, sin armar el archivo completo.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNAS)
+    pendientes = 0
+    for fila in filas:
+        valores = _valores_export(fila)
+        if isinstance(valores[2], datetime):
+            valores[2] = valores[2].isoformat(sep=" ")
+        writer.writerow(valores)
+        pendientes += 1
+        if pendientes >= CSV_FILAS_POR_BLOQUE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pendientes = 0
+    yield buffer.getvalue().encode("utf-8")
+
+
+def parquet_disponible() -> bool:
+    """pyarrow es opcional: solo se necesita para formato=parquet."""
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class _SalidaIncremental(io.RawIOBase):
+    """Destino de escritura que acumula bytes hasta que se retiran con drain()."""
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+        self._posicion = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._buffer += datos
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def drain(self) -> bytes:
+        datos = bytes(self._buffer)
+        self._buffer.clear()
+        return datos
+
+
+def iter_historial_parquet(filas: Iterable, row_group_size: int = 50000) -> Iterator[bytes]:
+    """
+    Parquet escrito por row groups de 'row_group_size' filas: cada grupo se envía en
+    cuanto se escribe, así la memoria queda acotada a un grupo. Requiere pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("ot", pa.string()),
+        ("sitio_nombre", pa.string()),
+        ("fecha", pa.timestamp("us")),
+        ("gls_existentes", pa.float64()),
+        ("gls_abastecidos", pa.float64()),
+        ("horometraje", pa.float64()),
+        ("status", pa.string()),
+        ("alarma_transferencia", pa.bool_()),
+        ("alarma_falla_energia", pa.bool_()),
+    ])
+    salida = _SalidaIncremental()
+    writer = pq.ParquetWriter(salida, schema)
+
+    def escribir(columnas):
+        tabla = pa.Table.from_pydict(dict(zip(EXPORT_COLUMNAS, columnas)), schema=schema)
+        writer.write_table(tabla, row_group_size=row_group_size)
+
+    columnas = [[] for _ in EXPORT_COLUMNAS]
+    for fila in filas:
+        for i, valor in enumerate(_valores_export(fila)):
+            columnas[i].append(valor)
+        if len(columnas[0]) >= row_group_size:
+            escribir(columnas)
+            columnas = [[] for _ in EXPORT_COLUMNAS]
+            datos = salida.drain()
+            if datos:
+                yield datos
+    if columnas[0]:
+        escribir(columnas)
+    writer.close()  # Escribe el footer con los metadatos
+    yield salida.drain()
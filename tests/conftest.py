@@ -0,0 +1,42 @@
+# tests/conftest.py
+"""
+Configuración común de las pruebas: variables de entorno mínimas para core.config
+y una base SQLite en memoria con todas las tablas de db/models.py por prueba.
+"""
+import os
+
+# core.config lee el entorno al importarse: valores de prueba antes de importar la app
+for _clave, _valor in {
+    "SECRET_KEY": "clave-de-pruebas",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+    "DATABASE_URL": "sqlite://",
+    "MAIL_USERNAME": "pruebas",
+    "MAIL_PASSWORD": "pruebas",
+    "MAIL_FROM": "pruebas@example.com",
+    "MAIL_PORT": "25",
+    "MAIL_SERVER": "localhost",
+    "MAIL_STARTTLS": "false",
+    "MAIL_SSL_TLS": "false",
+}.items():
+    os.environ.setdefault(_clave, _valor)
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.base import Base
+from db import models  # noqa: F401  (registra todas las tablas en Base.metadata)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    sesion = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        yield sesion
+    finally:
+        sesion.close()
+        engine.dispose()
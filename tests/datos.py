@@ -0,0 +1,52 @@
+# tests/datos.py
+"""Datos sintéticos compartidos por las pruebas."""
+import random
+from datetime import datetime, timedelta
+
+from db import models
+
+
+def crear_sitios(db, n: int, id_tecnico=None) -> list:
+    """Crea 'n' sitios (sin commit) y devuelve sus id_sitio."""
+    sitios = [
+        models.Sitio(id=f"S{i:05d}", nombre=f"Sitio {i}", departamento="Guatemala", municipio="Mixco",
+                     id_tecnico=id_tecnico)
+        for i in range(n)
+    ]
+    db.add_all(sitios)
+    db.flush()
+    return [s.id_sitio for s in sitios]
+
+
+def historial_sintetico(rng: random.Random, id_sitio: int, n: int, inicio: datetime = datetime(2025, 1, 6)) -> list:
+    """
+    Historial de 'n' abastecimientos de un sitio (dicts para Abastecimiento): consumo
+    aproximadamente lineal con ruido, algunos intervalos atípicos y algunos inválidos.
+    """
+    tasa = rng.uniform(0.5, 3.0)
+    horas_dia = rng.uniform(4, 20)
+    capacidad = rng.uniform(300, 800)
+    fecha, horometraje, nivel_post = inicio, rng.uniform(0, 5000), capacidad
+    filas = []
+    for i in range(n):
+        if i:
+            dias = rng.uniform(3, 12)
+            fecha = fecha + timedelta(days=dias)
+            horas = round(dias * horas_dia * rng.uniform(0.8, 1.2), 1)
+            consumo = tasa * horas * rng.uniform(0.9, 1.1)
+            if rng.random() < 0.1:
+                consumo *= rng.choice([0.2, 4.0])  # Intervalo atípico
+            if rng.random() < 0.05:
+                horas = 0  # Horómetro sin avance: intervalo inválido
+            horometraje += horas
+        else:
+            consumo = 0
+        gls_existentes = round(max(nivel_post - consumo, 0), 2)
+        gls_abastecidos = round(capacidad - gls_existentes, 2)
+        filas.append({
+            "id_sitio": id_sitio, "ot": f"OT{id_sitio}-{i}", "fecha": fecha,
+            "gls_existentes": gls_existentes, "gls_abastecidos": gls_abastecidos,
+            "horometraje": round(horometraje, 1), "rendimiento_mg": 0.0, "status": "ACTIVO",
+        })
+        nivel_post = gls_existentes + gls_abastecidos
+    return filas
@@ -0,0 +1,42 @@
+# tests/test_alert_emails.py
+"""
+Envío en paralelo de los correos de alerta: con más envíos simultáneos que conexiones
+en el pool, el tiempo máximo cuenta solo el envío y no la espera por una conexión.
+"""
+import asyncio
+
+from core import email_service, smtp_pool
+from db import models
+from db.models import EstadoEnvioEnum
+from tests.test_smtp_pool import _SMTPFalso
+
+
+class _SMTPLento(_SMTPFalso):
+    async def send_message(self, mensaje):
+        await asyncio.sleep(0.03)
+        await super().send_message(mensaje)
+
+
+def _notificacion(i: int) -> dict:
+    return {"user_id": i, "alerta_id": i, "email_to": f"tecnico{i}@example.com", "nombre_tecnico": f"Técnico {i}",
+            "nombre_sitio": f"Sitio {i}", "tipo_alerta": "NIVEL_BAJO", "mensaje_alerta": "Combustible bajo"}
+
+
+def test_envio_concurrente_no_vence_esperando_conexion(db, monkeypatch):
+    monkeypatch.setattr(smtp_pool.aiosmtplib, "SMTP", _SMTPLento)
+    _SMTPLento.conexiones = _SMTPLento.enviados = 0
+
+    async def _enviar():
+        pool = smtp_pool.SMTPConnectionPool("localhost", 25, None, None, use_tls=False, start_tls=False, size=3)
+        monkeypatch.setattr(smtp_pool, "_pool", pool)
+        # 30 correos, 10 en paralelo sobre 3 conexiones: cada uno tarda 0.03 s pero espera
+        # hasta ~0.1 s por su conexión, más que el tiempo máximo por envío
+        resultado = await email_service.send_new_alert_notifications(
+            db, [_notificacion(i) for i in range(30)], concurrency=10, timeout=0.08)
+        await pool.close()
+        return resultado
+
+    assert asyncio.run(_enviar()) == {"enviados": 30, "fallidos": 0}
+    assert _SMTPLento.conexiones <= 3
+    estados = [estado for (estado,) in db.query(models.NotificacionLog.estado_envio)]
+    assert estados == [EstadoEnvioEnum.EXITOSO] * 30
@@ -0,0 +1,113 @@
+"""
+Generación de alertas por bloques: se evalúan TODOS los sitios (no solo los 100 primeros),
+una consulta por bloque, y la memoria del recorrido no crece con el número de sitios.
+"""
+import asyncio
+import os
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from core import email_service
+from core.config import settings
+from crud import sitio as sitio_crud
+from db import models
+from services import alert_service
+from tests.datos import crear_sitios, historial_sintetico
+
+
+class _ContadorConsultas:
+    """Cuenta los SELECT ejecutados sobre el engine mientras está activo."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.selects = 0
+
+    def _contar(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            self.selects += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._contar)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._contar)
+
+
+def test_recorre_todos_los_sitios_una_consulta_por_bloque(db):
+    ids = crear_sitios(db, 1234)
+    db.commit()
+
+    vistos = []
+    with _ContadorConsultas(db.get_bind()) as contador:
+        for bloque in sitio_crud.iter_sitios_para_alertas(db, chunk_size=100):
+            assert len(bloque) <= 100
+            vistos.extend(s.id_sitio for s in bloque)
+            db.expunge_all()
+
+    assert vistos == sorted(ids)
+    # 13 bloques con datos + la consulta vacía que termina el recorrido
+    assert contador.selects == 13 + 1
+
+
+def test_alertas_evalua_mas_de_100_sitios(db, monkeypatch):
+    monkeypatch.setattr(settings, "ALERT_CHUNK_SIZE", 40)
+
+    async def _sin_correo(*args, **kwargs):
+        raise AssertionError("Los sitios de prueba no tienen técnico: no debe enviarse correo")
+    monkeypatch.setattr(email_service, "send_new_alert_notifications", _sin_correo)
+
+    rng = random.Random(5)
+    ids = crear_sitios(db, 250)
+    # Historial reciente: la fecha estimada de agotamiento cae cerca de hoy en todos los sitios
+    inicio = datetime.now() - timedelta(days=40)
+    db.bulk_insert_mappings(models.Abastecimiento, [
+        f for id_sitio in ids for f in historial_sintetico(rng, id_sitio, 6, inicio=inicio)])
+    db.commit()
+
+    resultado = asyncio.run(alert_service.generar_alertas_de_predicciones(db))
+
+    con_prediccion = {p.id_sitio for p in db.query(models.PrediccionAbastecimiento)}
+    con_alerta = {a.id_sitio for a in db.query(models.Alerta)}
+    assert len(con_prediccion) > 200  # Antes solo se evaluaban los 100 primeros
+    assert max(con_prediccion) == max(ids)
+    assert con_alerta and con_alerta <= con_prediccion
+    assert max(con_alerta) > ids[99]
+    assert f"{len(con_alerta)} nuevas alertas" in resultado["mensaje"]
+
+
+def _pico_recorrido(db, chunk_size: int) -> int:
+    """Pico de memoria (bytes, tracemalloc) de recorrer todos los sitios como lo hace la generación de alertas."""
+    tracemalloc.start()
+    try:
+        for _ in sitio_crud.iter_sitios_para_alertas(db, chunk_size=chunk_size):
+            db.expunge_all()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.skipif(not os.environ.get("PRUEBAS_LENTAS"), reason="Prueba lenta: definir PRUEBAS_LENTAS=1")
+def test_memoria_plana_de_100_a_100k_sitios(db):
+    """El pico de memoria del recorrido por bloques es el mismo con 100 que con 100.000 sitios."""
+    crear_sitios(db, 100)
+    db.commit()
+    pico_100 = _pico_recorrido(db, chunk_size=500)
+
+    db.bulk_insert_mappings(models.Sitio, [
+        {"id": f"M{i:06d}", "nombre": f"Sitio {i}", "departamento": "Guatemala", "municipio": "Mixco"}
+        for i in range(100000 - 100)])
+    db.commit()
+    inicio = time.perf_counter()
+    pico_100k = _pico_recorrido(db, chunk_size=500)
+    t_100k = time.perf_counter() - inicio
+
+    print(f"\nPico de memoria del recorrido: 100 sitios {pico_100 / 1024:.0f} KiB, "
+          f"100k sitios {pico_100k / 1024:.0f} KiB ({t_100k:.2f}s)")
+    # Un bloque de 500 sitios acota la memoria; sin bloques crecería ~1000x
+    assert pico_100k < pico_100 * 10
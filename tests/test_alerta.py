@@ -0,0 +1,46 @@
+# tests/test_alerta.py
+"""Alertas creadas en bloque: se devuelven exactamente las insertadas por el bloque."""
+import pytest
+from sqlalchemy import event, text
+
+from crud import alerta as alerta_crud
+from db import models
+from db.models import EstadoAlertaEnum, TipoAlertaEnum
+from tests.datos import crear_sitios
+
+
+@pytest.fixture(params=[True, False], ids=["returning", "sin_returning"])
+def con_returning(request, db, monkeypatch):
+    # Sin RETURNING se prueba el camino de MySQL
+    monkeypatch.setattr(db.get_bind().dialect, "insert_returning", request.param)
+    return request.param
+
+
+def test_no_devuelve_alertas_insertadas_a_la_vez_por_otro(db, con_returning):
+    ids = crear_sitios(db, 3)
+    db.commit()
+
+    # Simula otro proceso que crea una alerta manual del mismo sitio justo antes del INSERT del bloque
+    engine = db.get_bind()
+    simulada = {"hecho": False}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _insert_concurrente(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO alerta") and not simulada["hecho"]:
+            simulada["hecho"] = True
+            cursor.execute("INSERT INTO alerta (id_sitio, tipo_alerta, estado_alerta, mensaje) "
+                           "VALUES (?, 'INFORMATIVA', 'ABIERTA', 'manual')", (ids[0],))
+
+    try:
+        crear = [{"id_sitio": id_sitio, "id_prediccion": None, "tipo_alerta": TipoAlertaEnum.CRITICA,
+                  "mensaje": f"bloque {id_sitio}"} for id_sitio in ids]
+        nuevas = alerta_crud.bulk_apply_alert_changes(db, actualizar=[], cerrar=[], crear=crear)
+    finally:
+        event.remove(engine, "before_cursor_execute", _insert_concurrente)
+    db.commit()
+
+    assert simulada["hecho"]
+    assert sorted(a.mensaje for a in nuevas) == sorted(c["mensaje"] for c in crear)
+    assert all(a.id_alerta and a.estado_alerta == EstadoAlertaEnum.ABIERTA for a in nuevas)
+    abiertas = db.execute(text("SELECT COUNT(*) FROM alerta WHERE estado_alerta = 'ABIERTA'")).scalar()
+    assert abiertas == len(crear) + 1
@@ -0,0 +1,108 @@
+# tests/test_comprobante.py
+"""
+Comprobante de un abastecimiento nuevo: el correo se encola en la misma transacción
+que el abastecimiento y el PDF se genera desde el registro al enviarlo. Incluye la
+prueba de tiempo de render (p50/p99) de la plantilla del comprobante.
+"""
+import asyncio
+import os
+import random
+import statistics
+import time
+from datetime import datetime
+from io import BytesIO
+
+import pytest
+from fpdf import FPDF
+from sqlalchemy.orm import sessionmaker
+
+from crud import abastecimiento as abastecimiento_crud
+from crud import outbox as outbox_crud
+from db import models
+from schemas import abastecimiento as abastecimiento_schema
+from services import comprobante_service, outbox_service, report_assets
+from services.report_service import generate_comprobante_pdf
+from tests.datos import crear_sitios, historial_sintetico
+
+
+@pytest.fixture
+def abastecimiento_nuevo(db, monkeypatch):
+    """Crea (sin commit) un abastecimiento de un sitio con supervisor y encola su comprobante."""
+    # El PDF se genera en otra sesión: la misma base en memoria de la prueba
+    monkeypatch.setattr(comprobante_service, "SessionLocal", sessionmaker(bind=db.get_bind()))
+    supervisor = models.Supervisor(nombre_completo="Ana Pérez", correo="ana@example.com")
+    db.add(supervisor)
+    id_sitio = crear_sitios(db, 1)[0]
+    db.get(models.Sitio, id_sitio).supervisor = supervisor
+    db.commit()
+
+    fila = historial_sintetico(random.Random(1), id_sitio, 1)[0]
+    del fila["status"]
+    abastecimiento = abastecimiento_crud.create_abastecimiento(
+        db, abastecimiento_schema.AbastecimientoCreate(id_tipo_sitio=1, **fila), tecnico_id=None, commit=False)
+    assert comprobante_service.encolar_correos_comprobante(db, abastecimiento) == 1
+    return abastecimiento
+
+
+def test_sin_commit_no_queda_correo(db, abastecimiento_nuevo):
+    db.rollback()
+    assert db.query(models.NotificacionOutbox).count() == 0
+
+
+def test_pdf_se_genera_desde_el_registro_al_enviar(db, abastecimiento_nuevo):
+    db.commit()
+    fila = db.query(models.NotificacionOutbox).one()
+    assert fila.adjuntar_comprobante and fila.adjuntos == []  # El PDF no se guarda en el outbox
+
+    lote = outbox_crud.claim_pending(db, "A")
+    assert lote[0]["comprobante"] == abastecimiento_nuevo.id_abastecimiento
+    adjuntos = asyncio.run(outbox_service._adjuntos(lote[0], {}))
+    nombre, contenido, tipo_mime = adjuntos[0]
+    assert nombre.endswith(".pdf") and tipo_mime == "application/pdf"
+    assert contenido.startswith(b"%PDF")
+
+
+def _abastecimiento_en_memoria() -> models.Abastecimiento:
+    abastecimiento = models.Abastecimiento(
+        id_abastecimiento=1, id_sitio=1, ot="OT-1", fecha=datetime(2025, 6, 1, 10, 30), gls_existentes=120.0,
+        gls_abastecidos=300.0, horometraje=1000.0, rendimiento_mg=2.5, alarma_transferencia=False,
+        alarma_falla_energia=True, status="ACTIVO")
+    abastecimiento.sitio = models.Sitio(id="S00001", nombre="Sitio uno", municipio="Mixco", departamento="Guatemala")
+    return abastecimiento
+
+
+def test_logo_decodificado_una_vez_y_embebido_en_cada_comprobante():
+    if report_assets.get_logo() is None:
+        pytest.skip("Sin logo en static/img")
+    # Referencia: el logo dibujado por fpdf decodificándolo desde los bytes PNG
+    referencia = FPDF()
+    referencia.add_page()
+    referencia.image(BytesIO(report_assets.get_logo()), x=12, y=10, w=28)
+    objetos_imagen = bytes(referencia.output()).count(b"/Subtype /Image")  # Imagen y, si tiene alfa, su SMask
+
+    abastecimiento = _abastecimiento_en_memoria()
+    primero = generate_comprobante_pdf(abastecimiento)
+    segundo = generate_comprobante_pdf(abastecimiento)
+    # Cada documento lleva su propia copia del logo aunque fpdf no lo vuelva a decodificar
+    for pdf in (primero, segundo):
+        assert pdf.startswith(b"%PDF")
+        assert pdf.count(b"/Subtype /Image") == objetos_imagen
+        assert b"/XObject <</I1 " in pdf  # Registrada como primera imagen de la página
+    assert len(primero) == len(segundo)
+
+
+@pytest.mark.skipif(not os.environ.get("PRUEBAS_LENTAS"), reason="Prueba lenta: definir PRUEBAS_LENTAS=1")
+def test_tiempo_de_render_p50_p99():
+    """500 comprobantes seguidos: el render de la plantilla se mantiene en milisegundos de un dígito."""
+    abastecimiento = _abastecimiento_en_memoria()
+    generate_comprobante_pdf(abastecimiento)  # Calienta la caché del logo y las fuentes
+    tiempos = []
+    for _ in range(500):
+        inicio = time.perf_counter()
+        generate_comprobante_pdf(abastecimiento)
+        tiempos.append(time.perf_counter() - inicio)
+
+    tiempos.sort()
+    p50, p99 = statistics.median(tiempos), tiempos[int(len(tiempos) * 0.99) - 1]
+    print(f"\nRender del comprobante: p50 {p50 * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms")
+    assert p50 < 0.010
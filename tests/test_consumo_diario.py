@@ -0,0 +1,57 @@
+# tests/test_consumo_diario.py
+"""
+Rollup diario (consumo_diario): los incrementos al crear/editar/cancelar
+abastecimientos dejan los mismos totales que reconstruirlo desde el historial.
+"""
+import random
+from collections import defaultdict
+from datetime import timedelta
+
+import pytest
+
+from crud import abastecimiento as abastecimiento_crud
+from crud import consumo_diario as consumo_diario_crud
+from db import models
+from schemas import abastecimiento as abastecimiento_schema
+from tests.datos import crear_sitios, historial_sintetico
+
+
+def _rollup(db) -> dict:
+    """{(fecha, id_sitio): (n, galones)} sin las filas que quedaron en cero."""
+    db.expire_all()
+    return {
+        (f.fecha, f.id_sitio): (f.n_abastecimientos, pytest.approx(f.gls_abastecidos))
+        for f in db.query(models.ConsumoDiario) if f.n_abastecimientos
+    }
+
+
+def _desde_historial(db) -> dict:
+    totales = defaultdict(lambda: [0, 0.0])
+    for a in db.query(models.Abastecimiento).filter(models.Abastecimiento.status == 'ACTIVO'):
+        totales[(a.fecha.date(), a.id_sitio)][0] += 1
+        totales[(a.fecha.date(), a.id_sitio)][1] += a.gls_abastecidos
+    return {clave: (n, pytest.approx(galones)) for clave, (n, galones) in totales.items()}
+
+
+def test_incremental_igual_a_reconstruccion(db):
+    rng = random.Random(22)
+    creados = []
+    for id_sitio in crear_sitios(db, 5):
+        for fila in historial_sintetico(rng, id_sitio, 25):
+            del fila["status"]
+            creados.append(abastecimiento_crud.create_abastecimiento(
+                db, abastecimiento_schema.AbastecimientoCreate(id_tipo_sitio=1, **fila), tecnico_id=None))
+
+    for abastecimiento in rng.sample(creados, 20):  # Cambio de galones y/o de día
+        abastecimiento_crud.update_abastecimiento(db, abastecimiento, abastecimiento_schema.AbastecimientoUpdate(
+            gls_abastecidos=abastecimiento.gls_abastecidos + 5,
+            fecha=abastecimiento.fecha + timedelta(days=rng.choice([0, 1, -2]))))
+    for abastecimiento in rng.sample(creados, 15):
+        if abastecimiento.status == 'ACTIVO':
+            abastecimiento_crud.soft_delete_abastecimiento(db, abastecimiento)
+
+    incremental = _rollup(db)
+    assert incremental == _desde_historial(db)
+
+    consumo_diario_crud.rebuild_all(db)
+    assert _rollup(db) == incremental
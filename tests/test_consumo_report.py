@@ -0,0 +1,186 @@
+# tests/test_consumo_report.py
+"""
+Reportes periódicos de consumo en lote: todo el periodo sale de UNA consulta agregada
+(no una por sitio), se agrupa por contratista, supervisor y sitio, los PDFs se generan
+en el pool de procesos y cada destinatario recibe un único correo (digest) en el outbox.
+"""
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from crud import abastecimiento as abastecimiento_crud
+from db import models
+from services import consumo_report_service, report_service
+from tests.datos import historial_sintetico
+
+# Periodo mensual de junio de 2025 (referencia: cualquier día de julio)
+REFERENCIA = datetime(2025, 7, 15)
+DESDE, HASTA = datetime(2025, 6, 1), datetime(2025, 7, 1)
+
+
+@pytest.fixture(autouse=True)
+def _cerrar_pool_pdf():
+    yield
+    report_service.shutdown_pdf_pool()
+
+
+class _ContadorConsultas:
+    """Guarda las sentencias ejecutadas sobre el engine mientras está activo."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.sentencias = []
+
+    def _guardar(self, conn, cursor, statement, parameters, context, executemany):
+        self.sentencias.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._guardar)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._guardar)
+
+    def sobre_abastecimientos(self) -> int:
+        return sum(1 for s in self.sentencias
+                   if s.lstrip().upper().startswith("SELECT") and "FROM abastecimiento" in s)
+
+
+def _red(db, n_sitios: int, abastecimientos_por_sitio: int, semilla: int = 20) -> dict:
+    """
+    Dos contratistas con un supervisor cada uno, un tercio de los sitios sin supervisor y
+    un historial que empieza antes del periodo y termina después.
+    """
+    contratistas = [models.Contratista(nombre_contrata=f"Contrata {c}") for c in "AB"]
+    db.add_all(contratistas)
+    db.flush()
+    supervisores = [models.Supervisor(nombre_completo=f"Supervisor {c.nombre_contrata[-1]}",
+                                      correo=f"sup{c.id_contratista}@example.com", id_contratista=c.id_contratista)
+                    for c in contratistas]
+    db.add_all(supervisores)
+    db.add(models.Usuario(nombre_completo="Admin", contrasena="x", correo="admin@example.com",
+                          roles=[models.Rol(nombre="ADMIN")]))
+    db.flush()
+
+    sitios = []
+    for i in range(n_sitios):
+        contratista = contratistas[i % 2]
+        supervisor = supervisores[i % 2] if i % 3 else None
+        sitios.append(models.Sitio(id=f"R{i:05d}", nombre=f"Sitio {i}", departamento="Guatemala", municipio="Mixco",
+                                   id_contratista=contratista.id_contratista,
+                                   id_supervisor=supervisor.id_supervisor if supervisor else None))
+    db.add_all(sitios)
+    db.flush()
+    rng = random.Random(semilla)
+    db.bulk_insert_mappings(models.Abastecimiento, [
+        f for s in sitios
+        for f in historial_sintetico(rng, s.id_sitio, abastecimientos_por_sitio, inicio=DESDE - timedelta(days=20))])
+    db.commit()
+    return {"contratistas": contratistas, "supervisores": supervisores, "sitios": [s.id_sitio for s in sitios]}
+
+
+def _consumo_sitio_por_sitio(db, ids_sitios: list) -> dict:
+    """Forma anterior: el historial de cada sitio por separado y la suma en Python."""
+    resultado = {}
+    for id_sitio in ids_sitios:
+        filas = db.query(models.Abastecimiento).filter(
+            models.Abastecimiento.id_sitio == id_sitio,
+            models.Abastecimiento.status == 'ACTIVO',
+            models.Abastecimiento.fecha >= DESDE,
+            models.Abastecimiento.fecha < HASTA,
+        ).all()
+        if filas:
+            resultado[id_sitio] = (len(filas), sum(f.gls_abastecidos for f in filas))
+    return resultado
+
+
+def test_periodo_anterior():
+    assert consumo_report_service.periodo_anterior("mensual", REFERENCIA) == (DESDE, HASTA)
+    # Miércoles 16/07/2025 -> semana del lunes 07/07 al lunes 14/07
+    assert consumo_report_service.periodo_anterior("semanal", datetime(2025, 7, 16, 9)) == (
+        datetime(2025, 7, 7), datetime(2025, 7, 14))
+    with pytest.raises(ValueError):
+        consumo_report_service.periodo_anterior("anual", REFERENCIA)
+
+
+def test_una_consulta_agrupada_por_contratista_supervisor_y_sitio(db):
+    red = _red(db, 30, 12)
+
+    with _ContadorConsultas(db.get_bind()) as contador:
+        filas = abastecimiento_crud.get_consumo_por_sitio(db, DESDE, HASTA)
+    assert contador.sobre_abastecimientos() == 1
+
+    por_sitio = {f.id_sitio: f for f in filas}
+    assert len(por_sitio) == len(filas)  # Una fila por sitio
+    esperado = _consumo_sitio_por_sitio(db, red["sitios"])
+    assert set(por_sitio) == set(esperado)
+    for id_sitio, (abastecimientos, galones) in esperado.items():
+        assert por_sitio[id_sitio].abastecimientos == abastecimientos
+        assert por_sitio[id_sitio].gls_abastecidos == pytest.approx(galones)
+
+    por_supervisor, por_contratista = consumo_report_service._agrupar(filas)
+    assert set(por_contratista) == {c.id_contratista for c in red["contratistas"]}
+    assert set(por_supervisor) == {s.id_supervisor for s in red["supervisores"]}
+    # Todos los sitios salen en el reporte de su contratista; solo los supervisados en el de supervisor
+    assert sum(len(r["filas"]) for r in por_contratista.values()) == len(filas)
+    assert sum(len(r["filas"]) for r in por_supervisor.values()) == sum(
+        1 for f in filas if f.id_supervisor is not None)
+
+
+def test_genera_pdfs_y_encola_un_digest_por_destinatario(db):
+    red = _red(db, 24, 10)
+
+    with _ContadorConsultas(db.get_bind()) as contador:
+        resumen = consumo_report_service.generar_reportes_consumo(db, "mensual", REFERENCIA)
+    assert contador.sobre_abastecimientos() == 1  # Sin consultas por sitio
+
+    # 2 reportes de supervisor + 2 de contratista; 2 correos a supervisores + 1 al admin
+    assert resumen == {"periodo": "01/06/2025 - 30/06/2025", "reportes": 4, "correos": 3}
+    correos = {c.direccion_destino: c for c in db.query(models.NotificacionOutbox)}
+    assert set(correos) == {s.correo for s in red["supervisores"]} | {"admin@example.com"}
+    for correo in correos.values():
+        assert correo.asunto == "Reportes de Consumo - 01/06/2025 - 30/06/2025"
+        assert all(a.contenido.startswith(b"%PDF") and a.tipo_mime == "application/pdf" for a in correo.adjuntos)
+    for supervisor in red["supervisores"]:
+        assert len(correos[supervisor.correo].adjuntos) == 1
+    # El admin recibe en un solo correo el reporte de cada contratista
+    assert sorted(a.nombre for a in correos["admin@example.com"].adjuntos) == [
+        "Consumo_-_Contratista_Contrata_A_20250601.pdf", "Consumo_-_Contratista_Contrata_B_20250601.pdf"]
+
+
+def test_periodo_sin_abastecimientos_no_encola_correos(db):
+    _red(db, 6, 3)
+    resumen = consumo_report_service.generar_reportes_consumo(db, "mensual", datetime(2024, 1, 10))
+    assert resumen["reportes"] == 0 and resumen["correos"] == 0
+    assert db.query(models.NotificacionOutbox).count() == 0
+
+
+@pytest.mark.skipif(not os.environ.get("PRUEBAS_LENTAS"), reason="Prueba lenta: definir PRUEBAS_LENTAS=1")
+def test_consulta_agregada_contra_una_por_sitio_5k_sitios(db):
+    """5.000 sitios con 12 abastecimientos: una consulta agregada contra el historial de cada sitio."""
+    red = _red(db, 5000, 12)
+
+    with _ContadorConsultas(db.get_bind()) as contador_antes:
+        inicio = time.perf_counter()
+        antes = _consumo_sitio_por_sitio(db, red["sitios"])
+        t_antes = time.perf_counter() - inicio
+    db.expunge_all()
+    with _ContadorConsultas(db.get_bind()) as contador_despues:
+        inicio = time.perf_counter()
+        filas = abastecimiento_crud.get_consumo_por_sitio(db, DESDE, HASTA)
+        t_despues = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    resumen = consumo_report_service.generar_reportes_consumo(db, "mensual", REFERENCIA)
+    t_lote = time.perf_counter() - inicio
+
+    print(f"\nConsumo de 5000 sitios: una consulta por sitio {contador_antes.sobre_abastecimientos()} consultas "
+          f"{t_antes:.2f}s; agregada {contador_despues.sobre_abastecimientos()} consulta {t_despues:.3f}s; "
+          f"lote completo ({resumen['reportes']} PDFs, {resumen['correos']} correos) {t_lote:.2f}s")
+    assert len(filas) == len(antes)
+    assert contador_despues.sobre_abastecimientos() == 1
+    assert t_despues < t_antes
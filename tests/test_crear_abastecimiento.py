@@ -0,0 +1,174 @@
+"""
+POST /abastecimientos/ no genera el comprobante PDF en el event loop: responde con el id
+del trabajo y el PDF se descarga después. Incluye la prueba de latencia con carga
+concurrente contra uvicorn, antes (PDF en el handler) y después (trabajo en segundo plano).
+"""
+import asyncio
+import json
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import pytest
+import uvicorn
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from api import deps
+from api.routers import abastecimientos
+from db.base import Base
+from crud import abastecimiento as abastecimiento_crud
+from db import models
+from schemas import abastecimiento as abastecimiento_schema
+from services import comprobante_service, job_service
+from services.report_service import generate_comprobante_pdf
+from tests.datos import crear_sitios
+
+
+@pytest.fixture
+def servidor(tmp_path, monkeypatch):
+    """
+    App con el router de abastecimientos sobre una base SQLite en archivo (la usan los hilos
+    del servidor y del pool de trabajos) y, en /antes/, el handler anterior para comparar.
+    """
+    # Una sola conexión: SQLite no admite escritores concurrentes; las sesiones esperan su turno
+    engine = create_engine(f"sqlite:///{tmp_path / 'abastecimientos.db'}", pool_size=1, max_overflow=0,
+                           pool_timeout=60, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    fabrica = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(comprobante_service, "SessionLocal", fabrica)
+    manager = job_service.JobManager(str(tmp_path / "jobs"), max_workers=2)
+    monkeypatch.setattr(job_service, "_manager", manager)
+
+    db = fabrica()
+    usuario = models.Usuario(nombre_completo="Técnico", contrasena="x", correo="tecnico@example.com",
+                             roles=[models.Rol(nombre="TECNICO")])
+    db.add(usuario)
+    db.flush()
+    tecnico = models.Tecnico(id_usuario=usuario.id_usuario, id_grupo=1, id_contratista=1, nombre_tecnico="Técnico",
+                             dpi_tecnico="1234567890123", correo_tecnico="tecnico@example.com")
+    db.add(tecnico)
+    db.flush()
+    sitios = crear_sitios(db, 200, id_tecnico=tecnico.id_tecnico)
+    db.commit()
+    db.refresh(usuario)
+    _ = usuario.roles, usuario.tecnico  # Cargados antes de servir: el override no consulta la base
+    db.close()
+
+    def _db():
+        sesion = fabrica()
+        try:
+            yield sesion
+        finally:
+            sesion.close()
+
+    app = FastAPI()
+    app.include_router(abastecimientos.router)
+
+    @app.post("/antes/", status_code=201)
+    async def _crear_con_pdf_en_el_handler(abastecimiento: abastecimiento_schema.AbastecimientoCreate,
+                                          db: Session = Depends(_db)):
+        """Comportamiento anterior: handler async que genera el comprobante en el event loop."""
+        nuevo = abastecimiento_crud.create_abastecimiento(db, abastecimiento, tecnico_id=tecnico.id_tecnico)
+        generate_comprobante_pdf(nuevo)
+        id_abastecimiento = nuevo.id_abastecimiento
+        db.close()  # Devuelve la conexión aquí: el cierre de la dependencia espera al event loop
+        return {"id_abastecimiento": id_abastecimiento}
+
+    app.dependency_overrides[deps.get_db] = _db
+    app.dependency_overrides[deps.get_current_user] = lambda: usuario
+    yield app, sitios
+    manager.shutdown()
+    engine.dispose()
+
+
+async def _peticion(puerto: int, metodo: str, ruta: str, cuerpo: dict = None):
+    """Petición HTTP/1.1 mínima por socket; devuelve (status, cuerpo en bytes)."""
+    datos = json.dumps(cuerpo).encode() if cuerpo is not None else b""
+    reader, writer = await asyncio.open_connection("127.0.0.1", puerto)
+    writer.write(f"{metodo} {ruta} HTTP/1.1\r\nHost: local\r\nConnection: close\r\n"
+                 f"Content-Type: application/json\r\nContent-Length: {len(datos)}\r\n\r\n".encode() + datos)
+    await writer.drain()
+    respuesta = await reader.read()
+    writer.close()
+    cabecera, _, contenido = respuesta.partition(b"\r\n\r\n")
+    return int(cabecera.split(b" ", 2)[1]), contenido
+
+
+def _cuerpo(id_sitio: int, i: int) -> dict:
+    return {"id_sitio": id_sitio, "id_tipo_sitio": 1, "ot": f"OT-{id_sitio}-{i}",
+            "fecha": (datetime(2025, 6, 1) + timedelta(days=i)).isoformat(),
+            "gls_existentes": 120.0, "gls_abastecidos": 300.0, "horometraje": 1000.0 + i, "rendimiento_mg": 0.0}
+
+
+async def _con_servidor(app, funcion):
+    servidor = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning",
+                                             lifespan="off", timeout_graceful_shutdown=1))
+    tarea_servidor = asyncio.create_task(servidor.serve())
+    while not servidor.started:
+        await asyncio.sleep(0.01)
+    try:
+        return await funcion(servidor.servers[0].sockets[0].getsockname()[1])
+    finally:
+        servidor.should_exit = True
+        await asyncio.wait_for(tarea_servidor, timeout=10)
+
+
+async def _carga(puerto: int, ruta: str, sitios: list, n_peticiones: int, concurrencia: int, desde: int = 0) -> list:
+    """
+    n_peticiones POST a 'ruta' con 'concurrencia' clientes a la vez; devuelve la latencia de cada una (s).
+    'desde' desplaza el horometraje para que siga creciendo en una segunda carga sobre los mismos sitios.
+    """
+    limite = asyncio.Semaphore(concurrencia)
+
+    async def _una(i):
+        async with limite:
+            inicio = time.perf_counter()
+            codigo, _ = await _peticion(puerto, "POST", ruta, _cuerpo(sitios[i % len(sitios)], desde + i))
+            assert codigo == 201
+            return time.perf_counter() - inicio
+
+    return await asyncio.gather(*(_una(i) for i in range(n_peticiones)))
+
+
+def test_post_devuelve_job_y_el_pdf_se_descarga_despues(servidor):
+    app, sitios = servidor
+
+    async def _flujo(puerto):
+        codigo, contenido = await _peticion(puerto, "POST", "/abastecimientos/", _cuerpo(sitios[0], 1))
+        assert codigo == 201
+        job_id = json.loads(contenido)["id_comprobante_job"]
+        assert job_id
+        for _ in range(200):
+            codigo, pdf = await _peticion(puerto, "GET", f"/abastecimientos/comprobantes/{job_id}")
+            if codigo != 202:
+                return codigo, pdf
+            await asyncio.sleep(0.02)
+        return codigo, pdf
+
+    codigo, pdf = asyncio.run(_con_servidor(app, _flujo))
+    assert codigo == 200
+    assert pdf.startswith(b"%PDF")
+
+
+def _percentiles(latencias: list) -> tuple:
+    ordenadas = sorted(latencias)
+    return statistics.median(ordenadas), ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * 0.99))]
+
+
+@pytest.mark.skipif(not os.environ.get("PRUEBAS_LENTAS"), reason="Prueba lenta: definir PRUEBAS_LENTAS=1")
+def test_latencia_post_con_carga_antes_y_despues(servidor):
+    """400 POST con 50 clientes concurrentes: PDF en el handler contra trabajo en segundo plano."""
+    app, sitios = servidor
+    antes = asyncio.run(_con_servidor(app, lambda puerto: _carga(puerto, "/antes/", sitios, 400, 50)))
+    despues = asyncio.run(_con_servidor(app, lambda puerto: _carga(puerto, "/abastecimientos/", sitios, 400, 50,
+                                                                   desde=400)))
+
+    p50_antes, p99_antes = _percentiles(antes)
+    p50_despues, p99_despues = _percentiles(despues)
+    print(f"\nPOST /abastecimientos/ (50 concurrentes): PDF en el handler p50 {p50_antes * 1000:.0f} ms, "
+          f"p99 {p99_antes * 1000:.0f} ms; en segundo plano p50 {p50_despues * 1000:.0f} ms, "
+          f"p99 {p99_despues * 1000:.0f} ms")
+    assert p99_despues < p99_antes
@@ -0,0 +1,106 @@
+# tests/test_dashboard_cache.py
+"""
+Caché del dashboard (memoria y Redis vía fakeredis): las claves llevan la versión y
+una invalidación las descarta, varios misses simultáneos de la misma clave calculan
+una sola vez, y un commit que toca las tablas del dashboard invalida lo guardado.
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+from sqlalchemy.orm import sessionmaker
+
+from core.config import settings
+from crud import abastecimiento as abastecimiento_crud
+from db import models
+from schemas import abastecimiento as abastecimiento_schema
+from services import dashboard_cache, dashboard_service
+from tests.datos import crear_sitios, historial_sintetico
+
+
+@pytest.fixture(params=["memoria", "fakeredis"])
+def cache(request, monkeypatch):
+    monkeypatch.setattr(settings, "DASHBOARD_CACHE_BACKEND", request.param)
+    cache = dashboard_cache.DashboardCache(dashboard_cache._crear_backend(), ttl=60, espera_bloqueo=5)
+    monkeypatch.setattr(dashboard_cache, "_cache", cache)
+    return cache
+
+
+class _Contador:
+    def __init__(self, espera: float = 0.0):
+        self.llamadas = 0
+        self.espera = espera
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.llamadas += 1
+            n = self.llamadas
+        time.sleep(self.espera)
+        return {"calculo": n}
+
+
+def test_claves_versionadas_e_invalidacion(cache):
+    calcular = _Contador()
+    assert cache.get_or_compute("global", calcular) == {"calculo": 1}
+    assert cache.get_or_compute("global", calcular) == {"calculo": 1}
+    assert cache.get_or_compute("tecnico:7", calcular) == {"calculo": 2}  # Otro alcance, otra clave
+
+    version = cache.backend.version()
+    cache.invalidar()
+    assert cache.backend.version() == version + 1
+    assert cache.get_or_compute("global", calcular) == {"calculo": 3}
+    assert cache.get_or_compute("tecnico:7", calcular) == {"calculo": 4}
+
+
+def test_misses_simultaneos_calculan_una_vez(cache):
+    calcular = _Contador(espera=0.2)
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        resultados = list(pool.map(lambda _: cache.get_or_compute("global", calcular), range(20)))
+    assert calcular.llamadas == 1
+    assert resultados == [{"calculo": 1}] * 20
+
+
+def test_commit_en_tablas_del_dashboard_invalida(db, cache):
+    fabrica = sessionmaker(bind=db.get_bind())
+    dashboard_cache.registrar_invalidacion(fabrica)
+    sesion = fabrica()
+    admin = models.Usuario(nombre_completo="Admin", contrasena="x", correo="admin@example.com",
+                           roles=[models.Rol(nombre="ADMIN")])
+    sesion.add(admin)
+    id_sitio = crear_sitios(sesion, 1)[0]
+    sesion.commit()
+
+    antes = dashboard_service.get_dashboard_stats(sesion, admin)
+    assert antes["total_sitios"] == 1
+    version = cache.backend.version()
+
+    # Un commit que no toca las tablas del dashboard no invalida
+    admin.nombre_completo = "Administrador"
+    sesion.commit()
+    assert cache.backend.version() == version
+
+    # Alta por el ORM (flush): el dashboard en caché deja de servirse
+    datos = historial_sintetico(random.Random(1), id_sitio, 1)[0]
+    del datos["status"]
+    datos["fecha"] = datetime.now() - timedelta(hours=1)
+    creado = abastecimiento_crud.create_abastecimiento(
+        sesion, abastecimiento_schema.AbastecimientoCreate(id_tipo_sitio=1, **datos), tecnico_id=None)
+    assert cache.backend.version() > version
+    assert len(dashboard_service.get_dashboard_stats(sesion, admin)["ultimos_abastecimientos"]) == \
+        len(antes["ultimos_abastecimientos"]) + 1
+
+    # UPDATE masivo fuera del ORM por objeto; con rollback no se invalida
+    version = cache.backend.version()
+    sesion.execute(update(models.Abastecimiento).values(rendimiento_mg=2.0))
+    sesion.rollback()
+    assert cache.backend.version() == version
+    sesion.execute(update(models.Abastecimiento).where(
+        models.Abastecimiento.id_abastecimiento == creado.id_abastecimiento).values(rendimiento_mg=2.0))
+    sesion.commit()
+    assert cache.backend.version() == version + 1
+    sesion.close()
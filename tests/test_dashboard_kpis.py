@@ -0,0 +1,211 @@
+# tests/test_dashboard_kpis.py
+"""
+KPIs del dashboard: la consulta única con agregación condicional sobre el rollup
+diario da lo mismo que calcular cada indicador por separado desde las tablas base.
+Incluye la prueba de consultas y tiempo de BD por petición, antes y después.
+"""
+import os
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import event, func
+from sqlalchemy.orm import joinedload
+
+from crud import consumo_diario as consumo_diario_crud
+from db import models
+from services import dashboard_service
+from tests.datos import crear_sitios
+
+AHORA = datetime(2025, 6, 18, 10, 30)
+INICIO_MES = date(2025, 6, 1)
+DESDE_30_DIAS = (AHORA - timedelta(days=30)).date()
+ID_TECNICO = 7
+
+
+@pytest.fixture
+def datos(db):
+    """Sitios de dos técnicos con abastecimientos (activos y cancelados), predicciones y alertas."""
+    rng = random.Random(21)
+    ids = crear_sitios(db, 30)
+    for id_sitio in ids:
+        db.get(models.Sitio, id_sitio).id_tecnico = ID_TECNICO if id_sitio % 2 else ID_TECNICO + 1
+    abastecimientos = [
+        models.Abastecimiento(
+            id_sitio=rng.choice(ids), ot=f"OT{i}", fecha=AHORA - timedelta(days=rng.uniform(0, 70)),
+            gls_existentes=50.0, gls_abastecidos=round(rng.uniform(10, 400), 2), horometraje=float(i),
+            rendimiento_mg=0.0, status="ACTIVO" if rng.random() < 0.85 else "CANCELADO")
+        for i in range(600)
+    ]
+    db.add_all(abastecimientos)
+    db.flush()
+    for id_sitio in ids:
+        db.add(models.PrediccionAbastecimiento(
+            id_sitio=id_sitio, fecha_proximo_abastecimiento=AHORA + timedelta(days=rng.uniform(-3, 12)),
+            id_ultimo_abastecimiento_usado=abastecimientos[0].id_abastecimiento, horometro_estimado_fin=0.0))
+        db.add(models.Alerta(id_sitio=id_sitio, tipo_alerta=models.TipoAlertaEnum.CRITICA,
+                             estado_alerta=rng.choice(list(models.EstadoAlertaEnum))))
+    # Rollup diario por el mismo camino que las altas de la API
+    for abastecimiento in abastecimientos:
+        consumo_diario_crud.aplicar_cambio(db, None, consumo_diario_crud.huella(abastecimiento))
+    db.commit()
+    return abastecimientos
+
+
+def _esperado(db, abastecimientos, tecnico_id):
+    """Cada indicador por separado, en Python sobre las filas base."""
+    sitios = {s.id_sitio: s for s in db.query(models.Sitio)}
+    visible = lambda id_sitio: tecnico_id is None or sitios[id_sitio].id_tecnico == tecnico_id
+    activos = [a for a in abastecimientos if a.status == "ACTIVO" and visible(a.id_sitio)]
+    mes = [a for a in activos if a.fecha.date() >= INICIO_MES]
+    ult_30 = [a for a in activos if a.fecha.date() >= DESDE_30_DIAS]
+    return {
+        "total_sitios": sum(1 for id_sitio in sitios if visible(id_sitio)),
+        "total_abastecimientos_mes": len(mes),
+        "total_galones_mes": sum(a.gls_abastecidos for a in mes),
+        "sitios_proximo_abastecimiento": sum(
+            1 for p in db.query(models.PrediccionAbastecimiento)
+            if visible(p.id_sitio) and AHORA <= p.fecha_proximo_abastecimiento < AHORA + timedelta(days=7)),
+        "alertas_abiertas": sum(
+            1 for a in db.query(models.Alerta)
+            if visible(a.id_sitio) and a.estado_alerta in (models.EstadoAlertaEnum.ABIERTA, models.EstadoAlertaEnum.ENVIADA)),
+        "total_galones_ultimos_30_dias": sum(a.gls_abastecidos for a in ult_30),
+        "abastecimientos_ultimos_30_dias": len(ult_30),
+    }
+
+
+@pytest.mark.parametrize("tecnico_id", [None, ID_TECNICO])
+def test_kpis_igual_a_consultas_separadas(db, datos, tecnico_id):
+    kpis = dashboard_service._get_kpis(db, tecnico_id=tecnico_id, inicio_mes=INICIO_MES,
+                                       desde_30_dias=DESDE_30_DIAS, now_naive=AHORA)
+    esperado = _esperado(db, datos, tecnico_id)
+    assert kpis.keys() == esperado.keys()
+    for clave, valor in esperado.items():
+        assert kpis[clave] == pytest.approx(valor), clave
+    assert esperado["total_abastecimientos_mes"] and esperado["alertas_abiertas"]  # Los datos ejercitan cada KPI
+
+
+def test_kpis_sin_datos(db):
+    kpis = dashboard_service._get_kpis(db, tecnico_id=None, inicio_mes=INICIO_MES,
+                                       desde_30_dias=DESDE_30_DIAS, now_naive=AHORA)
+    assert set(kpis.values()) == {0}
+
+
+class _MedidorConsultas:
+    """Cuenta las sentencias ejecutadas sobre el engine y suma su tiempo en la BD."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.sentencias = 0
+        self.segundos = 0.0
+
+    def _antes(self, conn, cursor, statement, parameters, context, executemany):
+        context._inicio_medicion = time.perf_counter()
+
+    def _despues(self, conn, cursor, statement, parameters, context, executemany):
+        self.sentencias += 1
+        self.segundos += time.perf_counter() - context._inicio_medicion
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._antes)
+        event.listen(self.engine, "after_cursor_execute", self._despues)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._antes)
+        event.remove(self.engine, "after_cursor_execute", self._despues)
+
+
+def _kpis_antes(db, id_usuario, tecnico_id, now_naive):
+    """
+    Forma anterior de get_dashboard_stats para los KPIs: recarga el usuario con sus roles
+    y hace un count() o sum() por indicador sobre las tablas base.
+    """
+    db.query(models.Usuario).options(
+        joinedload(models.Usuario.roles), joinedload(models.Usuario.tecnico)
+    ).filter(models.Usuario.id_usuario == id_usuario).first()
+    inicio_mes = datetime.combine(INICIO_MES, datetime.min.time())
+    hace_30_dias = now_naive - timedelta(days=30)
+    sitios = db.query(models.Sitio)
+    mes = db.query(models.Abastecimiento).filter(models.Abastecimiento.fecha >= inicio_mes,
+                                                 models.Abastecimiento.status == 'ACTIVO')
+    ult_30 = db.query(models.Abastecimiento).filter(models.Abastecimiento.fecha >= hace_30_dias,
+                                                    models.Abastecimiento.status == 'ACTIVO')
+    proximos = db.query(models.PrediccionAbastecimiento).filter(
+        models.PrediccionAbastecimiento.fecha_proximo_abastecimiento >= now_naive,
+        models.PrediccionAbastecimiento.fecha_proximo_abastecimiento < now_naive + timedelta(days=7))
+    alertas = db.query(models.Alerta).filter(
+        models.Alerta.estado_alerta.in_([models.EstadoAlertaEnum.ABIERTA, models.EstadoAlertaEnum.ENVIADA]))
+    if tecnico_id is not None:
+        sitios = sitios.filter(models.Sitio.id_tecnico == tecnico_id)
+        mes, ult_30, proximos, alertas = (
+            q.join(models.Sitio).filter(models.Sitio.id_tecnico == tecnico_id) for q in (mes, ult_30, proximos, alertas))
+    return {
+        "total_sitios": sitios.count(),
+        "total_abastecimientos_mes": mes.count(),
+        "total_galones_mes": mes.with_entities(func.sum(models.Abastecimiento.gls_abastecidos)).scalar() or 0.0,
+        "sitios_proximo_abastecimiento": proximos.count(),
+        "alertas_abiertas": alertas.count(),
+        "total_galones_ultimos_30_dias": ult_30.with_entities(func.sum(models.Abastecimiento.gls_abastecidos)).scalar() or 0.0,
+        "abastecimientos_ultimos_30_dias": ult_30.count(),
+    }
+
+
+@pytest.mark.parametrize("tecnico_id", [None, ID_TECNICO])
+def test_kpis_en_una_sola_sentencia(db, datos, tecnico_id):
+    with _MedidorConsultas(db.get_bind()) as medidor:
+        dashboard_service._get_kpis(db, tecnico_id=tecnico_id, inicio_mes=INICIO_MES,
+                                    desde_30_dias=DESDE_30_DIAS, now_naive=AHORA)
+    assert medidor.sentencias == 1
+
+
+@pytest.mark.skipif(not os.environ.get("PRUEBAS_LENTAS"), reason="Prueba lenta: definir PRUEBAS_LENTAS=1")
+def test_consultas_y_tiempo_de_bd_por_peticion_antes_y_despues(db):
+    """2.000 sitios y 200.000 abastecimientos: KPIs por separado contra la consulta única."""
+    rng = random.Random(210)
+    usuario = models.Usuario(nombre_completo="Admin", contrasena="x", correo="admin@example.com",
+                             roles=[models.Rol(nombre="ADMIN")])
+    db.add(usuario)
+    ids = crear_sitios(db, 2000)
+    for id_sitio in ids:
+        db.get(models.Sitio, id_sitio).id_tecnico = ID_TECNICO if id_sitio % 2 else ID_TECNICO + 1
+    db.bulk_insert_mappings(models.Abastecimiento, [
+        {"id_sitio": id_sitio, "ot": f"OT{id_sitio}-{i}", "fecha": AHORA - timedelta(days=rng.uniform(0, 400)),
+         "gls_existentes": 50.0, "gls_abastecidos": round(rng.uniform(10, 400), 2), "horometraje": float(i),
+         "rendimiento_mg": 0.0, "status": "ACTIVO" if rng.random() < 0.85 else "CANCELADO"}
+        for id_sitio in ids for i in range(100)])
+    db.bulk_insert_mappings(models.PrediccionAbastecimiento, [
+        {"id_sitio": id_sitio, "fecha_proximo_abastecimiento": AHORA + timedelta(days=rng.uniform(-3, 12)),
+         "id_ultimo_abastecimiento_usado": 1, "horometro_estimado_fin": 0.0} for id_sitio in ids])
+    db.bulk_insert_mappings(models.Alerta, [
+        {"id_sitio": id_sitio, "tipo_alerta": models.TipoAlertaEnum.CRITICA,
+         "estado_alerta": rng.choice(list(models.EstadoAlertaEnum))} for id_sitio in ids])
+    db.commit()
+    consumo_diario_crud.rebuild_all(db)
+    id_usuario = usuario.id_usuario  # Fuera de la medición (el commit expira el objeto)
+
+    def _medir(funcion, repeticiones=30):
+        medidas = []
+        for _ in range(repeticiones):
+            with _MedidorConsultas(db.get_bind()) as medidor:
+                resultado = funcion()
+            medidas.append(medidor)
+        return resultado, medidas[0].sentencias, statistics.median(m.segundos for m in medidas)
+
+    for tecnico_id in (None, ID_TECNICO):
+        antes, consultas_antes, bd_antes = _medir(
+            lambda: _kpis_antes(db, id_usuario, tecnico_id, AHORA))
+        despues, consultas_despues, bd_despues = _medir(
+            lambda: dashboard_service._get_kpis(db, tecnico_id=tecnico_id, inicio_mes=INICIO_MES,
+                                                desde_30_dias=DESDE_30_DIAS, now_naive=AHORA))
+        alcance = "global" if tecnico_id is None else "técnico"
+        print(f"\nKPIs del dashboard ({alcance}): antes {consultas_antes} consultas, {bd_antes * 1000:.1f} ms de BD; "
+              f"después {consultas_despues} consulta, {bd_despues * 1000:.1f} ms de BD")
+        # El rollup cuenta días completos: los totales de 30 días difieren en el día parcial
+        for clave in ("total_sitios", "total_abastecimientos_mes", "total_galones_mes",
+                      "sitios_proximo_abastecimiento", "alertas_abiertas"):
+            assert despues[clave] == pytest.approx(antes[clave]), clave
+        assert consultas_antes == 8 and consultas_despues == 1
+        assert bd_despues < bd_antes
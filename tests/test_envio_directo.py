@@ -0,0 +1,33 @@
+# tests/test_envio_directo.py
+"""
+Correos con secretos (bienvenida, restablecimiento): corren como BackgroundTask después
+de responder, con su propia sesión para el log (la de la request ya se cerró).
+"""
+import asyncio
+
+from sqlalchemy.orm import sessionmaker
+
+from core import email_service, smtp_pool
+from db import models
+from db.models import EstadoEnvioEnum
+from tests.test_smtp_pool import _SMTPFalso
+
+
+def test_restablecimiento_se_registra_con_sesion_propia(db, monkeypatch):
+    monkeypatch.setattr(smtp_pool.aiosmtplib, "SMTP", _SMTPFalso)
+    monkeypatch.setattr(email_service, "SessionLocal", sessionmaker(bind=db.get_bind()))
+    _SMTPFalso.enviados = 0
+
+    async def _enviar():
+        monkeypatch.setattr(smtp_pool, "_pool", smtp_pool.SMTPConnectionPool(
+            "localhost", 25, None, None, use_tls=False, start_tls=False, size=1))
+        await email_service.send_password_reset_email(
+            user_id=1, email_to="u@example.com", nombre_usuario="Usuario", token="secreto")
+        await smtp_pool.get_pool().close()
+
+    asyncio.run(_enviar())
+    assert _SMTPFalso.enviados == 1
+    log = db.query(models.NotificacionLog).one()
+    assert (log.direccion_destino, log.estado_envio) == ("u@example.com", EstadoEnvioEnum.EXITOSO)
+    # El token no queda guardado en la base de datos
+    assert not db.query(models.NotificacionOutbox).count()
@@ -0,0 +1,98 @@
+# tests/test_estado_consumo.py
+"""
+Estado acumulado por sitio (estado_consumo_sitio): la actualización incremental al
+crear/editar/cancelar abastecimientos deja el mismo estado que una reconstrucción
+completa y la ventana de intervalos no crece con el historial.
+"""
+import random
+from datetime import timedelta
+
+import pytest
+
+from core.config import settings
+from crud import abastecimiento as abastecimiento_crud
+from crud import estado_consumo as estado_consumo_crud
+from db import models
+from schemas import abastecimiento as abastecimiento_schema
+from services import prediction_service
+from tests.datos import crear_sitios, historial_sintetico
+
+CAMPOS = ("n_registros", "primera_fecha", "primer_horometraje", "id_ultimo_abastecimiento", "ultima_fecha",
+          "ultimo_horometraje", "ultimo_gls_existentes", "ultimo_gls_abastecidos", "intervalos")
+
+
+def _crear(db, fila: dict) -> models.Abastecimiento:
+    datos = {k: v for k, v in fila.items() if k != "status"}
+    return abastecimiento_crud.create_abastecimiento(
+        db, abastecimiento_schema.AbastecimientoCreate(id_tipo_sitio=1, **datos), tecnico_id=None)
+
+
+def _estado(db, id_sitio: int) -> dict:
+    db.expire_all()
+    estado = db.get(models.EstadoConsumoSitio, id_sitio)
+    return {campo: getattr(estado, campo) for campo in CAMPOS}
+
+
+def _reconstruido(db, id_sitio: int) -> dict:
+    estado_consumo_crud.rebuild_estado_sitio(db, id_sitio)
+    db.commit()
+    return _estado(db, id_sitio)
+
+
+@pytest.fixture
+def sitio(db):
+    id_sitio = crear_sitios(db, 1)[0]
+    db.commit()
+    return id_sitio
+
+
+def test_incremental_igual_a_reconstruccion_y_ventana_acotada(db, sitio):
+    rng = random.Random(3)
+    filas = historial_sintetico(rng, sitio, 3 * settings.PREDICTION_INTERVAL_WINDOW)
+    for fila in filas:
+        _crear(db, fila)
+        assert len(_estado(db, sitio)["intervalos"]) <= settings.PREDICTION_INTERVAL_WINDOW
+
+    incremental = _estado(db, sitio)
+    assert incremental["n_registros"] == len(filas)
+    assert len(incremental["intervalos"]) == settings.PREDICTION_INTERVAL_WINDOW
+    assert incremental == _reconstruido(db, sitio)
+
+
+def test_fuera_de_orden_edicion_y_cancelacion(db, sitio):
+    rng = random.Random(4)
+    filas = historial_sintetico(rng, sitio, 12)
+    creados = [_crear(db, fila) for fila in filas[:-2] + filas[-1:]]
+
+    # Llega un abastecimiento con fecha anterior al último: se reconstruye
+    _crear(db, filas[-2])
+    assert _estado(db, sitio) == _reconstruido(db, sitio)
+
+    abastecimiento_crud.update_abastecimiento(
+        db, creados[5], abastecimiento_schema.AbastecimientoUpdate(gls_existentes=creados[5].gls_existentes - 30))
+    assert _estado(db, sitio) == _reconstruido(db, sitio)
+
+    abastecimiento_crud.soft_delete_abastecimiento(db, creados[-1])
+    estado = _estado(db, sitio)
+    assert estado == _reconstruido(db, sitio)
+    assert estado["n_registros"] == len(filas) - 1
+    assert estado["ultima_fecha"] == filas[-2]["fecha"]
+
+
+def test_prediccion_usa_la_misma_ventana_individual_y_por_lotes(db, sitio):
+    # Historial largo cuya tasa cambia a mitad: solo cuentan los intervalos recientes
+    rng = random.Random(5)
+    antiguo = historial_sintetico(rng, sitio, 2 * settings.PREDICTION_INTERVAL_WINDOW)
+    reciente = historial_sintetico(rng, sitio, settings.PREDICTION_INTERVAL_WINDOW + 10,
+                                   inicio=antiguo[-1]["fecha"] + timedelta(days=7))
+    for i, fila in enumerate(reciente):
+        fila["horometraje"] += antiguo[-1]["horometraje"]
+        fila["ot"] = f"R{i}"
+    for fila in antiguo + reciente:
+        _crear(db, fila)
+
+    individual = prediction_service.calculate_prediction(db, sitio)
+    por_lotes = prediction_service.compute_predictions_batch(db, sitio_ids=[sitio])[sitio]
+    assert not isinstance(individual, dict), individual
+    assert individual.horometro_estimado_fin == pytest.approx(por_lotes["horometro_estimado_fin"], abs=1e-9)
+    assert individual.consumo_diario_gls == pytest.approx(por_lotes["consumo_diario_gls"], abs=1e-9)
@@ -0,0 +1,193 @@
+# tests/test_event_hub.py
+"""
+Eventos en vivo (SSE): una ráfaga mayor que la cola de una conexión deja un "resync"
+en lugar de cerrarla, el alcance por técnico se respeta y un enjambre de clientes
+locales recibe los eventos por HTTP (prueba de carga).
+"""
+import asyncio
+import os
+import statistics
+import threading
+import time
+
+import pytest
+import uvicorn
+from fastapi import FastAPI, Query
+from sqlalchemy.orm import sessionmaker
+
+from api import deps
+from api.routers import eventos
+from db import models
+from services import event_hub
+from tests.datos import crear_sitios
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    hub = event_hub.EventHub(tamano_cola=100, max_conexiones=10000)
+    monkeypatch.setattr(event_hub, "_hub", hub)
+    yield hub
+    hub.detener()
+
+
+def _vaciar(cola: asyncio.Queue) -> list:
+    eventos_ = []
+    while not cola.empty():
+        eventos_.append(cola.get_nowait())
+    return eventos_
+
+
+def test_rafaga_de_un_proceso_de_alertas_pide_resync_sin_desconectar(db, hub):
+    """
+    Como generar_alertas_de_predicciones: trabajo síncrono en el event loop que confirma
+    por bloques; los eventos de cada commit se entregan juntos al liberarse el loop.
+    """
+    fabrica = sessionmaker(bind=db.get_bind())
+    event_hub.registrar_eventos(fabrica)
+    id_sitio_tecnico = 7
+
+    async def _proceso():
+        hub.iniciar(asyncio.get_running_loop())
+        global_ = hub.suscribir(event_hub.ALCANCE_GLOBAL)
+        tecnico = hub.suscribir("tecnico:1", {id_sitio_tecnico})
+        sesion = fabrica()
+        for bloque in range(15):  # 15 bloques de 100 predicciones, sin ceder el loop
+            for i in range(100):
+                id_sitio = id_sitio_tecnico if i == 0 else 1000 + i
+                event_hub.publicar_al_confirmar(sesion, "prediccion_actualizada", id_sitio, {"bloque": bloque})
+            sesion.commit()
+        sesion.close()
+        await asyncio.sleep(0)  # Se entregan todos los eventos encolados con call_soon_threadsafe
+        return global_, tecnico
+
+    global_, tecnico = asyncio.run(_proceso())
+    assert hub.conexiones == 2  # Nadie quedó desconectado
+    recibidos = _vaciar(global_.cola)
+    assert recibidos[0]["tipo"] == event_hub.TIPO_RESYNC
+    assert None not in recibidos and len(recibidos) <= 101
+    assert recibidos[-1]["datos"] == {"bloque": 14}  # Los más recientes no se pierden
+    # El técnico solo recibe su sitio (15 eventos: no se llena su cola)
+    del_tecnico = _vaciar(tecnico.cola)
+    assert [e["id_sitio"] for e in del_tecnico] == [id_sitio_tecnico] * 15
+
+
+# --- Prueba de carga: enjambre de clientes SSE locales contra uvicorn ---
+
+def _usuarios(db):
+    admin = models.Usuario(nombre_completo="Admin", contrasena="x", correo="admin@example.com",
+                           roles=[models.Rol(nombre="ADMIN")])
+    usuario_tecnico = models.Usuario(nombre_completo="Técnico", contrasena="x", correo="tecnico@example.com",
+                                     roles=[models.Rol(nombre="TECNICO")])
+    db.add_all([admin, usuario_tecnico])
+    db.flush()
+    tecnico = models.Tecnico(id_usuario=usuario_tecnico.id_usuario, id_grupo=1, id_contratista=1, nombre_tecnico="Técnico",
+                             dpi_tecnico="1234567890123", correo_tecnico="tecnico@example.com")
+    db.add(tecnico)
+    db.flush()
+    sitios_tecnico = crear_sitios(db, 3, id_tecnico=tecnico.id_tecnico)
+    db.commit()
+    for usuario in (admin, usuario_tecnico):
+        db.refresh(usuario)
+        _ = usuario.roles, usuario.tecnico  # Cargados antes de servir: el override no consulta la base
+    return {"admin": admin, "tecnico": usuario_tecnico}, sitios_tecnico
+
+
+async def _cliente(puerto: int, token: str, esperados: int, listos: asyncio.Event, fin: dict, t0: dict):
+    """Abre el stream y cuenta eventos 'prueba' hasta recibir 'esperados'; guarda cuándo terminó."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", puerto)
+    writer.write(f"GET /eventos/?token={token} HTTP/1.1\r\nHost: local\r\nAccept: text/event-stream\r\n\r\n".encode())
+    await writer.drain()
+    buffer = b""
+    while b"retry: 5000" not in buffer:
+        buffer += await reader.read(4096)
+    listos.set()
+    try:
+        while buffer.count(b"event: prueba") < esperados:
+            datos = await reader.read(4096)
+            if not datos:
+                break
+            buffer += datos
+        fin["t"] = time.perf_counter() - t0["t"]
+        fin["n"] = buffer.count(b"event: prueba")
+    finally:
+        writer.close()
+
+
+def _enjambre(db, hub, n_clientes: int, n_eventos: int = 20):
+    usuarios, sitios_tecnico = _usuarios(db)
+    app = FastAPI()
+    app.include_router(eventos.router)
+    fabrica = sessionmaker(bind=db.get_bind())
+
+    def _db():
+        sesion = fabrica()
+        try:
+            yield sesion
+        finally:
+            sesion.close()
+
+    app.dependency_overrides[deps.get_db] = _db
+    app.dependency_overrides[deps.get_current_user_stream] = lambda token: usuarios[token]
+
+    # Uno de cada cuatro clientes es técnico: recibe solo los eventos de sus sitios
+    ids_eventos = [sitios_tecnico[i % 3] if i % 4 == 0 else 100000 + i for i in range(n_eventos)]
+    esperados_tecnico = sum(1 for id_sitio in ids_eventos if id_sitio in sitios_tecnico)
+
+    async def _correr():
+        hub.iniciar(asyncio.get_running_loop())
+        servidor = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning",
+                                                 lifespan="off", timeout_graceful_shutdown=1))
+        tarea_servidor = asyncio.create_task(servidor.serve())
+        while not servidor.started:
+            await asyncio.sleep(0.01)
+        puerto = servidor.servers[0].sockets[0].getsockname()[1]
+
+        t0, tokens = {}, ["tecnico" if i % 4 == 0 else "admin" for i in range(n_clientes)]
+        listos = [asyncio.Event() for _ in tokens]
+        fines = [{} for _ in tokens]
+        aperturas = asyncio.Semaphore(200)  # Conexiones abriéndose a la vez (backlog del socket)
+
+        async def _abrir(i):
+            async with aperturas:
+                tarea = asyncio.create_task(_cliente(
+                    puerto, tokens[i], esperados_tecnico if tokens[i] == "tecnico" else n_eventos,
+                    listos[i], fines[i], t0))
+                await listos[i].wait()
+            return tarea
+
+        inicio = time.perf_counter()
+        clientes = await asyncio.gather(*(_abrir(i) for i in range(n_clientes)))
+        t_conexion = time.perf_counter() - inicio
+        conexiones = hub.conexiones
+
+        # Publicación desde otro hilo, como los commits de los endpoints síncronos
+        t0["t"] = time.perf_counter()
+        productor = threading.Thread(target=lambda: [
+            hub.publicar("prueba", id_sitio, {"i": i}) for i, id_sitio in enumerate(ids_eventos)])
+        productor.start()
+        await asyncio.wait_for(asyncio.gather(*clientes), timeout=120)
+        productor.join()
+
+        hub.detener()
+        servidor.should_exit = True
+        await asyncio.wait_for(tarea_servidor, timeout=10)
+        return conexiones, t_conexion, fines
+
+    conexiones, t_conexion, fines = asyncio.run(_correr())
+    assert conexiones == n_clientes
+    for i, fin in enumerate(fines):
+        assert fin["n"] == (esperados_tecnico if i % 4 == 0 else n_eventos), i
+    tiempos = sorted(fin["t"] for fin in fines)
+    p99 = tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.99))]
+    print(f"\n{n_clientes} clientes SSE: conexión {t_conexion:.2f}s; {n_eventos} eventos entregados a todos "
+          f"p50 {statistics.median(tiempos) * 1000:.0f} ms, p99 {p99 * 1000:.0f} ms")
+
+
+def test_enjambre_pequeno(db, hub):
+    _enjambre(db, hub, n_clientes=40)
+
+
+@pytest.mark.skipif(not os.environ.get("PRUEBAS_LENTAS"), reason="Prueba lenta: definir PRUEBAS_LENTAS=1")
+def test_enjambre_2000_conexiones(db, hub):
+    """Miles de conexiones inactivas en un solo proceso y la entrega de eventos a todas."""
+    _enjambre(db, hub, n_clientes=2000)
@@ -0,0 +1,52 @@
+# tests/test_eventos_token.py
+"""
+Autenticación del stream de eventos: en ?token= solo se acepta el token corto de
+POST /eventos/token, y ese token no sirve para el resto de la API.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+
+from api import deps
+from core.config import settings
+from db import models
+from security import jwt_handler
+
+
+@pytest.fixture
+def usuario(db):
+    usuario = models.Usuario(nombre_completo="Técnico", contrasena="x", correo="tecnico@example.com", activo=True)
+    db.add(usuario)
+    db.commit()
+    return usuario
+
+
+def _rechazado(funcion, *args, **kwargs):
+    with pytest.raises(HTTPException) as error:
+        funcion(*args, **kwargs)
+    return error.value.status_code == 401
+
+
+def test_token_de_stream_solo_para_el_stream(db, usuario):
+    token_stream = jwt_handler.create_stream_token(usuario.id_usuario)
+    token_acceso = jwt_handler.create_access_token({"sub": str(usuario.id_usuario)})
+
+    assert deps.get_current_user_stream(db=db, token_header=None, token=token_stream).id_usuario == usuario.id_usuario
+    assert deps.get_current_user_stream(db=db, token_header=token_acceso, token=None).id_usuario == usuario.id_usuario
+    # El token de acceso (largo) no se acepta en la URL
+    assert _rechazado(deps.get_current_user_stream, db=db, token_header=None, token=token_acceso)
+    # El token de stream no sirve como token de acceso
+    assert _rechazado(deps.get_current_user, db=db, token=token_stream)
+    assert _rechazado(deps.get_current_user_stream, db=db, token_header=token_stream, token=None)
+
+
+def test_token_de_stream_vence(db, usuario):
+    assert jwt.decode(jwt_handler.create_stream_token(usuario.id_usuario), settings.SECRET_KEY,
+                      algorithms=[settings.ALGORITHM])["exp"] <= (
+        datetime.now(timezone.utc) + timedelta(seconds=settings.SSE_TOKEN_EXPIRE_SECONDS + 1)).timestamp()
+    vencido = jwt.encode({"sub": str(usuario.id_usuario), "proposito": jwt_handler.PROPOSITO_STREAM,
+                          "exp": datetime.now(timezone.utc) - timedelta(seconds=1)},
+                         settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    assert _rechazado(deps.get_current_user_stream, db=db, token_header=None, token=vencido)
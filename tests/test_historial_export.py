@@ -0,0 +1,301 @@
+"""
+Descarga del historial en streaming: filas livianas leídas con cursor del lado del
+servidor (solo las columnas del reporte, con los filtros de rol del historial), Excel
+con hoja write-only enviado por bloques desde un archivo temporal (la memoria no
+crece con el número de filas), y CSV / Parquet generados a medida que llegan las filas.
+"""
+import csv
+import io
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from openpyxl import load_workbook
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from crud import abastecimiento as abastecimiento_crud
+from db import models
+from services import historial_export_service, report_service
+from tests.datos import crear_sitios, historial_sintetico
+
+
+def _usuario(db, rol: str, correo: str) -> models.Usuario:
+    usuario = models.Usuario(nombre_completo=rol.title(), contrasena="x", correo=correo, roles=[models.Rol(nombre=rol)])
+    db.add(usuario)
+    db.flush()
+    return usuario
+
+
+@pytest.fixture
+def historial(db):
+    """30 sitios con historial (10 del técnico); devuelve (admin, usuario técnico, ids de sus sitios)."""
+    admin = _usuario(db, "ADMIN", "admin@example.com")
+    usuario_tecnico = _usuario(db, "TECNICO", "tecnico@example.com")
+    tecnico = models.Tecnico(id_usuario=usuario_tecnico.id_usuario, id_grupo=1, id_contratista=1,
+                             nombre_tecnico="Técnico", dpi_tecnico="1234567890123", correo_tecnico="tecnico@example.com")
+    db.add(tecnico)
+    db.flush()
+    ids = crear_sitios(db, 30)
+    for id_sitio in ids[:10]:
+        db.get(models.Sitio, id_sitio).id_tecnico = tecnico.id_tecnico
+    rng = random.Random(14)
+    db.bulk_insert_mappings(models.Abastecimiento, [
+        f for id_sitio in ids for f in historial_sintetico(rng, id_sitio, rng.randint(1, 12))])
+    db.commit()
+    return admin, usuario_tecnico, set(ids[:10])
+
+
+def test_stream_filas_livianas_con_cursor_del_servidor(db, historial):
+    admin, _, _ = historial
+    ejecuciones = []
+
+    def _capturar(conn, cursor, statement, parameters, context, executemany):
+        if "FROM abastecimiento" in statement:
+            ejecuciones.append((statement, dict(context.execution_options)))
+
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", _capturar)
+    try:
+        filas = list(abastecimiento_crud.stream_historial_rows(db, admin, batch_size=50))
+    finally:
+        event.remove(engine, "before_cursor_execute", _capturar)
+
+    assert len(filas) == db.query(models.Abastecimiento).count()
+    assert not any(isinstance(f, models.Abastecimiento) for f in filas)
+    assert list(filas[0]._fields) == report_service.EXPORT_COLUMNAS
+    assert not any(isinstance(o, models.Abastecimiento) for o in db.identity_map.values())  # Sin objetos ORM
+    (sql, opciones), = ejecuciones
+    assert opciones.get("stream_results") and opciones.get("yield_per") == 50
+    seleccion = sql.split("FROM", 1)[0]
+    assert "rendimiento_mg" not in seleccion and "id_abastecimiento" not in seleccion  # Solo columnas del reporte
+
+
+def test_stream_igual_al_historial_completo_con_filtros_de_rol(db, historial):
+    admin, usuario_tecnico, sitios_tecnico = historial
+    for usuario, filtros in ((admin, {}), (usuario_tecnico, {}), (admin, {"q": "Sitio 2"}),
+                             (usuario_tecnico, {"sitio_id": min(sitios_tecnico)})):
+        completo = abastecimiento_crud.get_historial_abastecimientos(db, usuario, limit=None, **filtros)
+        esperado = [report_service._format_row(ab) for ab in completo]
+        obtenido = list(report_service.format_rows(abastecimiento_crud.stream_historial_rows(db, usuario, **filtros)))
+        assert obtenido == esperado and obtenido, (usuario.correo, filtros)
+    por_tecnico = {ab.id_sitio for ab in abastecimiento_crud.get_historial_abastecimientos(db, usuario_tecnico, limit=None)}
+    assert por_tecnico == sitios_tecnico
+
+    sin_rol = _usuario(db, "INVITADO", "invitado@example.com")
+    assert list(abastecimiento_crud.stream_historial_rows(db, sin_rol)) == []
+
+
+def _filas(n: int, sitio_largo: bool = False):
+    for i in range(n):
+        sitio = ("Sitio con un nombre extremadamente largo " * 5) if sitio_largo and i == 3 else f"Sitio {i % 500}"
+        yield [f"OT{i}", sitio, "06/01/25 08:00", "120.00", f"{300 + i % 7:.2f}", f"{1500 + i:.2f}",
+               "ACTIVO", "Sin Alarmas"]
+
+
+def test_excel_write_only_contenido_y_anchos(tmp_path):
+    destino = tmp_path / "historial.xlsx"
+    report_service.write_historial_excel(_filas(2500, sitio_largo=True), str(destino))
+
+    libro = load_workbook(destino, read_only=False)
+    hoja = libro["Historial Abastecimientos"]
+    filas = list(hoja.iter_rows(values_only=True))
+    assert list(filas[0]) == report_service.HEADERS
+    assert hoja["A1"].font.bold
+    assert len(filas) == 2501
+    assert filas[1][:2] == ("OT0", "Sitio 0")
+    assert filas[2501 - 1][5] == pytest.approx(1500 + 2499)  # Columnas numéricas como número
+    assert filas[1][3] == 120 and not isinstance(filas[1][3], str)
+    # Anchos tomados de la muestra inicial, acotados
+    assert hoja.column_dimensions["B"].width == report_service.EXCEL_ANCHO_MAXIMO
+    assert hoja.column_dimensions["A"].width == len("OT999") + 2
+
+
+def test_excel_en_archivo_temporal_y_envio_por_bloques(monkeypatch):
+    pequeno = report_service.generate_historial_excel_file(_filas(10))
+    assert not pequeno._rolled  # Pequeño: queda en memoria
+    pequeno.close()
+
+    monkeypatch.setattr(report_service, "EXCEL_SPOOL_MAX_BYTES", 64 * 1024)
+    archivo = report_service.generate_historial_excel_file(_filas(20000))
+    assert archivo._rolled  # Grande: pasa a disco
+    bloques = list(report_service.iter_file(archivo))
+    assert archivo.closed
+    assert all(len(b) <= report_service.CHUNK_BYTES for b in bloques) and len(bloques) > 1
+    with tempfile.NamedTemporaryFile(suffix=".xlsx") as copia:
+        copia.write(b"".join(bloques))
+        copia.flush()
+        hoja = load_workbook(copia.name, read_only=True)["Historial Abastecimientos"]
+        assert sum(1 for _ in hoja.iter_rows(values_only=True)) == 20001
+
+
+def _rss_excel(n: int) -> tuple:
+    """En un proceso nuevo: escribe n filas y devuelve (RSS máximo en KiB, segundos)."""
+    inicio = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directorio:
+        report_service.write_historial_excel(_filas(n), os.path.join(directorio, "historial.xlsx"))
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, time.perf_counter() - inicio
+
+
+@pytest.mark.skipif(not os.environ.get("PRUEBAS_LENTAS"), reason="Prueba lenta: definir PRUEBAS_LENTAS=1")
+def test_memoria_excel_500k_filas():
+    """RSS máximo del proceso al escribir 50.000 y 500.000 filas: no crece con las filas."""
+    resultados = {}
+    for n in (50000, 500000):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            resultados[n] = pool.submit(_rss_excel, n).result()
+
+    (rss_50k, t_50k), (rss_500k, t_500k) = resultados[50000], resultados[500000]
+    print(f"\nExcel write-only: 50k filas RSS máx. {rss_50k / 1024:.0f} MiB ({t_50k:.1f}s), "
+          f"500k filas {rss_500k / 1024:.0f} MiB ({t_500k:.1f}s)")
+    # Con el libro completo en memoria, 500k filas ocupaban cientos de MiB más que 50k
+    assert rss_500k - rss_50k < 50 * 1024
+
+
+def _primera_fila_y_pico(filas) -> tuple:
+    """(segundos hasta la primera fila formateada, total de filas, pico de memoria en bytes)."""
+    tracemalloc.start()
+    try:
+        inicio = time.perf_counter()
+        filas = iter(filas())
+        next(filas)
+        primera = time.perf_counter() - inicio
+        total = 1 + sum(1 for _ in filas)
+        return primera, total, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.skipif(not os.environ.get("PRUEBAS_LENTAS"), reason="Prueba lenta: definir PRUEBAS_LENTAS=1")
+def test_primera_fila_y_memoria_100k_registros(db, historial):
+    """Cursor con yield_per contra query.all() con joinedload: tiempo a la primera fila y pico de memoria."""
+    admin, _, _ = historial
+    db.bulk_insert_mappings(models.Sitio, [
+        {"id": f"B{i:05d}", "nombre": f"Sitio B{i}", "departamento": "Guatemala", "municipio": "Mixco"}
+        for i in range(1000)])
+    ids = [id_sitio for id_sitio, in db.query(models.Sitio.id_sitio).filter(models.Sitio.id.like("B%"))]
+    rng = random.Random(100000)
+    db.bulk_insert_mappings(models.Abastecimiento, [
+        f for id_sitio in ids for f in historial_sintetico(rng, id_sitio, 100)])
+    db.commit()
+    id_admin = admin.id_usuario
+    db.expunge_all()
+    admin = db.get(models.Usuario, id_admin)
+
+    t_stream, n_stream, pico_stream = _primera_fila_y_pico(lambda: report_service.format_rows(
+        abastecimiento_crud.stream_historial_rows(db, admin)))
+    db.expunge_all()
+    admin = db.get(models.Usuario, id_admin)
+    t_todo, n_todo, pico_todo = _primera_fila_y_pico(lambda: report_service.format_rows(
+        abastecimiento_crud.get_historial_abastecimientos(db, admin, limit=None)))
+
+    print(f"\n{n_stream} registros: primera fila {t_stream * 1000:.0f} ms con cursor, {t_todo * 1000:.0f} ms "
+          f"con query.all(); pico de memoria {pico_stream / 2**20:.1f} MiB contra {pico_todo / 2**20:.1f} MiB")
+    assert n_stream == n_todo > 100000
+    assert t_stream * 10 < t_todo
+    assert pico_stream * 10 < pico_todo
+
+
+@pytest.fixture
+def exportar(db, monkeypatch):
+    """iter_historial_export sobre la base de la prueba (usa su propia sesión)."""
+    monkeypatch.setattr(historial_export_service, "SessionLocal", sessionmaker(bind=db.get_bind()))
+    return historial_export_service.iter_historial_export
+
+
+def _contando(filas, consumidas: list):
+    for fila in filas:
+        consumidas[0] += 1
+        yield fila
+
+
+def test_csv_por_bloques_igual_al_historial(db, historial, exportar, monkeypatch):
+    admin, usuario_tecnico, sitios_tecnico = historial
+    for usuario in (admin, usuario_tecnico):
+        esperadas = list(abastecimiento_crud.stream_historial_rows(db, usuario))
+        bloques = list(exportar("csv", usuario.id_usuario))
+        lector = list(csv.reader(io.StringIO(b"".join(bloques).decode("utf-8"))))
+        assert lector[0] == report_service.EXPORT_COLUMNAS
+        assert len(lector) - 1 == len(esperadas) > 0
+        for fila_csv, fila in zip(lector[1:], esperadas):
+            assert fila_csv[0] == fila.ot and fila_csv[1] == fila.sitio_nombre
+            assert fila_csv[2] == fila.fecha.isoformat(sep=" ")
+            assert float(fila_csv[4]) == fila.gls_abastecidos and fila_csv[6] == "ACTIVO"
+            assert fila_csv[7] == str(fila.alarma_transferencia)
+
+    # El primer bloque sale tras CSV_FILAS_POR_BLOQUE filas, sin leer el resto del cursor
+    monkeypatch.setattr(report_service, "CSV_FILAS_POR_BLOQUE", 25)
+    consumidas = [0]
+    generador = report_service.iter_historial_csv(
+        _contando(abastecimiento_crud.stream_historial_rows(db, admin), consumidas))
+    assert next(generador).count(b"\n") == 26  # Encabezado + 25 filas
+    assert consumidas[0] == 25
+
+
+def test_parquet_por_row_groups(db, historial, exportar):
+    pq = pytest.importorskip("pyarrow.parquet")
+    admin, _, _ = historial
+    esperadas = list(abastecimiento_crud.stream_historial_rows(db, admin))
+    assert len(esperadas) > 100
+
+    consumidas = [0]
+    generador = report_service.iter_historial_parquet(
+        _contando(abastecimiento_crud.stream_historial_rows(db, admin), consumidas), row_group_size=40)
+    primero = next(generador)
+    assert primero.startswith(b"PAR1") and consumidas[0] == 40  # Cada grupo se envía al escribirse
+    contenido = primero + b"".join(generador)
+
+    archivo = pq.ParquetFile(io.BytesIO(contenido))
+    assert archivo.metadata.num_row_groups == -(-len(esperadas) // 40)
+    tabla = archivo.read()
+    assert tabla.column_names == report_service.EXPORT_COLUMNAS
+    assert tabla.column("ot").to_pylist() == [f.ot for f in esperadas]
+    assert tabla.column("fecha").to_pylist() == [f.fecha for f in esperadas]
+    assert tabla.column("status").to_pylist() == ["ACTIVO"] * len(esperadas)
+    assert tabla.column("alarma_falla_energia").to_pylist() == [f.alarma_falla_energia for f in esperadas]
+
+    # Mismos filtros de rol que el historial
+    _, usuario_tecnico, sitios_tecnico = historial
+    del_tecnico = pq.read_table(io.BytesIO(b"".join(exportar("parquet", usuario_tecnico.id_usuario))))
+    assert del_tecnico.num_rows == len(list(abastecimiento_crud.stream_historial_rows(db, usuario_tecnico)))
+
+
+def test_formato_desconocido(historial, exportar):
+    admin, _, _ = historial
+    with pytest.raises(ValueError):
+        list(exportar("xml", admin.id_usuario))
+
+
+@pytest.mark.skipif(not os.environ.get("PRUEBAS_LENTAS"), reason="Prueba lenta: definir PRUEBAS_LENTAS=1")
+def test_throughput_de_los_cuatro_formatos(db, historial, exportar):
+    """Filas por segundo de cada formato sobre ~20.000 registros (de la base a los bytes enviados)."""
+    admin, _, _ = historial
+    db.bulk_insert_mappings(models.Sitio, [
+        {"id": f"T{i:05d}", "nombre": f"Sitio T{i}", "departamento": "Guatemala", "municipio": "Mixco"}
+        for i in range(200)])
+    ids = [id_sitio for id_sitio, in db.query(models.Sitio.id_sitio).filter(models.Sitio.id.like("T%"))]
+    rng = random.Random(15)
+    db.bulk_insert_mappings(models.Abastecimiento, [
+        f for id_sitio in ids for f in historial_sintetico(rng, id_sitio, 100)])
+    db.commit()
+    total = db.query(models.Abastecimiento).count()
+
+    formatos = ["csv", "excel", "pdf"] + (["parquet"] if report_service.parquet_disponible() else [])
+    resultados = {}
+    for formato in formatos:
+        inicio = time.perf_counter()
+        tamano = sum(len(bloque) for bloque in exportar(formato, admin.id_usuario))
+        resultados[formato] = (time.perf_counter() - inicio, tamano)
+
+    print(f"\n{total} registros:")
+    for formato, (segundos, tamano) in resultados.items():
+        print(f"  {formato:8s} {total / segundos:10.0f} filas/s  {segundos:6.2f}s  {tamano / 1024:8.0f} KiB")
+    assert resultados["csv"][0] < resultados["excel"][0] < resultados["pdf"][0]
+    if "parquet" in resultados:
+        assert resultados["parquet"][0] < resultados["excel"][0]
@@ -0,0 +1,35 @@
+# tests/test_historial_watermark.py
+"""Marca de agua del historial (clave de la caché de reportes): cambia con cada modificación."""
+import random
+
+from sqlalchemy import update
+
+from crud import abastecimiento as abastecimiento_crud
+from db import models
+from schemas import abastecimiento as abastecimiento_schema
+from tests.datos import crear_sitios, historial_sintetico
+
+
+def test_ediciones_en_el_mismo_segundo_cambian_la_marca(db):
+    admin = models.Usuario(nombre_completo="Admin", contrasena="x", correo="admin@example.com",
+                           roles=[models.Rol(nombre="ADMIN")])
+    db.add(admin)
+    id_sitio = crear_sitios(db, 1)[0]
+    db.bulk_insert_mappings(models.Abastecimiento, historial_sintetico(random.Random(2), id_sitio, 3))
+    db.commit()
+    abastecimiento = db.query(models.Abastecimiento).first()
+
+    marcas = [abastecimiento_crud.get_historial_watermark(db, admin)]
+    for gls in (100.0, 101.0):
+        abastecimiento_crud.update_abastecimiento(
+            db, abastecimiento, abastecimiento_schema.AbastecimientoUpdate(gls_abastecidos=gls))
+        marcas.append(abastecimiento_crud.get_historial_watermark(db, admin))
+    abastecimiento_crud.soft_delete_abastecimiento(db, abastecimiento)
+    marcas.append(abastecimiento_crud.get_historial_watermark(db, admin))
+    # También los UPDATE masivos fuera del ORM por objeto
+    db.execute(update(models.Abastecimiento).where(models.Abastecimiento.id_sitio == id_sitio).values(rendimiento_mg=1.0))
+    db.commit()
+    marcas.append(abastecimiento_crud.get_historial_watermark(db, admin))
+
+    assert len({tuple(sorted(m.items())) for m in marcas}) == len(marcas)
+    assert all(m["total"] == 3 for m in marcas)
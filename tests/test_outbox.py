@@ -0,0 +1,61 @@
+# tests/test_outbox.py
+"""
+Outbox de correos: el lote se reclama con propietario y concesión (sin transacción
+abierta durante el envío) y el resultado solo lo registra quien sigue siendo dueño.
+"""
+from datetime import datetime, timedelta
+
+from crud import outbox as outbox_crud
+from db import models
+
+
+def _encolar(db, n: int):
+    for i in range(n):
+        outbox_crud.enqueue(db, direccion_destino=f"u{i}@example.com", asunto="Asunto", cuerpo_html="<p>Hola</p>",
+                            adjuntos=[("a.pdf", b"%PDF", "application/pdf")] if i == 0 else None)
+    db.commit()
+
+
+def _filas(db):
+    db.expire_all()
+    return db.query(models.NotificacionOutbox).order_by(models.NotificacionOutbox.id_outbox).all()
+
+
+def test_reclamo_con_concesion_y_resultado_del_propietario(db):
+    _encolar(db, 3)
+
+    lote = outbox_crud.claim_pending(db, "A", limit=2, concesion_segundos=60)
+    assert [c["id_outbox"] for c in lote] == [1, 2]
+    assert lote[0]["adjuntos"] == [("a.pdf", b"%PDF", "application/pdf")]
+    assert not db.in_transaction()  # El reclamo ya se confirmó: el envío no tiene transacción abierta
+    assert [f.estado for f in _filas(db)] == [models.EstadoOutboxEnum.EN_PROCESO] * 2 + [models.EstadoOutboxEnum.PENDIENTE]
+
+    # Otro despachador no toma lo que ya está EN_PROCESO
+    assert [c["id_outbox"] for c in outbox_crud.claim_pending(db, "B", limit=10)] == [3]
+
+    outbox_crud.record_results(db, "A", enviados=[1], fallidos=[(2, "550 rechazado")],
+                               max_intentos=3, backoff_base_segundos=30)
+    enviado, reintento, _ = _filas(db)
+    assert enviado.estado == models.EstadoOutboxEnum.ENVIADO
+    assert enviado.cuerpo_html is None and enviado.adjuntos == []  # No se conserva el contenido
+    assert reintento.estado == models.EstadoOutboxEnum.PENDIENTE
+    assert reintento.proximo_intento > datetime.utcnow() and reintento.reclamado_por is None
+    assert db.query(models.NotificacionLog).count() == 1
+
+
+def test_concesion_vencida_se_retoma_y_el_resultado_tardio_se_ignora(db):
+    _encolar(db, 1)
+    outbox_crud.claim_pending(db, "A", concesion_segundos=60)
+
+    fila = _filas(db)[0]
+    fila.reclamado_hasta = datetime.utcnow() - timedelta(seconds=1)  # "A" se colgó
+    db.commit()
+    assert [c["id_outbox"] for c in outbox_crud.claim_pending(db, "B")] == [1]
+
+    outbox_crud.record_results(db, "A", enviados=[], fallidos=[(1, "tarde")], max_intentos=1, backoff_base_segundos=30)
+    fila = _filas(db)[0]
+    assert fila.estado == models.EstadoOutboxEnum.EN_PROCESO and fila.reclamado_por == "B"
+
+    outbox_crud.record_results(db, "B", enviados=[], fallidos=[(1, "550")], max_intentos=1, backoff_base_segundos=30)
+    fila = _filas(db)[0]
+    assert fila.estado == models.EstadoOutboxEnum.FALLIDO and fila.cuerpo_html is None
@@ -0,0 +1,55 @@
+# tests/test_prediccion_cache.py
+"""Caché de predicciones: se reutilizan mientras el último abastecimiento y el modelo no cambien."""
+import random
+
+from crud import abastecimiento as abastecimiento_crud
+from db import models
+from schemas import abastecimiento as abastecimiento_schema
+from services import prediction_service
+from tests.datos import crear_sitios, historial_sintetico
+
+
+def _aciertos_y_fallos(db, sitio_ids):
+    antes = prediction_service.get_cache_stats()
+    resultados = prediction_service.calculate_predictions_batch(db, sitio_ids=sitio_ids)
+    db.commit()
+    despues = prediction_service.get_cache_stats()
+    return resultados, despues["hits"] - antes["hits"], despues["misses"] - antes["misses"]
+
+
+def test_lotes_reutiliza_predicciones_de_sitios_sin_estado(db):
+    # Historial cargado directamente (sin pasar por la API): los sitios no tienen estado_consumo_sitio
+    rng = random.Random(11)
+    ids = crear_sitios(db, 20)
+    filas = [f for id_sitio in ids for f in historial_sintetico(rng, id_sitio, 15)]
+    db.bulk_insert_mappings(models.Abastecimiento, filas)
+    db.commit()
+    assert db.query(models.EstadoConsumoSitio).count() == 0
+
+    resultados, aciertos, fallos = _aciertos_y_fallos(db, ids)
+    con_prediccion = [i for i, r in resultados.items() if isinstance(r, models.PrediccionAbastecimiento)]
+    assert (aciertos, fallos) == (0, len(ids))
+    assert con_prediccion
+
+    _, aciertos, fallos = _aciertos_y_fallos(db, ids)
+    assert aciertos == len(con_prediccion)
+    assert fallos == len(ids) - len(con_prediccion)
+
+
+def test_nuevo_abastecimiento_invalida_la_prediccion(db):
+    rng = random.Random(12)
+    ids = crear_sitios(db, 2)
+    filas = [f for id_sitio in ids for f in historial_sintetico(rng, id_sitio, 10)]
+    db.bulk_insert_mappings(models.Abastecimiento, filas)
+    db.commit()
+    _aciertos_y_fallos(db, ids)
+
+    ultimo = filas[-1]
+    nuevo = dict(ultimo, ot="NUEVO", fecha=ultimo["fecha"].replace(year=ultimo["fecha"].year + 1),
+                 horometraje=ultimo["horometraje"] + 100)
+    nuevo.pop("status")
+    abastecimiento_crud.create_abastecimiento(
+        db, abastecimiento_schema.AbastecimientoCreate(id_tipo_sitio=1, **nuevo), tecnico_id=None)
+
+    _, aciertos, fallos = _aciertos_y_fallos(db, ids)
+    assert (aciertos, fallos) == (1, 1)
@@ -0,0 +1,210 @@
+# tests/test_prediction_service.py
+"""
+Paridad del cálculo de predicciones: kernel NumPy contra sklearn, cálculo por lotes
+contra el cálculo individual y contra el algoritmo original (pandas + sklearn por sitio).
+"""
+import os
+import random
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import r2_score
+
+from core.config import settings
+from crud import estado_consumo as estado_consumo_crud
+from db import models
+from services import least_squares, prediction_service
+from tests.datos import crear_sitios, historial_sintetico
+
+N_SITIOS = 300
+
+
+def _referencia_original(filas: list):
+    """
+    Algoritmo original por sitio (antes del cálculo por lotes): DataFrame del historial,
+    diff, filtro IQR con pandas y LinearRegression de sklearn.
+    Devuelve (fecha_proximo_abastecimiento, horometro_estimado_fin) o None si no hay predicción.
+    """
+    if len(filas) < prediction_service.MIN_RECORDS_PREDICTION:
+        return None
+    df = pd.DataFrame(filas).sort_values(by='fecha').reset_index(drop=True)
+    df['horometraje_diff'] = df['horometraje'].diff()
+    df['nivel_combustible_post'] = df['gls_existentes'] + df['gls_abastecidos']
+    df['gls_consumidos'] = df['nivel_combustible_post'].shift(1) - df['gls_existentes']
+    limpio = df.dropna(subset=['horometraje_diff', 'gls_consumidos'])
+    limpio = limpio[(limpio['horometraje_diff'] > 0) & (limpio['gls_consumidos'] > 0)].copy()
+    if len(limpio) < 2:
+        return None
+    limpio['tasa_periodo'] = limpio['gls_consumidos'] / limpio['horometraje_diff']
+    q1, q3 = limpio['tasa_periodo'].quantile(0.25), limpio['tasa_periodo'].quantile(0.75)
+    iqr = q3 - q1
+    sin_outliers = limpio[(limpio['tasa_periodo'] >= q1 - 1.5 * iqr) & (limpio['tasa_periodo'] <= q3 + 1.5 * iqr)]
+    if len(sin_outliers) < 1:
+        return None
+    if len(sin_outliers) < 2:
+        tasa = sin_outliers['tasa_periodo'].iloc[0]
+    elif sin_outliers['horometraje_diff'].nunique() < 2:
+        tasa = sin_outliers['tasa_periodo'].mean()
+    else:
+        modelo = LinearRegression().fit(sin_outliers[['horometraje_diff']], sin_outliers['gls_consumidos'])
+        tasa = modelo.coef_[0]
+    if tasa <= 0:
+        return None
+
+    primero, ultimo = df.iloc[0], df.iloc[-1]
+    galones = ultimo['gls_existentes'] + ultimo['gls_abastecidos']
+    horas_restantes = galones / tasa
+    dias_totales = (ultimo['fecha'] - primero['fecha']).total_seconds() / (60 * 60 * 24)
+    horas_totales = ultimo['horometraje'] - primero['horometraje']
+    uso_diario = 8 if dias_totales < 1 or horas_totales <= 0 else min(horas_totales / dias_totales, 24)
+    return (ultimo['fecha'] + timedelta(days=float(horas_restantes / uso_diario)),
+            round(float(ultimo['horometraje'] + horas_restantes), 2))
+
+
+@pytest.fixture
+def historiales(db):
+    """N_SITIOS sitios con historiales sintéticos de 0 a 40 registros; devuelve {id_sitio: filas}."""
+    rng = random.Random(20250601)
+    ids = crear_sitios(db, N_SITIOS)
+    por_sitio = {id_sitio: historial_sintetico(rng, id_sitio, rng.randint(0, 40)) for id_sitio in ids}
+    db.bulk_insert_mappings(models.Abastecimiento, [f for filas in por_sitio.values() for f in filas])
+    db.commit()
+    estado_consumo_crud.rebuild_all(db)
+    return por_sitio
+
+
+@pytest.fixture(params=prediction_service.REGRESSION_BACKENDS)
+def backend(request, monkeypatch):
+    monkeypatch.setattr(settings, "PREDICTION_REGRESSION_BACKEND", request.param)
+    return request.param
+
+
+def test_fit_line_igual_a_sklearn():
+    rng = np.random.default_rng(7)
+    for n in (2, 3, 10, 500):
+        for _ in range(20):
+            x = rng.uniform(1, 400, n)
+            y = 1.7 * x + rng.normal(0, 25, n)
+            ajuste = least_squares.fit_line(x, y)
+            modelo = LinearRegression().fit(x.reshape(-1, 1), y)
+            assert ajuste.slope == pytest.approx(modelo.coef_[0], rel=1e-9, abs=1e-12)
+            assert ajuste.intercept == pytest.approx(modelo.intercept_, rel=1e-9, abs=1e-9)
+            assert ajuste.r2 == pytest.approx(r2_score(y, modelo.predict(x.reshape(-1, 1))), rel=1e-9, abs=1e-12)
+            assert least_squares.fit_slope_sklearn(x, y) == pytest.approx(ajuste.slope, rel=1e-9, abs=1e-12)
+
+    # Sin varianza en x: pendiente 0, igual que sklearn
+    x = np.full(5, 12.0)
+    y = np.array([3.0, 4.0, 5.0, 6.0, 7.0])
+    assert least_squares.fit_line(x, y).slope == 0.0
+    assert least_squares.fit_slope_sklearn(x, y) == pytest.approx(0.0, abs=1e-12)
+
+
+def test_lotes_igual_al_algoritmo_original(db, historiales, backend):
+    resultados = prediction_service.compute_predictions_batch(db, sitio_ids=list(historiales))
+
+    con_prediccion = 0
+    for id_sitio, filas in historiales.items():
+        esperado = _referencia_original(filas)
+        obtenido = resultados[id_sitio]
+        if esperado is None:
+            assert "error" in obtenido, id_sitio
+            continue
+        con_prediccion += 1
+        assert "error" not in obtenido, (id_sitio, obtenido)
+        fecha, horometro = esperado
+        assert abs((obtenido["fecha_proximo_abastecimiento"] - fecha).total_seconds()) < 1, id_sitio
+        assert obtenido["horometro_estimado_fin"] == pytest.approx(horometro, abs=0.011), id_sitio
+    assert con_prediccion > N_SITIOS // 2  # Los datos sí ejercitan la regresión
+
+
+def test_lotes_igual_al_calculo_individual(db, historiales, backend):
+    lotes = prediction_service.compute_predictions_batch(db, sitio_ids=list(historiales))
+
+    for id_sitio in historiales:
+        individual = prediction_service.calculate_prediction(db, id_sitio)
+        por_lotes = lotes[id_sitio]
+        if isinstance(individual, dict):
+            assert por_lotes == individual, id_sitio
+            continue
+        assert "error" not in por_lotes, (id_sitio, por_lotes)
+        assert individual.id_ultimo_abastecimiento_usado == por_lotes["id_ultimo_abastecimiento_usado"]
+        assert abs((individual.fecha_proximo_abastecimiento - por_lotes["fecha_proximo_abastecimiento"])
+                   .total_seconds()) < 1, id_sitio
+        assert individual.horometro_estimado_fin == pytest.approx(por_lotes["horometro_estimado_fin"], abs=1e-9)
+        assert individual.consumo_diario_gls == pytest.approx(por_lotes["consumo_diario_gls"], abs=1e-9)
+        assert individual.huella_modelo == por_lotes["huella_modelo"]
+
+
+def test_backends_numpy_y_sklearn_coinciden(db, historiales, monkeypatch):
+    por_backend = {}
+    for nombre in prediction_service.REGRESSION_BACKENDS:
+        monkeypatch.setattr(settings, "PREDICTION_REGRESSION_BACKEND", nombre)
+        por_backend[nombre] = prediction_service.compute_predictions_batch(db, sitio_ids=list(historiales))
+
+    numpy_, sklearn_ = por_backend["numpy"], por_backend["sklearn"]
+    for id_sitio in historiales:
+        if "error" in numpy_[id_sitio]:
+            assert numpy_[id_sitio] == sklearn_[id_sitio]
+            continue
+        assert numpy_[id_sitio]["horometro_estimado_fin"] == pytest.approx(
+            sklearn_[id_sitio]["horometro_estimado_fin"], abs=1e-6)
+        # La huella distingue el backend con que se calculó cada predicción
+        assert numpy_[id_sitio]["huella_modelo"] != sklearn_[id_sitio]["huella_modelo"]
+
+
+def test_backend_desconocido_falla(db, historiales, monkeypatch):
+    monkeypatch.setattr(settings, "PREDICTION_REGRESSION_BACKEND", "otro")
+    with pytest.raises(ValueError):
+        prediction_service.compute_predictions_batch(db, sitio_ids=list(historiales))
+
+
+@pytest.mark.skipif(not os.environ.get("PRUEBAS_LENTAS"), reason="Prueba lenta: definir PRUEBAS_LENTAS=1")
+def test_lotes_10k_sitios_paridad_y_tiempo(db, monkeypatch):
+    """Paridad con el algoritmo original en 10.000 sitios y tiempo de ambos caminos."""
+    monkeypatch.setattr(settings, "PREDICTION_REGRESSION_BACKEND", "numpy")
+    rng = random.Random(10000)
+    ids = crear_sitios(db, 10000)
+    por_sitio = {id_sitio: historial_sintetico(rng, id_sitio, rng.randint(2, 30)) for id_sitio in ids}
+    db.bulk_insert_mappings(models.Abastecimiento, [f for filas in por_sitio.values() for f in filas])
+    db.commit()
+
+    inicio = time.perf_counter()
+    resultados = prediction_service.compute_predictions_batch(db, sitio_ids=ids)
+    t_lotes = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    esperados = {id_sitio: _referencia_original(filas) for id_sitio, filas in por_sitio.items()}
+    t_original = time.perf_counter() - inicio
+
+    for id_sitio, esperado in esperados.items():
+        if esperado is None:
+            assert "error" in resultados[id_sitio], id_sitio
+        else:
+            assert resultados[id_sitio]["horometro_estimado_fin"] == pytest.approx(esperado[1], abs=0.011), id_sitio
+    print(f"\n10k sitios: lotes {t_lotes:.2f}s, original por sitio {t_original:.2f}s "
+          f"(sin contar sus consultas), x{t_original / t_lotes:.0f}")
+    assert t_lotes < t_original
+
+
+@pytest.mark.skipif(not os.environ.get("PRUEBAS_LENTAS"), reason="Prueba lenta: definir PRUEBAS_LENTAS=1")
+def test_latencia_por_sitio_numpy_vs_sklearn():
+    """Microbenchmark del ajuste de un sitio (20 intervalos) con cada backend."""
+    rng = np.random.default_rng(3)
+    datos = [(x, 1.5 * x + rng.normal(0, 10, x.size)) for x in rng.uniform(10, 300, (2000, 20))]
+
+    inicio = time.perf_counter()
+    for x, y in datos:
+        least_squares.fit_line(x, y)
+    t_numpy = (time.perf_counter() - inicio) / len(datos)
+
+    inicio = time.perf_counter()
+    for x, y in datos:
+        least_squares.fit_slope_sklearn(x, y)
+    t_sklearn = (time.perf_counter() - inicio) / len(datos)
+
+    print(f"\nPor sitio: numpy {t_numpy * 1e6:.0f} µs, sklearn {t_sklearn * 1e6:.0f} µs")
+    assert t_numpy < t_sklearn
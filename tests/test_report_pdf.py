@@ -0,0 +1,174 @@
+# tests/test_report_pdf.py
+"""
+PDF del historial: la paginación calculada para el modo en paralelo coincide con la real,
+la medición de filas (_TablaLayout) coincide con multi_cell de fpdf, y el logo se carga
+una vez por proceso desde disco (sin red).
+"""
+import os
+import random
+import re
+import socket
+import time
+
+import pytest
+from fpdf import FPDF
+from fpdf.enums import MethodReturnValue
+
+from services import report_assets, report_service
+
+PALABRAS = ["Sitio", "Guatemala", "Mixco", "Zona", "10", "Falla", "Energía", "Transferencia", "Ñandú",
+            "X" * 60, "a", "ACTIVO", "Ninguna", "Torre"]
+
+
+def _paginas_pdf(contenido: bytes) -> int:
+    return len(re.findall(rb"/Type\s*/Page\b", contenido))
+
+
+def _fila(i: int, sitio: str = None) -> list:
+    return [f"OT{i}", sitio or f"Sitio {i}", "06/01/2025 08:00", "120.0", "300.0", "1500.0", "ACTIVO", "Ninguna"]
+
+
+def _filas_aleatorias(rng: random.Random, n: int, n_sitios: int = 50) -> list:
+    """Filas con nombres de sitio y alarmas repetidos, algunos largos (varias líneas)."""
+    sitios = [" ".join(rng.choice(PALABRAS) for _ in range(rng.randint(1, 12))) for _ in range(n_sitios)]
+    alarmas = ["Ninguna", "Transferencia", "Falla Energía", "Transferencia, Falla Energía"]
+    return [[f"OT{i}", rng.choice(sitios), "06/01/2025 08:00", f"{rng.uniform(0, 500):.1f}",
+             f"{rng.uniform(0, 500):.1f}", f"{rng.uniform(0, 9000):.1f}", "ACTIVO", rng.choice(alarmas)]
+            for i in range(n)]
+
+
+def _lineas_multi_cell(pdf: FPDF, ancho: float, texto: str) -> int:
+    """Líneas que ocupa el texto según fpdf (lo que medía antes el FPDF auxiliar de cada fila)."""
+    return len(pdf.multi_cell(ancho, 5, texto, dry_run=True, output=MethodReturnValue.LINES))
+
+
+def test_layout_cuenta_las_mismas_lineas_que_multi_cell():
+    rng = random.Random(12)
+    tabla = report_service._TablaHistorial(report_service.PDFWithHeader())
+    for _ in range(2000):
+        columna = rng.randrange(len(report_service.HEADERS))
+        texto = " ".join(rng.choice(PALABRAS) for _ in range(rng.randint(1, 15)))
+        if rng.random() < 0.1:
+            texto = texto.replace(" ", "\n", 1)
+        esperado = _lineas_multi_cell(tabla.pdf, tabla.col_widths[columna], texto)
+        assert tabla.layout.lineas(columna, texto) == esperado, (columna, texto)
+
+
+def test_layout_x_de_columnas_y_memoria_de_valores_repetidos(monkeypatch):
+    tabla = report_service._TablaHistorial(report_service.PDFWithHeader())
+    layout = tabla.layout
+    inicio = layout.col_x[0]
+    for i, x in enumerate(layout.col_x):
+        assert x == pytest.approx(inicio + sum(tabla.col_widths[:i]))
+    assert layout.col_x[-1] + tabla.col_widths[-1] - inicio == pytest.approx(tabla.pdf.w - 2 * inicio)
+
+    medidos = []
+    contar = layout._contar_lineas
+    monkeypatch.setattr(layout, "_contar_lineas", lambda texto, ancho: medidos.append(texto) or contar(texto, ancho))
+    filas = _filas_aleatorias(random.Random(3), 2000, n_sitios=20)
+    for fila in filas:
+        tabla.medir(fila)
+    distintos = {(i, valor) for fila in filas for i, valor in enumerate(fila)}
+    assert len(medidos) == len(distintos)  # Cada valor distinto de cada columna se mide una sola vez
+    assert len({fila[1] for fila in filas}) <= 20
+
+
+def test_filas_con_varias_lineas_no_se_salen_de_la_pagina():
+    filas = _filas_aleatorias(random.Random(5), 400)
+    total, _ = report_service._paginar(filas)
+    contenido = report_service.generate_historial_pdf_rows(filas)
+    assert total == _paginas_pdf(contenido)
+
+
+def test_paginar_cuenta_filas_mas_altas_que_una_pagina():
+    alta = "Nombre de sitio muy largo " * 400  # Varias páginas de alto en la columna Sitio
+    casos = [
+        [_fila(i) for i in range(120)],
+        [_fila(0, alta)] + [_fila(i) for i in range(1, 60)],
+        [_fila(i) for i in range(30)] + [_fila(30, alta)] + [_fila(i) for i in range(31, 90)],
+        [_fila(i) for i in range(10)] + [_fila(10, alta), _fila(11, alta)] + [_fila(i) for i in range(12, 20)],
+    ]
+    for filas in casos:
+        total, cortes = report_service._paginar(filas)
+        assert total == _paginas_pdf(report_service.generate_historial_pdf_rows(filas))
+        assert [pagina for _, pagina in cortes] == sorted({pagina for _, pagina in cortes})
+
+
+def _imagenes_pdf(contenido: bytes) -> int:
+    return len(re.findall(rb"/Subtype\s*/Image", contenido))
+
+
+@pytest.fixture
+def sin_red(monkeypatch):
+    """Cualquier intento de conexión o resolución de nombres falla, como sin red."""
+    def _sin_red(*args, **kwargs):
+        raise OSError("Red deshabilitada en la prueba")
+    monkeypatch.setattr(socket.socket, "connect", _sin_red)
+    monkeypatch.setattr(socket, "create_connection", _sin_red)
+    monkeypatch.setattr(socket, "getaddrinfo", _sin_red)
+    report_assets.get_image.cache_clear()
+    yield
+    report_assets.get_image.cache_clear()
+
+
+def test_logo_se_carga_una_vez_sin_red(sin_red, capsys):
+    una_pagina = report_service.generate_historial_pdf_rows([_fila(0)])
+    report_assets.get_image.cache_clear()
+
+    contenido = report_service.generate_historial_pdf_rows([_fila(i) for i in range(300)])
+
+    assert _paginas_pdf(contenido) > 5
+    assert report_assets.get_image.cache_info().misses == 1  # Una lectura de disco para todas las páginas
+    # El logo se dibuja en cada página pero se incrusta una sola vez, como en el PDF de una página
+    assert _imagenes_pdf(contenido) == _imagenes_pdf(una_pagina) > 0
+    assert "No se pudo cargar el logo" not in capsys.readouterr().out
+
+
+@pytest.mark.skipif(not os.environ.get("PRUEBAS_LENTAS"), reason="Prueba lenta: definir PRUEBAS_LENTAS=1")
+def test_pdf_10k_filas_sin_red(sin_red):
+    """PDF de 10.000 filas sin red: antes eran una descarga (o un timeout) del logo por página."""
+    inicio = time.perf_counter()
+    contenido = report_service.generate_historial_pdf_rows([_fila(i) for i in range(10000)])
+    t_pdf = time.perf_counter() - inicio
+
+    paginas = _paginas_pdf(contenido)
+    print(f"\nPDF de 10k filas sin red: {paginas} páginas en {t_pdf:.2f}s "
+          f"({t_pdf / paginas * 1000:.1f} ms por página), {len(contenido) / 1024:.0f} KiB")
+    assert paginas > 200
+    assert report_assets.get_image.cache_info().misses == 1
+
+
+def _medir_con_fpdf_por_fila(filas: list, col_widths: list) -> list:
+    """Medición anterior: un FPDF nuevo con su página por cada fila y multi_cell en cada celda."""
+    alturas = []
+    for fila in filas:
+        temp_pdf = FPDF()
+        temp_pdf.add_page(orientation='L')
+        temp_pdf.set_font("Arial", size=8)
+        alturas.append(max(_lineas_multi_cell(temp_pdf, col_widths[i], item) for i, item in enumerate(fila)))
+    return alturas
+
+
+@pytest.mark.skipif(not os.environ.get("PRUEBAS_LENTAS"), reason="Prueba lenta: definir PRUEBAS_LENTAS=1")
+def test_medicion_y_pdf_50k_filas():
+    """Medición de 50.000 filas con _TablaLayout contra un FPDF por fila, y el PDF completo."""
+    filas = _filas_aleatorias(random.Random(50000), 50000, n_sitios=2000)
+    tabla = report_service._TablaHistorial(report_service.PDFWithHeader())
+
+    inicio = time.perf_counter()
+    lineas = [max(tabla.medir(fila)[0]) for fila in filas]
+    t_layout = time.perf_counter() - inicio
+
+    muestra = 5000  # El método anterior sobre una muestra, extrapolado a 50k filas
+    inicio = time.perf_counter()
+    esperadas = _medir_con_fpdf_por_fila(filas[:muestra], tabla.col_widths)
+    t_fpdf = (time.perf_counter() - inicio) * len(filas) / muestra
+    assert lineas[:muestra] == esperadas
+
+    inicio = time.perf_counter()
+    contenido = report_service.generate_historial_pdf_rows(filas)
+    t_pdf = time.perf_counter() - inicio
+
+    print(f"\n50k filas: medición con _TablaLayout {t_layout:.2f}s, con un FPDF por fila ~{t_fpdf:.1f}s "
+          f"(x{t_fpdf / t_layout:.0f}); PDF completo {_paginas_pdf(contenido)} páginas en {t_pdf:.1f}s")
+    assert t_layout * 5 < t_fpdf
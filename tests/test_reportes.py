@@ -0,0 +1,167 @@
+# tests/test_reportes.py
+"""
+Trabajos de /reportes: la deduplicación depende del alcance y los filtros, no del usuario;
+peticiones idénticas simultáneas generan un solo archivo, y los resultados se guardan en
+disco por bloques y se eliminan pasada la TTL.
+"""
+import csv
+import io
+import json
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from db import models
+from services import historial_export_service, job_service
+from tests.datos import crear_sitios, historial_sintetico
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    liberar = threading.Event()
+
+    def exportar_bloqueado(*args):
+        liberar.wait(5)  # El trabajo sigue en curso mientras llegan las demás peticiones
+        return b"datos"
+
+    manager = job_service.JobManager(str(tmp_path), max_workers=2)
+    monkeypatch.setattr(job_service, "get_manager", lambda: manager)
+    monkeypatch.setattr(historial_export_service, "iter_historial_export", exportar_bloqueado)
+    yield manager
+    liberar.set()
+    manager._executor.shutdown(wait=True)
+
+
+def test_mismo_alcance_comparte_trabajo_entre_usuarios(manager):
+    primero = historial_export_service.submit_reporte("csv", 1, "todos", sitio_id=3)
+    assert historial_export_service.submit_reporte("csv", 2, "todos", sitio_id=3) == primero
+    assert manager.get(primero)["datos"]["alcance"] == "todos"
+
+    # Otro alcance, otros filtros u otro formato: trabajos distintos
+    distintos = {
+        historial_export_service.submit_reporte("csv", 3, "tecnico:7", sitio_id=3),
+        historial_export_service.submit_reporte("csv", 1, "todos", sitio_id=4),
+        historial_export_service.submit_reporte("excel", 1, "todos", sitio_id=3),
+    }
+    assert len(distintos) == 3 and primero not in distintos
+
+
+def _esperar(manager: job_service.JobManager, job_id: str) -> dict:
+    for _ in range(500):
+        job = manager.get(job_id)
+        if job["estado"] not in (job_service.ESTADO_PENDIENTE, job_service.ESTADO_EN_PROCESO):
+            return job
+        threading.Event().wait(0.01)
+    raise AssertionError(f"El trabajo {job_id} no terminó")
+
+
+@pytest.fixture
+def almacen(tmp_path):
+    manager = job_service.JobManager(str(tmp_path), max_workers=4, ttl_segundos=3600)
+    yield manager
+    manager._executor.shutdown(wait=True)
+
+
+def test_peticiones_identicas_simultaneas_un_solo_render(almacen):
+    renders = []
+    liberar = threading.Event()
+
+    def render(*args):
+        renders.append(args)
+        liberar.wait(5)
+        return b"archivo"
+
+    def pedir(_):
+        return almacen.submit("reporte", render, "csv", nombre_archivo="r.csv", media_type="text/csv",
+                              clave="reporte:todos:csv")
+
+    with ThreadPoolExecutor(max_workers=20) as clientes:
+        ids = set(clientes.map(pedir, range(50)))
+    liberar.set()
+    assert len(ids) == 1
+    job = _esperar(almacen, ids.pop())
+    assert job["estado"] == job_service.ESTADO_COMPLETADO and len(renders) == 1
+
+    # Terminado el primero, la misma petición genera un archivo nuevo (los datos pudieron cambiar)
+    otro = pedir(None)
+    assert otro != job["id"]
+    _esperar(almacen, otro)
+    assert len(renders) == 2
+
+
+def test_resultado_por_bloques_visible_desde_otro_proceso(almacen, tmp_path):
+    job_id = almacen.submit("reporte", lambda: (bytes([i]) * 1000 for i in range(10)),
+                            nombre_archivo="r.bin", media_type="application/octet-stream")
+    assert _esperar(almacen, job_id)["estado"] == job_service.ESTADO_COMPLETADO
+    with open(almacen.result_path(job_id), "rb") as f:
+        assert f.read() == b"".join(bytes([i]) * 1000 for i in range(10))
+
+    # Otro worker del mismo host lee el estado desde el disco
+    almacen._executor.shutdown(wait=True)
+    otro_worker = job_service.JobManager(str(tmp_path), max_workers=1)
+    try:
+        assert otro_worker.get(job_id)["estado"] == job_service.ESTADO_COMPLETADO
+        assert otro_worker.get("../../etc/passwd") is None
+    finally:
+        otro_worker.shutdown()
+
+
+def test_fallo_no_deja_archivos_a_medias(almacen, tmp_path):
+    def render_con_error():
+        yield b"parte"
+        raise RuntimeError("se cayó la base")
+
+    job_id = almacen.submit("reporte", render_con_error, nombre_archivo="r.csv", media_type="text/csv")
+    job = _esperar(almacen, job_id)
+    assert job["estado"] == job_service.ESTADO_FALLIDO and "se cayó la base" in job["error"]
+    almacen._executor.shutdown(wait=True)
+    assert not any(nombre.endswith((".bin.tmp", ".bin")) for nombre in os.listdir(tmp_path))
+
+
+def test_limpieza_por_ttl(almacen):
+    viejo = almacen.submit("reporte", lambda: b"viejo", nombre_archivo="a", media_type="text/plain")
+    nuevo = almacen.submit("reporte", lambda: b"nuevo", nombre_archivo="b", media_type="text/plain")
+    almacen._executor.shutdown(wait=True)  # Ambos terminados y con su estado final ya escrito en disco
+    # Un trabajo terminado hace más de la TTL (estado escrito por cualquier proceso)
+    job = almacen.get(viejo)
+    job["terminado_en"] = (datetime.utcnow() - timedelta(hours=2)).isoformat()
+    almacen._guardar(job)
+    # Uno en curso sin fecha de fin no se toca
+    en_curso = dict(almacen.get(nuevo), id="f" * 32, estado=job_service.ESTADO_EN_PROCESO, terminado_en=None)
+    almacen._guardar(en_curso)
+
+    assert almacen.limpiar_expirados(forzar=True) == 1
+    assert almacen.get(viejo) is None and not os.path.exists(almacen.result_path(viejo))
+    assert almacen.get(nuevo)["estado"] == job_service.ESTADO_COMPLETADO and os.path.exists(almacen.result_path(nuevo))
+    assert almacen.get(en_curso["id"]) is not None
+    # Sin forzar, la limpieza corre como mucho una vez por minuto
+    job = almacen.get(nuevo)
+    job["terminado_en"] = (datetime.utcnow() - timedelta(hours=2)).isoformat()
+    almacen._guardar(job)
+    assert almacen.limpiar_expirados() == 0
+    assert almacen.get(nuevo) is not None
+
+
+def test_reporte_csv_generado_en_segundo_plano(db, almacen, monkeypatch):
+    monkeypatch.setattr(job_service, "get_manager", lambda: almacen)
+    monkeypatch.setattr(historial_export_service, "SessionLocal", sessionmaker(bind=db.get_bind()))
+    admin = models.Usuario(nombre_completo="Admin", contrasena="x", correo="admin@example.com",
+                           roles=[models.Rol(nombre="ADMIN")])
+    db.add(admin)
+    rng = random.Random(16)
+    db.bulk_insert_mappings(models.Abastecimiento, [
+        f for id_sitio in crear_sitios(db, 5) for f in historial_sintetico(rng, id_sitio, 8)])
+    db.commit()
+
+    job_id = historial_export_service.submit_reporte("csv", admin.id_usuario, "todos")
+    job = _esperar(almacen, job_id)
+    assert job["estado"] == job_service.ESTADO_COMPLETADO and job["nombre_archivo"].endswith(".csv")
+    with open(almacen.result_path(job_id), encoding="utf-8") as f:
+        filas = list(csv.reader(f))
+    assert len(filas) == 1 + 40
+    assert json.loads(json.dumps(job["datos"])) == {"formato": "csv", "sitio_id": None, "q": None, "alcance": "todos"}
@@ -0,0 +1,77 @@
+# tests/test_sitios_menor_nivel.py
+"""
+Sitios con menor nivel de combustible: se ordenan por el nivel guardado (indexado),
+que se refresca por bloques acotados cuando envejece, y los ya agotados salen primero
+según cuánto tiempo llevan sin combustible (el nivel guardado puede ser negativo).
+"""
+from datetime import datetime, timedelta
+
+from core.config import settings
+from crud import prediccion as prediccion_crud
+from db import models
+from services import prediction_service
+from tests.datos import crear_sitios
+
+AHORA = datetime(2025, 6, 18, 10, 30)
+
+
+def _prediccion(db, id_sitio: int, consumo_diario_gls, dias_para_agotar: float, nivel_guardado, antiguedad: timedelta):
+    abastecimiento = models.Abastecimiento(
+        id_sitio=id_sitio, ot=f"OT{id_sitio}", fecha=AHORA - timedelta(days=30), gls_existentes=10.0,
+        gls_abastecidos=300.0, horometraje=100.0, rendimiento_mg=0.0, status="ACTIVO")
+    db.add(abastecimiento)
+    db.flush()
+    db.add(models.PrediccionAbastecimiento(
+        id_sitio=id_sitio, id_ultimo_abastecimiento_usado=abastecimiento.id_abastecimiento,
+        fecha_proximo_abastecimiento=AHORA + timedelta(days=dias_para_agotar), horometro_estimado_fin=500.0,
+        consumo_diario_gls=consumo_diario_gls, nivel_estimado_gls=nivel_guardado,
+        nivel_estimado_en=AHORA - antiguedad))
+
+
+def _niveles(db) -> dict:
+    db.expire_all()
+    return {p.id_sitio: (p.nivel_estimado_gls, p.nivel_estimado_en) for p in db.query(models.PrediccionAbastecimiento)}
+
+
+def test_refresco_acotado_y_orden_con_agotados_primero(db):
+    lleno, bajo, agotado_ayer, agotado_hace_una_semana, reciente, sin_consumo = crear_sitios(db, 6)
+    viejo = timedelta(days=10)
+    # Niveles guardados hace 10 días: ya no reflejan el orden actual
+    _prediccion(db, lleno, 20.0, dias_para_agotar=10, nivel_guardado=400.0, antiguedad=viejo)
+    _prediccion(db, bajo, 50.0, dias_para_agotar=1, nivel_guardado=550.0, antiguedad=viejo)
+    _prediccion(db, agotado_ayer, 30.0, dias_para_agotar=-1, nivel_guardado=270.0, antiguedad=viejo)
+    _prediccion(db, agotado_hace_una_semana, 10.0, dias_para_agotar=-7, nivel_guardado=30.0, antiguedad=viejo)
+    # Calculado hace un momento: no se reescribe
+    _prediccion(db, reciente, 40.0, dias_para_agotar=5, nivel_guardado=180.0, antiguedad=timedelta(minutes=1))
+    _prediccion(db, sin_consumo, None, dias_para_agotar=-30, nivel_guardado=None, antiguedad=viejo)
+    db.commit()
+
+    # Como mucho 'limite' filas por llamada, las más antiguas primero
+    assert prediction_service.refrescar_niveles(db, AHORA, limite=3) == 3
+    assert prediction_service.refrescar_niveles(db, AHORA, limite=3) == 1
+    assert prediction_service.refrescar_niveles(db, AHORA, limite=3) == 0
+    db.commit()
+
+    niveles = _niveles(db)
+    assert niveles[reciente] == (180.0, AHORA - timedelta(minutes=1))
+    assert niveles[sin_consumo] == (None, AHORA - viejo)
+    assert niveles[agotado_hace_una_semana] == (-70.0, AHORA)
+    assert niveles[bajo] == (50.0, AHORA)
+
+    resultado = prediccion_crud.get_sitios_menor_nivel(db, limit=10)
+    assert [p.id_sitio for p in resultado] == [agotado_hace_una_semana, agotado_ayer, bajo, reciente, lleno]
+    assert [p.id_sitio for p in prediccion_crud.get_sitios_menor_nivel(db, limit=2)] == \
+        [agotado_hace_una_semana, agotado_ayer]
+
+
+def test_consultar_predicciones_vigentes_no_reescribe_el_nivel(db, monkeypatch):
+    """La caché de predicciones ya no marca filas sucias en cada consulta (lo hace refrescar_niveles)."""
+    id_sitio = crear_sitios(db, 1)[0]
+    _prediccion(db, id_sitio, 20.0, dias_para_agotar=10, nivel_guardado=123.0,
+                antiguedad=timedelta(minutes=settings.PREDICTION_NIVEL_MAX_AGE_MINUTES * 2))
+    db.commit()
+    monkeypatch.setattr(prediccion_crud, "get_predicciones_vigentes",
+                        lambda db, ids, huella: db.query(models.PrediccionAbastecimiento).all())
+    prediction_service.calculate_predictions_batch(db, sitio_ids=[id_sitio])
+    assert not db.dirty
+    assert _niveles(db)[id_sitio][0] == 123.0
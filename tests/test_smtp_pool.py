@@ -0,0 +1,114 @@
+# tests/test_smtp_pool.py
+"""
+Pool SMTP: los envíos reutilizan las conexiones autenticadas en lugar de abrir una por
+correo, y un envío que vence o se cancela no deja su cupo tomado.
+"""
+import asyncio
+
+import aiosmtplib
+import pytest
+
+from core import smtp_pool
+
+
+class _SMTPFalso:
+    """Sustituto de aiosmtplib.SMTP que cuenta conexiones y mensajes."""
+    conexiones = 0
+    enviados = 0
+
+    def __init__(self, **params):
+        self.is_connected = False
+
+    async def connect(self):
+        type(self).conexiones += 1
+        await asyncio.sleep(0.01)  # Latencia de TCP + TLS + AUTH
+        self.is_connected = True
+
+    async def send_message(self, mensaje):
+        if not self.is_connected:
+            raise aiosmtplib.SMTPServerDisconnected("desconectado")
+        type(self).enviados += 1
+        await asyncio.sleep(0)
+
+    def close(self):
+        self.is_connected = False
+
+    async def quit(self):
+        self.close()
+
+
+def test_pool_reutiliza_conexiones(monkeypatch):
+    monkeypatch.setattr(smtp_pool.aiosmtplib, "SMTP", _SMTPFalso)
+    _SMTPFalso.conexiones = _SMTPFalso.enviados = 0
+
+    async def _enviar():
+        pool = smtp_pool.SMTPConnectionPool("localhost", 25, None, None, use_tls=False, start_tls=False, size=3)
+        correos = [smtp_pool.build_email(f"u{i}@example.com", "Asunto", "<p>Hola</p>") for i in range(100)]
+        await asyncio.gather(*(pool.send(correo) for correo in correos))
+
+        # Una conexión cerrada por el servidor se reabre en el siguiente uso
+        smtp = await pool._acquire()
+        smtp.close()
+        pool._release(smtp)
+        await pool.send(correos[0])
+        await pool.close()
+
+    asyncio.run(_enviar())
+    assert _SMTPFalso.enviados == 101
+    assert _SMTPFalso.conexiones <= 4  # Como mucho 'size' conexiones + la reconexión
+
+
+class _SMTPColgado(_SMTPFalso):
+    """Servidor que no responde a los envíos dirigidos a 'colgado@...' ni a las conexiones si 'colgar_conexion'."""
+    colgar_conexion = False
+
+    async def connect(self):
+        if type(self).colgar_conexion:
+            await asyncio.sleep(3600)
+        await super().connect()
+
+    async def send_message(self, mensaje):
+        if mensaje["To"].startswith("colgado@"):
+            await asyncio.sleep(3600)
+        await super().send_message(mensaje)
+
+
+def test_envios_vencidos_o_cancelados_liberan_su_cupo(monkeypatch):
+    monkeypatch.setattr(smtp_pool.aiosmtplib, "SMTP", _SMTPColgado)
+    _SMTPColgado.conexiones = _SMTPColgado.enviados = 0
+
+    async def _enviar():
+        pool = smtp_pool.SMTPConnectionPool("localhost", 25, None, None, use_tls=False, start_tls=False, size=2)
+        colgado = smtp_pool.build_email("colgado@example.com", "Asunto", "<p>Hola</p>")
+        normal = smtp_pool.build_email("u@example.com", "Asunto", "<p>Hola</p>")
+
+        # Más envíos vencidos que cupos: con timeout del pool y con wait_for/cancel del llamador
+        for _ in range(3):
+            with pytest.raises(asyncio.TimeoutError):
+                await pool.send(colgado, timeout=0.05)
+        for _ in range(3):
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(pool.send(colgado), timeout=0.05)
+        tarea = asyncio.create_task(pool.send(colgado))
+        await asyncio.sleep(0.05)
+        tarea.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tarea
+
+        # Conexión que no abre: la cancelación también devuelve el cupo
+        _SMTPColgado.colgar_conexion = True
+        for _ in range(3):
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(pool.send(normal), timeout=0.05)
+        _SMTPColgado.colgar_conexion = False
+
+        # El pool sigue atendiendo (antes quedaba bloqueado en _acquire para siempre)
+        await asyncio.wait_for(asyncio.gather(*(pool.send(normal) for _ in range(10))), timeout=2)
+        assert pool._libres.qsize() <= pool.size
+        await pool.close()
+
+    try:
+        asyncio.run(_enviar())
+    finally:
+        _SMTPColgado.colgar_conexion = False
+    assert _SMTPColgado.enviados == 10